@@ -6,16 +6,20 @@ import sqlite3
 import random
 import shutil
 from datetime import datetime, timedelta
-import hashlib
+from functools import lru_cache
 import os
 
+from database import hash_password as _hash_password
+
 BASE_DIR = os.path.dirname(__file__)
 TRAINING_DIR = os.path.join(BASE_DIR, 'data', 'training')
 SCHEMA_FILE = os.path.join(BASE_DIR, 'schema.sql')
 PRODUCTION_DB = os.path.join(BASE_DIR, 'data', 'maschinengemeinschaft.db')
 
+@lru_cache(maxsize=None)
 def hash_password(password):
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    # Vorberechneter Hash je Klartext (scrypt würde sonst pro Benutzer neu rechnen)
+    return _hash_password(password)
 
 def init_database(db_path):
     """Initialisiert eine neue Datenbank mit Schema aus Produktions-DB"""
@@ -75,6 +75,84 @@ def convert_sql_syntax(sql: str) -> str:
     return convert_placeholders(sql)
 
 
+# ==================== PASSWORT-HASHING ====================
+# Format kompatibel zu werkzeug.security:
+#   scrypt:N:r:p$salt$hash   bzw.   pbkdf2:sha256:iterationen$salt$hash
+# Alte Hashes (64 Hex-Zeichen, SHA-256 ohne Salt) werden beim Login erkannt
+# und nach erfolgreicher Anmeldung automatisch auf das aktuelle Verfahren umgestellt.
+
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')  # 'scrypt' oder 'pbkdf2'
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 15))
+SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600000))
+SALT_CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+
+def _hash_scrypt(password: str, salt: str, params: str) -> str:
+    n, r, p = (int(x) for x in params.split(':'))
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt.encode('utf-8'),
+                          n=n, r=r, p=p, maxmem=132 * n * r * p).hex()
+
+
+def _hash_pbkdf2(password: str, salt: str, params: str) -> str:
+    hash_name, iterations = params.split(':')
+    return hashlib.pbkdf2_hmac(hash_name, password.encode('utf-8'),
+                               salt.encode('utf-8'), int(iterations)).hex()
+
+
+# Verfahren -> Hash-Funktion (weitere Verfahren hier eintragen)
+PASSWORD_HASHERS = {
+    'scrypt': _hash_scrypt,
+    'pbkdf2': _hash_pbkdf2,
+}
+
+
+def _current_method_params() -> Tuple[str, str]:
+    """Aktuell konfiguriertes Verfahren mit Kostenparametern"""
+    if PASSWORD_HASH_METHOD == 'pbkdf2':
+        return 'pbkdf2', f'sha256:{PBKDF2_ITERATIONS}'
+    return 'scrypt', f'{SCRYPT_N}:{SCRYPT_R}:{SCRYPT_P}'
+
+
+def hash_password(password: str, salt: str = None) -> str:
+    """Passwort mit Salt und aktuellem Verfahren hashen"""
+    method, params = _current_method_params()
+    if salt is None:
+        salt = ''.join(secrets.choice(SALT_CHARS) for _ in range(16))
+    return f"{method}:{params}${salt}${PASSWORD_HASHERS[method](password, salt, params)}"
+
+
+def _is_legacy_hash(password_hash: str) -> bool:
+    return len(password_hash) == 64 and '$' not in password_hash
+
+
+def check_password(password_hash: Optional[str], password: str) -> bool:
+    """Passwort gegen gespeicherten Hash prüfen (neue Verfahren und Alt-SHA-256)"""
+    if not password_hash or password is None:
+        return False
+
+    if _is_legacy_hash(password_hash):
+        legacy = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        return secrets.compare_digest(legacy, password_hash)
+
+    try:
+        method_params, salt, expected = password_hash.split('$', 2)
+        method, params = method_params.split(':', 1)
+        hasher = PASSWORD_HASHERS[method]
+        return secrets.compare_digest(hasher(password, salt, params), expected)
+    except (ValueError, KeyError):
+        return False
+
+
+def password_needs_rehash(password_hash: Optional[str]) -> bool:
+    """True wenn Hash veraltet ist (Alt-SHA-256 oder andere Kostenparameter)"""
+    if not password_hash or _is_legacy_hash(password_hash):
+        return True
+    method, params = _current_method_params()
+    return not password_hash.startswith(f"{method}:{params}$")
+
+
 class MaschinenDB:
     """Hauptklasse für Datenbankverwaltung"""
 
@@ -243,21 +321,24 @@ class MaschinenDB:
         self.connection.commit()
 
     def _hash_password(self, password: str) -> str:
-        """Passwort hashen mit SHA-256"""
-        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+        """Passwort hashen (scrypt/PBKDF2 mit Salt, siehe hash_password)"""
+        return hash_password(password)
 
     def verify_login(self, username: str, password: str) -> Optional[Dict]:
-        """Benutzer-Login überprüfen"""
-        password_hash = self._hash_password(password)
+        """Benutzer-Login überprüfen (Suche nur über username)"""
         if self.using_postgresql:
-            sql = """SELECT * FROM benutzer
-                     WHERE username = %s AND password_hash = %s AND aktiv = true"""
+            sql = "SELECT * FROM benutzer WHERE username = %s AND aktiv = true"
         else:
-            sql = """SELECT * FROM benutzer
-                     WHERE username = ? AND password_hash = ? AND aktiv = 1"""
-        self.cursor.execute(sql, (username, password_hash))
-        row = self.cursor.fetchone()
-        return dict(row) if row else None
+            sql = "SELECT * FROM benutzer WHERE username = ? AND aktiv = 1"
+        self.cursor.execute(sql, (username,))
+        benutzer = self.fetchone()
+        if not benutzer or not check_password(benutzer.get('password_hash'), password):
+            return None
+
+        # Alten SHA-256-Hash bzw. veraltete Kostenparameter transparent erneuern
+        if password_needs_rehash(benutzer.get('password_hash')):
+            self.update_password(benutzer['id'], password)
+        return benutzer
 
     def update_password(self, benutzer_id: int, new_password: str):
         """Passwort eines Benutzers ändern"""
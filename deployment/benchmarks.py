@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark-Suite für häufig genutzte Routen und DB-Hilfsfunktionen
+
+Läuft gegen generierte SQLite-Datenbanken mehrerer Größen
+(generate_load_data.py, Skalierung z.B. 1x / 10x / 50x) und misst pro
+Benchmark Wall-Time und Anzahl SQL-Abfragen (aus metrics).
+
+Jede Größe läuft in einem eigenen Prozess, weil die Datenbankpfade beim
+Import der App gelesen werden. Ergebnisse als JSON, zum Vergleich
+zwischen Commits:
+
+    python benchmarks.py --scales 1,10 --out bench_vorher.json
+    (Änderung einspielen)
+    python benchmarks.py --scales 1,10 --out bench_nachher.json --vergleich bench_vorher.json
+
+Generierte Datenbanken werden in BENCH_DIR wiederverwendet (--neu erzeugt sie neu).
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import calendar
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import date, datetime
+
+BENCH_DIR = os.environ.get('BENCH_DIR', os.path.join(tempfile.gettempdir(), 'mgr_bench'))
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ERGEBNIS_MARKER = 'BENCH_ERGEBNIS:'
+
+
+# ==================== EINZELLAUF (Kindprozess) ====================
+
+def _einzellauf(db_path, scale, repeat):
+    """Alle Benchmarks gegen eine Datenbank (DB_PATH ist bereits gesetzt)"""
+    import metrics
+    from web_app import app
+    from database import MaschinenDBContext
+    from utils.sql_helpers import convert_sql
+    from utils.jobs import job_einreihen, job_schritt, job_laden
+
+    def messen(name, funktion, erwartet=200, wiederholungen=repeat):
+        """Zeit und Abfragen pro Lauf; abweichender Status bricht den Benchmark ab
+
+        Eine Fehlerseite oder Weiterleitung ist schneller als die echte
+        Antwort und würde als Verbesserung erscheinen.
+        """
+        zeiten, abfragen, status = [], [], None
+        for _ in range(wiederholungen):
+            vorher = metrics.total_count('mgr_db_query_duration_seconds')
+            start = time.perf_counter()
+            status = funktion()
+            zeiten.append(time.perf_counter() - start)
+            if status != erwartet:
+                raise RuntimeError(f"Benchmark {name}: Status {status}, erwartet {erwartet}")
+            abfragen.append(metrics.total_count('mgr_db_query_duration_seconds') - vorher)
+        zeiten.sort()
+        return {
+            'scale': scale,
+            'name': name,
+            'runs': len(zeiten),
+            'median_ms': round(statistics.median(zeiten) * 1000, 3),
+            'min_ms': round(zeiten[0] * 1000, 3),
+            'max_ms': round(zeiten[-1] * 1000, 3),
+            'queries': int(statistics.median(abfragen)),
+            'status': status,
+        }
+
+    # Testpersonen: Gemeinschafts-Admin der größten Gemeinschaft, Mitglied mit den meisten Einsätzen
+    with MaschinenDBContext(db_path) as db:
+        cursor = db.connection.cursor()
+        cursor.execute(convert_sql("""
+            SELECT ga.gemeinschaft_id, b.username
+            FROM gemeinschafts_admin ga
+            JOIN benutzer b ON b.id = ga.benutzer_id
+            JOIN maschinen m ON m.gemeinschaft_id = ga.gemeinschaft_id
+            GROUP BY ga.gemeinschaft_id, b.username
+            ORDER BY COUNT(m.id) DESC
+            LIMIT 1
+        """))
+        gemeinschaft_id, admin_username = cursor.fetchone()
+        cursor.execute(convert_sql("""
+            SELECT b.id, b.username FROM maschineneinsaetze e
+            JOIN benutzer b ON b.id = e.benutzer_id
+            WHERE b.admin_level = 0 OR b.admin_level IS NULL
+            GROUP BY b.id, b.username
+            ORDER BY COUNT(*) DESC
+            LIMIT 1
+        """))
+        mitglied_id, mitglied_username = cursor.fetchone()
+        cursor.execute(convert_sql("""
+            SELECT id, stundenzaehler_aktuell FROM maschinen WHERE gemeinschaft_id = ? LIMIT 1
+        """), (gemeinschaft_id,))
+        maschine_id, stand = cursor.fetchone()
+        cursor.execute("SELECT MIN(id) FROM einsatzzwecke")
+        zweck_id = cursor.fetchone()[0]
+
+    def client_fuer(username):
+        client = app.test_client()
+        client.post('/login', data={'username': username, 'password': 'test123'})
+        return client
+
+    mitglied = client_fuer(mitglied_username)
+    admin = client_fuer(admin_username)
+
+    def get(client, url):
+        return lambda: client.get(url).status_code
+
+    def job(typ, **parameter):
+        """Hintergrund-Job einreihen und synchron ausführen (JOB_WORKER_THREADS=0)
+
+        Die Export-Routen antworten nur noch mit einer Weiterleitung auf die
+        Statusseite - gemessen wird die Arbeit des Jobs.
+        """
+        def ausfuehren():
+            job_id = job_einreihen(typ, dict(parameter, db_path=db_path))
+            job_schritt()
+            ergebnis = job_laden(job_id)
+            if ergebnis['status'] != 'fertig':
+                return f"{ergebnis['status']}: {ergebnis['meldung']}"
+            return ergebnis['status']
+        return ausfuehren
+
+    ergebnisse = [
+        messen('dashboard', get(mitglied, '/dashboard')),
+        messen('meine_einsaetze', get(mitglied, '/meine-einsaetze')),
+        messen('reservierungen_balken', get(mitglied, '/reservierungen-balken')),
+        messen('meine_einsaetze_csv', get(mitglied, '/meine-einsaetze/csv')),
+        messen('admin_transaktionen', get(admin, f'/admin/abrechnungen/{gemeinschaft_id}/transaktionen')),
+        messen('job_export_csv', job('export_csv'), 'fertig'),
+        messen('job_export_json', job('export_json'), 'fertig'),
+        messen('job_export_alle_einsaetze_csv', job('export_alle_einsaetze_csv'), 'fertig'),
+        messen('maschinenuebersicht_pdf', get(admin, f'/admin/gemeinschaften/{gemeinschaft_id}/maschinenuebersicht/pdf')),
+    ]
+
+    # Generierte Daten enthalten keine Abrechnungen: eine für den Monat des
+    # letzten Einsatzes des Mitglieds anlegen, damit die echte Seite gemessen wird
+    with MaschinenDBContext(db_path) as db:
+        cursor = db.connection.cursor()
+        cursor.execute(convert_sql("""
+            SELECT m.gemeinschaft_id, MAX(e.datum) FROM maschineneinsaetze e
+            JOIN maschinen m ON m.id = e.maschine_id
+            WHERE e.benutzer_id = ?
+            GROUP BY m.gemeinschaft_id
+            ORDER BY COUNT(*) DESC
+            LIMIT 1
+        """), (mitglied_id,))
+        abrechnung_gemeinschaft_id, letzter_einsatz = cursor.fetchone()
+        jahr, monat = int(str(letzter_einsatz)[:4]), int(str(letzter_einsatz)[5:7])
+        von = f'{jahr}-{monat:02d}-01'
+        bis = f'{jahr}-{monat:02d}-{calendar.monthrange(jahr, monat)[1]}'
+        cursor.execute(convert_sql("""
+            SELECT COALESCE(SUM(e.kosten_berechnet), 0), COALESCE(SUM(e.treibstoffkosten), 0)
+            FROM maschineneinsaetze e
+            JOIN maschinen m ON m.id = e.maschine_id
+            WHERE e.benutzer_id = ? AND m.gemeinschaft_id = ? AND e.datum >= ? AND e.datum <= ?
+        """), (mitglied_id, abrechnung_gemeinschaft_id, von, bis))
+        betrag_maschinen, betrag_treibstoff = cursor.fetchone()
+        cursor.execute(convert_sql("""
+            INSERT INTO mitglieder_abrechnungen
+                (benutzer_id, gemeinschaft_id, zeitraum_von, zeitraum_bis,
+                 betrag_maschinen, betrag_treibstoff, betrag_gesamt)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """), (mitglied_id, abrechnung_gemeinschaft_id, von, bis,
+               betrag_maschinen, betrag_treibstoff, betrag_maschinen + betrag_treibstoff))
+        abrechnung_id = cursor.lastrowid
+        db.connection.commit()
+    ergebnisse.append(messen('abrechnung_pdf', get(mitglied, f'/abrechnung/{abrechnung_id}/pdf')))
+
+    # DB-Hilfsfunktionen: 1000 Aufrufe pro Lauf
+    beispiel_sql = """
+        SELECT e.id, e.datum, m.bezeichnung FROM maschineneinsaetze e
+        JOIN maschinen m ON e.maschine_id = m.id
+        WHERE e.benutzer_id = ? AND e.datum BETWEEN ? AND ? AND m.aktiv = true
+        ORDER BY e.datum DESC LIMIT 50
+    """
+
+    def convert_sql_1000():
+        for _ in range(1000):
+            convert_sql(beispiel_sql)
+        return 'ok'
+
+    ergebnisse.append(messen('convert_sql_x1000', convert_sql_1000, 'ok'))
+
+    zaehler = {'stand': stand or 0}
+
+    def add_einsatz_100():
+        with MaschinenDBContext(db_path) as db:
+            for _ in range(100):
+                anfang = zaehler['stand']
+                zaehler['stand'] = round(anfang + 1.5, 1)
+                db.add_einsatz(datum=date.today().isoformat(), benutzer_id=mitglied_id, maschine_id=maschine_id,
+                               einsatzzweck_id=zweck_id, anfangstand=anfang, endstand=zaehler['stand'])
+        return 'ok'
+
+    ergebnisse.append(messen('add_einsatz_x100', add_einsatz_100, 'ok'))
+    return ergebnisse
+
+
+# ==================== STEUERUNG (Elternprozess) ====================
+
+def _db_fuer(scale, seed, neu):
+    """Generierte Datenbank für eine Skalierung (wiederverwendet, Arbeitskopie pro Lauf)"""
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    vorlage = os.path.join(BENCH_DIR, f'bench_s{scale:g}_seed{seed}.db')
+    if neu or not os.path.exists(vorlage):
+        if os.path.exists(vorlage):
+            os.remove(vorlage)
+        print(f"Erzeuge Datenbank Skalierung {scale:g}x ...", flush=True)
+        subprocess.run([sys.executable, os.path.join(BASE_DIR, 'generate_load_data.py'),
+                        '--scale', str(scale), '--seed', str(seed), '--db', vorlage],
+                       cwd=BASE_DIR, check=True, stdout=subprocess.DEVNULL)
+    # Benchmarks schreiben (Abrechnungen, Einsätze) - Vorlage unverändert lassen
+    arbeitskopie = os.path.join(BENCH_DIR, f'lauf_s{scale:g}_{os.getpid()}.db')
+    shutil.copyfile(vorlage, arbeitskopie)
+    return arbeitskopie
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _vergleich(ergebnisse, datei):
+    """Median-Zeiten und Abfragen gegen eine frühere Ergebnisdatei"""
+    with open(datei, 'r', encoding='utf-8') as f:
+        alt = {(e['scale'], e['name']): e for e in json.load(f)['ergebnisse']}
+    print(f"\nVergleich mit {datei}:")
+    print(f"{'Skal.':>6} {'Benchmark':<34}{'vorher':>11}{'nachher':>11}{'Faktor':>8}{'Abfragen':>14}")
+    for e in ergebnisse:
+        vorher = alt.get((e['scale'], e['name']))
+        if not vorher:
+            continue
+        faktor = e['median_ms'] / vorher['median_ms'] if vorher['median_ms'] else 0
+        print(f"{e['scale']:>6g} {e['name']:<34}{vorher['median_ms']:>9.1f}ms{e['median_ms']:>9.1f}ms"
+              f"{faktor:>7.2f}x{vorher['queries']:>7} -> {e['queries']:<5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks für Routen und DB-Hilfsfunktionen')
+    parser.add_argument('--scales', default='1,10', help='Skalierungen, kommagetrennt (Standard: 1,10)')
+    parser.add_argument('--repeat', type=int, default=5, help='Wiederholungen pro Benchmark')
+    parser.add_argument('--seed', type=int, default=42, help='Seed für generierte Daten')
+    parser.add_argument('--out', help='Ergebnisse als JSON speichern')
+    parser.add_argument('--vergleich', help='Frühere JSON-Ergebnisse zum Vergleich')
+    parser.add_argument('--neu', action='store_true', help='Datenbanken neu generieren')
+    parser.add_argument('--einzeln', help=argparse.SUPPRESS)
+    parser.add_argument('--scale', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.einzeln:
+        ergebnisse = _einzellauf(args.einzeln, args.scale, args.repeat)
+        print(ERGEBNIS_MARKER + json.dumps(ergebnisse))
+        return 0
+
+    ergebnisse = []
+    for scale in [float(s) for s in args.scales.split(',') if s.strip()]:
+        db_path = _db_fuer(scale, args.seed, args.neu)
+        job_dir = os.path.join(BENCH_DIR, f'jobs_{os.getpid()}')
+        # Jobs laufen synchron im Benchmark-Prozess (job_schritt), nicht in Worker-Threads
+        umgebung = dict(os.environ, DB_PATH=db_path, SQLITE_PATH=db_path, DB_TYPE='sqlite', METRICS_DIR='',
+                        JOB_WORKER_THREADS='0', JOB_DIR=job_dir)
+        print(f"Benchmarks Skalierung {scale:g}x ...", flush=True)
+        try:
+            lauf = subprocess.run([sys.executable, os.path.abspath(__file__), '--einzeln', db_path,
+                                   '--scale', str(scale), '--repeat', str(args.repeat)],
+                                  cwd=BASE_DIR, env=umgebung, capture_output=True, text=True)
+        finally:
+            os.remove(db_path)
+            shutil.rmtree(job_dir, ignore_errors=True)
+        zeile = next((z for z in lauf.stdout.splitlines() if z.startswith(ERGEBNIS_MARKER)), None)
+        if zeile is None:
+            print(lauf.stdout[-2000:], lauf.stderr[-4000:])
+            return 1
+        ergebnisse.extend(json.loads(zeile[len(ERGEBNIS_MARKER):]))
+
+    print(f"\n{'Skal.':>6} {'Benchmark':<34}{'Median':>11}{'Min':>11}{'Max':>11}{'Abfragen':>10}{'Status':>8}")
+    for e in ergebnisse:
+        print(f"{e['scale']:>6g} {e['name']:<34}{e['median_ms']:>9.1f}ms{e['min_ms']:>9.1f}ms"
+              f"{e['max_ms']:>9.1f}ms{e['queries']:>10}{str(e['status']):>8}")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({
+                'commit': _git_commit(),
+                'zeitpunkt': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'plattform': platform.platform(),
+                'repeat': args.repeat,
+                'seed': args.seed,
+                'ergebnisse': ergebnisse,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"\nErgebnisse gespeichert: {args.out}")
+
+    if args.vergleich:
+        _vergleich(ergebnisse, args.vergleich)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prüfung von Verbindungspool und Prozess-Zeitgrenze
+
+Prüft gegen einen laufenden PostgreSQL-Server (DB_TYPE=postgresql, PG_*):
+- Ausleihen: freie Verbindungen werden wiederverwendet, ausgeliehene nicht
+  doppelt vergeben
+- Zurückgeben: eine offene Transaktion wird zurückgerollt, bevor die
+  Verbindung wieder im Pool liegt
+- Grenze: ist PG_POOL_MAX erreicht, scheitert das nächste Ausleihen nach
+  PG_POOL_TIMEOUT_SECONDS statt unbegrenzt zu warten
+
+Ohne PostgreSQL werden diese Prüfungen übersprungen. Immer geprüft:
+- befehl_ausfuehren beendet einen hängenden Prozess nach
+  PROZESS_TIMEOUT_SECONDS
+
+Die Grenzen werden für die Prüfung fest gesetzt (PG_POOL_SIZE=1,
+PG_POOL_MAX=2, Zeitgrenzen 1s).
+
+Aufruf:
+    DB_TYPE=postgresql PG_HOST=... PG_PASSWORD=... python check_pool.py
+
+Exit-Code 1, wenn eine Prüfung fehlschlägt.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+os.environ.update(PG_POOL_SIZE='1', PG_POOL_MAX='2', PG_POOL_TIMEOUT_SECONDS='1',
+                  PROZESS_TIMEOUT_SECONDS='1')
+
+import database  # noqa: E402
+from utils.prozesse import befehl_ausfuehren  # noqa: E402
+
+ergebnisse = []
+
+
+def pruefen(name, funktion):
+    try:
+        meldung = funktion()
+        ergebnisse.append(('OK', name, meldung or ''))
+    except Exception as e:
+        ergebnisse.append(('FEHLER', name, f'{type(e).__name__}: {e}'))
+
+
+def uebersprungen(name, grund):
+    ergebnisse.append(('ÜBERSPRUNGEN', name, grund))
+
+
+# ==================== POOL ====================
+
+def pool_ausleihen():
+    erste = database._primary_ausleihen()
+    zweite = database._primary_ausleihen()
+    try:
+        assert erste is not zweite, 'dieselbe Verbindung zweimal ausgeliehen'
+    finally:
+        database._primary_zurueckgeben(zweite)
+    database._primary_zurueckgeben(erste)
+
+    # PG_POOL_SIZE=1: nur die zuerst zurückgegebene bleibt offen
+    wieder = database._primary_ausleihen()
+    database._primary_zurueckgeben(wieder)
+    assert wieder is zweite, 'freie Verbindung wurde nicht wiederverwendet'
+    assert erste.closed, 'Verbindung über PG_POOL_SIZE hinaus nicht geschlossen'
+
+
+def pool_rollback():
+    connection = database._primary_ausleihen()
+    cursor = connection.cursor()
+    cursor.execute("CREATE TEMP TABLE pool_pruefung (x INTEGER)")
+    database._primary_zurueckgeben(connection)
+
+    wieder = database._primary_ausleihen()
+    try:
+        assert wieder is connection, 'Verbindung nicht wiederverwendet'
+        status = wieder.get_transaction_status()
+        assert status == database.psycopg2.extensions.TRANSACTION_STATUS_IDLE, \
+            f'Transaktionsstatus {status} nach dem Zurückgeben'
+        cursor = wieder.cursor()
+        cursor.execute("SELECT to_regclass('pg_temp.pool_pruefung')")
+        assert cursor.fetchone()[0] is None, 'nicht bestätigte Änderung ist noch sichtbar'
+        wieder.rollback()
+    finally:
+        database._primary_zurueckgeben(wieder)
+
+
+def pool_grenze():
+    ausgeliehen = [database._primary_ausleihen() for _ in range(database.PG_POOL_MAX)]
+    try:
+        start = time.monotonic()
+        try:
+            ueberzaehlig = database._primary_ausleihen()
+        except database.psycopg2.OperationalError:
+            dauer = time.monotonic() - start
+        else:
+            database._primary_zurueckgeben(ueberzaehlig)
+            raise AssertionError(f'mehr als PG_POOL_MAX={database.PG_POOL_MAX} Verbindungen ausgeliehen')
+    finally:
+        for connection in ausgeliehen:
+            database._primary_zurueckgeben(connection)
+
+    assert database.PG_POOL_TIMEOUT_SECONDS <= dauer < database.PG_POOL_TIMEOUT_SECONDS + 2, \
+        f'nach {dauer:.2f}s abgebrochen (Zeitgrenze {database.PG_POOL_TIMEOUT_SECONDS:g}s)'
+
+    # Plätze wurden wieder freigegeben
+    connection = database._primary_ausleihen()
+    database._primary_zurueckgeben(connection)
+    return f'abgelehnt nach {dauer:.2f}s'
+
+
+# ==================== PROZESSE ====================
+
+def prozess_zeitgrenze():
+    with tempfile.TemporaryDirectory() as verzeichnis:
+        pid_datei = os.path.join(verzeichnis, 'pid')
+        skript = (f"import os, time; open({pid_datei!r}, 'w').write(str(os.getpid())); "
+                  f"time.sleep(30)")
+        start = time.monotonic()
+        try:
+            befehl_ausfuehren([sys.executable, '-c', skript])
+        except subprocess.TimeoutExpired:
+            dauer = time.monotonic() - start
+        else:
+            raise AssertionError('Prozess lief ohne Zeitgrenze zu Ende')
+        with open(pid_datei, 'r') as f:
+            pid = int(f.read())
+
+    assert dauer < 10, f'erst nach {dauer:.2f}s abgebrochen'
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return f'beendet nach {dauer:.2f}s'
+    raise AssertionError(f'Prozess {pid} läuft nach der Zeitgrenze weiter')
+
+
+def main():
+    pool = [('Pool: Ausleihen und Wiederverwenden', pool_ausleihen),
+            ('Pool: Rollback beim Zurückgeben', pool_rollback),
+            ('Pool: Zeitgrenze bei PG_POOL_MAX', pool_grenze)]
+    if database.USING_POSTGRESQL:
+        for name, funktion in pool:
+            pruefen(name, funktion)
+    else:
+        for name, _ in pool:
+            uebersprungen(name, 'kein PostgreSQL (DB_TYPE=postgresql und PG_* setzen)')
+
+    pruefen('befehl_ausfuehren: Zeitgrenze', prozess_zeitgrenze)
+
+    for status, name, meldung in ergebnisse:
+        print(f"{status:<13} {name:<40} {meldung}")
+    return 1 if any(status == 'FEHLER' for status, _, _ in ergebnisse) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
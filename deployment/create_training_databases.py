@@ -2,26 +2,50 @@
 # -*- coding: utf-8 -*-
 """
 Erstellt die SQLite-Übungsdatenbanken für Trainings- und Testzwecke
+
+Jede Übungsdatenbank wird als versionierte Vorlage gebaut
+(data/training/vorlagen/, siehe utils/training.py) und von dort in den
+Übungsordner kopiert. Vorlagen in aktueller Version werden wiederverwendet;
+--neu erzwingt den Neuaufbau.
+
+Aufruf:
+    python create_training_databases.py [--neu]
+    python create_training_databases.py --vorlage <db_key> <ziel.db>
+
+--vorlage baut nur die eine Vorlage nach <ziel.db>; so ruft
+utils/training.py den Generator in einem eigenen Prozess auf.
 """
 
 import os
+import sys
 import sqlite3
-import hashlib
+from functools import lru_cache
 from datetime import datetime, timedelta
 import random
 
+from database import hash_password as _hash_password
+from utils.training import (
+    TRAINING_DATABASES, TRAINING_DB_DIR, TRAINING_SEED,
+    vorlage_erstellen, training_db_zuruecksetzen
+)
+
 # Pfade
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-TRAINING_DIR = os.path.join(os.path.dirname(BASE_DIR), 'data', 'training')
+TRAINING_DIR = TRAINING_DB_DIR
 SCHEMA_FILE = os.path.join(BASE_DIR, 'schema.sql')
 
 # Sicherstellen dass Verzeichnis existiert
 os.makedirs(TRAINING_DIR, exist_ok=True)
 
 
+@lru_cache(maxsize=None)
 def hash_password(password):
-    """Passwort hashen mit SHA-256"""
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    """Passwort hashen (scrypt mit Salt, siehe database.hash_password)
+
+    Wird pro Klartext nur einmal berechnet: Übungsdatenbanken mit hunderten
+    Testbenutzern ('test123') bleiben so in Sekunden erstellt.
+    """
+    return _hash_password(password)
 
 
 def create_database(db_path):
@@ -121,22 +145,23 @@ def add_users(conn, count=5):
     nachnamen = ['Müller', 'Huber', 'Mair', 'Berger', 'Hofer', 'Gruber', 'Wagner', 'Moser', 'Bauer', 'Schmid',
                  'Winkler', 'Weber', 'Steiner', 'Maier', 'Eder', 'Schwarz', 'Fischer', 'Reiter', 'Brunner', 'Auer']
 
+    rows = []
     for i in range(count):
         vorname = random.choice(vornamen)
         nachname = random.choice(nachnamen)
         username = f"{vorname.lower()}.{nachname.lower()}{i+1}"
+        rows.append((nachname, vorname, username, hash_password('test123')))
 
-        cursor.execute("""
-            INSERT INTO benutzer (name, vorname, username, password_hash, is_admin, admin_level, aktiv)
-            VALUES (?, ?, ?, ?, 0, 0, 1)
-        """, (nachname, vorname, username, hash_password('test123')))
+    cursor.executemany("""
+        INSERT INTO benutzer (name, vorname, username, password_hash, is_admin, admin_level, aktiv)
+        VALUES (?, ?, ?, ?, 0, 0, 1)
+    """, rows)
 
-        # Zu Gemeinschaft hinzufügen
-        user_id = cursor.lastrowid
-        cursor.execute("""
-            INSERT OR IGNORE INTO mitglied_gemeinschaft (mitglied_id, gemeinschaft_id)
-            VALUES (?, 1)
-        """, (user_id,))
+    # Alle Testbenutzer zur Gemeinschaft hinzufügen
+    cursor.execute("""
+        INSERT OR IGNORE INTO mitglied_gemeinschaft (mitglied_id, gemeinschaft_id)
+        SELECT id, 1 FROM benutzer WHERE id > 1
+    """)
 
     conn.commit()
 
@@ -156,13 +181,11 @@ def add_machines(conn, count=3):
         ('Schneepflug', 'Hauer', 'HS 2800', 18, 'stunden'),
     ]
 
-    for i in range(min(count, len(maschinen))):
-        m = maschinen[i]
-        cursor.execute("""
-            INSERT INTO maschinen (bezeichnung, hersteller, modell, preis_pro_einheit, abrechnungsart,
-                                   gemeinschaft_id, aktiv, stundenzaehler_aktuell)
-            VALUES (?, ?, ?, ?, ?, 1, 1, ?)
-        """, (m[0], m[1], m[2], m[3], m[4], random.randint(100, 2000)))
+    cursor.executemany("""
+        INSERT INTO maschinen (bezeichnung, hersteller, modell, preis_pro_einheit, abrechnungsart,
+                               gemeinschaft_id, aktiv, stundenzaehler_aktuell)
+        VALUES (?, ?, ?, ?, ?, 1, 1, ?)
+    """, [m + (random.randint(100, 2000),) for m in maschinen[:count]])
 
     conn.commit()
 
@@ -187,7 +210,11 @@ def add_einsaetze(conn, count=25):
     # Stundenzähler pro Maschine tracken
     stundenzaehler = {m[0]: m[1] or 0 for m in maschinen}
 
-    for i in range(count):
+    # Daten in den letzten 180 Tagen, chronologisch damit die Zählerstände fortlaufend sind
+    daten = sorted(datetime.now() - timedelta(days=random.randint(1, 180)) for _ in range(count))
+
+    rows = []
+    for datum in daten:
         benutzer_id = random.choice(benutzer_ids)
         maschine = random.choice(maschinen)
         maschine_id = maschine[0]
@@ -196,9 +223,6 @@ def add_einsaetze(conn, count=25):
 
         zweck_id = random.choice(zweck_ids)
 
-        # Datum in den letzten 180 Tagen
-        datum = datetime.now() - timedelta(days=random.randint(1, 180))
-
         anfangstand = stundenzaehler[maschine_id]
         betriebsstunden = round(random.uniform(0.5, 8), 1)
         endstand = anfangstand + betriebsstunden
@@ -213,79 +237,110 @@ def add_einsaetze(conn, count=25):
             flaeche = round(betriebsstunden * random.uniform(0.5, 2), 2)
             kosten = flaeche * preis
 
-        cursor.execute("""
-            INSERT INTO maschineneinsaetze (datum, benutzer_id, maschine_id, einsatzzweck_id,
-                                            anfangstand, endstand, betriebsstunden,
-                                            treibstoffverbrauch, treibstoffkosten, kosten_berechnet)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (datum.strftime('%Y-%m-%d'), benutzer_id, maschine_id, zweck_id,
-              anfangstand, endstand, betriebsstunden, treibstoffverbrauch, treibstoffkosten, kosten))
+        rows.append((datum.strftime('%Y-%m-%d'), benutzer_id, maschine_id, zweck_id,
+                     anfangstand, endstand, betriebsstunden, treibstoffverbrauch, treibstoffkosten, kosten))
+
+    cursor.executemany("""
+        INSERT INTO maschineneinsaetze (datum, benutzer_id, maschine_id, einsatzzweck_id,
+                                        anfangstand, endstand, betriebsstunden,
+                                        treibstoffverbrauch, treibstoffkosten, kosten_berechnet)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
 
     # Stundenzähler aktualisieren
-    for maschine_id, stand in stundenzaehler.items():
-        cursor.execute("UPDATE maschinen SET stundenzaehler_aktuell = ? WHERE id = ?", (stand, maschine_id))
+    cursor.executemany("UPDATE maschinen SET stundenzaehler_aktuell = ? WHERE id = ?",
+                       [(stand, maschine_id) for maschine_id, stand in stundenzaehler.items()])
 
     conn.commit()
 
 
-def create_empty_db():
+def create_empty_db(db_path):
     """Erstellt leere Übungsdatenbank"""
-    print("Erstelle: uebung_leer.db")
-    db_path = os.path.join(TRAINING_DIR, 'uebung_leer.db')
     conn = create_database(db_path)
     add_admin_user(conn)
     conn.close()
-    print(f"  -> {db_path}")
 
 
-def create_anfaenger_db():
+def create_anfaenger_db(db_path):
     """Erstellt Anfänger-Übungsdatenbank"""
-    print("Erstelle: uebung_anfaenger.db")
-    db_path = os.path.join(TRAINING_DIR, 'uebung_anfaenger.db')
     conn = create_database(db_path)
     add_admin_user(conn)
     add_users(conn, 5)
     add_machines(conn, 3)
     add_einsaetze(conn, 25)
     conn.close()
-    print(f"  -> {db_path}")
 
 
-def create_fortgeschritten_db():
+def create_fortgeschritten_db(db_path):
     """Erstellt Fortgeschrittenen-Übungsdatenbank"""
-    print("Erstelle: uebung_fortgeschritten.db")
-    db_path = os.path.join(TRAINING_DIR, 'uebung_fortgeschritten.db')
     conn = create_database(db_path)
     add_admin_user(conn)
     add_users(conn, 15)
     add_machines(conn, 8)
     add_einsaetze(conn, 250)
     conn.close()
-    print(f"  -> {db_path}")
 
 
-def create_admin_db():
+def create_admin_db(db_path):
     """Erstellt Admin-Übungsdatenbank"""
-    print("Erstelle: uebung_admin.db")
-    db_path = os.path.join(TRAINING_DIR, 'uebung_admin.db')
     conn = create_database(db_path)
     add_admin_user(conn)
     add_users(conn, 25)
     add_machines(conn, 8)
     add_einsaetze(conn, 700)
     conn.close()
-    print(f"  -> {db_path}")
+
+
+ERSTELLER = {
+    'uebung_leer': create_empty_db,
+    'uebung_anfaenger': create_anfaenger_db,
+    'uebung_fortgeschritten': create_fortgeschritten_db,
+    'uebung_admin': create_admin_db,
+}
+
+
+def vorlage_bauen(db_key, db_path):
+    """Vorlage einer Übungsdatenbank nach db_path schreiben
+
+    Fester Seed pro Datenbank: gleiche Vorlage unabhängig von der Reihenfolge.
+    """
+    random.seed(f"{TRAINING_SEED}:{db_key}")
+    ERSTELLER[db_key](db_path)
+    kennzahlen_bauen(db_path)
+
+
+def kennzahlen_bauen(db_path):
+    """Kennzahlen-Cache in der Vorlage füllen
+
+    Eine zurückgesetzte Übungsdatenbank ersetzt die Datei unter demselben
+    Pfad; laufende Prozesse haben den Cache dieses Pfads bereits als geprüft
+    vermerkt und würden eine leere Tabelle nicht mehr nachfüllen.
+    """
+    from database import MaschinenDBContext, USING_POSTGRESQL
+    if USING_POSTGRESQL:
+        # Übungsdatenbanken gibt es nur mit SQLite
+        return
+    from utils.maschinen_kennzahlen import kennzahlen_neu_aufbauen
+    with MaschinenDBContext(db_path) as db:
+        kennzahlen_neu_aufbauen(db)
 
 
 if __name__ == '__main__':
+    if '--vorlage' in sys.argv:
+        db_key, ziel = sys.argv[sys.argv.index('--vorlage') + 1:][:2]
+        vorlage_bauen(db_key, ziel)
+        sys.exit(0)
+
+    neu = '--neu' in sys.argv
+
     print("=" * 50)
     print("Erstelle Übungsdatenbanken...")
     print("=" * 50)
 
-    create_empty_db()
-    create_anfaenger_db()
-    create_fortgeschritten_db()
-    create_admin_db()
+    for db_key in TRAINING_DATABASES:
+        print(f"Erstelle: {TRAINING_DATABASES[db_key]['file']}")
+        print(f"  Vorlage: {vorlage_erstellen(db_key, neu=neu)}")
+        print(f"  -> {training_db_zuruecksetzen(db_key)}")
 
     print("=" * 50)
     print("Fertig!")
@@ -5,11 +5,15 @@ Unterstützt PostgreSQL und SQLite (Fallback)
 """
 
 import os
+import time
 import hashlib
 import secrets
+import threading
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 
+import metrics
+
 # Datenbank-Konfiguration aus Umgebungsvariablen
 DB_TYPE = os.environ.get('DB_TYPE', 'sqlite')  # 'postgresql' oder 'sqlite'
 
@@ -20,6 +24,25 @@ PG_DATABASE = os.environ.get('PG_DATABASE', 'maschinengemeinschaft')
 PG_USER = os.environ.get('PG_USER', 'mgr_user')
 PG_PASSWORD = os.environ.get('PG_PASSWORD', '')
 
+# Lesereplikat (Standby aus admin_replication) für Berichte/Exporte
+# Leer = alle Verbindungen gehen an den Primary
+PG_REPLICA_HOST = os.environ.get('PG_REPLICA_HOST', '')
+PG_REPLICA_PORT = os.environ.get('PG_REPLICA_PORT', PG_PORT)
+PG_REPLICA_USER = os.environ.get('PG_REPLICA_USER', PG_USER)
+PG_REPLICA_PASSWORD = os.environ.get('PG_REPLICA_PASSWORD', PG_PASSWORD)
+# Verbindungspool für den Primary (pro Worker-Prozess, siehe _primary_ausleihen)
+# PG_POOL_SIZE: freie Verbindungen, die zur Wiederverwendung offen bleiben (0 = jede schließen)
+# PG_POOL_MAX: gleichzeitig ausgeliehene Verbindungen; weitere Anfragen warten
+# höchstens PG_POOL_TIMEOUT_SECONDS auf einen freien Platz
+PG_POOL_SIZE = int(os.environ.get('PG_POOL_SIZE', 5))
+PG_POOL_MAX = int(os.environ.get('PG_POOL_MAX', 20))
+PG_POOL_TIMEOUT_SECONDS = float(os.environ.get('PG_POOL_TIMEOUT_SECONDS', 30))
+
+# Maximal tolerierter Replikationsrückstand, sonst Fallback auf den Primary
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 10))
+# Wie lange ein Prüfergebnis (Lag bzw. nicht erreichbar) gilt
+REPLICA_CHECK_INTERVAL_SECONDS = float(os.environ.get('REPLICA_CHECK_INTERVAL_SECONDS', 15))
+
 # SQLite-Fallback
 SQLITE_PATH = os.environ.get('SQLITE_PATH', 'maschinengemeinschaft.db')
 
@@ -38,6 +61,37 @@ else:
     USING_POSTGRESQL = False
 
 
+def _record_query_time(start: float):
+    """Query-Dauer für /metrics erfassen"""
+    metrics.observe('mgr_db_query_duration_seconds', time.perf_counter() - start,
+                    {'backend': 'postgresql' if USING_POSTGRESQL else 'sqlite'})
+
+
+if not USING_POSTGRESQL:
+    class MetricsCursor(sqlite3.Cursor):
+        """SQLite-Cursor mit Zeitmessung (auch für direkte cursor.execute-Aufrufe)"""
+
+        def execute(self, sql, parameters=()):
+            start = time.perf_counter()
+            try:
+                return super().execute(sql, parameters)
+            finally:
+                _record_query_time(start)
+
+        def executemany(self, sql, seq_of_parameters):
+            start = time.perf_counter()
+            try:
+                return super().executemany(sql, seq_of_parameters)
+            finally:
+                _record_query_time(start)
+
+    class MetricsConnection(sqlite3.Connection):
+        """SQLite-Connection, die immer MetricsCursor liefert"""
+
+        def cursor(self, factory=MetricsCursor):
+            return super().cursor(factory)
+
+
 def convert_placeholders(sql: str) -> str:
     """Konvertiert ? Platzhalter zu %s für PostgreSQL"""
     if USING_POSTGRESQL:
@@ -101,6 +155,291 @@ def convert_sql_syntax(sql: str) -> str:
     return convert_placeholders(sql)
 
 
+# ==================== PASSWORT-HASHING ====================
+# Format kompatibel zu werkzeug.security:
+#   scrypt:N:r:p$salt$hash   bzw.   pbkdf2:sha256:iterationen$salt$hash
+# Alte Hashes (64 Hex-Zeichen, SHA-256 ohne Salt) werden beim Login erkannt
+# und nach erfolgreicher Anmeldung automatisch auf das aktuelle Verfahren umgestellt.
+
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')  # 'scrypt' oder 'pbkdf2'
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 15))
+SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600000))
+SALT_CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+
+def _hash_scrypt(password: str, salt: str, params: str) -> str:
+    n, r, p = (int(x) for x in params.split(':'))
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt.encode('utf-8'),
+                          n=n, r=r, p=p, maxmem=132 * n * r * p).hex()
+
+
+def _hash_pbkdf2(password: str, salt: str, params: str) -> str:
+    hash_name, iterations = params.split(':')
+    return hashlib.pbkdf2_hmac(hash_name, password.encode('utf-8'),
+                               salt.encode('utf-8'), int(iterations)).hex()
+
+
+# Verfahren -> Hash-Funktion (weitere Verfahren hier eintragen)
+PASSWORD_HASHERS = {
+    'scrypt': _hash_scrypt,
+    'pbkdf2': _hash_pbkdf2,
+}
+
+
+def _current_method_params() -> Tuple[str, str]:
+    """Aktuell konfiguriertes Verfahren mit Kostenparametern"""
+    if PASSWORD_HASH_METHOD == 'pbkdf2':
+        return 'pbkdf2', f'sha256:{PBKDF2_ITERATIONS}'
+    return 'scrypt', f'{SCRYPT_N}:{SCRYPT_R}:{SCRYPT_P}'
+
+
+def hash_password(password: str, salt: str = None) -> str:
+    """Passwort mit Salt und aktuellem Verfahren hashen"""
+    method, params = _current_method_params()
+    if salt is None:
+        salt = ''.join(secrets.choice(SALT_CHARS) for _ in range(16))
+    return f"{method}:{params}${salt}${PASSWORD_HASHERS[method](password, salt, params)}"
+
+
+def _is_legacy_hash(password_hash: str) -> bool:
+    return len(password_hash) == 64 and '$' not in password_hash
+
+
+def check_password(password_hash: Optional[str], password: str) -> bool:
+    """Passwort gegen gespeicherten Hash prüfen (neue Verfahren und Alt-SHA-256)"""
+    if not password_hash or password is None:
+        return False
+
+    if _is_legacy_hash(password_hash):
+        legacy = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        return secrets.compare_digest(legacy, password_hash)
+
+    try:
+        method_params, salt, expected = password_hash.split('$', 2)
+        method, params = method_params.split(':', 1)
+        hasher = PASSWORD_HASHERS[method]
+        return secrets.compare_digest(hasher(password, salt, params), expected)
+    except (ValueError, KeyError):
+        return False
+
+
+def password_needs_rehash(password_hash: Optional[str]) -> bool:
+    """True wenn Hash veraltet ist (Alt-SHA-256 oder andere Kostenparameter)"""
+    if not password_hash or _is_legacy_hash(password_hash):
+        return True
+    method, params = _current_method_params()
+    return not password_hash.startswith(f"{method}:{params}$")
+
+
+# ==================== LESEREPLIKAT ====================
+
+# Letzte Prüfung des Replikats: (Zeitpunkt, nutzbar)
+_replica_status = {'geprueft': 0.0, 'nutzbar': True}
+
+_REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def replica_configured() -> bool:
+    """True wenn ein Lesereplikat konfiguriert ist (nur PostgreSQL)"""
+    return USING_POSTGRESQL and bool(PG_REPLICA_HOST)
+
+
+def _connect_replica():
+    """Verbindung zum Replikat öffnen, None bei Ausfall oder zu großem Lag
+
+    Das Ergebnis wird REPLICA_CHECK_INTERVAL_SECONDS lang gemerkt, damit ein
+    ausgefallener Standby nicht jeden Bericht um den Connect-Timeout verzögert.
+    """
+    jetzt = time.time()
+    if not _replica_status['nutzbar'] and jetzt - _replica_status['geprueft'] < REPLICA_CHECK_INTERVAL_SECONDS:
+        return None
+
+    try:
+        connection = psycopg2.connect(
+            host=PG_REPLICA_HOST,
+            port=PG_REPLICA_PORT,
+            database=PG_DATABASE,
+            user=PG_REPLICA_USER,
+            password=PG_REPLICA_PASSWORD,
+            connect_timeout=3
+        )
+    except psycopg2.Error as e:
+        print(f"WARNUNG: Lesereplikat nicht erreichbar, verwende Primary: {e}")
+        _replica_status.update(geprueft=jetzt, nutzbar=False)
+        return None
+
+    if jetzt - _replica_status['geprueft'] >= REPLICA_CHECK_INTERVAL_SECONDS:
+        try:
+            cursor = connection.cursor()
+            cursor.execute(_REPLICA_LAG_SQL)
+            lag = float(cursor.fetchone()[0] or 0)
+            cursor.close()
+            connection.rollback()
+        except psycopg2.Error as e:
+            print(f"WARNUNG: Replikations-Lag nicht ermittelbar: {e}")
+            lag = None
+        nutzbar = lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+        if lag is not None and not nutzbar:
+            print(f"WARNUNG: Lesereplikat {lag:.1f}s hinter dem Primary, verwende Primary")
+        _replica_status.update(geprueft=jetzt, nutzbar=nutzbar)
+        if not nutzbar:
+            connection.close()
+            return None
+
+    connection.set_session(readonly=True)
+    return connection
+
+
+# ==================== VERBINDUNGSPOOL / GEVENT ====================
+
+# Freie Primary-Verbindungen und Plätze des aktuellen Prozesses. Nach einem
+# fork (Gunicorn mit --preload) werden geerbte Verbindungen nicht weiterverwendet.
+_pool = {'pid': None, 'frei': [], 'plaetze': None}
+_pool_lock = threading.Lock()
+
+
+def _pool_zustand():
+    with _pool_lock:
+        if _pool['pid'] != os.getpid():
+            _pool.update(pid=os.getpid(), frei=[], plaetze=threading.BoundedSemaphore(PG_POOL_MAX))
+        return _pool
+
+
+def _primary_ausleihen():
+    """Verbindung zum Primary aus dem Pool (oder neu geöffnet)
+
+    Die Zahl gleichzeitig ausgeliehener Verbindungen ist auf PG_POOL_MAX
+    begrenzt - im gevent-Modus laufen pro Worker viele Requests parallel, ohne
+    Grenze würden sie max_connections des Servers erschöpfen.
+    """
+    zustand = _pool_zustand()
+    if not zustand['plaetze'].acquire(timeout=PG_POOL_TIMEOUT_SECONDS):
+        raise psycopg2.OperationalError(
+            f"Keine freie Datenbankverbindung nach {PG_POOL_TIMEOUT_SECONDS:.0f}s (PG_POOL_MAX={PG_POOL_MAX})")
+    try:
+        while True:
+            with _pool_lock:
+                connection = zustand['frei'].pop() if zustand['frei'] else None
+            if connection is None:
+                break
+            if not connection.closed:
+                return connection
+
+        connection = psycopg2.connect(
+            host=PG_HOST,
+            port=PG_PORT,
+            database=PG_DATABASE,
+            user=PG_USER,
+            password=PG_PASSWORD
+        )
+        metrics.inc('mgr_db_connections_opened_total', {'ziel': 'primary'})
+        return connection
+    except Exception:
+        zustand['plaetze'].release()
+        raise
+
+
+def _primary_zurueckgeben(connection):
+    """Verbindung in den Pool zurücklegen oder schließen
+
+    Wiederverwendet wird nur eine offene Verbindung ohne laufende Transaktion;
+    nicht abgeschlossene Transaktionen werden zurückgerollt.
+    """
+    zustand = _pool_zustand()
+    try:
+        wiederverwenden = not connection.closed
+        if wiederverwenden and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                wiederverwenden = False
+
+        with _pool_lock:
+            if wiederverwenden and len(zustand['frei']) < PG_POOL_SIZE:
+                zustand['frei'].append(connection)
+                return
+
+        if not connection.closed:
+            connection.close()
+        metrics.inc('mgr_db_connections_closed_total', {'ziel': 'primary'})
+    finally:
+        zustand['plaetze'].release()
+
+
+def _gevent_wait_callback(connection, timeout=None):
+    """psycopg2 wartet auf den Server über den gevent-Hub statt im Systemaufruf"""
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        status = connection.poll()
+        if status == psycopg2.extensions.POLL_OK:
+            break
+        elif status == psycopg2.extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif status == psycopg2.extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Unerwarteter Poll-Status: {status}")
+
+
+def gevent_aktiv() -> bool:
+    """True wenn der Prozess von gevent gepatcht ist (Gunicorn gevent-Worker)"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def _kooperativ_einrichten():
+    """Im gevent-Worker psycopg2 kooperativ machen (sonst blockiert jede Abfrage den Prozess)
+
+    Muss vor der ersten Verbindung laufen - daher beim Import dieses Moduls.
+    """
+    if USING_POSTGRESQL and gevent_aktiv():
+        psycopg2.extensions.set_wait_callback(_gevent_wait_callback)
+
+
+_kooperativ_einrichten()
+
+
+# Referenzdaten-Cache (Maschinen, Einsatzzwecke, Gemeinschaften) pro Datenbank.
+# Gültig solange der Zähler 'referenzdaten' in cache_versionen unverändert ist;
+# die TTL fängt Änderungen ohne App ab (Restore, direkte SQL-Änderungen).
+REFERENZDATEN_VERSION = 'referenzdaten'
+REFERENZDATEN_TTL_SECONDS = int(os.environ.get('REFERENZDATEN_TTL_SECONDS', 300))
+_referenzdaten = {}
+_referenzdaten_lock = threading.Lock()
+
+
+def einsatz_kosten(maschine: Optional[Dict], anfangstand: float, endstand: float,
+                   flaeche_menge: float = None) -> Optional[float]:
+    """Maschinenkosten eines Einsatzes nach Abrechnungsart der Maschine"""
+    if not maschine:
+        return None
+    abrechnungsart = maschine.get('abrechnungsart', 'stunden')
+    preis = maschine.get('preis_pro_einheit', 0) or 0
+
+    if abrechnungsart == 'stunden':
+        # Berechne basierend auf Betriebsstunden
+        return (endstand - anfangstand) * preis
+    if abrechnungsart in ['hektar', 'kilometer', 'stueck']:
+        # Berechne basierend auf Fläche/Menge, falls vorhanden
+        if flaeche_menge and flaeche_menge > 0:
+            return flaeche_menge * preis
+        # Fallback: 0 Euro wenn keine Menge angegeben
+        return 0.0
+    return None
+
+
 class CursorWrapper:
     """Wrapper für Cursor, der automatisch SQL konvertiert"""
 
@@ -109,10 +448,22 @@ class CursorWrapper:
 
     def execute(self, sql, params=None):
         sql = convert_sql_syntax(sql)
-        if params:
-            self._cursor.execute(sql, params)
-        else:
-            self._cursor.execute(sql)
+        start = time.perf_counter()
+        try:
+            if params:
+                self._cursor.execute(sql, params)
+            else:
+                self._cursor.execute(sql)
+        finally:
+            _record_query_time(start)
+
+    def executemany(self, sql, seq_of_params):
+        sql = convert_sql_syntax(sql)
+        start = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, seq_of_params)
+        finally:
+            _record_query_time(start)
 
     def fetchone(self):
         return self._cursor.fetchone()
@@ -172,41 +523,62 @@ class ConnectionWrapper:
 class MaschinenDB:
     """Hauptklasse für Datenbankverwaltung"""
 
-    def __init__(self, db_path: str = None):
-        """Initialisiere Datenbankverbindung"""
+    def __init__(self, db_path: str = None, read_only: bool = False):
+        """Initialisiere Datenbankverbindung
+
+        read_only=True: reine Lesezugriffe (Berichte, Exporte, Kalender) -
+        bei PostgreSQL mit Lesereplikat wird der Standby verwendet.
+        """
         self.db_path = db_path or SQLITE_PATH
         self.connection = None
         self.cursor = None
         self.using_postgresql = USING_POSTGRESQL
+        self.read_only = read_only
+        self.using_replica = False
+        self._gepoolt = False
+        self._referenzdaten_version = None
 
     def connect(self):
         """Verbindung zur Datenbank herstellen"""
         if self.using_postgresql:
-            raw_connection = psycopg2.connect(
-                host=PG_HOST,
-                port=PG_PORT,
-                database=PG_DATABASE,
-                user=PG_USER,
-                password=PG_PASSWORD
-            )
+            raw_connection = None
+            if self.read_only and replica_configured():
+                raw_connection = _connect_replica()
+            self.using_replica = raw_connection is not None
+            if raw_connection is None:
+                raw_connection = _primary_ausleihen()
+                self._gepoolt = True
             # Wrapper für automatische SQL-Konvertierung
             self.connection = ConnectionWrapper(raw_connection)
             self._raw_connection = raw_connection  # Für commit/rollback
             self.cursor = CursorWrapper(raw_connection.cursor(cursor_factory=DictCursor))
         else:
-            self.connection = sqlite3.connect(self.db_path)
+            self.connection = sqlite3.connect(self.db_path, factory=MetricsConnection)
             self.connection.row_factory = sqlite3.Row
             self.cursor = self.connection.cursor()
             self._raw_connection = self.connection
+        if not self._gepoolt:
+            metrics.inc('mgr_db_connections_opened_total', self._metric_labels())
+
+    def _metric_labels(self) -> Dict:
+        """Labels für die Verbindungs-Metriken"""
+        return {'ziel': 'replikat' if self.using_replica else 'primary'}
 
     def close(self):
         """Datenbankverbindung schließen"""
         if self.cursor:
             self.cursor.close()
-        if hasattr(self, '_raw_connection') and self._raw_connection:
+        if self._gepoolt:
+            self._gepoolt = False
+            _primary_zurueckgeben(self._raw_connection)
+            self._raw_connection = None
+            self.connection = None
+        elif hasattr(self, '_raw_connection') and self._raw_connection:
             self._raw_connection.close()
+            metrics.inc('mgr_db_connections_closed_total', self._metric_labels())
         elif self.connection:
             self.connection.close()
+            metrics.inc('mgr_db_connections_closed_total', self._metric_labels())
 
     def execute(self, sql: str, params: tuple = None):
         """SQL ausführen mit automatischer Syntax-Konvertierung"""
@@ -258,6 +630,53 @@ class MaschinenDB:
             self.cursor.executescript(schema_sql)
         self.connection.commit()
 
+    # ==================== REFERENZDATEN-CACHE ====================
+
+    def _referenzdaten(self, schluessel, laden):
+        """Selten geänderte Stammdaten aus dem Prozess-Cache lesen
+
+        Die Version wird einmal pro Verbindung gelesen (Primärschlüssel-Zugriff),
+        bei Abweichung wird der Cache dieser Datenbank verworfen.
+        """
+        if self._referenzdaten_version is None:
+            from utils.cache_versionen import version_lesen
+            self._referenzdaten_version = version_lesen(self, REFERENZDATEN_VERSION)
+        version = self._referenzdaten_version
+
+        eintrag = _referenzdaten.get(self.db_path)
+        if eintrag is None or eintrag['version'] != version \
+                or time.time() - eintrag['geladen'] >= REFERENZDATEN_TTL_SECONDS:
+            with _referenzdaten_lock:
+                eintrag = _referenzdaten.get(self.db_path)
+                if eintrag is None or eintrag['version'] != version \
+                        or time.time() - eintrag['geladen'] >= REFERENZDATEN_TTL_SECONDS:
+                    eintrag = {'version': version, 'geladen': time.time(), 'daten': {}}
+                    _referenzdaten[self.db_path] = eintrag
+
+        daten = eintrag['daten']
+        if schluessel not in daten:
+            daten[schluessel] = laden()
+        return daten[schluessel]
+
+    def referenzdaten_geaendert(self):
+        """Referenzdaten in allen Prozessen ungültig machen
+
+        Läuft in der Transaktion des Aufrufers (vor dessen Commit aufrufen).
+        """
+        from utils.cache_versionen import version_erhoehen
+        version_erhoehen(self, REFERENZDATEN_VERSION)
+        self._referenzdaten_version = None
+        _referenzdaten.pop(self.db_path, None)
+
+    def get_gemeinschaft(self, gemeinschaft_id: int) -> Optional[Dict]:
+        """Gemeinschaft abrufen (aus dem Referenzdaten-Cache)"""
+        def laden():
+            self.execute("SELECT * FROM gemeinschaften")
+            return {row['id']: row for row in self.fetchall()}
+
+        gemeinschaft = self._referenzdaten('gemeinschaften', laden).get(int(gemeinschaft_id))
+        return dict(gemeinschaft) if gemeinschaft else None
+
     # ==================== BENUTZER ====================
 
     def add_benutzer(self, name: str, vorname: str = None, username: str = None,
@@ -343,21 +762,20 @@ class MaschinenDB:
         self.connection.commit()
 
     def _hash_password(self, password: str) -> str:
-        """Passwort hashen mit SHA-256"""
-        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+        """Passwort hashen (scrypt/PBKDF2 mit Salt, siehe hash_password)"""
+        return hash_password(password)
 
     def verify_login(self, username: str, password: str) -> Optional[Dict]:
-        """Benutzer-Login überprüfen"""
-        password_hash = self._hash_password(password)
-        if self.using_postgresql:
-            sql = """SELECT * FROM benutzer
-                     WHERE username = %s AND password_hash = %s AND aktiv = true"""
-        else:
-            sql = """SELECT * FROM benutzer
-                     WHERE username = ? AND password_hash = ? AND aktiv = 1"""
-        self.cursor.execute(sql, (username, password_hash))
-        row = self.cursor.fetchone()
-        return dict(row) if row else None
+        """Benutzer-Login überprüfen (Suche nur über username, Index idx_benutzer_username)"""
+        self.execute("SELECT * FROM benutzer WHERE username = ? AND aktiv = 1", (username,))
+        benutzer = self.fetchone()
+        if not benutzer or not check_password(benutzer.get('password_hash'), password):
+            return None
+
+        # Alten SHA-256-Hash bzw. veraltete Kostenparameter transparent erneuern
+        if password_needs_rehash(benutzer.get('password_hash')):
+            self.update_password(benutzer['id'], password)
+        return benutzer
 
     def update_password(self, benutzer_id: int, new_password: str):
         """Passwort eines Benutzers ändern"""
@@ -448,7 +866,9 @@ class MaschinenDB:
                           abrechnungsart, preis_pro_einheit,
                           erfassungsmodus, gemeinschaft_id,
                           anschaffungspreis, abschreibungsdauer_jahre))
-            return self.cursor.fetchone()[0]
+            maschine_id = self.cursor.fetchone()[0]
+            self.referenzdaten_geaendert()
+            return maschine_id
         else:
             sql = """INSERT INTO maschinen (bezeichnung, hersteller, modell, baujahr,
                             kennzeichen, anschaffungsdatum,
@@ -465,18 +885,35 @@ class MaschinenDB:
                           abrechnungsart, preis_pro_einheit,
                           erfassungsmodus, gemeinschaft_id,
                           anschaffungspreis, abschreibungsdauer_jahre))
+            maschine_id = self.cursor.lastrowid
+            self.referenzdaten_geaendert()
             self.connection.commit()
-            return self.cursor.lastrowid
-
-    def get_all_maschinen(self, nur_aktive: bool = True) -> List[Dict]:
-        """Alle Maschinen abrufen"""
-        sql = "SELECT * FROM maschinen"
-        if nur_aktive:
-            sql += " WHERE aktiv = true" if self.using_postgresql else " WHERE aktiv = 1"
-        sql += " ORDER BY bezeichnung"
-
-        self.execute(sql)
-        return self.fetchall()
+            return maschine_id
+
+    def get_all_maschinen(self, nur_aktive: bool = True, mit_zaehler: bool = False) -> List[Dict]:
+        """Alle Maschinen abrufen (aus dem Referenzdaten-Cache)
+
+        Der Stundenzähler ändert sich mit fast jedem Einsatz und ist daher nicht
+        im Cache; mit_zaehler=True liest ihn aktuell nach (eine Abfrage).
+        """
+        def laden():
+            sql = "SELECT * FROM maschinen"
+            if nur_aktive:
+                sql += " WHERE aktiv = true" if self.using_postgresql else " WHERE aktiv = 1"
+            sql += " ORDER BY bezeichnung"
+            self.execute(sql)
+            maschinen = self.fetchall()
+            for maschine in maschinen:
+                maschine.pop('stundenzaehler_aktuell', None)
+            return maschinen
+
+        maschinen = [dict(m) for m in self._referenzdaten(('maschinen', nur_aktive), laden)]
+        if mit_zaehler:
+            self.execute("SELECT id, stundenzaehler_aktuell FROM maschinen")
+            staende = {row['id']: row['stundenzaehler_aktuell'] for row in self.fetchall()}
+            for maschine in maschinen:
+                maschine['stundenzaehler_aktuell'] = staende.get(maschine['id'])
+        return maschinen
 
     def get_maschine(self, maschine_id: int) -> Optional[Dict]:
         """Einzelne Maschine abrufen"""
@@ -497,6 +934,7 @@ class MaschinenDB:
             sql = f"UPDATE maschinen SET {fields} WHERE id = ?"
         values = list(kwargs.values()) + [maschine_id]
         self.cursor.execute(sql, values)
+        self.referenzdaten_geaendert()
         self.connection.commit()
 
     def update_stundenzaehler(self, maschine_id: int, neuer_stand: float):
@@ -514,6 +952,7 @@ class MaschinenDB:
                                   (maschine_id,))
         else:
             self.execute("DELETE FROM maschinen WHERE id = ?", (maschine_id,))
+        self.referenzdaten_geaendert()
         self.connection.commit()
 
     # ==================== EINSATZZWECKE ====================
@@ -523,22 +962,28 @@ class MaschinenDB:
         if self.using_postgresql:
             sql = "INSERT INTO einsatzzwecke (bezeichnung, beschreibung) VALUES (%s, %s) RETURNING id"
             self.cursor.execute(sql, (bezeichnung, beschreibung))
-            return self.cursor.fetchone()[0]
+            einsatzzweck_id = self.cursor.fetchone()[0]
+            self.referenzdaten_geaendert()
+            return einsatzzweck_id
         else:
             sql = "INSERT INTO einsatzzwecke (bezeichnung, beschreibung) VALUES (?, ?)"
             self.cursor.execute(sql, (bezeichnung, beschreibung))
+            einsatzzweck_id = self.cursor.lastrowid
+            self.referenzdaten_geaendert()
             self.connection.commit()
-            return self.cursor.lastrowid
+            return einsatzzweck_id
 
     def get_all_einsatzzwecke(self, nur_aktive: bool = True) -> List[Dict]:
-        """Alle Einsatzzwecke abrufen"""
-        sql = "SELECT * FROM einsatzzwecke"
-        if nur_aktive:
-            sql += " WHERE aktiv = true" if self.using_postgresql else " WHERE aktiv = 1"
-        sql += " ORDER BY bezeichnung"
+        """Alle Einsatzzwecke abrufen (aus dem Referenzdaten-Cache)"""
+        def laden():
+            sql = "SELECT * FROM einsatzzwecke"
+            if nur_aktive:
+                sql += " WHERE aktiv = true" if self.using_postgresql else " WHERE aktiv = 1"
+            sql += " ORDER BY bezeichnung"
+            self.execute(sql)
+            return self.fetchall()
 
-        self.execute(sql)
-        return self.fetchall()
+        return [dict(z) for z in self._referenzdaten(('einsatzzwecke', nur_aktive), laden)]
 
     def get_einsatzzweck_by_id(self, einsatzzweck_id: int) -> Optional[Dict]:
         """Einzelnen Einsatzzweck abrufen"""
@@ -555,6 +1000,7 @@ class MaschinenDB:
             sql = f"UPDATE einsatzzwecke SET {fields} WHERE id = ?"
         values = list(kwargs.values()) + [einsatzzweck_id]
         self.cursor.execute(sql, values)
+        self.referenzdaten_geaendert()
         self.connection.commit()
 
     def delete_einsatzzweck(self, einsatzzweck_id: int, soft_delete: bool = True):
@@ -568,6 +1014,7 @@ class MaschinenDB:
                                   (einsatzzweck_id,))
         else:
             self.execute("DELETE FROM einsatzzwecke WHERE id = ?", (einsatzzweck_id,))
+        self.referenzdaten_geaendert()
         self.connection.commit()
 
     def activate_einsatzzweck(self, einsatzzweck_id: int):
@@ -578,6 +1025,7 @@ class MaschinenDB:
         else:
             self.cursor.execute("UPDATE einsatzzwecke SET aktiv = 1 WHERE id = ?",
                               (einsatzzweck_id,))
+        self.referenzdaten_geaendert()
         self.connection.commit()
 
     # ==================== MASCHINENEINSÄTZE ====================
@@ -591,22 +1039,8 @@ class MaschinenDB:
             raise ValueError("Endstand muss größer oder gleich Anfangstand sein!")
 
         # Kosten berechnen basierend auf Maschinen-Abrechnungsart
-        kosten_berechnet = None
         maschine = self.get_maschine_by_id(maschine_id)
-        if maschine:
-            abrechnungsart = maschine.get('abrechnungsart', 'stunden')
-            preis = maschine.get('preis_pro_einheit', 0) or 0
-
-            if abrechnungsart == 'stunden':
-                # Berechne basierend auf Betriebsstunden
-                kosten_berechnet = (endstand - anfangstand) * preis
-            elif abrechnungsart in ['hektar', 'kilometer', 'stueck']:
-                # Berechne basierend auf Fläche/Menge, falls vorhanden
-                if flaeche_menge and flaeche_menge > 0:
-                    kosten_berechnet = flaeche_menge * preis
-                else:
-                    # Fallback: 0 Euro wenn keine Menge angegeben
-                    kosten_berechnet = 0.0
+        kosten_berechnet = einsatz_kosten(maschine, anfangstand, endstand, flaeche_menge)
 
         if self.using_postgresql:
             sql = """INSERT INTO maschineneinsaetze (datum, benutzer_id, maschine_id,
@@ -633,44 +1067,120 @@ class MaschinenDB:
             self.connection.commit()
             einsatz_id = self.cursor.lastrowid
 
-        # Stundenzähler der Maschine automatisch aktualisieren
-        self.update_stundenzaehler(maschine_id, endstand)
+        # Stundenzähler der Maschine nur vorwärts stellen (nachgetragene Einsätze)
+        from utils.stundenzaehler import zaehler_nach_einsatz
+        from utils.maschinen_kennzahlen import kennzahlen_einsatz_hinzu
+        zaehler_nach_einsatz(self, maschine_id, endstand)
+        kennzahlen_einsatz_hinzu(self, maschine, datum, anfangstand, endstand, flaeche_menge)
+        self.connection.commit()
 
         return einsatz_id
 
-    def get_all_einsaetze(self, limit: int = None) -> List[Dict]:
-        """Alle Einsätze abrufen (übersichtlich formatiert)"""
-        sql = "SELECT * FROM einsaetze_uebersicht"
+    def _einsatz_filter(self, von: str = None, bis: str = None, maschine_id=None,
+                        benutzer_id=None, gemeinschaft_id=None):
+        """WHERE-Bedingungen für die Einsatz-Übersicht (Alias e = Einsatz, m = Maschine)
+
+        maschine_id, benutzer_id und gemeinschaft_id akzeptieren eine ID oder
+        eine Liste von IDs.
+        """
+        bedingungen = []
+        params = []
+
+        if von or bis:
+            from utils.sql_helpers import datum_bereich
+            bereich, bereich_params = datum_bereich("e.datum", von, bis)
+            bedingungen.append(bereich)
+            params.extend(bereich_params)
+
+        for spalte, wert in (("e.maschine_id", maschine_id),
+                             ("e.benutzer_id", benutzer_id),
+                             ("m.gemeinschaft_id", gemeinschaft_id)):
+            if wert is None:
+                continue
+            if isinstance(wert, (list, tuple, set)):
+                werte = list(wert)
+                if not werte:
+                    bedingungen.append("1 = 0")
+                    continue
+                bedingungen.append(f"{spalte} IN ({','.join('?' for _ in werte)})")
+                params.extend(werte)
+            else:
+                bedingungen.append(f"{spalte} = ?")
+                params.append(wert)
+
+        return bedingungen, params
+
+    def get_einsaetze_uebersicht(self, von: str = None, bis: str = None, maschine_id=None,
+                                 benutzer_id=None, gemeinschaft_id=None, storniert: bool = False,
+                                 limit: int = None, offset: int = None) -> List[Dict]:
+        """Einsätze übersichtlich formatiert, neueste zuerst
+
+        Filter und Limit werden in die Abfrage durchgereicht; sortiert wird
+        über den Index (datum DESC, id DESC), so dass "die letzten N" ein
+        Index-Bereich sind statt Join und Sortierung über alle Einsätze.
+        storniert=False liefert aktive, True stornierte, None beide Arten.
+        """
+        bedingungen, params = self._einsatz_filter(von, bis, maschine_id, benutzer_id, gemeinschaft_id)
+        where = f"WHERE {' AND '.join(bedingungen)}" if bedingungen else ""
+
+        quellen = []
+        if storniert is not True:
+            quellen.append(("maschineneinsaetze", "e.id", "FALSE AS storniert, NULL AS storniert_am"))
+        if storniert is not False:
+            quellen.append(("maschineneinsaetze_storniert", "e.original_id",
+                            "TRUE AS storniert, e.storniert_am"))
+
+        teile = []
+        alle_params = []
+        for tabelle, id_spalte, storno_spalten in quellen:
+            teile.append(f"""SELECT {id_spalte} AS id, e.datum,
+                       e.benutzer_id, e.maschine_id, m.gemeinschaft_id, e.einsatzzweck_id,
+                       b.name || ', ' || COALESCE(b.vorname, '') AS benutzer,
+                       m.bezeichnung AS maschine,
+                       m.abrechnungsart AS abrechnungsart,
+                       m.preis_pro_einheit AS preis_pro_einheit,
+                       ez.bezeichnung AS einsatzzweck,
+                       e.anfangstand, e.endstand, e.betriebsstunden,
+                       e.treibstoffverbrauch, e.treibstoffkosten,
+                       e.flaeche_menge, e.kosten_berechnet, e.anmerkungen,
+                       {storno_spalten}
+                FROM {tabelle} e
+                JOIN benutzer b ON e.benutzer_id = b.id
+                JOIN maschinen m ON e.maschine_id = m.id
+                JOIN einsatzzwecke ez ON e.einsatzzweck_id = ez.id
+                {where}""")
+            alle_params.extend(params)
+
+        if len(teile) == 1:
+            sql = teile[0] + " ORDER BY e.datum DESC, e.id DESC"
+        else:
+            sql = f"SELECT * FROM ({' UNION ALL '.join(teile)}) u ORDER BY datum DESC, id DESC"
+
         if limit:
-            sql += f" LIMIT {limit}"
+            sql += " LIMIT ?"
+            alle_params.append(int(limit))
+            if offset:
+                sql += " OFFSET ?"
+                alle_params.append(int(offset))
 
-        self.execute(sql)
+        self.execute(sql, tuple(alle_params))
         return self.fetchall()
 
+    def get_all_einsaetze(self, limit: int = None) -> List[Dict]:
+        """Alle Einsätze abrufen (übersichtlich formatiert)"""
+        return self.get_einsaetze_uebersicht(limit=limit)
+
     def get_einsaetze_by_benutzer(self, benutzer_id: int) -> List[Dict]:
         """Einsätze eines bestimmten Benutzers abrufen"""
-        benutzer = self.get_benutzer(benutzer_id)
-        if not benutzer:
-            return []
-
-        search_pattern = f"%{benutzer['name']}%"
-        self.execute("SELECT * FROM einsaetze_uebersicht WHERE benutzer LIKE ?", (search_pattern,))
-        return self.fetchall()
+        return self.get_einsaetze_uebersicht(benutzer_id=benutzer_id)
 
     def get_einsaetze_by_maschine(self, maschine_id: int) -> List[Dict]:
         """Einsätze einer bestimmten Maschine abrufen"""
-        maschine = self.get_maschine(maschine_id)
-        if not maschine:
-            return []
-
-        self.execute("SELECT * FROM einsaetze_uebersicht WHERE maschine = ?", (maschine['bezeichnung'],))
-        return self.fetchall()
+        return self.get_einsaetze_uebersicht(maschine_id=maschine_id)
 
     def get_einsaetze_by_zeitraum(self, von: str, bis: str) -> List[Dict]:
         """Einsätze in einem Zeitraum abrufen"""
-        self.execute("""SELECT * FROM einsaetze_uebersicht
-                 WHERE datum BETWEEN ? AND ?""", (von, bis))
-        return self.fetchall()
+        return self.get_einsaetze_uebersicht(von=von, bis=bis)
 
     def get_statistik_benutzer(self, benutzer_id: int) -> Dict:
         """Statistik für einen Benutzer"""
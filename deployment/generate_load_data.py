@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Skalierbarer Testdaten-Generator für Lasttests und Hardware-Dimensionierung
+
+Erzeugt reproduzierbar (gleicher Seed = gleiche Daten) realistische Daten
+im Vielfachen der heutigen Größe:
+- Gemeinschaften, Betriebe (1-2 Gemeinschaften je Betrieb), Mitglieder
+- Maschinen mit fortlaufenden Stundenzählern
+- mehrjährige Einsätze mit Saisonverlauf (Frühjahr/Sommer stärker)
+- offene Reservierungen (nächste 90 Tage), Bank-Transaktionen, Buchungen/Mitgliederkonten
+
+Geschrieben wird tabellenweise mit Bulk-Inserts (SQLite: executemany,
+PostgreSQL: execute_values) und einem Commit pro Tabelle. IDs werden
+explizit vergeben, daher kann auch in eine bestehende Datenbank
+zusätzlich generiert werden.
+
+Aufruf:
+    python generate_load_data.py --scale 100 --db /tmp/mgr_last.db
+    DB_TYPE=postgresql PG_DATABASE=mgr_last python generate_load_data.py --scale 10
+
+Login aller generierten Benutzer: m<ID> / test123 (Passwort per --passwort)
+"""
+
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+from datetime import date, timedelta
+
+from database import MaschinenDBContext, USING_POSTGRESQL, hash_password
+from utils.schema_migration import run_migrations
+
+# Heutige Größe (Skalierung 1) - Mengen pro Einheit
+BASIS = {
+    'gemeinschaften': 3,
+    'betriebe_pro_gemeinschaft': 14,
+    'maschinen_pro_gemeinschaft': 8,
+    'einsaetze_pro_maschine_jahr': 60,
+    'offene_reservierungen_pro_maschine': 15,
+    'zahlungen_pro_betrieb_jahr': 3,
+}
+
+CHUNK_SIZE = 5000
+
+# Monatsgewichte für Einsätze (Jänner..Dezember)
+SAISON_GEWICHTE = [1, 1, 2, 4, 7, 8, 8, 7, 6, 4, 2, 2]
+
+VORNAMEN = ['Hans', 'Peter', 'Maria', 'Anna', 'Josef', 'Franz', 'Elisabeth', 'Johann', 'Theresia', 'Karl',
+            'Martin', 'Stefan', 'Thomas', 'Michael', 'Andreas', 'Christian', 'Markus', 'Sabine', 'Katharina', 'Herbert']
+NACHNAMEN = ['Müller', 'Huber', 'Mair', 'Berger', 'Hofer', 'Gruber', 'Wagner', 'Moser', 'Bauer', 'Schmid',
+             'Winkler', 'Weber', 'Steiner', 'Maier', 'Eder', 'Schwarz', 'Fischer', 'Reiter', 'Brunner', 'Auer']
+ORTE = ['6020 Innsbruck', '6100 Seefeld', '6130 Schwaz', '6200 Jenbach', '6230 Brixlegg', '6300 Wörgl']
+
+# (Bezeichnung, Hersteller, Modell, Preis pro Einheit, Abrechnungsart, Anschaffungspreis)
+MASCHINEN_VORLAGEN = [
+    ('Traktor', 'Fendt', '724 Vario', 45.0, 'stunden', 185000.0),
+    ('Traktor', 'Steyr', '4130 Profi', 40.0, 'stunden', 125000.0),
+    ('Mähwerk', 'Pöttinger', 'Novacat 352', 18.0, 'hektar', 28000.0),
+    ('Ladewagen', 'Strautmann', 'Super Vitesse', 25.0, 'stunden', 75000.0),
+    ('Güllefass', 'Zunhammer', 'SKE 18500', 12.0, 'stunden', 65000.0),
+    ('Kreisler', 'Kuhn', 'GF 8501', 10.0, 'hektar', 22000.0),
+    ('Rundballenpresse', 'Krone', 'Comprima F 125', 8.5, 'stueck', 48000.0),
+    ('Pflug', 'Lemken', 'Juwel 8', 28.0, 'hektar', 35000.0),
+    ('Schneepflug', 'Hauer', 'HSP 2800', 35.0, 'stunden', 12000.0),
+]
+
+EINSATZZWECKE = ['Mähen', 'Pflügen', 'Transportfahrten', 'Gülle ausbringen', 'Heuernte', 'Schneeräumung']
+
+
+class BulkWriter:
+    """Schreibt Zeilen blockweise - executemany (SQLite) bzw. execute_values (PostgreSQL)"""
+
+    def __init__(self, db, chunk_size=CHUNK_SIZE):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.raw = db._raw_connection
+        self.anzahl = {}
+
+    def next_id(self, table):
+        """Nächste freie ID einer Tabelle"""
+        cursor = self.raw.cursor()
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        return cursor.fetchone()[0] + 1
+
+    def insert(self, table, columns, rows):
+        """Zeilen (beliebiger Iterator) einfügen, ein Commit am Ende"""
+        cursor = self.raw.cursor()
+        spalten = ', '.join(columns)
+        if USING_POSTGRESQL:
+            sql = f"INSERT INTO {table} ({spalten}) VALUES %s"
+        else:
+            sql = f"INSERT INTO {table} ({spalten}) VALUES ({', '.join('?' * len(columns))})"
+
+        block = []
+        anzahl = 0
+        for row in rows:
+            block.append(row)
+            if len(block) >= self.chunk_size:
+                self._write(cursor, sql, block)
+                anzahl += len(block)
+                block = []
+        if block:
+            self._write(cursor, sql, block)
+            anzahl += len(block)
+
+        self.raw.commit()
+        self.anzahl[table] = self.anzahl.get(table, 0) + anzahl
+        return anzahl
+
+    def _write(self, cursor, sql, block):
+        if USING_POSTGRESQL:
+            from psycopg2.extras import execute_values
+            execute_values(cursor, sql, block, page_size=len(block))
+        else:
+            cursor.executemany(sql, block)
+
+    def reset_sequences(self, tables):
+        """PostgreSQL: Sequenzen nach expliziten IDs nachziehen"""
+        if not USING_POSTGRESQL:
+            return
+        cursor = self.raw.cursor()
+        for table in tables:
+            cursor.execute(f"""
+                SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 1))
+                FROM {table}
+            """)
+        self.raw.commit()
+
+
+def prepare_schema(db_path):
+    """Schema anlegen und auf aktuellen Stand migrieren"""
+    with MaschinenDBContext(db_path) as db:
+        db.init_database()
+    if not USING_POSTGRESQL:
+        os.environ['SQLITE_PATH'] = db_path
+    run_migrations()
+
+
+def _saison_datum(rng, jahr):
+    monat = rng.choices(range(1, 13), weights=SAISON_GEWICHTE)[0]
+    return date(jahr, monat, rng.randint(1, 28))
+
+
+def generate(db_path, scale=1.0, seed=42, jahre=3, passwort='test123', chunk_size=CHUNK_SIZE):
+    """Daten im Umfang scale x heutige Größe erzeugen
+
+    Returns:
+        Dict Tabelle -> Anzahl eingefügter Zeilen
+    """
+    rng = random.Random(seed)
+    heute = date.today()
+    jahre_liste = list(range(heute.year - jahre + 1, heute.year + 1))
+    anzahl_gemeinschaften = max(1, round(BASIS['gemeinschaften'] * scale))
+    password_hash = hash_password(passwort)
+
+    with MaschinenDBContext(db_path) as db:
+        writer = BulkWriter(db, chunk_size)
+        cursor = db._raw_connection.cursor()
+
+        # Einsatzzwecke (Stammdaten, nur falls noch keine vorhanden)
+        cursor.execute("SELECT id FROM einsatzzwecke")
+        zweck_ids = [r[0] for r in cursor.fetchall()]
+        if not zweck_ids:
+            start = writer.next_id('einsatzzwecke')
+            writer.insert('einsatzzwecke', ['id', 'bezeichnung', 'aktiv'],
+                          [(start + i, z, True) for i, z in enumerate(EINSATZZWECKE)])
+            zweck_ids = list(range(start, start + len(EINSATZZWECKE)))
+
+        # ==================== GEMEINSCHAFTEN / BETRIEBE / BENUTZER ====================
+        g_start = writer.next_id('gemeinschaften')
+        b_start = writer.next_id('betriebe')
+        u_start = writer.next_id('benutzer')
+        gemeinschaft_ids = list(range(g_start, g_start + anzahl_gemeinschaften))
+
+        gemeinschaften, betriebe, benutzer = [], [], []
+        betriebe_gemeinschaften, benutzer_betriebe, mitglied_gemeinschaft, gemeinschafts_admin = [], [], [], []
+        benutzer_je_betrieb = {}
+
+        for gid in gemeinschaft_ids:
+            gemeinschaften.append((gid, f'Gemeinschaft {gid}', 'Lasttest-Daten', rng.choice(ORTE),
+                                   round(rng.uniform(2000, 20000), 2), f'AT{gid:018d}', True))
+
+        betrieb_id = b_start
+        benutzer_id = u_start
+        for gid in gemeinschaft_ids:
+            anzahl = max(2, int(rng.gauss(BASIS['betriebe_pro_gemeinschaft'], 3)))
+            for k in range(anzahl):
+                nachname = rng.choice(NACHNAMEN)
+                betriebe.append((betrieb_id, f'Betrieb {nachname} {betrieb_id}', rng.choice(ORTE),
+                                 f'AT{betrieb_id:018d}', True))
+                betriebe_gemeinschaften.append((betrieb_id, gid))
+                # Rund jeder fünfte Betrieb ist in einer zweiten Gemeinschaft
+                if len(gemeinschaft_ids) > 1 and rng.random() < 0.2:
+                    zweite = rng.choice([g for g in gemeinschaft_ids if g != gid])
+                    betriebe_gemeinschaften.append((betrieb_id, zweite))
+
+                benutzer_je_betrieb[betrieb_id] = []
+                for j in range(1 if rng.random() < 0.7 else 2):
+                    # Erster Benutzer jeder Gemeinschaft wird Gemeinschafts-Admin
+                    ist_admin = k == 0 and j == 0
+                    if ist_admin:
+                        gemeinschafts_admin.append((benutzer_id, gid))
+                    benutzer.append((benutzer_id, nachname, rng.choice(VORNAMEN), f'm{benutzer_id}', password_hash,
+                                     ist_admin, 1 if ist_admin else 0, True,
+                                     date(rng.randint(2005, heute.year), rng.randint(1, 12), 1).isoformat()))
+                    benutzer_betriebe.append((benutzer_id, betrieb_id, j == 0))
+                    benutzer_je_betrieb[betrieb_id].append(benutzer_id)
+                    benutzer_id += 1
+                betrieb_id += 1
+
+        benutzer_je_gemeinschaft = {}
+        for bid, gid in betriebe_gemeinschaften:
+            for uid in benutzer_je_betrieb[bid]:
+                mitglied_gemeinschaft.append((uid, gid, 'mitglied'))
+                benutzer_je_gemeinschaft.setdefault(gid, []).append(uid)
+
+        writer.insert('gemeinschaften', ['id', 'name', 'beschreibung', 'adresse', 'anfangssaldo_bank',
+                                         'bank_iban', 'aktiv'], gemeinschaften)
+        writer.insert('betriebe', ['id', 'name', 'ort', 'iban', 'aktiv'], betriebe)
+        writer.insert('benutzer', ['id', 'name', 'vorname', 'username', 'password_hash',
+                                   'is_admin', 'admin_level', 'aktiv', 'mitglied_seit'], benutzer)
+        writer.insert('betriebe_gemeinschaften', ['betrieb_id', 'gemeinschaft_id'], betriebe_gemeinschaften)
+        writer.insert('benutzer_betriebe', ['benutzer_id', 'betrieb_id', 'ist_kontaktperson'], benutzer_betriebe)
+        writer.insert('mitglied_gemeinschaft', ['mitglied_id', 'gemeinschaft_id', 'rolle'], mitglied_gemeinschaft)
+        writer.insert('gemeinschafts_admin', ['benutzer_id', 'gemeinschaft_id'], gemeinschafts_admin)
+
+        # ==================== MASCHINEN ====================
+        m_start = writer.next_id('maschinen')
+        maschinen = []
+        maschine_id = m_start
+        for gid in gemeinschaft_ids:
+            for _ in range(max(1, int(rng.gauss(BASIS['maschinen_pro_gemeinschaft'], 2)))):
+                v = rng.choice(MASCHINEN_VORLAGEN)
+                maschinen.append({
+                    'id': maschine_id, 'gemeinschaft_id': gid, 'bezeichnung': f'{v[0]} {v[1]} #{maschine_id}',
+                    'hersteller': v[1], 'modell': v[2], 'preis': v[3], 'abrechnungsart': v[4],
+                    'anschaffungspreis': v[5], 'baujahr': rng.randint(2005, heute.year),
+                    'stand': round(rng.uniform(0, 3000), 1)
+                })
+                maschine_id += 1
+
+        # ==================== EINSÄTZE (Stundenzähler fortlaufend je Maschine) ====================
+        def einsatz_rows():
+            for m in maschinen:
+                mitglieder = benutzer_je_gemeinschaft.get(m['gemeinschaft_id'])
+                if not mitglieder:
+                    continue
+                daten = []
+                for jahr in jahre_liste:
+                    n = int(BASIS['einsaetze_pro_maschine_jahr'] * rng.uniform(0.5, 1.5))
+                    daten.extend(d for d in (_saison_datum(rng, jahr) for _ in range(n)) if d <= heute)
+                daten.sort()
+                stand = m['stand']
+                for datum in daten:
+                    stunden = round(rng.uniform(0.5, 8.0), 1)
+                    anfang, stand = stand, round(stand + stunden, 1)
+                    menge = None
+                    if m['abrechnungsart'] == 'hektar':
+                        menge = round(rng.uniform(1.0, 15.0), 2)
+                    elif m['abrechnungsart'] == 'stueck':
+                        menge = rng.randint(5, 50)
+                    kosten = round((menge if menge is not None else stunden) * m['preis'], 2)
+                    liter = round(stunden * rng.uniform(5, 15), 1) if rng.random() < 0.3 else None
+                    row = (datum.isoformat(), rng.choice(mitglieder), m['id'], rng.choice(zweck_ids),
+                           anfang, stand, liter, round(liter * 1.55, 2) if liter else None, menge, kosten)
+                    yield row if USING_POSTGRESQL else row + (stunden,)
+                m['stand'] = stand
+
+        einsatz_spalten = ['datum', 'benutzer_id', 'maschine_id', 'einsatzzweck_id', 'anfangstand', 'endstand',
+                           'treibstoffverbrauch', 'treibstoffkosten', 'flaeche_menge', 'kosten_berechnet']
+        if not USING_POSTGRESQL:
+            # PostgreSQL berechnet betriebsstunden als GENERATED-Spalte
+            einsatz_spalten.append('betriebsstunden')
+
+        # Maschinen zuerst (FK), Zählerstand danach per UPDATE auf den Endstand
+        writer.insert('maschinen', ['id', 'bezeichnung', 'hersteller', 'modell', 'baujahr', 'gemeinschaft_id',
+                                    'preis_pro_einheit', 'abrechnungsart', 'anschaffungspreis',
+                                    'stundenzaehler_aktuell', 'aktiv'],
+                      [(m['id'], m['bezeichnung'], m['hersteller'], m['modell'], m['baujahr'], m['gemeinschaft_id'],
+                        m['preis'], m['abrechnungsart'], m['anschaffungspreis'], m['stand'], True)
+                       for m in maschinen])
+        writer.insert('maschineneinsaetze', einsatz_spalten, einsatz_rows())
+
+        sql = "UPDATE maschinen SET stundenzaehler_aktuell = %s WHERE id = %s" if USING_POSTGRESQL else \
+              "UPDATE maschinen SET stundenzaehler_aktuell = ? WHERE id = ?"
+        cursor.executemany(sql, [(m['stand'], m['id']) for m in maschinen])
+        db._raw_connection.commit()
+
+        # ==================== RESERVIERUNGEN ====================
+        def reservierung_rows():
+            for m in maschinen:
+                mitglieder = benutzer_je_gemeinschaft.get(m['gemeinschaft_id'])
+                if not mitglieder:
+                    continue
+                n = int(BASIS['offene_reservierungen_pro_maschine'] * rng.uniform(0.5, 1.5))
+                for offset in rng.sample(range(0, 90), n):
+                    datum = heute + timedelta(days=offset)
+                    status = 'storniert' if rng.random() < 0.1 else 'aktiv'
+                    ganztags = rng.random() < 0.6
+                    yield (m['id'], rng.choice(mitglieder), datum.isoformat(), ganztags,
+                           None if ganztags else '08:00', None if ganztags else '12:00',
+                           rng.choice(EINSATZZWECKE), status, status == 'storniert')
+
+        writer.insert('maschinen_reservierungen', ['maschine_id', 'benutzer_id', 'datum', 'ganztags', 'uhrzeit_von',
+                                                   'uhrzeit_bis', 'zweck', 'status', 'storniert'],
+                      reservierung_rows())
+
+        # ==================== KONTEN / BUCHUNGEN / BANK ====================
+        k_start = writer.next_id('mitglieder_konten')
+        konten = []
+        for i, (bid, gid) in enumerate(betriebe_gemeinschaften):
+            konten.append((k_start + i, benutzer_je_betrieb[bid][0], bid, gid))
+
+        def buchung_rows(salden):
+            for konto_id, uid, bid, gid in konten:
+                saldo = 0.0
+                for jahr in jahre_liste:
+                    betrag = round(rng.uniform(200, 4000), 2)
+                    datum = date(jahr, 11, 30)
+                    if datum <= heute:
+                        saldo -= betrag
+                        yield (konto_id, uid, bid, gid, datum.isoformat(), -betrag, 'abrechnung', 'abrechnung',
+                               f'Abrechnung {jahr}', 'abrechnung')
+                    for _ in range(BASIS['zahlungen_pro_betrieb_jahr']):
+                        datum = date(jahr, rng.randint(1, 12), rng.randint(1, 28))
+                        if datum > heute:
+                            continue
+                        teil = round(betrag / BASIS['zahlungen_pro_betrieb_jahr'], 2)
+                        saldo += teil
+                        yield (konto_id, uid, bid, gid, datum.isoformat(), teil, 'einzahlung', 'einzahlung',
+                               'Einzahlung', 'zahlung')
+                salden[konto_id] = round(saldo, 2)
+
+        # Konten zuerst (FK), Saldo danach aus den erzeugten Buchungen
+        salden = {}
+        writer.insert('mitglieder_konten', ['id', 'benutzer_id', 'betrieb_id', 'gemeinschaft_id', 'saldo'],
+                      [k + (0.0,) for k in konten])
+        writer.insert('buchungen', ['konto_id', 'benutzer_id', 'betrieb_id', 'gemeinschaft_id', 'datum', 'betrag',
+                                    'typ', 'buchungsart', 'beschreibung', 'referenz_typ'],
+                      buchung_rows(salden))
+        sql = "UPDATE mitglieder_konten SET saldo = %s WHERE id = %s" if USING_POSTGRESQL else \
+              "UPDATE mitglieder_konten SET saldo = ? WHERE id = ?"
+        cursor.executemany(sql, [(saldo, konto_id) for konto_id, saldo in salden.items()])
+        db._raw_connection.commit()
+
+        def bank_rows():
+            for konto_id, uid, bid, gid in konten:
+                for jahr in jahre_liste:
+                    for _ in range(BASIS['zahlungen_pro_betrieb_jahr']):
+                        datum = date(jahr, rng.randint(1, 12), rng.randint(1, 28))
+                        if datum > heute:
+                            continue
+                        betrag = round(rng.uniform(50, 1500), 2)
+                        zugeordnet = rng.random() < 0.8
+                        schluessel = f'{seed}|{konto_id}|{datum}|{betrag}|{rng.random()}'
+                        yield (datum.isoformat(), datum.isoformat(), betrag, f'Mitgliedsbeitrag Betrieb {bid}',
+                               f'Betrieb {bid}', f'AT{bid:018d}', gid, uid if zugeordnet else None, zugeordnet,
+                               'benutzer' if zugeordnet else None, uid if zugeordnet else None,
+                               hashlib.sha256(schluessel.encode()).hexdigest())
+
+        writer.insert('bank_transaktionen', ['buchungsdatum', 'valutadatum', 'betrag', 'verwendungszweck',
+                                             'auftraggeber', 'iban', 'gemeinschaft_id', 'benutzer_id', 'zugeordnet',
+                                             'zuordnung_typ', 'zuordnung_id', 'import_hash'],
+                      bank_rows())
+
+        writer.reset_sequences(['einsatzzwecke', 'gemeinschaften', 'betriebe', 'benutzer', 'betriebe_gemeinschaften',
+                                'benutzer_betriebe', 'gemeinschafts_admin', 'maschinen', 'maschineneinsaetze',
+                                'maschinen_reservierungen', 'mitglieder_konten', 'buchungen', 'bank_transaktionen'])
+        return writer.anzahl
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Skalierbare Testdaten für Lasttests erzeugen')
+    parser.add_argument('--scale', type=float, default=10, help='Vielfaches der heutigen Größe (Standard: 10)')
+    parser.add_argument('--seed', type=int, default=42, help='Zufalls-Seed (gleicher Seed = gleiche Daten)')
+    parser.add_argument('--jahre', type=int, default=3, help='Anzahl Jahre mit Einsätzen (Standard: 3)')
+    parser.add_argument('--db', default=os.environ.get('SQLITE_PATH', 'maschinengemeinschaft_last.db'),
+                        help='SQLite-Datei (bei DB_TYPE=postgresql ignoriert)')
+    parser.add_argument('--passwort', default='test123', help='Passwort aller generierten Benutzer')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Zeilen pro Bulk-Insert')
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print(f"Lasttest-Daten: Skalierung {args.scale}x, Seed {args.seed}, {args.jahre} Jahre")
+    print(f"Ziel: {'PostgreSQL' if USING_POSTGRESQL else args.db}")
+    print("=" * 50)
+
+    start = time.perf_counter()
+    prepare_schema(args.db)
+    anzahl = generate(args.db, scale=args.scale, seed=args.seed, jahre=args.jahre,
+                      passwort=args.passwort, chunk_size=args.chunk_size)
+    dauer = time.perf_counter() - start
+
+    for table, n in anzahl.items():
+        print(f"  {table:<28} {n:>10,}")
+    print(f"Gesamt: {sum(anzahl.values()):,} Zeilen in {dauer:.1f}s")
+    print(f"Login: m<ID> / {args.passwort}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
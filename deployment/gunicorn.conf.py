@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Gunicorn-Konfiguration für Maschinengemeinschaft
+
+Aufruf (Dockerfile, systemd):
+    gunicorn -c gunicorn.conf.py web_app:app
+
+Betriebsarten über GUNICORN_WORKER_CLASS (Details: docs/system/NEBENLAEUFIGKEIT.md):
+
+- sync (Standard): GUNICORN_WORKERS Prozesse, je ein Request gleichzeitig.
+  Funktioniert mit SQLite und PostgreSQL.
+- gthread: zusätzlich GUNICORN_THREADS Threads pro Prozess. Blockierende
+  Aufrufe geben das GIL frei; für SQLite die sichere Wahl mit mehr Parallelität.
+- gevent: pro Prozess bis zu GUNICORN_WORKER_CONNECTIONS Requests als
+  Greenlets. Der Worker patcht die Standardbibliothek (Sockets, subprocess,
+  threading), database.py schaltet psycopg2 in den kooperativen Modus. Nur mit
+  PostgreSQL sinnvoll - sqlite3 wartet im C-Code und hält alle Greenlets an.
+"""
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', 4 if worker_class == 'gthread' else 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
+# Lange Downloads/Exporte nicht als hängenden Worker abbrechen
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+
+
+def when_ready(server):
+    """Konfiguration beim Start prüfen und die Betriebsart ins Log schreiben"""
+    server.log.info("Betriebsart: %s, %s Worker, %s", worker_class, workers,
+                    f"{worker_connections} Verbindungen/Worker" if worker_class == 'gevent'
+                    else f"{threads} Thread(s)/Worker")
+
+    if worker_class != 'gevent':
+        return
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        server.log.error("GUNICORN_WORKER_CLASS=gevent, aber gevent ist nicht installiert")
+    if os.environ.get('DB_TYPE', 'sqlite') != 'postgresql':
+        server.log.warning("gevent-Modus mit SQLite: Abfragen blockieren den ganzen Worker, "
+                           "besser GUNICORN_WORKER_CLASS=gthread verwenden")
+    if int(os.environ.get('JOB_WORKER_THREADS', 1)) > 0:
+        server.log.warning("gevent-Modus mit Job-Threads im Web-Worker: rechenintensive Jobs "
+                           "(PDF, Exporte) halten alle Requests des Workers an - "
+                           "JOB_WORKER_THREADS=0 setzen und job_worker.py separat starten")
+    pool_max = int(os.environ.get('PG_POOL_MAX', 20))
+    if pool_max < worker_connections:
+        server.log.info("Höchstens %s gleichzeitige Datenbankverbindungen pro Worker "
+                        "(PG_POOL_MAX), weitere Requests warten auf einen freien Platz", pool_max)
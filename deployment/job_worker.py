@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Eigenständiger Worker für Hintergrund-Jobs
+
+Standardmäßig arbeiten Threads in jedem Gunicorn-Worker die Warteschlange ab
+(siehe utils/jobs.py). Wer Jobs lieber in einem eigenen Prozess ausführt,
+setzt für Gunicorn JOB_WORKER_THREADS=0 und startet zusätzlich:
+
+    python job_worker.py
+
+Mehrere Worker-Prozesse sind möglich; jeder Job wird genau einmal vergeben.
+"""
+
+import signal
+import threading
+
+from utils.schema_migration import run_migrations
+from utils.jobs import worker_schleife
+
+
+def main():
+    run_migrations()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    print("Job-Worker gestartet")
+    worker_schleife(stop)
+    print("Job-Worker beendet")
+
+
+if __name__ == '__main__':
+    main()
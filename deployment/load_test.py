@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lasttest über den Flask-Test-Client (ohne laufenden Server)
+
+Spielt typische Abläufe von Mitgliedern (Dashboard, Einsätze erfassen und
+ansehen, Reservierungen, Konto) und Gemeinschafts-Admins (Konten,
+Transaktionen, Abrechnungen, Berichte) gegen eine mit
+generate_load_data.py erzeugte Datenbank ab und gibt Latenzen pro Route
+aus (Anzahl, p50, p95, p99, Maximum, Fehler).
+
+Aufruf:
+    python generate_load_data.py --scale 100 --db /tmp/mgr_last.db
+    python load_test.py --db /tmp/mgr_last.db --requests 2000 --threads 4
+
+Nebenläufigkeit der Betriebsart (gunicorn.conf.py) prüfen: gegen einen
+laufenden Server (--url) und mit Admin-Sitzungen, die während des ganzen
+Laufs einen langsamen Request wiederholen (--blockierer). Das p95 der
+Mitglieder darf dabei nicht auf die Dauer der blockierenden Requests steigen:
+    GUNICORN_WORKER_CLASS=gevent gunicorn -c gunicorn.conf.py web_app:app
+    python load_test.py --db /tmp/mgr_last.db --url http://127.0.0.1:5000 \
+        --threads 8 --blockierer 4 --max-p95 500
+
+Exit-Code 1 bei Serverfehlern (5xx) oder wenn --max-p95 überschritten wird
+- damit als Regressionstest vor der Saison verwendbar.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import json
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Lasttest mit typischen Mitglieder-/Admin-Abläufen')
+    parser.add_argument('--db', default=os.environ.get('SQLITE_PATH', 'maschinengemeinschaft_last.db'),
+                        help='SQLite-Datei (bei DB_TYPE=postgresql ignoriert)')
+    parser.add_argument('--requests', type=int, default=1000, help='Anzahl Requests gesamt')
+    parser.add_argument('--threads', type=int, default=1, help='Parallele Sitzungen')
+    parser.add_argument('--admin-anteil', type=float, default=0.15, help='Anteil Admin-Sitzungen (0..1)')
+    parser.add_argument('--schreiben', action='store_true', help='Auch Einsätze speichern (POST)')
+    parser.add_argument('--seed', type=int, default=42, help='Zufalls-Seed')
+    parser.add_argument('--passwort', default='test123', help='Passwort der generierten Benutzer')
+    parser.add_argument('--max-p95', type=float, default=0, help='Grenze p95 in ms (0 = keine Prüfung)')
+    parser.add_argument('--url', default='', help='Laufender Server statt Flask-Test-Client, z.B. http://127.0.0.1:5000')
+    parser.add_argument('--blockierer', type=int, default=0,
+                        help='Admin-Sitzungen, die parallel --blockierer-url wiederholen')
+    parser.add_argument('--blockierer-url', default='/admin/maschinen/auslastung?neu=1',
+                        help='Langsamer Request der Blockierer (Export, Bericht, ...)')
+    parser.add_argument('--admin', default='admin:admin123', help='Login der Blockierer (benutzer:passwort)')
+    return parser.parse_args()
+
+
+ARGS = _parse_args() if __name__ == '__main__' else None
+
+if ARGS is not None:
+    # Vor dem Import der App setzen - Pfade werden beim Import gelesen
+    os.environ['DB_PATH'] = os.path.abspath(ARGS.db)
+    os.environ['SQLITE_PATH'] = os.path.abspath(ARGS.db)
+    if ARGS.url:
+        # Jobs arbeitet der Server ab, nicht der Lasttest-Prozess
+        os.environ.setdefault('JOB_WORKER_THREADS', '0')
+
+from web_app import app  # noqa: E402
+from database import MaschinenDBContext  # noqa: E402
+from utils.sql_helpers import convert_sql  # noqa: E402
+
+# (Gewicht, Name, URL-Funktion) - URL-Funktion erhält die Sitzungsdaten
+MITGLIED_MIX = [
+    (30, 'dashboard', lambda s: '/dashboard'),
+    (15, 'meine_einsaetze', lambda s: '/meine-einsaetze'),
+    (10, 'neuer_einsatz', lambda s: '/neuer-einsatz'),
+    (8, 'stundenzaehler_api', lambda s: f"/api/maschine/{s['rng'].choice(s['maschinen'])}/stundenzaehler"),
+    (8, 'reservierungen_kalender', lambda s: '/reservierungen-kalender'),
+    (6, 'meine_reservierungen', lambda s: '/meine-reservierungen'),
+    (5, 'meine_abrechnungen', lambda s: '/meine-abrechnungen'),
+    (5, 'mein_konto', lambda s: f"/mein-konto/{s['gemeinschaft_id']}"),
+    (3, 'nachrichten', lambda s: '/nachrichten'),
+    (2, 'meine_einsaetze_csv', lambda s: '/meine-einsaetze/csv'),
+]
+
+ADMIN_MIX = [
+    (20, 'admin_dashboard', lambda s: '/admin'),
+    (15, 'admin_konten', lambda s: f"/admin/gemeinschaften/{s['gemeinschaft_id']}/konten"),
+    (12, 'admin_transaktionen', lambda s: f"/admin/abrechnungen/{s['gemeinschaft_id']}/transaktionen"),
+    (10, 'abrechnungen_liste', lambda s: f"/admin/abrechnungen/{s['gemeinschaft_id']}/liste"),
+    (10, 'gemeinschaft_abrechnung', lambda s: f"/admin/gemeinschaften/{s['gemeinschaft_id']}/abrechnung"),
+    (8, 'admin_maschinen', lambda s: '/admin/maschinen'),
+    (8, 'rentabilitaet', lambda s: f"/admin/maschinen/{s['rng'].choice(s['maschinen'])}/rentabilitaet"),
+    (7, 'gemeinschaft_mitglieder', lambda s: f"/admin/gemeinschaften/{s['gemeinschaft_id']}/mitglieder"),
+    (5, 'abrechnung_csv', lambda s: f"/admin/gemeinschaften/{s['gemeinschaft_id']}/abrechnung/csv"),
+    (5, 'alle_einsaetze', lambda s: '/admin/alle-einsaetze'),
+]
+
+
+def load_benutzer(db_path, rng, anzahl=200):
+    """Stichprobe von Mitgliedern und Gemeinschafts-Admins mit Maschinen"""
+    with MaschinenDBContext(db_path) as db:
+        cursor = db.connection.cursor()
+        sql = convert_sql("""
+            SELECT b.id, b.username, b.admin_level, mg.gemeinschaft_id
+            FROM benutzer b
+            JOIN mitglied_gemeinschaft mg ON mg.mitglied_id = b.id
+            WHERE b.username LIKE 'm%' AND b.aktiv = true
+        """)
+        cursor.execute(sql)
+        zeilen = cursor.fetchall()
+
+        cursor.execute(convert_sql("SELECT id, gemeinschaft_id FROM maschinen WHERE aktiv = true"))
+        maschinen = {}
+        for maschine_id, gemeinschaft_id in cursor.fetchall():
+            maschinen.setdefault(gemeinschaft_id, []).append(maschine_id)
+
+        cursor.execute(convert_sql("SELECT id FROM einsatzzwecke WHERE aktiv = true"))
+        zweck_ids = [r[0] for r in cursor.fetchall()]
+
+    mitglieder, admins = [], []
+    for benutzer_id, username, admin_level, gemeinschaft_id in zeilen:
+        if gemeinschaft_id not in maschinen:
+            continue
+        eintrag = {'id': benutzer_id, 'username': username, 'gemeinschaft_id': gemeinschaft_id,
+                   'maschinen': maschinen[gemeinschaft_id], 'zwecke': zweck_ids}
+        (admins if (admin_level or 0) >= 1 else mitglieder).append(eintrag)
+
+    rng.shuffle(mitglieder)
+    rng.shuffle(admins)
+    return mitglieder[:anzahl], admins[:anzahl]
+
+
+class Statistik:
+    """Latenzen pro Route (thread-sicher)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latenzen = {}
+        self.fehler = {}
+
+    def add(self, name, dauer, status):
+        with self._lock:
+            self.latenzen.setdefault(name, []).append(dauer)
+            if status >= 500:
+                self.fehler[name] = self.fehler.get(name, 0) + 1
+
+    @staticmethod
+    def _perzentil(werte, p):
+        return werte[min(len(werte) - 1, int(len(werte) * p))]
+
+    def report(self):
+        """Tabelle ausgeben, gibt das gesamte p95 (ms) zurück"""
+        print(f"{'Route':<26}{'Anzahl':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}{'5xx':>6}")
+        alle = []
+        for name in sorted(self.latenzen):
+            werte = sorted(self.latenzen[name])
+            alle.extend(werte)
+            ms = [self._perzentil(werte, p) * 1000 for p in (0.5, 0.95, 0.99)] + [werte[-1] * 1000]
+            print(f"{name:<26}{len(werte):>8}" + ''.join(f"{v:>8.1f}ms" for v in ms)
+                  + f"{self.fehler.get(name, 0):>6}")
+        if not alle:
+            return 0.0
+        alle.sort()
+        p95 = self._perzentil(alle, 0.95) * 1000
+        print(f"{'GESAMT':<26}{len(alle):>8}{self._perzentil(alle, 0.5) * 1000:>8.1f}ms{p95:>8.1f}ms")
+        return p95
+
+
+class _HttpAntwort:
+    def __init__(self, status_code, data, url):
+        self.status_code = status_code
+        self.data = data
+        self.url = url
+
+    def get_json(self):
+        try:
+            return json.loads(self.data)
+        except ValueError:
+            return None
+
+
+class _HttpClient:
+    """Cookie-Sitzung gegen einen laufenden Server (Schnittstelle wie der Test-Client)"""
+
+    def __init__(self, basis_url):
+        self.basis_url = basis_url.rstrip('/')
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def _senden(self, url, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self._opener.open(self.basis_url + url, data=body, timeout=300) as response:
+                return _HttpAntwort(response.status, response.read(), response.geturl())
+        except urllib.error.HTTPError as e:
+            return _HttpAntwort(e.code, e.read(), e.geturl())
+        except OSError:
+            # Verbindung abgelehnt/abgebrochen zählt wie ein Serverfehler
+            return _HttpAntwort(599, b'', self.basis_url + url)
+
+    def get(self, url):
+        return self._senden(url)
+
+    def post(self, url, data=None):
+        return self._senden(url, data or {})
+
+
+def _client(basis_url=None):
+    return _HttpClient(basis_url) if basis_url else app.test_client()
+
+
+def _login(client, benutzer, passwort):
+    response = client.post('/login', data={'username': benutzer['username'], 'password': passwort})
+    if isinstance(client, _HttpClient):
+        # Erfolgreicher Login leitet vom Login-Formular weg
+        return response.status_code < 400 and not urllib.parse.urlparse(response.url).path.endswith('/login')
+    with client.session_transaction() as sess:
+        return response.status_code < 400 and 'benutzer_id' in sess
+
+
+def run_blockierer(benutzer, passwort, url, stop, statistik, basis_url=None):
+    """Admin-Sitzung, die bis stop einen langsamen Request wiederholt"""
+    with _client(basis_url) as client:
+        if not _login(client, {'username': benutzer}, passwort):
+            statistik.add('blockierer_login', 0.0, 500)
+            return
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = client.get(url)
+            statistik.add('blockierer', time.perf_counter() - start, response.status_code)
+
+
+def run_session(benutzer, mix, anzahl, statistik, passwort, schreiben, seed, basis_url=None):
+    """Eine Sitzung: Login, dann anzahl Requests nach Gewichtung"""
+    rng = random.Random(seed)
+    zustand = dict(benutzer, rng=rng)
+    gewichte = [m[0] for m in mix]
+
+    with _client(basis_url) as client:
+        if not _login(client, benutzer, passwort):
+            statistik.add('login_fehlgeschlagen', 0.0, 500)
+            return
+
+        for _ in range(anzahl):
+            if schreiben and mix is MITGLIED_MIX and rng.random() < 0.1:
+                _einsatz_speichern(client, zustand, statistik)
+                continue
+            _, name, url = rng.choices(mix, weights=gewichte)[0]
+            start = time.perf_counter()
+            response = client.get(url(zustand))
+            statistik.add(name, time.perf_counter() - start, response.status_code)
+
+
+def _einsatz_speichern(client, zustand, statistik):
+    """Einsatz wie im Formular erfassen: Zählerstand holen, dann POST"""
+    rng = zustand['rng']
+    maschine_id = rng.choice(zustand['maschinen'])
+    start = time.perf_counter()
+    stand = client.get(f'/api/maschine/{maschine_id}/stundenzaehler').get_json() or {}
+    anfang = float(stand.get('stundenzaehler') or 0)
+    response = client.post('/neuer-einsatz', data={
+        'datum': date.today().isoformat(),
+        'maschine_id': maschine_id,
+        'einsatzzweck_id': rng.choice(zustand['zwecke']),
+        'anfangstand': anfang,
+        'endstand': round(anfang + rng.uniform(0.5, 6), 1),
+    })
+    statistik.add('einsatz_speichern', time.perf_counter() - start, response.status_code)
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    db_path = os.environ['DB_PATH']
+    mitglieder, admins = load_benutzer(db_path, rng)
+    if not mitglieder:
+        print("Keine generierten Benutzer gefunden - zuerst generate_load_data.py ausführen")
+        return 1
+
+    # Sitzungen à 20 Requests, Mischung Mitglieder/Admins
+    pro_sitzung = 20
+    sitzungen = []
+    for i in range(max(1, args.requests // pro_sitzung)):
+        if admins and rng.random() < args.admin_anteil:
+            sitzungen.append((rng.choice(admins), ADMIN_MIX))
+        else:
+            sitzungen.append((rng.choice(mitglieder), MITGLIED_MIX))
+
+    print(f"Lasttest: {len(sitzungen)} Sitzungen x {pro_sitzung} Requests, {args.threads} Thread(s)"
+          + (f", {args.blockierer} Blockierer ({args.blockierer_url})" if args.blockierer else '')
+          + (f" gegen {args.url}" if args.url else ''))
+    statistik = Statistik()
+    blockierer_statistik = Statistik()
+    stop = threading.Event()
+    admin, admin_passwort = args.admin.split(':', 1)
+    blockierer = [threading.Thread(target=run_blockierer, daemon=True,
+                                   args=(admin, admin_passwort, args.blockierer_url, stop,
+                                         blockierer_statistik, args.url or None))
+                  for _ in range(args.blockierer)]
+    for thread in blockierer:
+        thread.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        for i, (benutzer, mix) in enumerate(sitzungen):
+            pool.submit(run_session, benutzer, mix, pro_sitzung, statistik,
+                        args.passwort, args.schreiben, args.seed + i, args.url or None)
+    dauer = time.perf_counter() - start
+    stop.set()
+    for thread in blockierer:
+        thread.join()
+
+    p95 = statistik.report()
+    anzahl = sum(len(w) for w in statistik.latenzen.values())
+    print(f"{anzahl} Requests in {dauer:.1f}s ({anzahl / dauer:.1f} req/s)")
+
+    if blockierer:
+        print("\nBlockierende Requests (nicht im p95):")
+        blockierer_statistik.report()
+        statistik.fehler.update(blockierer_statistik.fehler)
+
+    if statistik.fehler:
+        print(f"FEHLER: {sum(statistik.fehler.values())} Serverfehler (5xx)")
+        return 1
+    if args.max_p95 and p95 > args.max_p95:
+        print(f"FEHLER: p95 {p95:.1f}ms über Grenze {args.max_p95:.1f}ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(ARGS))
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Betriebsmetriken für Maschinengemeinschaft (Prometheus-Textformat)
+
+Sammelt prozesslokal:
+- Request-Latenzen pro Endpoint (Histogramm)
+- Datenbank-Verbindungen (geöffnet/geschlossen) und Query-Zeiten
+- Laufzeiten von Hintergrund-Jobs (Archivierung, Abrechnung)
+- Größen von Exporten/Downloads
+- Dokument-Cache: 304-Antworten, Treffer im Datei-Cache, neu erzeugte Dokumente
+- Speicherverbrauch des Worker-Prozesses
+
+Bei mehreren Gunicorn-Workern kann über METRICS_DIR ein gemeinsames
+Verzeichnis angegeben werden; jeder Worker legt dort regelmäßig einen
+Snapshot ab und /metrics liefert die Summe aller lebenden Worker.
+
+Bewusst ohne externe Abhängigkeiten (kein prometheus_client).
+"""
+
+import os
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+SNAPSHOT_INTERVAL_SECONDS = 10
+
+# Bucket-Grenzen in Sekunden bzw. Bytes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+JOB_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+
+# Name -> (Typ, Hilfetext, Buckets)
+METRIC_DEFINITIONS = {
+    'mgr_http_request_duration_seconds': ('histogram', 'Dauer der HTTP-Requests pro Endpoint', LATENCY_BUCKETS),
+    'mgr_db_connections_opened_total': ('counter', 'Geöffnete Datenbankverbindungen', None),
+    'mgr_db_connections_closed_total': ('counter', 'Geschlossene Datenbankverbindungen', None),
+    'mgr_db_query_duration_seconds': ('histogram', 'Dauer der SQL-Abfragen', QUERY_BUCKETS),
+    'mgr_job_duration_seconds': ('histogram', 'Laufzeit von Jobs (Archivierung, Abrechnung, ...)', JOB_BUCKETS),
+    'mgr_export_size_bytes': ('histogram', 'Größe ausgelieferter Exporte/Downloads', SIZE_BUCKETS),
+    'mgr_dokument_cache_total': ('counter', 'Erzeugte Dokumente: nicht_geaendert (304), datei (Cache), erzeugt', None),
+    'mgr_process_resident_memory_bytes': ('gauge', 'Residenter Speicher des Worker-Prozesses', None),
+}
+
+_lock = threading.Lock()
+# Name -> {Label-Tupel: Wert} bzw. {Label-Tupel: [Bucket-Zähler..., Summe, Anzahl]}
+_values = {name: {} for name in METRIC_DEFINITIONS}
+_last_snapshot = 0.0
+
+
+def _label_key(labels):
+    """Labels als sortiertes Tupel (hashbar, stabile Reihenfolge)"""
+    return tuple(sorted((labels or {}).items()))
+
+
+def inc(name, labels=None, amount=1):
+    """Counter erhöhen"""
+    key = _label_key(labels)
+    with _lock:
+        _values[name][key] = _values[name].get(key, 0) + amount
+
+
+def observe(name, value, labels=None):
+    """Wert in ein Histogramm eintragen"""
+    buckets = METRIC_DEFINITIONS[name][2]
+    key = _label_key(labels)
+    with _lock:
+        data = _values[name].get(key)
+        if data is None:
+            data = [0] * (len(buckets) + 2)
+            _values[name][key] = data
+        for i, grenze in enumerate(buckets):
+            if value <= grenze:
+                data[i] += 1
+        data[-2] += value
+        data[-1] += 1
+
+
+def total_count(name):
+    """Summe über alle Labels: Anzahl Beobachtungen (Histogramm) bzw. Zählerstand"""
+    with _lock:
+        return sum(v[-1] if isinstance(v, list) else v for v in _values[name].values())
+
+
+@contextmanager
+def job_timer(job):
+    """Misst die Laufzeit eines Jobs, z.B. ``with job_timer('archivierung'):``"""
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except Exception:
+        status = 'fehler'
+        raise
+    finally:
+        observe('mgr_job_duration_seconds', time.perf_counter() - start,
+                {'job': job, 'status': status})
+
+
+def timed_job(job):
+    """Decorator-Variante von job_timer"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with job_timer(job):
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def get_memory_bytes():
+    """Residenten Speicher (RSS) des aktuellen Prozesses ermitteln"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+        # ru_maxrss ist unter Linux in KB (Spitzenwert, besser als nichts)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except (ImportError, AttributeError):
+        return 0
+
+
+def _update_memory():
+    """Speicher-Gauge für diesen Worker aktualisieren"""
+    key = _label_key({'pid': str(os.getpid())})
+    with _lock:
+        _values['mgr_process_resident_memory_bytes'] = {key: get_memory_bytes()}
+
+
+def _snapshot():
+    """Kopie der aktuellen Werte (JSON-serialisierbar)"""
+    with _lock:
+        return {
+            name: [[list(map(list, key)), list(value) if isinstance(value, list) else value]
+                   for key, value in werte.items()]
+            for name, werte in _values.items()
+        }
+
+
+def write_snapshot(force=False):
+    """Snapshot dieses Workers nach METRICS_DIR schreiben (gedrosselt)"""
+    global _last_snapshot
+    if not METRICS_DIR:
+        return
+    now = time.time()
+    if not force and now - _last_snapshot < SNAPSHOT_INTERVAL_SECONDS:
+        return
+    _last_snapshot = now
+    _update_memory()
+
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        ziel = os.path.join(METRICS_DIR, f'worker_{os.getpid()}.json')
+        tmp = ziel + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(_snapshot(), f)
+        os.replace(tmp, ziel)
+    except OSError as e:
+        print(f"WARNUNG: Metriken-Snapshot fehlgeschlagen: {e}")
+
+
+def _pid_lebt(pid):
+    """Prüft ob ein Prozess noch existiert"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _collect_all():
+    """Werte aller Worker zusammenführen (oder nur dieses Prozesses)"""
+    _update_memory()
+    if not METRICS_DIR:
+        return _snapshot()
+
+    write_snapshot(force=True)
+    gesamt = {name: {} for name in METRIC_DEFINITIONS}
+
+    for dateiname in os.listdir(METRICS_DIR):
+        if not (dateiname.startswith('worker_') and dateiname.endswith('.json')):
+            continue
+        pfad = os.path.join(METRICS_DIR, dateiname)
+        try:
+            pid = int(dateiname[len('worker_'):-len('.json')])
+        except ValueError:
+            continue
+        if not _pid_lebt(pid):
+            # Beendeter Worker (z.B. nach max_requests-Neustart) - aufräumen
+            try:
+                os.remove(pfad)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(pfad, 'r', encoding='utf-8') as f:
+                daten = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        for name, eintraege in daten.items():
+            if name not in gesamt:
+                continue
+            for key, value in eintraege:
+                key = tuple(tuple(k) for k in key)
+                if isinstance(value, list):
+                    bisher = gesamt[name].get(key)
+                    gesamt[name][key] = value if bisher is None else [a + b for a, b in zip(bisher, value)]
+                else:
+                    gesamt[name][key] = gesamt[name].get(key, 0) + value
+
+    return {
+        name: [[list(map(list, key)), value] for key, value in werte.items()]
+        for name, werte in gesamt.items()
+    }
+
+
+def _format_labels(pairs, extra=None):
+    """Label-Paare im Prometheus-Format"""
+    pairs = list(pairs) + (extra or [])
+    if not pairs:
+        return ''
+    teile = []
+    for k, v in pairs:
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        teile.append(f'{k}="{v}"')
+    return '{' + ','.join(teile) + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """Alle Metriken im Prometheus-Textformat (Version 0.0.4)"""
+    daten = _collect_all()
+    zeilen = []
+
+    for name, (typ, hilfe, buckets) in METRIC_DEFINITIONS.items():
+        zeilen.append(f'# HELP {name} {hilfe}')
+        zeilen.append(f'# TYPE {name} {typ}')
+        for key, value in sorted(daten.get(name, []), key=lambda e: str(e[0])):
+            pairs = [tuple(k) for k in key]
+            if typ == 'histogram':
+                for grenze, anzahl in zip(buckets, value[:len(buckets)]):
+                    zeilen.append(f'{name}_bucket{_format_labels(pairs, [("le", _format_number(float(grenze)))])} {anzahl}')
+                zeilen.append(f'{name}_bucket{_format_labels(pairs, [("le", "+Inf")])} {value[-1]}')
+                zeilen.append(f'{name}_sum{_format_labels(pairs)} {_format_number(value[-2])}')
+                zeilen.append(f'{name}_count{_format_labels(pairs)} {value[-1]}')
+            else:
+                zeilen.append(f'{name}{_format_labels(pairs)} {_format_number(value)}')
+
+    return '\n'.join(zeilen) + '\n'
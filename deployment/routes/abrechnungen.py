@@ -3,11 +3,15 @@
 Abrechnungen - Meine Abrechnungen, Konto-Übersicht
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, make_response
-from database import MaschinenDBContext
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash
+from database import MaschinenDBContext, REFERENZDATEN_VERSION
 from utils.decorators import login_required
 from utils.training import get_current_db_path
 from utils.sql_helpers import convert_sql
+from utils.mitgliedschaft import mitgliedschaft
+from utils.jahresabschluss import abgeschlossen_bis, einsaetze_quelle, saldo_vortrag
+from utils.cache_versionen import version_lesen
+from utils.dokument_cache import dokument_antwort, datenstand
 
 abrechnungen_bp = Blueprint('abrechnungen', __name__)
 
@@ -75,7 +79,7 @@ def abrechnung_pdf(abrechnung_id):
     benutzer_id = session.get('benutzer_id')
     db_path = get_current_db_path()
 
-    with MaschinenDBContext(db_path) as db:
+    with MaschinenDBContext(db_path, read_only=True) as db:
         cursor = db.connection.cursor()
 
         sql = convert_sql("""
@@ -135,50 +139,67 @@ def abrechnung_pdf(abrechnung_id):
         cursor.execute(sql, (abrechnung_id,))
         abrechnung_gemeinschaft_id = cursor.fetchone()[0]
 
-        sql = convert_sql("""
-            SELECT
-                m.bezeichnung,
-                me.datum,
-                me.endstand - me.anfangstand as betriebsstunden,
-                m.preis_pro_einheit,
-                me.kosten_berechnet,
-                me.treibstoffverbrauch,
-                me.treibstoffkosten,
-                m.treibstoff_berechnen
-            FROM maschineneinsaetze me
+        # Zeiträume abgeschlossener Jahre liegen im Archiv
+        quelle = 'maschineneinsaetze'
+        bis = abgeschlossen_bis(db, abrechnung_gemeinschaft_id)
+        if bis is not None and int(str(abrechnung['zeitraum_von'])[:4]) <= bis:
+            quelle = einsaetze_quelle(db)
+
+        # Datenstand: Einsätze werden nie geändert, nur angelegt/storniert -
+        # Anzahl und Ids genügen; Maschinen/Gemeinschaft über den Versionszähler
+        einsatz_filter = (benutzer_id, abrechnung['zeitraum_von'],
+                          abrechnung['zeitraum_bis'], abrechnung_gemeinschaft_id)
+        stand = (db_path, tuple(row), version_lesen(db, REFERENZDATEN_VERSION), datenstand(db, f"""
+            SELECT COUNT(*), MAX(me.id), SUM(me.id)
+            FROM {quelle} me
             JOIN maschinen m ON me.maschine_id = m.id
-            WHERE me.benutzer_id = ?
-            AND me.datum >= ?
-            AND me.datum <= ?
-            AND m.gemeinschaft_id = ?
-            ORDER BY me.datum
-        """)
-        cursor.execute(sql, (benutzer_id, abrechnung['zeitraum_von'],
-                            abrechnung['zeitraum_bis'], abrechnung_gemeinschaft_id))
-
-        einsaetze = []
-        for row in cursor.fetchall():
-            treibstoff_berechnen = row[7]
-            einsaetze.append({
-                'maschine': row[0],
-                'datum': row[1],
-                'betriebsstunden': row[2] if row[2] else 0,
-                'preis_pro_stunde': row[3] if row[3] else 0,
-                'betrag_maschine': row[4] if row[4] else 0,
-                'treibstoff_liter': row[5] if treibstoff_berechnen and row[5] else 0,
-                'treibstoffkosten': row[6] if treibstoff_berechnen and row[6] else 0,
-                'treibstoff_berechnen': treibstoff_berechnen
-            })
-
-        html = render_template('abrechnung_pdf.html',
-                             abrechnung=abrechnung,
-                             einsaetze=einsaetze)
-
-        response = make_response(html)
-        response.headers['Content-Type'] = 'text/html'
-        response.headers['Content-Disposition'] = f'inline; filename=Abrechnung_{abrechnung_id}.html'
-
-        return response
+            WHERE me.benutzer_id = ? AND me.datum >= ? AND me.datum <= ? AND m.gemeinschaft_id = ?
+        """, einsatz_filter))
+
+        return dokument_antwort(stand, lambda: _abrechnung_html(db, abrechnung, quelle, einsatz_filter),
+                                'text/html', f'Abrechnung_{abrechnung_id}.html')
+
+
+def _abrechnung_html(db, abrechnung, quelle, einsatz_filter):
+    """Abrechnung mit Einsatzliste rendern"""
+    cursor = db.connection.cursor()
+    sql = convert_sql(f"""
+        SELECT
+            m.bezeichnung,
+            me.datum,
+            me.endstand - me.anfangstand as betriebsstunden,
+            m.preis_pro_einheit,
+            me.kosten_berechnet,
+            me.treibstoffverbrauch,
+            me.treibstoffkosten,
+            m.treibstoff_berechnen
+        FROM {quelle} me
+        JOIN maschinen m ON me.maschine_id = m.id
+        WHERE me.benutzer_id = ?
+        AND me.datum >= ?
+        AND me.datum <= ?
+        AND m.gemeinschaft_id = ?
+        ORDER BY me.datum
+    """)
+    cursor.execute(sql, einsatz_filter)
+
+    einsaetze = []
+    for row in cursor.fetchall():
+        treibstoff_berechnen = row[7]
+        einsaetze.append({
+            'maschine': row[0],
+            'datum': row[1],
+            'betriebsstunden': row[2] if row[2] else 0,
+            'preis_pro_stunde': row[3] if row[3] else 0,
+            'betrag_maschine': row[4] if row[4] else 0,
+            'treibstoff_liter': row[5] if treibstoff_berechnen and row[5] else 0,
+            'treibstoffkosten': row[6] if treibstoff_berechnen and row[6] else 0,
+            'treibstoff_berechnen': treibstoff_berechnen
+        })
+
+    return render_template('abrechnung_pdf.html',
+                         abrechnung=abrechnung,
+                         einsaetze=einsaetze)
 
 
 @abrechnungen_bp.route('/mein-konto/<int:gemeinschaft_id>')
@@ -192,22 +213,13 @@ def mein_konto(gemeinschaft_id):
         cursor = db.connection.cursor()
 
         # Gemeinschaft laden
-        sql = convert_sql("SELECT * FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        columns = [desc[0] for desc in cursor.description]
-        row = cursor.fetchone()
-        if not row:
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
+        if not gemeinschaft:
             flash('Gemeinschaft nicht gefunden!', 'danger')
             return redirect(url_for('dashboard.dashboard'))
-        gemeinschaft = dict(zip(columns, row))
 
         # Prüfe Mitgliedschaft
-        sql = convert_sql("""
-            SELECT COUNT(*) FROM mitglied_gemeinschaft
-            WHERE mitglied_id = ? AND gemeinschaft_id = ?
-        """)
-        cursor.execute(sql, (benutzer_id, gemeinschaft_id))
-        if cursor.fetchone()[0] == 0:
+        if not mitgliedschaft(db).ist_mitglied(benutzer_id, gemeinschaft_id):
             flash('Sie sind nicht Mitglied dieser Gemeinschaft!', 'danger')
             return redirect(url_for('dashboard.dashboard'))
 
@@ -255,8 +267,10 @@ def mein_konto(gemeinschaft_id):
         columns = [desc[0] for desc in cursor.description]
         offene_abrechnungen = [dict(zip(columns, row)) for row in cursor.fetchall()]
 
-        # Saldo Vorjahr (vereinfacht: 0)
-        saldo_vorjahr = 0
+        # Saldo Vorjahr: Vortrag des letzten Jahresabschlusses für die Betriebe des Benutzers
+        sql = convert_sql("SELECT betrieb_id FROM benutzer_betriebe WHERE benutzer_id = ?")
+        cursor.execute(sql, (benutzer_id,))
+        saldo_vorjahr = saldo_vortrag(db, gemeinschaft_id, [row[0] for row in cursor.fetchall()])
 
     return render_template('mein_konto.html',
                          gemeinschaft=gemeinschaft,
@@ -3,12 +3,13 @@
 Benutzer - Abstimmungen und Anträge
 """
 
-from datetime import datetime
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from database import MaschinenDBContext
 from utils.decorators import login_required
 from utils.training import get_current_db_path
 from utils.sql_helpers import convert_sql
+from utils.abstimmung_zaehler import STIMMEN, AbstimmungGeschlossen, stimme_abgeben, statistik_aus_zeile
+from utils.mitgliedschaft import mitgliedschaft
 
 abstimmungen_bp = Blueprint('abstimmungen', __name__)
 
@@ -22,29 +23,23 @@ def abstimmungen_liste():
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        # Gemeinschaften des Benutzers ermitteln
-        sql = convert_sql("""
-            SELECT gemeinschaft_id FROM mitglied_gemeinschaft
-            WHERE mitglied_id = ?
-        """)
-        cursor.execute(sql, (session['benutzer_id'],))
-        gemeinschaft_ids = [row[0] for row in cursor.fetchall()]
-
+        gemeinschaft_ids = sorted(mitgliedschaft(db).gemeinschaften_von(session['benutzer_id']))
         if not gemeinschaft_ids:
             return render_template('abstimmungen.html',
                                  abstimmungen_offen=[],
                                  abstimmungen_abgeschlossen=[])
+        placeholders = ','.join('?' for _ in gemeinschaft_ids)
 
-        # Offene Abstimmungen
-        placeholders = ','.join(['?' for _ in gemeinschaft_ids])
+        # Offene Abstimmungen der eigenen Gemeinschaften mit Zählerstand
+        # und eigener Stimme in einer Abfrage
         sql = convert_sql(f"""
             SELECT a.*, g.name as gemeinschaft_name,
-                   (SELECT COUNT(*) FROM abstimmung_stimmen WHERE abstimmung_id = a.id) as stimmen_anzahl,
-                   (SELECT 1 FROM abstimmung_stimmen WHERE abstimmung_id = a.id AND benutzer_id = ?) as hat_abgestimmt
+                   a.stimmen_gesamt as stimmen_anzahl,
+                   CASE WHEN s.id IS NULL THEN 0 ELSE 1 END as hat_abgestimmt
             FROM abstimmungen a
             JOIN gemeinschaften g ON a.gemeinschaft_id = g.id
-            WHERE a.status = 'offen'
-            AND a.gemeinschaft_id IN ({placeholders})
+            LEFT JOIN abstimmung_stimmen s ON s.abstimmung_id = a.id AND s.benutzer_id = ?
+            WHERE a.gemeinschaft_id IN ({placeholders}) AND a.status = 'offen'
             ORDER BY a.ablauf_datum ASC
         """)
         cursor.execute(sql, [session['benutzer_id']] + gemeinschaft_ids)
@@ -56,8 +51,7 @@ def abstimmungen_liste():
             SELECT a.*, g.name as gemeinschaft_name
             FROM abstimmungen a
             JOIN gemeinschaften g ON a.gemeinschaft_id = g.id
-            WHERE a.status = 'abgeschlossen'
-            AND a.gemeinschaft_id IN ({placeholders})
+            WHERE a.gemeinschaft_id IN ({placeholders}) AND a.status = 'abgeschlossen'
             ORDER BY a.erstellt_am DESC
             LIMIT 10
         """)
@@ -95,12 +89,7 @@ def abstimmung_detail(id):
         abstimmung = dict(zip(columns, row))
 
         # Prüfen ob Benutzer Mitglied der Gemeinschaft ist
-        sql = convert_sql("""
-            SELECT 1 FROM mitglied_gemeinschaft
-            WHERE mitglied_id = ? AND gemeinschaft_id = ?
-        """)
-        cursor.execute(sql, (session['benutzer_id'], abstimmung['gemeinschaft_id']))
-        if not cursor.fetchone():
+        if not mitgliedschaft(db).ist_mitglied(session['benutzer_id'], abstimmung['gemeinschaft_id']):
             flash('Sie sind nicht berechtigt, an dieser Abstimmung teilzunehmen.', 'danger')
             return redirect(url_for('abstimmungen.abstimmungen_liste'))
 
@@ -113,22 +102,10 @@ def abstimmung_detail(id):
         eigene_stimme_row = cursor.fetchone()
         eigene_stimme = eigene_stimme_row[0] if eigene_stimme_row else None
 
-        # Statistik berechnen
-        sql = convert_sql("""
-            SELECT stimme, COUNT(*) as anzahl
-            FROM abstimmung_stimmen
-            WHERE abstimmung_id = ?
-            GROUP BY stimme
-        """)
-        cursor.execute(sql, (id,))
-        statistik = {'ja': 0, 'nein': 0, 'enthaltung': 0}
-        for row in cursor.fetchall():
-            statistik[row[0]] = row[1]
-
     return render_template('abstimmung_stimmen.html',
                          abstimmung=abstimmung,
                          eigene_stimme=eigene_stimme,
-                         statistik=statistik)
+                         statistik=statistik_aus_zeile(abstimmung))
 
 
 @abstimmungen_bp.route('/abstimmungen/<int:id>/stimmen', methods=['POST'])
@@ -138,14 +115,13 @@ def abstimmung_stimme_abgeben(id):
     db_path = get_current_db_path()
 
     stimme = request.form.get('stimme')
-    if stimme not in ['ja', 'nein', 'enthaltung']:
+    if stimme not in STIMMEN:
         flash('Ungültige Stimme.', 'danger')
         return redirect(url_for('abstimmungen.abstimmung_detail', id=id))
 
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        # Prüfen ob Abstimmung noch offen
         sql = convert_sql("SELECT status, gemeinschaft_id FROM abstimmungen WHERE id = ?")
         cursor.execute(sql, (id,))
         row = cursor.fetchone()
@@ -157,50 +133,64 @@ def abstimmung_stimme_abgeben(id):
             flash('Diese Abstimmung ist bereits abgeschlossen.', 'warning')
             return redirect(url_for('abstimmungen.abstimmung_detail', id=id))
 
-        # Prüfen ob Benutzer Mitglied ist
-        sql = convert_sql("""
-            SELECT 1 FROM mitglied_gemeinschaft
-            WHERE mitglied_id = ? AND gemeinschaft_id = ?
-        """)
-        cursor.execute(sql, (session['benutzer_id'], row[1]))
-        if not cursor.fetchone():
+        if not mitgliedschaft(db).ist_mitglied(session['benutzer_id'], row[1]):
             flash('Sie sind nicht berechtigt, an dieser Abstimmung teilzunehmen.', 'danger')
             return redirect(url_for('abstimmungen.abstimmungen_liste'))
 
-        # Prüfen ob bereits abgestimmt
-        sql = convert_sql("""
-            SELECT 1 FROM abstimmung_stimmen
-            WHERE abstimmung_id = ? AND benutzer_id = ?
-        """)
-        cursor.execute(sql, (id, session['benutzer_id']))
-        if cursor.fetchone():
-            # Stimme aktualisieren
-            sql = convert_sql("""
-                UPDATE abstimmung_stimmen
-                SET stimme = ?, abgegeben_am = ?
-                WHERE abstimmung_id = ? AND benutzer_id = ?
-            """)
-            cursor.execute(sql, (
-                stimme,
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                id,
-                session['benutzer_id']
-            ))
-            flash('Ihre Stimme wurde geändert.', 'success')
-        else:
-            # Neue Stimme einfügen
-            sql = convert_sql("""
-                INSERT INTO abstimmung_stimmen (abstimmung_id, benutzer_id, stimme)
-                VALUES (?, ?, ?)
-            """)
-            cursor.execute(sql, (id, session['benutzer_id'], stimme))
-            flash('Ihre Stimme wurde erfolgreich abgegeben.', 'success')
+        # Stimme speichern und Zähler nachführen (eine Transaktion)
+        try:
+            alte_stimme = stimme_abgeben(cursor, id, session['benutzer_id'], stimme)
+        except AbstimmungGeschlossen:
+            db.connection.rollback()
+            flash('Diese Abstimmung ist bereits abgeschlossen.', 'warning')
+            return redirect(url_for('abstimmungen.abstimmung_detail', id=id))
 
         db.connection.commit()
 
+    if alte_stimme is None:
+        flash('Ihre Stimme wurde erfolgreich abgegeben.', 'success')
+    else:
+        flash('Ihre Stimme wurde geändert.', 'success')
+
     return redirect(url_for('abstimmungen.abstimmung_detail', id=id))
 
 
+@abstimmungen_bp.route('/abstimmungen/<int:id>/ergebnis')
+@login_required
+def abstimmung_ergebnis(id):
+    """Live-Ergebnis als JSON (liest nur die Zähler der Abstimmung)"""
+    db_path = get_current_db_path()
+
+    with MaschinenDBContext(db_path) as db:
+        cursor = db.connection.cursor()
+
+        sql = convert_sql("""
+            SELECT gemeinschaft_id, status, geheim, stimmen_ja, stimmen_nein,
+                   stimmen_enthaltung, stimmen_gesamt
+            FROM abstimmungen
+            WHERE id = ?
+        """)
+        cursor.execute(sql, (id,))
+        row = cursor.fetchone()
+        if not row or not mitgliedschaft(db).ist_mitglied(session['benutzer_id'], row[0]):
+            return jsonify({'success': False}), 404
+
+        columns = [desc[0] for desc in cursor.description]
+        abstimmung = dict(zip(columns, row))
+
+    statistik = statistik_aus_zeile(abstimmung)
+    ergebnis = {
+        'success': True,
+        'status': abstimmung['status'],
+        'gesamt': statistik['gesamt']
+    }
+    # Geheime Abstimmung: Verteilung erst nach Abschluss
+    if not abstimmung['geheim'] or abstimmung['status'] == 'abgeschlossen':
+        ergebnis.update({s: statistik[s] for s in STIMMEN})
+
+    return jsonify(ergebnis)
+
+
 @abstimmungen_bp.route('/antrag-stellen', methods=['GET', 'POST'])
 @login_required
 def antrag_stellen():
@@ -208,7 +198,7 @@ def antrag_stellen():
     db_path = get_current_db_path()
 
     if request.method == 'POST':
-        gemeinschaft_id = request.form.get('gemeinschaft_id')
+        gemeinschaft_id = request.form.get('gemeinschaft_id', type=int)
         titel = request.form.get('titel')
         beschreibung = request.form.get('beschreibung')
 
@@ -220,12 +210,7 @@ def antrag_stellen():
             cursor = db.connection.cursor()
 
             # Prüfen ob Benutzer Mitglied ist
-            sql = convert_sql("""
-                SELECT 1 FROM mitglied_gemeinschaft
-                WHERE mitglied_id = ? AND gemeinschaft_id = ?
-            """)
-            cursor.execute(sql, (session['benutzer_id'], gemeinschaft_id))
-            if not cursor.fetchone():
+            if not mitgliedschaft(db).ist_mitglied(session['benutzer_id'], gemeinschaft_id):
                 flash('Sie sind nicht Mitglied dieser Gemeinschaft.', 'danger')
                 return redirect(url_for('abstimmungen.antrag_stellen'))
 
@@ -241,16 +226,10 @@ def antrag_stellen():
 
     # Gemeinschaften des Benutzers
     with MaschinenDBContext(db_path) as db:
-        cursor = db.connection.cursor()
-        sql = convert_sql("""
-            SELECT g.id, g.name
-            FROM gemeinschaften g
-            JOIN mitglied_gemeinschaft mg ON g.id = mg.gemeinschaft_id
-            WHERE mg.mitglied_id = ? AND g.aktiv = true
-            ORDER BY g.name
-        """)
-        cursor.execute(sql, (session['benutzer_id'],))
-        gemeinschaften = [{'id': row[0], 'name': row[1]} for row in cursor.fetchall()]
+        graph = mitgliedschaft(db)
+        gemeinschaften = graph.gemeinschaften_liste(
+            graph.gemeinschaften_von(session['benutzer_id'], nur_aktive=True)
+        )
 
     return render_template('antrag_stellen.html', gemeinschaften=gemeinschaften)
 
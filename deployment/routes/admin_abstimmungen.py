@@ -9,6 +9,7 @@ from database import MaschinenDBContext
 from utils.decorators import admin_required, schriftfuehrer_required
 from utils.training import get_current_db_path
 from utils.sql_helpers import convert_sql
+from utils.abstimmung_zaehler import statistik_aus_zeile
 
 admin_abstimmungen_bp = Blueprint('admin_abstimmungen', __name__, url_prefix='/admin/abstimmungen')
 
@@ -133,22 +134,10 @@ def abstimmung_detail(id):
             columns = [desc[0] for desc in cursor.description]
             stimmen = [dict(zip(columns, row)) for row in cursor.fetchall()]
 
-        # Statistik berechnen
-        sql = convert_sql("""
-            SELECT stimme, COUNT(*) as anzahl
-            FROM abstimmung_stimmen
-            WHERE abstimmung_id = ?
-            GROUP BY stimme
-        """)
-        cursor.execute(sql, (id,))
-        statistik = {'ja': 0, 'nein': 0, 'enthaltung': 0}
-        for row in cursor.fetchall():
-            statistik[row[0]] = row[1]
-
     return render_template('admin_abstimmung_detail.html',
                          abstimmung=abstimmung,
                          stimmen=stimmen,
-                         statistik=statistik)
+                         statistik=statistik_aus_zeile(abstimmung))
 
 
 @admin_abstimmungen_bp.route('/<int:id>/bearbeiten', methods=['GET', 'POST'])
@@ -208,28 +197,17 @@ def abstimmung_abschliessen(id):
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        # Ergebnis berechnen
-        sql = convert_sql("""
-            SELECT stimme, COUNT(*) as anzahl
-            FROM abstimmung_stimmen
-            WHERE abstimmung_id = ?
-            GROUP BY stimme
-        """)
-        cursor.execute(sql, (id,))
-        ergebnis = {'ja': 0, 'nein': 0, 'enthaltung': 0}
-        for row in cursor.fetchall():
-            ergebnis[row[0]] = row[1]
-
-        # Abstimmung abschließen mit Ergebnis
+        # Abstimmung abschließen - Ergebnis aus den Zählern in derselben
+        # Anweisung übernehmen (gleichzeitige Stimmabgaben warten auf die Zeile)
         sql = convert_sql("""
             UPDATE abstimmungen
             SET status = 'abgeschlossen',
-                ergebnis_ja = ?,
-                ergebnis_nein = ?,
-                ergebnis_enthaltung = ?
+                ergebnis_ja = stimmen_ja,
+                ergebnis_nein = stimmen_nein,
+                ergebnis_enthaltung = stimmen_enthaltung
             WHERE id = ?
         """)
-        cursor.execute(sql, (ergebnis['ja'], ergebnis['nein'], ergebnis['enthaltung'], id))
+        cursor.execute(sql, (id,))
         db.connection.commit()
 
     flash('Abstimmung wurde abgeschlossen.', 'success')
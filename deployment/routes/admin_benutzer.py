@@ -8,6 +8,7 @@ from database import MaschinenDBContext
 from utils.decorators import admin_required
 from utils.training import get_current_db_path
 from utils.sql_helpers import convert_sql
+from utils.auth_context import invalidate_auth_context
 
 admin_benutzer_bp = Blueprint('admin_benutzer', __name__, url_prefix='/admin')
 
@@ -81,6 +82,7 @@ def admin_benutzer_edit(benutzer_id):
             if password:
                 db.update_password(benutzer_id, password)
             db.update_benutzer(benutzer_id, **update_data)
+            invalidate_auth_context(benutzer_id)
             flash('Benutzer erfolgreich aktualisiert!', 'success')
             return redirect(url_for('admin_benutzer.admin_benutzer'))
 
@@ -104,6 +106,7 @@ def admin_benutzer_delete(benutzer_id):
     with MaschinenDBContext(db_path) as db:
         benutzer = db.get_benutzer_by_id(benutzer_id)
         db.delete_benutzer(benutzer_id, soft_delete=False)
+    invalidate_auth_context(benutzer_id)
     flash(f'Benutzer {benutzer["name"]} wurde gelöscht.', 'success')
     return redirect(url_for('admin_benutzer.admin_benutzer'))
 
@@ -116,5 +119,6 @@ def admin_benutzer_activate(benutzer_id):
     with MaschinenDBContext(db_path) as db:
         benutzer = db.get_benutzer_by_id(benutzer_id)
         db.activate_benutzer(benutzer_id)
+    invalidate_auth_context(benutzer_id)
     flash(f'Benutzer {benutzer["name"]} wurde reaktiviert.', 'success')
     return redirect(url_for('admin_benutzer.admin_benutzer'))
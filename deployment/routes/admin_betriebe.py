@@ -10,6 +10,9 @@ from database import MaschinenDBContext
 from utils.decorators import admin_required
 from utils.training import get_current_db_path
 from utils.sql_helpers import convert_sql
+from utils.auth_context import invalidate_auth_context
+from utils.posteingang import zugehoerigkeit_geaendert
+from utils.mitgliedschaft import mitgliedschaft_geaendert
 
 admin_betriebe_bp = Blueprint('admin_betriebe', __name__, url_prefix='/admin')
 
@@ -134,7 +137,10 @@ def betrieb_gemeinschaften(betrieb_id):
                 sql = convert_sql("INSERT INTO betriebe_gemeinschaften (betrieb_id, gemeinschaft_id) VALUES (?, ?)")
                 cursor.execute(sql, (betrieb_id, gid))
 
+            zugehoerigkeit_geaendert(db, betrieb_ids=[betrieb_id])
+            mitgliedschaft_geaendert(db)
             db.connection.commit()
+            invalidate_auth_context()
 
             flash(f'{len(neue_ids)} Gemeinschaft(en) zugewiesen.', 'success')
             return redirect(url_for('admin_betriebe.betrieb_bearbeiten', betrieb_id=betrieb_id))
@@ -267,6 +273,8 @@ def betrieb_benutzer(betrieb_id):
                     ON CONFLICT (benutzer_id, betrieb_id) DO NOTHING
                 """)
                 cursor.execute(sql, (benutzer_id, betrieb_id))
+                zugehoerigkeit_geaendert(db, benutzer_ids=[benutzer_id])
+                mitgliedschaft_geaendert(db)
                 db.connection.commit()
                 flash('Benutzer wurde dem Betrieb zugeordnet.', 'success')
 
@@ -274,6 +282,8 @@ def betrieb_benutzer(betrieb_id):
                 # Benutzer aus benutzer_betriebe entfernen
                 sql = convert_sql("DELETE FROM benutzer_betriebe WHERE benutzer_id = ? AND betrieb_id = ?")
                 cursor.execute(sql, (benutzer_id, betrieb_id))
+                zugehoerigkeit_geaendert(db, benutzer_ids=[benutzer_id])
+                mitgliedschaft_geaendert(db)
                 db.connection.commit()
                 flash('Benutzer wurde vom Betrieb entfernt.', 'success')
 
@@ -6,25 +6,30 @@ Admin - Finanzen, Konten, Buchungen, CSV-Import
 from datetime import datetime
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from database import MaschinenDBContext
-from utils.decorators import admin_required
+from utils.decorators import admin_required, gemeinschaft_admin_required
+from utils.auth_context import ist_gemeinschafts_admin
 from utils.training import get_current_db_path
 from utils.sql_helpers import convert_sql
+from utils.jobs import job_einreihen
+from utils.maschinen_kennzahlen import kennzahlen_aktualisieren, kennzahlen_nach_einsaetzen
+from utils.jahresabschluss import (
+    JahrAbgeschlossen, datum_pruefen, saldo_vortrag, bank_saldo_archiv,
+    jahresabschluesse_laden, aeltestes_offenes_jahr
+)
 
 admin_finanzen_bp = Blueprint('admin_finanzen', __name__, url_prefix='/admin')
 
 
 @admin_finanzen_bp.route('/gemeinschaften/<int:gemeinschaft_id>/konten')
 @admin_required
+@gemeinschaft_admin_required()
 def admin_konten(gemeinschaft_id):
     """Mitgliederkonten-Übersicht (nach Betrieben)"""
     db_path = get_current_db_path()
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        sql = convert_sql("SELECT * FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        columns = [desc[0] for desc in cursor.description]
-        gemeinschaft = dict(zip(columns, cursor.fetchone()))
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
 
         # Konten nach Betrieben anzeigen (über betriebe_gemeinschaften)
         sql = convert_sql("""
@@ -107,6 +112,7 @@ def admin_konten(gemeinschaft_id):
 
 @admin_finanzen_bp.route('/gemeinschaften/<int:gemeinschaft_id>/konten/buchung-neu', methods=['GET', 'POST'])
 @admin_required
+@gemeinschaft_admin_required()
 def admin_konten_buchung_neu(gemeinschaft_id):
     """Neue manuelle Buchung erstellen (pro Betrieb)"""
     admin_benutzer_id = session.get('benutzer_id')
@@ -115,10 +121,7 @@ def admin_konten_buchung_neu(gemeinschaft_id):
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        sql = convert_sql("SELECT * FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        columns = [desc[0] for desc in cursor.description]
-        gemeinschaft = dict(zip(columns, cursor.fetchone()))
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
 
         if request.method == 'POST':
             betrieb_id = request.form.get('betrieb_id')
@@ -145,6 +148,13 @@ def admin_konten_buchung_neu(gemeinschaft_id):
                 return redirect(url_for('admin_finanzen.admin_konten_buchung_neu',
                                        gemeinschaft_id=gemeinschaft_id))
 
+            try:
+                datum_pruefen(db, gemeinschaft_id, datum)
+            except JahrAbgeschlossen as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('admin_finanzen.admin_konten_buchung_neu',
+                                       gemeinschaft_id=gemeinschaft_id))
+
             sql = convert_sql("""
                 INSERT INTO buchungen (
                     betrieb_id, gemeinschaft_id, datum, betrag,
@@ -197,6 +207,7 @@ def admin_konten_buchung_neu(gemeinschaft_id):
 
 @admin_finanzen_bp.route('/gemeinschaften/<int:gemeinschaft_id>/konten/detail/<int:betrieb_id>')
 @admin_required
+@gemeinschaft_admin_required()
 def admin_konten_detail(gemeinschaft_id, betrieb_id):
     """Kontodetail für einen Betrieb"""
     db_path = get_current_db_path()
@@ -204,10 +215,7 @@ def admin_konten_detail(gemeinschaft_id, betrieb_id):
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        sql = convert_sql("SELECT * FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        columns = [desc[0] for desc in cursor.description]
-        gemeinschaft = dict(zip(columns, cursor.fetchone()))
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
 
         # Betrieb laden
         sql = convert_sql("SELECT * FROM betriebe WHERE id = ?")
@@ -256,13 +264,16 @@ def admin_konten_detail(gemeinschaft_id, betrieb_id):
         columns = [desc[0] for desc in cursor.description]
         buchungen = [dict(zip(columns, row)) for row in cursor.fetchall()]
 
+        # Buchungen abgeschlossener Jahre sind archiviert, ihr Ergebnis steckt im Vortrag
+        saldo_vorjahr = saldo_vortrag(db, gemeinschaft_id, [betrieb_id])
+
     return render_template('admin_konten_detail.html',
                          gemeinschaft=gemeinschaft,
                          betrieb=betrieb,
                          benutzer_im_betrieb=benutzer_im_betrieb,
                          konto=konto,
                          saldo=saldo,
-                         saldo_vorjahr=0,
+                         saldo_vorjahr=saldo_vorjahr,
                          buchungen=buchungen)
 
 
@@ -328,6 +339,7 @@ def admin_abrechnungen():
 
 @admin_finanzen_bp.route('/gemeinschaften/<int:gemeinschaft_id>/konten/zahlung/<int:betrieb_id>', methods=['GET', 'POST'])
 @admin_required
+@gemeinschaft_admin_required()
 def admin_konten_zahlung(gemeinschaft_id, betrieb_id):
     """Zahlung für offene Abrechnungen verbuchen (pro Betrieb)"""
     admin_id = session.get('benutzer_id')
@@ -336,10 +348,7 @@ def admin_konten_zahlung(gemeinschaft_id, betrieb_id):
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        sql = convert_sql("SELECT * FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        columns = [desc[0] for desc in cursor.description]
-        gemeinschaft = dict(zip(columns, cursor.fetchone()))
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
 
         sql = convert_sql("SELECT * FROM betriebe WHERE id = ?")
         cursor.execute(sql, (betrieb_id,))
@@ -351,6 +360,12 @@ def admin_konten_zahlung(gemeinschaft_id, betrieb_id):
             datum = request.form['datum']
             beschreibung = request.form.get('beschreibung', f'Zahlung von {betrieb["name"]}')
 
+            try:
+                datum_pruefen(db, gemeinschaft_id, datum)
+            except JahrAbgeschlossen as e:
+                flash(str(e), 'danger')
+                return redirect(request.url)
+
             sql = convert_sql("""
                 INSERT INTO buchungen (
                     betrieb_id, gemeinschaft_id, datum, betrag,
@@ -431,6 +446,7 @@ def admin_konten_zahlung(gemeinschaft_id, betrieb_id):
 
 @admin_finanzen_bp.route('/abrechnungen/<int:gemeinschaft_id>/erstellen', methods=['GET', 'POST'])
 @admin_required
+@gemeinschaft_admin_required()
 def abrechnungen_erstellen(gemeinschaft_id):
     """Erstellt Abrechnungen für alle Mitglieder einer Gemeinschaft"""
     db_path = get_current_db_path()
@@ -438,16 +454,6 @@ def abrechnungen_erstellen(gemeinschaft_id):
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        if session.get('admin_level', 0) < 2:
-            sql = convert_sql("""
-                SELECT COUNT(*) FROM gemeinschafts_admin
-                WHERE benutzer_id = ? AND gemeinschaft_id = ?
-            """)
-            cursor.execute(sql, (session['benutzer_id'], gemeinschaft_id))
-            if cursor.fetchone()[0] == 0:
-                flash('Keine Berechtigung!', 'danger')
-                return redirect(url_for('admin_finanzen.admin_abrechnungen'))
-
         if request.method == 'POST':
             zeitraum_von = request.form.get('zeitraum_von')
             zeitraum_bis = request.form.get('zeitraum_bis')
@@ -456,129 +462,33 @@ def abrechnungen_erstellen(gemeinschaft_id):
                 flash('Bitte beide Datumsfelder ausfüllen!', 'warning')
                 return redirect(request.url)
 
-            von_obj = datetime.strptime(zeitraum_von, '%Y-%m-%d')
-            bis_obj = datetime.strptime(zeitraum_bis, '%Y-%m-%d')
-            abrechnungszeitraum = f"{von_obj.strftime('%m/%Y')} - {bis_obj.strftime('%m/%Y')}"
-
-            # Abrechnungen pro Betrieb erstellen (über betriebe_gemeinschaften)
-            sql = convert_sql("""
-                SELECT bt.id, bt.name FROM betriebe bt
-                JOIN betriebe_gemeinschaften bgem ON bt.id = bgem.betrieb_id
-                WHERE bgem.gemeinschaft_id = ? AND (bt.aktiv = true OR bt.aktiv IS NULL)
-                ORDER BY bt.name
-            """)
-            cursor.execute(sql, (gemeinschaft_id,))
-            betriebe = cursor.fetchall()
-
-            erstellt = 0
-            uebersprungen = 0
-
-            for betrieb_row in betriebe:
-                betrieb_id = betrieb_row[0]
-                betrieb_name = betrieb_row[1]
-
-                # Prüfen ob bereits Abrechnung existiert
-                sql = convert_sql("""
-                    SELECT COUNT(*) FROM mitglieder_abrechnungen
-                    WHERE gemeinschaft_id = ? AND betrieb_id = ?
-                    AND zeitraum_von = ? AND zeitraum_bis = ?
-                """)
-                cursor.execute(sql, (gemeinschaft_id, betrieb_id, zeitraum_von, zeitraum_bis))
-
-                if cursor.fetchone()[0] > 0:
-                    uebersprungen += 1
-                    continue
-
-                # Maschinenkosten für alle Benutzer des Betriebs summieren (über benutzer_betriebe)
-                sql = convert_sql("""
-                    SELECT COALESCE(SUM(me.kosten_berechnet), 0)
-                    FROM maschineneinsaetze me
-                    JOIN maschinen m ON me.maschine_id = m.id
-                    JOIN benutzer_betriebe bb ON me.benutzer_id = bb.benutzer_id
-                    WHERE bb.betrieb_id = ?
-                    AND me.datum BETWEEN ? AND ?
-                    AND m.gemeinschaft_id = ?
-                """)
-                cursor.execute(sql, (betrieb_id, zeitraum_von, zeitraum_bis, gemeinschaft_id))
-                betrag_maschinen = cursor.fetchone()[0] or 0
-
-                # Treibstoffkosten für alle Benutzer des Betriebs summieren (über benutzer_betriebe)
-                sql = convert_sql("""
-                    SELECT COALESCE(SUM(me.treibstoffkosten), 0)
-                    FROM maschineneinsaetze me
-                    JOIN maschinen m ON me.maschine_id = m.id
-                    JOIN benutzer_betriebe bb ON me.benutzer_id = bb.benutzer_id
-                    WHERE bb.betrieb_id = ?
-                    AND me.datum BETWEEN ? AND ?
-                    AND m.treibstoff_berechnen = true
-                    AND m.gemeinschaft_id = ?
-                """)
-                cursor.execute(sql, (betrieb_id, zeitraum_von, zeitraum_bis, gemeinschaft_id))
-                betrag_treibstoff = cursor.fetchone()[0] or 0
-
-                betrag_gesamt = betrag_maschinen + betrag_treibstoff
-
-                if betrag_gesamt > 0:
-                    sql = convert_sql("""
-                        INSERT INTO mitglieder_abrechnungen
-                        (gemeinschaft_id, betrieb_id,
-                         abrechnungszeitraum, zeitraum_von, zeitraum_bis, betrag_gesamt,
-                         betrag_treibstoff, betrag_maschinen, betrag_sonstiges,
-                         status, erstellt_von)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, 'offen', ?)
-                        RETURNING id
-                    """)
-                    cursor.execute(sql, (gemeinschaft_id, betrieb_id,
-                                        abrechnungszeitraum, zeitraum_von, zeitraum_bis, betrag_gesamt,
-                                        betrag_treibstoff, betrag_maschinen, session['benutzer_id']))
-
-                    abrechnung_id = cursor.fetchone()[0]
-
-                    # Konto erstellen oder aktualisieren (pro Betrieb)
-                    sql = convert_sql("""
-                        INSERT INTO mitglieder_konten (betrieb_id, gemeinschaft_id, saldo)
-                        VALUES (?, ?, 0)
-                        ON CONFLICT(betrieb_id, gemeinschaft_id) DO NOTHING
-                    """)
-                    cursor.execute(sql, (betrieb_id, gemeinschaft_id))
-
-                    # Buchung erstellen (pro Betrieb)
-                    sql = convert_sql("""
-                        INSERT INTO buchungen (
-                            betrieb_id, gemeinschaft_id, datum, betrag, typ,
-                            beschreibung, referenz_typ, referenz_id, erstellt_von
-                        ) VALUES (?, ?, ?, ?, 'abrechnung', ?, 'abrechnung', ?, ?)
-                    """)
-                    cursor.execute(sql, (
-                        betrieb_id, gemeinschaft_id, zeitraum_bis, -betrag_gesamt,
-                        f'Abrechnung #{abrechnung_id} für {abrechnungszeitraum}',
-                        abrechnung_id, session['benutzer_id']
-                    ))
-
-                    # Saldo aktualisieren
-                    sql = convert_sql("""
-                        UPDATE mitglieder_konten
-                        SET saldo = saldo - ?, letzte_aktualisierung = CURRENT_TIMESTAMP
-                        WHERE betrieb_id = ? AND gemeinschaft_id = ?
-                    """)
-                    cursor.execute(sql, (betrag_gesamt, betrieb_id, gemeinschaft_id))
-
-                    erstellt += 1
+            try:
+                datetime.strptime(zeitraum_von, '%Y-%m-%d')
+                datetime.strptime(zeitraum_bis, '%Y-%m-%d')
+            except ValueError:
+                flash('Ungültiges Datum!', 'warning')
+                return redirect(request.url)
 
-            db.connection.commit()
+            try:
+                datum_pruefen(db, gemeinschaft_id, zeitraum_von)
+            except JahrAbgeschlossen as e:
+                flash(str(e), 'warning')
+                return redirect(request.url)
 
-            if erstellt > 0:
-                flash(f'{erstellt} Abrechnung(en) erfolgreich erstellt', 'success')
-            if uebersprungen > 0:
-                flash(f'{uebersprungen} Abrechnung(en) bereits vorhanden (übersprungen)', 'info')
-            if erstellt == 0 and uebersprungen == 0:
-                flash(f'Keine Maschineneinsätze im Zeitraum {zeitraum_von} bis {zeitraum_bis} gefunden.', 'warning')
+            # Abrechnungslauf im Hintergrund (Fortschritt pro Betrieb auf der Statusseite)
+            job_id = job_einreihen('abrechnungen_erstellen', {
+                'db_path': db_path,
+                'gemeinschaft_id': gemeinschaft_id,
+                'zeitraum_von': zeitraum_von,
+                'zeitraum_bis': zeitraum_bis,
+                'benutzer_id': session['benutzer_id']
+            }, session['benutzer_id'],
+                zurueck=url_for('admin_finanzen.abrechnungen_liste', gemeinschaft_id=gemeinschaft_id))
 
-            return redirect(url_for('admin_finanzen.abrechnungen_liste', gemeinschaft_id=gemeinschaft_id))
+            flash('Der Abrechnungslauf wurde gestartet und läuft im Hintergrund.', 'info')
+            return redirect(url_for('admin_jobs.admin_job', job_id=job_id))
 
-        sql = convert_sql("SELECT name FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        gemeinschaft_name = cursor.fetchone()[0]
+        gemeinschaft_name = db.get_gemeinschaft(gemeinschaft_id)['name']
 
         heute = datetime.now()
         jahr = heute.year
@@ -622,6 +532,7 @@ def abrechnungen_erstellen(gemeinschaft_id):
 
 @admin_finanzen_bp.route('/abrechnungen/<int:gemeinschaft_id>/liste')
 @admin_required
+@gemeinschaft_admin_required()
 def abrechnungen_liste(gemeinschaft_id):
     """Liste aller Abrechnungen einer Gemeinschaft"""
     db_path = get_current_db_path()
@@ -629,16 +540,6 @@ def abrechnungen_liste(gemeinschaft_id):
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        if session.get('admin_level', 0) < 2:
-            sql = convert_sql("""
-                SELECT COUNT(*) FROM gemeinschafts_admin
-                WHERE benutzer_id = ? AND gemeinschaft_id = ?
-            """)
-            cursor.execute(sql, (session['benutzer_id'], gemeinschaft_id))
-            if cursor.fetchone()[0] == 0:
-                flash('Keine Berechtigung!', 'danger')
-                return redirect(url_for('admin_finanzen.admin_abrechnungen'))
-
         sql = convert_sql("""
             SELECT
                 ma.id, ma.zeitraum_von, ma.zeitraum_bis,
@@ -700,9 +601,7 @@ def abrechnungen_liste(gemeinschaft_id):
             summe_maschinen += betrag_maschinen
             summe_treibstoff += betrag_treibstoff
 
-        sql = convert_sql("SELECT name FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        gemeinschaft_name = cursor.fetchone()[0]
+        gemeinschaft_name = db.get_gemeinschaft(gemeinschaft_id)['name']
 
     return render_template('abrechnungen_liste.html',
                          gemeinschaft_id=gemeinschaft_id,
@@ -714,6 +613,7 @@ def abrechnungen_liste(gemeinschaft_id):
 
 @admin_finanzen_bp.route('/abrechnungen/<int:gemeinschaft_id>/csv-import', methods=['GET', 'POST'])
 @admin_required
+@gemeinschaft_admin_required()
 def admin_csv_import(gemeinschaft_id):
     """CSV-Import für Banktransaktionen"""
     db_path = get_current_db_path()
@@ -721,16 +621,6 @@ def admin_csv_import(gemeinschaft_id):
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        if session.get('admin_level', 0) < 2:
-            sql = convert_sql("""
-                SELECT COUNT(*) FROM gemeinschafts_admin
-                WHERE benutzer_id = ? AND gemeinschaft_id = ?
-            """)
-            cursor.execute(sql, (session['benutzer_id'], gemeinschaft_id))
-            if cursor.fetchone()[0] == 0:
-                flash('Keine Berechtigung für diese Gemeinschaft!', 'danger')
-                return redirect(url_for('admin_finanzen.admin_abrechnungen'))
-
         sql = convert_sql("SELECT * FROM csv_import_konfiguration WHERE gemeinschaft_id = ?")
         cursor.execute(sql, (gemeinschaft_id,))
 
@@ -744,9 +634,7 @@ def admin_csv_import(gemeinschaft_id):
             db.connection.commit()
             return redirect(request.url)
 
-        sql = convert_sql("SELECT name FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        gemeinschaft_name = cursor.fetchone()[0]
+        gemeinschaft_name = db.get_gemeinschaft(gemeinschaft_id)['name']
 
     return render_template('admin_csv_import.html',
                          gemeinschaft_id=gemeinschaft_id,
@@ -756,6 +644,7 @@ def admin_csv_import(gemeinschaft_id):
 
 @admin_finanzen_bp.route('/abrechnungen/<int:gemeinschaft_id>/csv-konfiguration', methods=['GET', 'POST'])
 @admin_required
+@gemeinschaft_admin_required()
 def admin_csv_konfiguration(gemeinschaft_id):
     """CSV-Import-Format konfigurieren"""
     db_path = get_current_db_path()
@@ -763,16 +652,6 @@ def admin_csv_konfiguration(gemeinschaft_id):
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        if session.get('admin_level', 0) < 2:
-            sql = convert_sql("""
-                SELECT COUNT(*) FROM gemeinschafts_admin
-                WHERE benutzer_id = ? AND gemeinschaft_id = ?
-            """)
-            cursor.execute(sql, (session['benutzer_id'], gemeinschaft_id))
-            if cursor.fetchone()[0] == 0:
-                flash('Keine Berechtigung für diese Gemeinschaft!', 'danger')
-                return redirect(url_for('admin_finanzen.admin_abrechnungen'))
-
         if request.method == 'POST':
             sql = convert_sql("""
                 UPDATE csv_import_konfiguration
@@ -820,9 +699,7 @@ def admin_csv_konfiguration(gemeinschaft_id):
             db.connection.commit()
             return redirect(request.url)
 
-        sql = convert_sql("SELECT name FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        gemeinschaft_name = cursor.fetchone()[0]
+        gemeinschaft_name = db.get_gemeinschaft(gemeinschaft_id)['name']
 
     return render_template('admin_csv_konfiguration.html',
                          gemeinschaft_id=gemeinschaft_id,
@@ -832,23 +709,14 @@ def admin_csv_konfiguration(gemeinschaft_id):
 
 @admin_finanzen_bp.route('/abrechnungen/<int:gemeinschaft_id>/transaktionen')
 @admin_required
+@gemeinschaft_admin_required()
 def admin_transaktionen(gemeinschaft_id):
     """Übersicht aller Transaktionen einer Gemeinschaft"""
     db_path = get_current_db_path()
 
-    with MaschinenDBContext(db_path) as db:
+    with MaschinenDBContext(db_path, read_only=True) as db:
         cursor = db.connection.cursor()
 
-        if session.get('admin_level', 0) < 2:
-            sql = convert_sql("""
-                SELECT COUNT(*) FROM gemeinschafts_admin
-                WHERE benutzer_id = ? AND gemeinschaft_id = ?
-            """)
-            cursor.execute(sql, (session['benutzer_id'], gemeinschaft_id))
-            if cursor.fetchone()[0] == 0:
-                flash('Keine Berechtigung für diese Gemeinschaft!', 'danger')
-                return redirect(url_for('admin_finanzen.admin_abrechnungen'))
-
         filter_typ = request.args.get('typ', 'alle')
 
         query = convert_sql("""
@@ -894,11 +762,12 @@ def admin_transaktionen(gemeinschaft_id):
 
         row = cursor.fetchone()
 
-        sql = convert_sql("SELECT anfangssaldo_bank, anfangssaldo_datum FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        saldo_row = cursor.fetchone()
-        anfangssaldo = saldo_row[0] if saldo_row else 0.0
-        anfangssaldo_datum = saldo_row[1] if saldo_row else None
+        # Transaktionen abgeschlossener Jahre liegen im Archiv
+        saldo_archiv = bank_saldo_archiv(db, gemeinschaft_id)
+
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
+        anfangssaldo = gemeinschaft.get('anfangssaldo_bank') if gemeinschaft else 0.0
+        anfangssaldo_datum = gemeinschaft.get('anfangssaldo_datum') if gemeinschaft else None
 
         statistik = {
             'anzahl_gesamt': row[0],
@@ -911,12 +780,11 @@ def admin_transaktionen(gemeinschaft_id):
             'unzugeordnete_ausgaenge': row[7],
             'anfangssaldo': anfangssaldo,
             'anfangssaldo_datum': anfangssaldo_datum,
-            'aktueller_saldo': anfangssaldo + row[2]
+            'saldo_archiv': saldo_archiv,
+            'aktueller_saldo': anfangssaldo + saldo_archiv + row[2]
         }
 
-        sql = convert_sql("SELECT name FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        gemeinschaft_name = cursor.fetchone()[0]
+        gemeinschaft_name = gemeinschaft['name']
 
         sql = convert_sql("""
             SELECT DISTINCT b.id, b.name, b.vorname
@@ -933,13 +801,13 @@ def admin_transaktionen(gemeinschaft_id):
         maschinen = [{'id': row[0], 'bezeichnung': row[1]} for row in cursor.fetchall()]
 
         sql = convert_sql("""
-            SELECT date(importiert_am) as import_datum, importiert_von, COUNT(*) as anzahl,
+            SELECT t.import_datum, t.importiert_von, COUNT(*) as anzahl,
                    MAX(b.name || ' ' || COALESCE(b.vorname, '')) as importiert_von_name
             FROM bank_transaktionen t
             LEFT JOIN benutzer b ON t.importiert_von = b.id
             WHERE t.gemeinschaft_id = ?
-            GROUP BY date(importiert_am), importiert_von
-            ORDER BY date(importiert_am) DESC
+            GROUP BY t.import_datum, t.importiert_von
+            ORDER BY t.import_datum DESC
         """)
         cursor.execute(sql, (gemeinschaft_id,))
 
@@ -980,15 +848,9 @@ def transaktion_zuordnen(transaktion_id):
 
         gemeinschaft_id, betrag = result
 
-        if session.get('admin_level', 0) < 2:
-            sql = convert_sql("""
-                SELECT COUNT(*) FROM gemeinschafts_admin
-                WHERE benutzer_id = ? AND gemeinschaft_id = ?
-            """)
-            cursor.execute(sql, (session['benutzer_id'], gemeinschaft_id))
-            if cursor.fetchone()[0] == 0:
-                flash('Keine Berechtigung!', 'danger')
-                return redirect(url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
+        if not ist_gemeinschafts_admin(gemeinschaft_id):
+            flash('Keine Berechtigung!', 'danger')
+            return redirect(url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
 
         zuordnung_typ = request.form.get('zuordnung_typ')
 
@@ -1031,6 +893,7 @@ def transaktion_zuordnen(transaktion_id):
                     WHERE id = ?
                 """)
                 cursor.execute(sql, (maschine_id, transaktion_id))
+                kennzahlen_aktualisieren(db, int(maschine_id), datetime.now().year)
 
                 db.connection.commit()
                 flash('Ausgang der Maschine zugeordnet', 'success')
@@ -1077,15 +940,9 @@ def transaktion_zuordnung_aufheben(transaktion_id):
 
         gemeinschaft_id, zuordnung_typ, zuordnung_id = result
 
-        if session.get('admin_level', 0) < 2:
-            sql = convert_sql("""
-                SELECT COUNT(*) FROM gemeinschafts_admin
-                WHERE benutzer_id = ? AND gemeinschaft_id = ?
-            """)
-            cursor.execute(sql, (session['benutzer_id'], gemeinschaft_id))
-            if cursor.fetchone()[0] == 0:
-                flash('Keine Berechtigung!', 'danger')
-                return redirect(url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
+        if not ist_gemeinschafts_admin(gemeinschaft_id):
+            flash('Keine Berechtigung!', 'danger')
+            return redirect(url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
 
         sql = convert_sql("""
             UPDATE bank_transaktionen
@@ -1095,8 +952,12 @@ def transaktion_zuordnung_aufheben(transaktion_id):
         cursor.execute(sql, (transaktion_id,))
 
         if zuordnung_typ in ['maschine', 'gemeinschaft']:
-            sql = convert_sql("DELETE FROM gemeinschafts_kosten WHERE transaktion_id = ?")
+            sql = convert_sql("""
+                DELETE FROM gemeinschafts_kosten WHERE transaktion_id = ?
+                RETURNING maschine_id, datum
+            """)
             cursor.execute(sql, (transaktion_id,))
+            kennzahlen_nach_einsaetzen(db, [row for row in cursor.fetchall() if row[0]])
 
         db.connection.commit()
         flash('Zuordnung aufgehoben', 'info')
@@ -1122,19 +983,17 @@ def transaktion_loeschen(transaktion_id):
 
         gemeinschaft_id, zuordnung_typ = result
 
-        if session.get('admin_level', 0) < 2:
-            sql = convert_sql("""
-                SELECT COUNT(*) FROM gemeinschafts_admin
-                WHERE benutzer_id = ? AND gemeinschaft_id = ?
-            """)
-            cursor.execute(sql, (session['benutzer_id'], gemeinschaft_id))
-            if cursor.fetchone()[0] == 0:
-                flash('Keine Berechtigung!', 'danger')
-                return redirect(url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
+        if not ist_gemeinschafts_admin(gemeinschaft_id):
+            flash('Keine Berechtigung!', 'danger')
+            return redirect(url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
 
         if zuordnung_typ in ['maschine', 'gemeinschaft']:
-            sql = convert_sql("DELETE FROM gemeinschafts_kosten WHERE transaktion_id = ?")
+            sql = convert_sql("""
+                DELETE FROM gemeinschafts_kosten WHERE transaktion_id = ?
+                RETURNING maschine_id, datum
+            """)
             cursor.execute(sql, (transaktion_id,))
+            kennzahlen_nach_einsaetzen(db, [row for row in cursor.fetchall() if row[0]])
 
         sql = convert_sql("DELETE FROM bank_transaktionen WHERE id = ?")
         cursor.execute(sql, (transaktion_id,))
@@ -1147,6 +1006,7 @@ def transaktion_loeschen(transaktion_id):
 
 @admin_finanzen_bp.route('/abrechnungen/<int:gemeinschaft_id>/import-loeschen', methods=['POST'])
 @admin_required
+@gemeinschaft_admin_required()
 def import_loeschen(gemeinschaft_id):
     """Löscht alle Transaktionen eines bestimmten Imports"""
     db_path = get_current_db_path()
@@ -1154,16 +1014,6 @@ def import_loeschen(gemeinschaft_id):
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        if session.get('admin_level', 0) < 2:
-            sql = convert_sql("""
-                SELECT COUNT(*) FROM gemeinschafts_admin
-                WHERE benutzer_id = ? AND gemeinschaft_id = ?
-            """)
-            cursor.execute(sql, (session['benutzer_id'], gemeinschaft_id))
-            if cursor.fetchone()[0] == 0:
-                flash('Keine Berechtigung für diese Gemeinschaft!', 'danger')
-                return redirect(url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
-
         import_datum = request.form.get('import_datum')
         importiert_von = request.form.get('importiert_von')
 
@@ -1173,7 +1023,7 @@ def import_loeschen(gemeinschaft_id):
 
         sql = convert_sql("""
             SELECT COUNT(*) FROM bank_transaktionen
-            WHERE gemeinschaft_id = ? AND date(importiert_am) = ? AND importiert_von = ?
+            WHERE gemeinschaft_id = ? AND import_datum = ? AND importiert_von = ?
         """)
         cursor.execute(sql, (gemeinschaft_id, import_datum, importiert_von))
         anzahl = cursor.fetchone()[0]
@@ -1182,32 +1032,21 @@ def import_loeschen(gemeinschaft_id):
             flash('Keine Transaktionen zum Löschen gefunden!', 'warning')
             return redirect(url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
 
-        sql = convert_sql("""
-            SELECT id FROM bank_transaktionen
-            WHERE gemeinschaft_id = ? AND date(importiert_am) = ? AND importiert_von = ?
-        """)
-        cursor.execute(sql, (gemeinschaft_id, import_datum, importiert_von))
-        trans_ids = [row[0] for row in cursor.fetchall()]
-
-        if trans_ids:
-            placeholders = ','.join(['?' for _ in trans_ids])
-            sql = f"DELETE FROM gemeinschafts_kosten WHERE transaktion_id IN ({placeholders})"
-            cursor.execute(sql, trans_ids)
+    job_id = job_einreihen('import_loeschen', {
+        'db_path': db_path,
+        'gemeinschaft_id': gemeinschaft_id,
+        'import_datum': import_datum,
+        'importiert_von': importiert_von
+    }, session['benutzer_id'],
+        zurueck=url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
 
-        sql = convert_sql("""
-            DELETE FROM bank_transaktionen
-            WHERE gemeinschaft_id = ? AND date(importiert_am) = ? AND importiert_von = ?
-        """)
-        cursor.execute(sql, (gemeinschaft_id, import_datum, importiert_von))
-
-        db.connection.commit()
-        flash(f'{anzahl} Transaktionen des Imports vom {import_datum} gelöscht', 'success')
-
-    return redirect(url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
+    flash(f'{anzahl} Transaktionen des Imports vom {import_datum} werden im Hintergrund gelöscht.', 'info')
+    return redirect(url_for('admin_jobs.admin_job', job_id=job_id))
 
 
 @admin_finanzen_bp.route('/abrechnungen/<int:gemeinschaft_id>/anfangssaldo', methods=['GET', 'POST'])
 @admin_required
+@gemeinschaft_admin_required()
 def anfangssaldo_bearbeiten(gemeinschaft_id):
     """Anfangssaldo für Gemeinschaft eingeben/bearbeiten"""
     db_path = get_current_db_path()
@@ -1215,16 +1054,6 @@ def anfangssaldo_bearbeiten(gemeinschaft_id):
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        if session.get('admin_level', 0) < 2:
-            sql = convert_sql("""
-                SELECT COUNT(*) FROM gemeinschafts_admin
-                WHERE benutzer_id = ? AND gemeinschaft_id = ?
-            """)
-            cursor.execute(sql, (session['benutzer_id'], gemeinschaft_id))
-            if cursor.fetchone()[0] == 0:
-                flash('Keine Berechtigung!', 'danger')
-                return redirect(url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
-
         if request.method == 'POST':
             anfangssaldo = request.form.get('anfangssaldo', '0')
             anfangssaldo_datum = request.form.get('anfangssaldo_datum', None)
@@ -1241,20 +1070,68 @@ def anfangssaldo_bearbeiten(gemeinschaft_id):
                 WHERE id = ?
             """)
             cursor.execute(sql, (anfangssaldo, anfangssaldo_datum, gemeinschaft_id))
+            db.referenzdaten_geaendert()
 
             db.connection.commit()
             flash(f'Anfangssaldo auf {anfangssaldo:.2f} € gesetzt', 'success')
             return redirect(url_for('admin_finanzen.admin_transaktionen', gemeinschaft_id=gemeinschaft_id))
 
-        sql = convert_sql("SELECT name, anfangssaldo_bank, anfangssaldo_datum FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        row = cursor.fetchone()
+        row = db.get_gemeinschaft(gemeinschaft_id)
 
         gemeinschaft = {
             'id': gemeinschaft_id,
-            'name': row[0],
-            'anfangssaldo': row[1] or 0.0,
-            'anfangssaldo_datum': row[2]
+            'name': row['name'],
+            'anfangssaldo': row['anfangssaldo_bank'] or 0.0,
+            'anfangssaldo_datum': row['anfangssaldo_datum']
         }
 
     return render_template('anfangssaldo_bearbeiten.html', gemeinschaft=gemeinschaft)
+
+
+@admin_finanzen_bp.route('/abrechnungen/<int:gemeinschaft_id>/jahresabschluss', methods=['GET', 'POST'])
+@admin_required
+@gemeinschaft_admin_required()
+def jahresabschluss(gemeinschaft_id):
+    """Jahresabschlüsse anzeigen und ein Geschäftsjahr abschließen"""
+    db_path = get_current_db_path()
+    aktuelles_jahr = datetime.now().year
+
+    if request.method == 'POST':
+        try:
+            jahr = int(request.form.get('jahr', ''))
+        except ValueError:
+            flash('Ungültiges Jahr!', 'warning')
+            return redirect(request.url)
+
+        if jahr >= aktuelles_jahr:
+            flash('Nur vergangene Jahre können abgeschlossen werden.', 'warning')
+            return redirect(request.url)
+
+        # Abschluss und Archivierung im Hintergrund (eine Transaktion)
+        job_id = job_einreihen('jahresabschluss', {
+            'db_path': db_path,
+            'gemeinschaft_id': gemeinschaft_id,
+            'jahr': jahr,
+            'benutzer_id': session['benutzer_id'],
+            'bemerkung': request.form.get('bemerkung') or None
+        }, session['benutzer_id'],
+            zurueck=url_for('admin_finanzen.jahresabschluss', gemeinschaft_id=gemeinschaft_id))
+
+        flash(f'Der Jahresabschluss {jahr} wurde gestartet und läuft im Hintergrund.', 'info')
+        return redirect(url_for('admin_jobs.admin_job', job_id=job_id))
+
+    with MaschinenDBContext(db_path, read_only=True) as db:
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
+        abschluesse = jahresabschluesse_laden(db, gemeinschaft_id)
+        offenes_jahr = aeltestes_offenes_jahr(db, gemeinschaft_id)
+
+    # Vorschlag: ältestes offene Jahr, sonst das Vorjahr
+    vorschlag = offenes_jahr if offenes_jahr and offenes_jahr < aktuelles_jahr else aktuelles_jahr - 1
+    if abschluesse and vorschlag <= abschluesse[0]['jahr']:
+        vorschlag = abschluesse[0]['jahr'] + 1
+
+    return render_template('admin_jahresabschluss.html',
+                         gemeinschaft=gemeinschaft,
+                         abschluesse=abschluesse,
+                         vorschlag=vorschlag,
+                         aktuelles_jahr=aktuelles_jahr)
@@ -4,10 +4,16 @@ Admin - Gemeinschaften-Verwaltung
 """
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from database import MaschinenDBContext
-from utils.decorators import admin_required
+from database import MaschinenDBContext, REFERENZDATEN_VERSION
+from utils.decorators import admin_required, gemeinschaft_admin_required
 from utils.training import get_current_db_path
 from utils.sql_helpers import convert_sql
+from utils.auth_context import invalidate_auth_context
+from utils.posteingang import zugehoerigkeit_geaendert
+from utils.mitgliedschaft import mitgliedschaft_geaendert
+from utils.maschinen_kennzahlen import flotte_laden
+from utils.cache_versionen import version_lesen
+from utils.dokument_cache import dokument_antwort, datenstand
 
 admin_gemeinschaften_bp = Blueprint('admin_gemeinschaften', __name__, url_prefix='/admin')
 
@@ -48,6 +54,8 @@ def admin_gemeinschaften_neu():
                 request.form.get('beschreibung'),
                 bool(request.form.get('aktiv'))
             ))
+            mitgliedschaft_geaendert(db)
+            db.referenzdaten_geaendert()
             db.connection.commit()
         flash('Gemeinschaft erfolgreich angelegt!', 'success')
         return redirect(url_for('admin_gemeinschaften.admin_gemeinschaften'))
@@ -56,6 +64,7 @@ def admin_gemeinschaften_neu():
 
 @admin_gemeinschaften_bp.route('/gemeinschaften/<int:gemeinschaft_id>/edit', methods=['GET', 'POST'])
 @admin_required
+@gemeinschaft_admin_required(redirect_endpoint='admin_gemeinschaften.admin_gemeinschaften')
 def admin_gemeinschaften_edit(gemeinschaft_id):
     """Gemeinschaft bearbeiten"""
     db_path = get_current_db_path()
@@ -95,30 +104,27 @@ def admin_gemeinschaften_edit(gemeinschaft_id):
                 request.form.get('bank_kontoinhaber'),
                 gemeinschaft_id
             ))
+            mitgliedschaft_geaendert(db)
+            db.referenzdaten_geaendert()
             db.connection.commit()
             flash('Gemeinschaft erfolgreich aktualisiert!', 'success')
             return redirect(url_for('admin_gemeinschaften.admin_gemeinschaften'))
 
-        sql = convert_sql("SELECT * FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        columns = [desc[0] for desc in cursor.description]
-        gemeinschaft = dict(zip(columns, cursor.fetchone()))
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
 
     return render_template('admin_gemeinschaften_form.html', gemeinschaft=gemeinschaft)
 
 
 @admin_gemeinschaften_bp.route('/gemeinschaften/<int:gemeinschaft_id>/mitglieder', methods=['GET', 'POST'])
 @admin_required
+@gemeinschaft_admin_required(redirect_endpoint='admin_gemeinschaften.admin_gemeinschaften')
 def admin_gemeinschaften_mitglieder(gemeinschaft_id):
     """Betriebe einer Gemeinschaft verwalten"""
     db_path = get_current_db_path()
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        sql = convert_sql("SELECT * FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        columns = [desc[0] for desc in cursor.description]
-        gemeinschaft = dict(zip(columns, cursor.fetchone()))
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
 
         if request.method == 'POST':
             action = request.form.get('action')
@@ -135,6 +141,8 @@ def admin_gemeinschaften_mitglieder(gemeinschaft_id):
                             ON CONFLICT DO NOTHING
                         """)
                         cursor.execute(sql, (int(betrieb_id), gemeinschaft_id))
+                    zugehoerigkeit_geaendert(db, betrieb_ids=betrieb_ids)
+                    mitgliedschaft_geaendert(db)
                     db.connection.commit()
                     flash(f'{len(betrieb_ids)} Betrieb(e) hinzugefügt!', 'success')
 
@@ -149,9 +157,13 @@ def admin_gemeinschaften_mitglieder(gemeinschaft_id):
                             WHERE betrieb_id = ? AND gemeinschaft_id = ?
                         """)
                         cursor.execute(sql, (int(betrieb_id), gemeinschaft_id))
+                    zugehoerigkeit_geaendert(db, betrieb_ids=entfernen_ids)
+                    mitgliedschaft_geaendert(db)
                     db.connection.commit()
                     flash(f'{len(entfernen_ids)} Betrieb(e) entfernt!', 'success')
 
+            # Verwaltete Betriebe der Gemeinschafts-Admins haben sich geändert
+            invalidate_auth_context()
             return redirect(url_for('admin_gemeinschaften.admin_gemeinschaften_mitglieder',
                                    gemeinschaft_id=gemeinschaft_id))
 
@@ -192,16 +204,14 @@ def admin_gemeinschaften_mitglieder(gemeinschaft_id):
 
 @admin_gemeinschaften_bp.route('/gemeinschaften/<int:gemeinschaft_id>/abrechnung')
 @admin_required
+@gemeinschaft_admin_required(redirect_endpoint='admin_gemeinschaften.admin_gemeinschaften')
 def admin_gemeinschaften_abrechnung(gemeinschaft_id):
     """Abrechnungsübersicht einer Gemeinschaft"""
     db_path = get_current_db_path()
-    with MaschinenDBContext(db_path) as db:
+    with MaschinenDBContext(db_path, read_only=True) as db:
         cursor = db.connection.cursor()
 
-        sql = convert_sql("SELECT * FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        columns = [desc[0] for desc in cursor.description]
-        gemeinschaft = dict(zip(columns, cursor.fetchone()))
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
 
         # Einsätze nach Betrieb (über benutzer_betriebe)
         sql = convert_sql("""
@@ -262,45 +272,64 @@ def admin_gemeinschaften_abrechnung(gemeinschaft_id):
 
 @admin_gemeinschaften_bp.route('/gemeinschaften/<int:gemeinschaft_id>/abrechnung/csv')
 @admin_required
+@gemeinschaft_admin_required(redirect_endpoint='admin_gemeinschaften.admin_gemeinschaften')
 def admin_gemeinschaften_abrechnung_csv(gemeinschaft_id):
     """CSV Export der Gemeinschafts-Abrechnung"""
-    import csv
-    from io import StringIO
     from datetime import datetime
-    from flask import make_response
 
     db_path = get_current_db_path()
 
-    with MaschinenDBContext(db_path) as db:
-        cursor = db.cursor
-
-        sql = convert_sql("SELECT * FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        columns = [desc[0] for desc in cursor.description]
-        gemeinschaft = dict(zip(columns, cursor.fetchone()))
+    with MaschinenDBContext(db_path, read_only=True) as db:
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
 
-        sql = convert_sql("""
-            SELECT
-                b.id, b.name, b.vorname,
-                COUNT(e.id) as anzahl_einsaetze,
-                SUM(e.endstand - e.anfangstand) as betriebsstunden,
-                SUM(
-                    CASE
-                        WHEN m.abrechnungsart = 'stunden' THEN (e.endstand - e.anfangstand) * COALESCE(m.preis_pro_einheit, 0)
-                        ELSE COALESCE(e.flaeche_menge, 0) * COALESCE(m.preis_pro_einheit, 0)
-                    END
-                ) as maschinenkosten
-            FROM benutzer b
+        # Datenstand: Mitglieder und Id-Summen ihrer (unveränderlichen) Einsätze
+        stand = (db_path, version_lesen(db, REFERENZDATEN_VERSION), datenstand(db, """
+            SELECT b.id, b.name, b.vorname FROM benutzer b
             JOIN mitglied_gemeinschaft mg ON b.id = mg.mitglied_id
-            LEFT JOIN maschineneinsaetze e ON b.id = e.benutzer_id
-            LEFT JOIN maschinen m ON e.maschine_id = m.id AND m.gemeinschaft_id = ?
             WHERE mg.gemeinschaft_id = ?
-            GROUP BY b.id, b.name, b.vorname
-            ORDER BY b.name, b.vorname
-        """)
-        cursor.execute(sql, (gemeinschaft_id, gemeinschaft_id))
+            ORDER BY b.id
+        """, (gemeinschaft_id,)), datenstand(db, """
+            SELECT COUNT(e.id), MAX(e.id), SUM(e.id)
+            FROM mitglied_gemeinschaft mg
+            JOIN maschineneinsaetze e ON e.benutzer_id = mg.mitglied_id
+            WHERE mg.gemeinschaft_id = ?
+        """, (gemeinschaft_id,)))
 
-        rows = cursor.fetchall()
+        dateiname = f'Abrechnung_{gemeinschaft["name"]}_{datetime.now().strftime("%Y%m%d")}.csv'
+        return dokument_antwort(stand, lambda: _abrechnung_csv(db, gemeinschaft),
+                                'text/csv; charset=utf-8', dateiname, anhang=True)
+
+
+def _abrechnung_csv(db, gemeinschaft):
+    """Gemeinschafts-Abrechnung als CSV (Summen pro Mitglied)"""
+    import csv
+    from io import StringIO
+    from datetime import datetime
+
+    gemeinschaft_id = gemeinschaft['id']
+    cursor = db.cursor
+    sql = convert_sql("""
+        SELECT
+            b.id, b.name, b.vorname,
+            COUNT(e.id) as anzahl_einsaetze,
+            SUM(e.endstand - e.anfangstand) as betriebsstunden,
+            SUM(
+                CASE
+                    WHEN m.abrechnungsart = 'stunden' THEN (e.endstand - e.anfangstand) * COALESCE(m.preis_pro_einheit, 0)
+                    ELSE COALESCE(e.flaeche_menge, 0) * COALESCE(m.preis_pro_einheit, 0)
+                END
+            ) as maschinenkosten
+        FROM benutzer b
+        JOIN mitglied_gemeinschaft mg ON b.id = mg.mitglied_id
+        LEFT JOIN maschineneinsaetze e ON b.id = e.benutzer_id
+        LEFT JOIN maschinen m ON e.maschine_id = m.id AND m.gemeinschaft_id = ?
+        WHERE mg.gemeinschaft_id = ?
+        GROUP BY b.id, b.name, b.vorname
+        ORDER BY b.name, b.vorname
+    """)
+    cursor.execute(sql, (gemeinschaft_id, gemeinschaft_id))
+
+    rows = cursor.fetchall()
 
     output = StringIO()
     writer = csv.writer(output, delimiter=';')
@@ -327,17 +356,34 @@ def admin_gemeinschaften_abrechnung_csv(gemeinschaft_id):
     writer.writerow([])
     writer.writerow(['GESAMT', '', gesamt_einsaetze, f"{gesamt_stunden:.1f}", f"{gesamt_maschinenkosten:.2f}"])
 
-    output.seek(0)
-    response = make_response(output.getvalue().encode('utf-8-sig'))
-    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-    response.headers['Content-Disposition'] = f'attachment; filename=Abrechnung_{gemeinschaft["name"]}_{datetime.now().strftime("%Y%m%d")}.csv'
-    return response
+    return output.getvalue().encode('utf-8-sig')
 
 
 @admin_gemeinschaften_bp.route('/gemeinschaften/<int:gemeinschaft_id>/maschinenuebersicht/pdf')
 @admin_required
+@gemeinschaft_admin_required(redirect_endpoint='admin_gemeinschaften.admin_gemeinschaften')
 def admin_gemeinschaften_maschinenuebersicht_pdf(gemeinschaft_id):
     """PDF-Übersicht aller Maschinen einer Gemeinschaft"""
+    from datetime import datetime
+
+    db_path = get_current_db_path()
+
+    with MaschinenDBContext(db_path, read_only=True) as db:
+        gemeinschaft = db.get_gemeinschaft(gemeinschaft_id)
+
+        # Lebensdauer-Kennzahlen aus dem Cache (inkl. archivierter Jahre)
+        maschinen = sorted(flotte_laden(db, gemeinschaft_id=gemeinschaft_id),
+                           key=lambda m: m['bezeichnung'] or '')
+
+    # Das PDF hängt nur von den (gecachten) Kennzahlen ab - sie sind der Datenstand
+    stand = (db_path, gemeinschaft['name'], [sorted(m.items()) for m in maschinen])
+    dateiname = f'Maschinenuebersicht_{gemeinschaft["name"]}_{datetime.now().strftime("%Y%m%d")}.pdf'
+    return dokument_antwort(stand, lambda: _maschinenuebersicht_pdf(gemeinschaft, maschinen),
+                            'application/pdf', dateiname)
+
+
+def _maschinenuebersicht_pdf(gemeinschaft, maschinen):
+    """Maschinenübersicht als PDF (reportlab)"""
     from reportlab.lib.pagesizes import A4
     from reportlab.lib.units import cm
     from reportlab.lib import colors
@@ -349,30 +395,6 @@ def admin_gemeinschaften_maschinenuebersicht_pdf(gemeinschaft_id):
     import os
     from datetime import datetime
 
-    db_path = get_current_db_path()
-
-    with MaschinenDBContext(db_path) as db:
-        cursor = db.connection.cursor()
-
-        sql = convert_sql("SELECT * FROM gemeinschaften WHERE id = ?")
-        cursor.execute(sql, (gemeinschaft_id,))
-        columns = [desc[0] for desc in cursor.description]
-        gemeinschaft = dict(zip(columns, cursor.fetchone()))
-
-        sql = convert_sql("""
-            SELECT m.*,
-                (SELECT SUM(e.endstand - e.anfangstand) FROM maschineneinsaetze e WHERE e.maschine_id = m.id) as betriebsstunden,
-                (SELECT SUM(CASE WHEN m.abrechnungsart = 'stunden' THEN (e.endstand - e.anfangstand) * COALESCE(m.preis_pro_einheit, 0)
-                                 ELSE COALESCE(e.flaeche_menge, 0) * COALESCE(m.preis_pro_einheit, 0) END) FROM maschineneinsaetze e WHERE e.maschine_id = m.id) as einnahmen,
-                (SELECT SUM(auf.wartungskosten + auf.reparaturkosten + auf.versicherung + auf.steuern + auf.sonstige_kosten) FROM maschinen_aufwendungen auf WHERE auf.maschine_id = m.id) as aufwendungen
-            FROM maschinen m
-            WHERE m.gemeinschaft_id = ?
-            ORDER BY m.bezeichnung
-        """)
-        cursor.execute(sql, (gemeinschaft_id,))
-        maschinen = cursor.fetchall()
-        maschinen_columns = [desc[0] for desc in cursor.description]
-
     font_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'fonts', 'DejaVuSans.ttf')
     if os.path.exists(font_path):
         pdfmetrics.registerFont(TTFont('DejaVuSans', font_path))
@@ -396,8 +418,7 @@ def admin_gemeinschaften_maschinenuebersicht_pdf(gemeinschaft_id):
         'Bezeichnung', 'Hersteller', 'Modell', 'Baujahr', 'Betriebsstunden',
         'Einnahmen', 'Aufwendungen', 'Abschreibung (Jahr)', 'Deckungsbeitrag'
     ]]
-    for row in maschinen:
-        maschine = dict(zip(maschinen_columns, row))
+    for maschine in maschinen:
         einnahmen = maschine.get('einnahmen') or 0
         aufwendungen = maschine.get('aufwendungen') or 0
         anschaffungspreis = maschine.get('anschaffungspreis') or 0
@@ -433,8 +454,4 @@ def admin_gemeinschaften_maschinenuebersicht_pdf(gemeinschaft_id):
     elements.append(table)
 
     doc.build(elements)
-    buffer.seek(0)
-    return buffer.getvalue(), 200, {
-        'Content-Type': 'application/pdf',
-        'Content-Disposition': f'inline; filename="Maschinenuebersicht_{gemeinschaft["name"]}_{datetime.now().strftime("%Y%m%d")}.pdf"'
-    }
+    return buffer.getvalue()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Admin - Hintergrund-Jobs (Status, Fortschritt, Ergebnisse)
+"""
+
+import os
+from flask import Blueprint, render_template, redirect, url_for, flash, session, jsonify, send_file
+from utils.decorators import admin_required
+from utils.auth_context import get_auth_context
+from utils.jobs import job_laden, jobs_liste, job_verzeichnis
+
+admin_jobs_bp = Blueprint('admin_jobs', __name__, url_prefix='/admin')
+
+
+def _ist_hauptadmin():
+    kontext = get_auth_context()
+    return kontext is not None and kontext['admin_level'] >= 2
+
+
+def _job_pruefen(job_id):
+    """Job laden, wenn der Benutzer ihn sehen darf (eigener Job oder Haupt-Admin)"""
+    job = job_laden(job_id)
+    if job is None:
+        return None
+    if job['erstellt_von'] != session['benutzer_id'] and not _ist_hauptadmin():
+        return None
+    return job
+
+
+def _status_json(job):
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'status_text': job['status_text'],
+        'fortschritt': job['fortschritt'],
+        'meldung': job['meldung'],
+        'download': bool(job['status'] == 'fertig' and job['ergebnis'].get('datei'))
+    }
+
+
+@admin_jobs_bp.route('/jobs')
+@admin_required
+def admin_jobs():
+    """Liste der letzten Hintergrund-Jobs"""
+    if _ist_hauptadmin():
+        jobs = jobs_liste()
+    else:
+        jobs = jobs_liste(benutzer_id=session['benutzer_id'])
+    return render_template('admin_jobs.html', jobs=jobs)
+
+
+@admin_jobs_bp.route('/jobs/<int:job_id>')
+@admin_required
+def admin_job(job_id):
+    """Statusseite eines Jobs (aktualisiert sich selbst)"""
+    job = _job_pruefen(job_id)
+    if job is None:
+        flash('Job nicht gefunden.', 'danger')
+        return redirect(url_for('admin_jobs.admin_jobs'))
+    return render_template('admin_job.html', job=job)
+
+
+@admin_jobs_bp.route('/jobs/<int:job_id>/status')
+@admin_required
+def admin_job_status(job_id):
+    """Status und Fortschritt als JSON (für die Statusseite)"""
+    job = _job_pruefen(job_id)
+    if job is None:
+        return jsonify({'success': False}), 404
+    return jsonify(dict(success=True, **_status_json(job)))
+
+
+@admin_jobs_bp.route('/jobs/<int:job_id>/download')
+@admin_required
+def admin_job_download(job_id):
+    """Ergebnisdatei eines fertigen Jobs herunterladen"""
+    job = _job_pruefen(job_id)
+    if job is None or job['status'] != 'fertig' or not job['ergebnis'].get('datei'):
+        flash('Keine Ergebnisdatei vorhanden.', 'warning')
+        return redirect(url_for('admin_jobs.admin_jobs'))
+
+    ergebnis = job['ergebnis']
+    pfad = os.path.join(job_verzeichnis(job_id), os.path.basename(ergebnis['datei']))
+    if not os.path.exists(pfad):
+        flash('Die Ergebnisdatei ist nicht mehr vorhanden.', 'warning')
+        return redirect(url_for('admin_jobs.admin_job', job_id=job_id))
+
+    return send_file(
+        pfad,
+        mimetype=ergebnis.get('mimetype'),
+        as_attachment=True,
+        download_name=ergebnis.get('download_name') or ergebnis['datei']
+    )
@@ -10,6 +10,13 @@ from database import MaschinenDBContext
 from utils.decorators import admin_required
 from utils.training import get_current_db_path
 from utils.sql_helpers import convert_sql, db_execute
+from utils.mitgliedschaft import mitgliedschaft_geaendert
+from utils.jobs import job_einreihen
+from utils.auslastung import auslastung_laden, STILLSTAND_TAGE
+from utils.maschinen_kennzahlen import (
+    kennzahlen_aktualisieren, kennzahlen_laden, flotte_laden, kennzahlen_jahre
+)
+from utils.dokument_cache import dokument_antwort
 
 admin_maschinen_bp = Blueprint('admin_maschinen', __name__, url_prefix='/admin')
 
@@ -20,7 +27,7 @@ def admin_maschinen():
     """Maschinenverwaltung"""
     db_path = get_current_db_path()
     with MaschinenDBContext(db_path) as db:
-        maschinen = db.get_all_maschinen(nur_aktive=False)
+        maschinen = db.get_all_maschinen(nur_aktive=False, mit_zaehler=True)
     return render_template('admin_maschinen.html', maschinen=maschinen)
 
 
@@ -61,6 +68,10 @@ def admin_maschinen_neu():
             treibstoff_berechnen = True if request.form.get('treibstoff_berechnen') else False
             sql = convert_sql("UPDATE maschinen SET treibstoff_berechnen = ? WHERE id = ?")
             cursor.execute(sql, (treibstoff_berechnen, maschine_id))
+            # Preis/Abrechnungsart können sich geändert haben: alle Jahre neu bewerten
+            kennzahlen_aktualisieren(db, maschine_id)
+            mitgliedschaft_geaendert(db)
+            db.referenzdaten_geaendert()
 
             flash('Maschine erfolgreich angelegt!', 'success')
             return redirect(url_for('admin_maschinen.admin_maschinen'))
@@ -111,6 +122,10 @@ def admin_maschinen_edit(maschine_id):
             treibstoff_berechnen = True if request.form.get('treibstoff_berechnen') else False
             sql = convert_sql("UPDATE maschinen SET treibstoff_berechnen = ? WHERE id = ?")
             cursor.execute(sql, (treibstoff_berechnen, maschine_id))
+            # Preis/Abrechnungsart können sich geändert haben: alle Jahre neu bewerten
+            kennzahlen_aktualisieren(db, maschine_id)
+            mitgliedschaft_geaendert(db)
+            db.referenzdaten_geaendert()
 
             flash('Maschine erfolgreich aktualisiert!', 'success')
             return redirect(url_for('admin_maschinen.admin_maschinen'))
@@ -138,6 +153,7 @@ def admin_maschinen_delete(maschine_id):
     with MaschinenDBContext(db_path) as db:
         maschine = db.get_maschine_by_id(maschine_id)
         db.delete_maschine(maschine_id)
+        mitgliedschaft_geaendert(db)
     flash(f'Maschine {maschine["bezeichnung"]} wurde gelöscht.', 'success')
     return redirect(url_for('admin_maschinen.admin_maschinen'))
 
@@ -148,131 +164,92 @@ def admin_maschinen_rentabilitaet(maschine_id):
     """Rentabilitätsbericht für eine Maschine"""
     db_path = get_current_db_path()
 
-    with MaschinenDBContext(db_path) as db:
+    with MaschinenDBContext(db_path, read_only=True) as db:
         cursor = db.cursor
         maschine = db.get_maschine_by_id(maschine_id)
 
-        sql = convert_sql("""
-            SELECT
-                COUNT(e.id) as anzahl_einsaetze,
-                SUM(e.endstand - e.anfangstand) as betriebsstunden_gesamt,
-                SUM(
-                    CASE
-                        WHEN m.abrechnungsart = 'stunden' THEN (e.endstand - e.anfangstand) * COALESCE(m.preis_pro_einheit, 0)
-                        ELSE COALESCE(e.flaeche_menge, 0) * COALESCE(m.preis_pro_einheit, 0)
-                    END
-                ) as einnahmen_gesamt
-            FROM maschineneinsaetze e
-            JOIN maschinen m ON e.maschine_id = m.id
-            WHERE m.id = ?
-        """)
-        cursor.execute(sql, (maschine_id,))
-        row = cursor.fetchone()
-        anzahl_einsaetze = row[0] or 0
-        betriebsstunden = row[1] or 0
-        einnahmen = row[2] or 0
-
-        anschaffungspreis = maschine.get('anschaffungspreis', 0) or 0
-        abschreibungsdauer = maschine.get('abschreibungsdauer_jahre', 10) or 10
-        anschaffungsdatum = maschine.get('anschaffungsdatum')
-        abschreibung_pro_jahr = anschaffungspreis / abschreibungsdauer if abschreibungsdauer > 0 else 0
-
-        alter_jahre_float = 0
-        alter_jahre = 0
-        alter_error = None
-        if anschaffungsdatum:
-            try:
-                datum = datetime.strptime(str(anschaffungsdatum)[:10], '%Y-%m-%d')
-                tage = (datetime.now() - datum).days
-                alter_jahre_float = tage / 365.25
-                alter_jahre = max(0, int(tage // 365))
-            except Exception as e:
-                alter_error = f"Ungültiges Anschaffungsdatum: {anschaffungsdatum}"
-        else:
-            alter_error = "Kein Anschaffungsdatum hinterlegt"
-
-        abschreibung_bisher = min(abschreibung_pro_jahr * alter_jahre_float, anschaffungspreis)
-        restwert = max(anschaffungspreis - abschreibung_bisher, 0)
-
-        sql = convert_sql("""
-            SELECT jahr, wartungskosten, reparaturkosten, versicherung, steuern, sonstige_kosten
-            FROM maschinen_aufwendungen
-            WHERE maschine_id = ?
-            ORDER BY jahr
-        """)
-        cursor.execute(sql, (maschine_id,))
-        columns = [desc[0] for desc in cursor.description]
-        alle_aufwendungen = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        aufwendungen_gesamt = sum(
-            (a.get('wartungskosten') or 0) + (a.get('reparaturkosten') or 0) +
-            (a.get('versicherung') or 0) + (a.get('steuern') or 0) + (a.get('sonstige_kosten') or 0)
-            for a in alle_aufwendungen
-        )
+        # Kennzahlen pro Jahr aus dem Cache (inkl. archivierter Jahre)
+        kennzahlen = kennzahlen_laden(db, maschine_id)
 
         sql = convert_sql("""
             SELECT datum, betrag, beschreibung, typ FROM buchungen
             WHERE referenz_typ = 'maschine' AND referenz_id = ?
+            UNION ALL
+            SELECT datum, betrag, beschreibung, kategorie FROM gemeinschafts_kosten
+            WHERE maschine_id = ?
             ORDER BY datum
         """)
-        cursor.execute(sql, (maschine_id,))
+        cursor.execute(sql, (maschine_id, maschine_id))
         bankbuchungen = [dict(zip([desc[0] for desc in cursor.description], row)) for row in cursor.fetchall()]
-        bankkosten_gesamt = sum(b['betrag'] for b in bankbuchungen)
-
-        db_execute(cursor, """
-            SELECT
-                strftime('%Y', e.datum) as jahr,
-                COUNT(e.id) as anzahl,
-                SUM(e.endstand - e.anfangstand) as stunden,
-                SUM(
-                    CASE
-                        WHEN m.abrechnungsart = 'stunden' THEN (e.endstand - e.anfangstand) * COALESCE(m.preis_pro_einheit, 0)
-                        ELSE COALESCE(e.flaeche_menge, 0) * COALESCE(m.preis_pro_einheit, 0)
-                    END
-                ) as einnahmen
-            FROM maschineneinsaetze e
-            JOIN maschinen m ON e.maschine_id = m.id
-            WHERE m.id = ?
-            GROUP BY jahr
-            ORDER BY jahr DESC
-        """, (maschine_id,))
-        columns = [desc[0] for desc in cursor.description]
-        einsaetze_pro_jahr = [dict(zip(columns, row)) for row in cursor.fetchall()]
-
-        aufwendungen_dict = {str(a['jahr']): a for a in alle_aufwendungen}
-        for einsatz in einsaetze_pro_jahr:
-            jahr = einsatz['jahr']
-            if jahr in aufwendungen_dict:
-                a = aufwendungen_dict[jahr]
-                einsatz['aufwendungen'] = (
-                    (a.get('wartungskosten') or 0) + (a.get('reparaturkosten') or 0) +
-                    (a.get('versicherung') or 0) + (a.get('steuern') or 0) + (a.get('sonstige_kosten') or 0)
-                )
-            else:
-                einsatz['aufwendungen'] = 0
-            einsatz['gewinn'] = (einsatz['einnahmen'] or 0) - einsatz['aufwendungen']
-
-        gesamtkosten = aufwendungen_gesamt + bankkosten_gesamt
-        deckungsbeitrag = einnahmen - abschreibung_pro_jahr - gesamtkosten
-        rentabilitaet_prozent = (deckungsbeitrag / anschaffungspreis * 100) if anschaffungspreis > 0 else 0
-
-        rentabilitaet = {
-            'anzahl_einsaetze': anzahl_einsaetze,
-            'betriebsstunden': betriebsstunden,
-            'einnahmen_gesamt': einnahmen,
-            'aufwendungen_gesamt': aufwendungen_gesamt,
-            'bankkosten_gesamt': bankkosten_gesamt,
-            'gesamtkosten': gesamtkosten,
-            'anschaffungspreis': anschaffungspreis,
-            'abschreibungsdauer': abschreibungsdauer,
-            'abschreibung_pro_jahr': abschreibung_pro_jahr,
-            'alter_jahre': alter_jahre,
-            'alter_jahre_float': alter_jahre_float,
-            'alter_error': alter_error,
-            'abschreibung_bisher': abschreibung_bisher,
-            'restwert': restwert,
-            'deckungsbeitrag': deckungsbeitrag,
-            'rentabilitaet_prozent': rentabilitaet_prozent
-        }
+
+    # Alter und Abschreibung hängen vom heutigen Datum ab
+    stand = (db_path, datetime.now().date(), sorted(maschine.items()),
+             [sorted(k.items()) for k in kennzahlen], [sorted(b.items()) for b in bankbuchungen])
+    return dokument_antwort(stand, lambda: _rentabilitaet_seite(maschine, kennzahlen, bankbuchungen),
+                            'text/html; charset=utf-8', seite=True)
+
+
+def _rentabilitaet_seite(maschine, kennzahlen, bankbuchungen):
+    """Rentabilitätsbericht berechnen und rendern"""
+    anzahl_einsaetze = sum(k['anzahl_einsaetze'] or 0 for k in kennzahlen)
+    betriebsstunden = sum(k['betriebsstunden'] or 0 for k in kennzahlen)
+    einnahmen = sum(k['einnahmen'] or 0 for k in kennzahlen)
+    aufwendungen_gesamt = sum(k['aufwendungen'] or 0 for k in kennzahlen)
+    bankkosten_gesamt = sum(k['bankkosten'] or 0 for k in kennzahlen)
+
+    anschaffungspreis = maschine.get('anschaffungspreis', 0) or 0
+    abschreibungsdauer = maschine.get('abschreibungsdauer_jahre', 10) or 10
+    anschaffungsdatum = maschine.get('anschaffungsdatum')
+    abschreibung_pro_jahr = anschaffungspreis / abschreibungsdauer if abschreibungsdauer > 0 else 0
+
+    alter_jahre_float = 0
+    alter_jahre = 0
+    alter_error = None
+    if anschaffungsdatum:
+        try:
+            datum = datetime.strptime(str(anschaffungsdatum)[:10], '%Y-%m-%d')
+            tage = (datetime.now() - datum).days
+            alter_jahre_float = tage / 365.25
+            alter_jahre = max(0, int(tage // 365))
+        except Exception as e:
+            alter_error = f"Ungültiges Anschaffungsdatum: {anschaffungsdatum}"
+    else:
+        alter_error = "Kein Anschaffungsdatum hinterlegt"
+
+    abschreibung_bisher = min(abschreibung_pro_jahr * alter_jahre_float, anschaffungspreis)
+    restwert = max(anschaffungspreis - abschreibung_bisher, 0)
+
+    einsaetze_pro_jahr = [{
+        'jahr': k['jahr'],
+        'anzahl': k['anzahl_einsaetze'],
+        'stunden': k['betriebsstunden'],
+        'einnahmen': k['einnahmen'],
+        'aufwendungen': k['aufwendungen'],
+        'gewinn': (k['einnahmen'] or 0) - (k['aufwendungen'] or 0),
+    } for k in kennzahlen if k['anzahl_einsaetze']]
+
+    gesamtkosten = aufwendungen_gesamt + bankkosten_gesamt
+    deckungsbeitrag = einnahmen - abschreibung_pro_jahr - gesamtkosten
+    rentabilitaet_prozent = (deckungsbeitrag / anschaffungspreis * 100) if anschaffungspreis > 0 else 0
+
+    rentabilitaet = {
+        'anzahl_einsaetze': anzahl_einsaetze,
+        'betriebsstunden': betriebsstunden,
+        'einnahmen_gesamt': einnahmen,
+        'aufwendungen_gesamt': aufwendungen_gesamt,
+        'bankkosten_gesamt': bankkosten_gesamt,
+        'gesamtkosten': gesamtkosten,
+        'anschaffungspreis': anschaffungspreis,
+        'abschreibungsdauer': abschreibungsdauer,
+        'abschreibung_pro_jahr': abschreibung_pro_jahr,
+        'alter_jahre': alter_jahre,
+        'alter_jahre_float': alter_jahre_float,
+        'alter_error': alter_error,
+        'abschreibung_bisher': abschreibung_bisher,
+        'restwert': restwert,
+        'deckungsbeitrag': deckungsbeitrag,
+        'rentabilitaet_prozent': rentabilitaet_prozent
+    }
 
     return render_template('admin_maschinen_rentabilitaet.html',
                          maschine=maschine,
@@ -281,6 +258,78 @@ def admin_maschinen_rentabilitaet(maschine_id):
                          bankbuchungen=bankbuchungen)
 
 
+@admin_maschinen_bp.route('/maschinen/vergleich')
+@admin_required
+def admin_maschinen_vergleich():
+    """Rentabilität aller Maschinen im Vergleich (Lebensdauer oder ein Jahr)"""
+    db_path = get_current_db_path()
+    jahr = request.args.get('jahr', type=int)
+    gemeinschaft_id = request.args.get('gemeinschaft_id', type=int)
+
+    with MaschinenDBContext(db_path, read_only=True) as db:
+        maschinen = flotte_laden(db, gemeinschaft_id=gemeinschaft_id, jahr=jahr)
+        jahre = kennzahlen_jahre(db)
+
+        cursor = db.connection.cursor()
+        cursor.execute(convert_sql("SELECT id, name FROM gemeinschaften WHERE aktiv = true ORDER BY name"))
+        gemeinschaften = [{'id': row[0], 'name': row[1]} for row in cursor.fetchall()]
+
+    summe = {
+        schluessel: sum(m[schluessel] for m in maschinen)
+        for schluessel in ('anzahl_einsaetze', 'betriebsstunden', 'einnahmen',
+                           'gesamtkosten', 'abschreibung_pro_jahr', 'deckungsbeitrag')
+    }
+
+    return render_template('admin_maschinen_vergleich.html',
+                         maschinen=maschinen,
+                         summe=summe,
+                         jahre=jahre,
+                         jahr=jahr,
+                         gemeinschaften=gemeinschaften,
+                         gemeinschaft_id=gemeinschaft_id)
+
+
+@admin_maschinen_bp.route('/maschinen/vergleich/neu-berechnen', methods=['POST'])
+@admin_required
+def admin_maschinen_kennzahlen_neu():
+    """Kennzahlen-Cache im Hintergrund vollständig neu aufbauen"""
+    job_id = job_einreihen('kennzahlen_neu', {'db_path': get_current_db_path()},
+                           session['benutzer_id'],
+                           zurueck=url_for('admin_maschinen.admin_maschinen_vergleich'))
+    flash('Kennzahlen werden im Hintergrund neu berechnet.', 'info')
+    return redirect(url_for('admin_jobs.admin_job', job_id=job_id))
+
+
+@admin_maschinen_bp.route('/maschinen/auslastung')
+@admin_required
+def admin_maschinen_auslastung():
+    """Auslastung, Stillstände, Spitzentage und Reservierungsquote einer Gemeinschaft"""
+    db_path = get_current_db_path()
+    aktuelles_jahr = datetime.now().year
+    jahr = request.args.get('jahr', aktuelles_jahr, type=int)
+    gemeinschaft_id = request.args.get('gemeinschaft_id', type=int)
+
+    with MaschinenDBContext(db_path, read_only=True) as db:
+        cursor = db.connection.cursor()
+        cursor.execute(convert_sql("SELECT id, name FROM gemeinschaften WHERE aktiv = true ORDER BY name"))
+        gemeinschaften = [{'id': row[0], 'name': row[1]} for row in cursor.fetchall()]
+        if not gemeinschaften:
+            flash('Keine aktive Gemeinschaft vorhanden.', 'warning')
+            return redirect(url_for('admin_maschinen.admin_maschinen'))
+        if gemeinschaft_id not in {g['id'] for g in gemeinschaften}:
+            gemeinschaft_id = gemeinschaften[0]['id']
+
+        auslastung = auslastung_laden(db, gemeinschaft_id, jahr, neu=bool(request.args.get('neu')))
+
+    return render_template('admin_maschinen_auslastung.html',
+                         auslastung=auslastung,
+                         gemeinschaften=gemeinschaften,
+                         gemeinschaft_id=gemeinschaft_id,
+                         jahr=auslastung['von'].year,
+                         jahre=range(aktuelles_jahr, aktuelles_jahr - 10, -1),
+                         stillstand_tage=STILLSTAND_TAGE)
+
+
 @admin_maschinen_bp.route('/maschinen/<int:maschine_id>/aufwendungen', methods=['GET', 'POST'])
 @admin_required
 def admin_maschinen_aufwendungen(maschine_id):
@@ -316,6 +365,7 @@ def admin_maschinen_aufwendungen(maschine_id):
             """)
             cursor.execute(sql, (maschine_id, jahr, wartungskosten, reparaturkosten,
                                 versicherung, steuern, sonstige_kosten, bemerkung))
+            kennzahlen_aktualisieren(db, maschine_id, jahr)
 
             db.connection.commit()
             flash(f'Aufwendungen für {jahr} gespeichert.', 'success')
@@ -9,10 +9,21 @@ from database import MaschinenDBContext
 from utils.decorators import admin_required, hauptadmin_required
 from utils.training import get_current_db_path
 from utils.sql_helpers import convert_sql, db_execute
+from utils.auth_context import invalidate_auth_context
+from utils.jobs import job_einreihen, upload_ablegen
+from utils.einsatz_storno import WIDERRUF_STUNDEN, einsaetze_stornieren, widerrufbare_vorgaenge
 
 admin_system_bp = Blueprint('admin_system', __name__, url_prefix='/admin')
 
 
+def _job_starten(typ, parameter, zurueck=None):
+    """Hintergrund-Job einreihen und zur Statusseite weiterleiten"""
+    job_id = job_einreihen(typ, parameter, session['benutzer_id'],
+                           zurueck=zurueck or url_for('admin_system.admin_dashboard'))
+    flash('Der Vorgang wurde gestartet und läuft im Hintergrund.', 'info')
+    return redirect(url_for('admin_jobs.admin_job', job_id=job_id))
+
+
 @admin_system_bp.route('')
 @admin_required
 def admin_dashboard():
@@ -141,7 +152,10 @@ def admin_stornierte_einsaetze():
             SELECT s.*, m.bezeichnung as maschine_name,
                    b.name as benutzer_name, b.vorname as benutzer_vorname,
                    sv.name as storniert_von_name, sv.vorname as storniert_von_vorname,
-                   ez.bezeichnung as einsatzzweck_name
+                   ez.bezeichnung as einsatzzweck_name,
+                   s.endstand - s.anfangstand as stunden,
+                   s.kosten_berechnet as maschinenkosten,
+                   COALESCE(s.treibstoffkosten, 0) + COALESCE(s.kosten_berechnet, 0) as gesamtkosten
             FROM maschineneinsaetze_storniert s
             JOIN maschinen m ON s.maschine_id = m.id
             JOIN benutzer b ON s.benutzer_id = b.id
@@ -154,8 +168,11 @@ def admin_stornierte_einsaetze():
         columns = [desc[0] for desc in cursor.description]
         stornierte_einsaetze = [dict(zip(columns, row)) for row in cursor.fetchall()]
 
+        widerrufbar = widerrufbare_vorgaenge(db)
+
     return render_template('admin_stornierte_einsaetze.html',
-                         stornierte_einsaetze=stornierte_einsaetze)
+                         stornierte_einsaetze=stornierte_einsaetze,
+                         widerrufbar=widerrufbar)
 
 
 @admin_system_bp.route('/backup-bestaetigen', methods=['POST'])
@@ -299,6 +316,7 @@ def admin_rollen_set_level():
         cursor.execute(sql, (admin_level, is_admin, benutzer_id))
         db.connection.commit()
 
+    invalidate_auth_context(benutzer_id)
     flash('Admin-Level wurde aktualisiert.', 'success')
     return redirect(url_for('admin_system.admin_rollen'))
 
@@ -360,6 +378,8 @@ def admin_rollen_add_gemeinschaft():
             count = cursor.fetchone()[0]
             print(f"[DEBUG] Nach INSERT: {count} Einträge gefunden")
 
+            invalidate_auth_context(benutzer_id)
+
             if count > 0:
                 flash(f'Gemeinschafts-Admin-Rechte hinzugefügt! (Benutzer {benutzer_id} -> Gemeinschaft {gemeinschaft_id})', 'success')
             else:
@@ -386,6 +406,8 @@ def admin_rollen_remove_gemeinschaft():
         db.remove_gemeinschafts_admin(benutzer_id, gemeinschaft_id)
         flash('Gemeinschafts-Admin-Rechte entfernt!', 'success')
 
+    invalidate_auth_context(benutzer_id)
+
     return redirect(url_for('admin_system.admin_rollen'))
 
 
@@ -419,6 +441,8 @@ def admin_rollen_set_rolle():
         cursor.execute(sql, (rolle, benutzer_id))
         db.connection.commit()
 
+    invalidate_auth_context(benutzer_id)
+
     rollen_namen = {
         'obmann': 'Obmann',
         'kassier': 'Kassier',
@@ -434,162 +458,22 @@ def admin_rollen_set_rolle():
 @admin_system_bp.route('/export/json')
 @admin_required
 def admin_export_json():
-    """Alle Daten als JSON exportieren"""
-    import json
-    from io import BytesIO
-    from flask import send_file
-
-    db_path = get_current_db_path()
-
-    with MaschinenDBContext(db_path) as db:
-        data = {
-            'export_datum': datetime.now().isoformat(),
-            'benutzer': db.get_all_benutzer(nur_aktive=False),
-            'maschinen': db.get_all_maschinen(nur_aktive=False),
-            'einsatzzwecke': db.get_all_einsatzzwecke(nur_aktive=False),
-            'einsaetze': db.get_all_einsaetze()
-        }
-
-    json_str = json.dumps(data, indent=2, ensure_ascii=False, default=str)
-    json_bytes = BytesIO(json_str.encode('utf-8'))
-    json_bytes.seek(0)
-
-    filename = f'maschinengemeinschaft_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-    return send_file(
-        json_bytes,
-        mimetype='application/json',
-        as_attachment=True,
-        download_name=filename
-    )
+    """Alle Daten als JSON exportieren (Hintergrund-Job)"""
+    return _job_starten('export_json', {'db_path': get_current_db_path()})
 
 
 @admin_system_bp.route('/export/csv')
 @admin_required
 def admin_export_csv():
-    """Alle Daten als CSV-ZIP exportieren"""
-    import csv
-    import zipfile
-    from io import BytesIO, StringIO
-    from flask import send_file
-
-    db_path = get_current_db_path()
-
-    with MaschinenDBContext(db_path) as db:
-        benutzer = db.get_all_benutzer(nur_aktive=False)
-        maschinen = db.get_all_maschinen(nur_aktive=False)
-        einsatzzwecke = db.get_all_einsatzzwecke(nur_aktive=False)
-        einsaetze = db.get_all_einsaetze()
-
-    zip_buffer = BytesIO()
-
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        if benutzer:
-            csv_buffer = StringIO()
-            writer = csv.DictWriter(csv_buffer, fieldnames=benutzer[0].keys())
-            writer.writeheader()
-            writer.writerows(benutzer)
-            zip_file.writestr('benutzer.csv', csv_buffer.getvalue())
-
-        if maschinen:
-            csv_buffer = StringIO()
-            writer = csv.DictWriter(csv_buffer, fieldnames=maschinen[0].keys())
-            writer.writeheader()
-            writer.writerows(maschinen)
-            zip_file.writestr('maschinen.csv', csv_buffer.getvalue())
-
-        if einsatzzwecke:
-            csv_buffer = StringIO()
-            writer = csv.DictWriter(csv_buffer, fieldnames=einsatzzwecke[0].keys())
-            writer.writeheader()
-            writer.writerows(einsatzzwecke)
-            zip_file.writestr('einsatzzwecke.csv', csv_buffer.getvalue())
-
-        if einsaetze:
-            csv_buffer = StringIO()
-            writer = csv.DictWriter(csv_buffer, fieldnames=einsaetze[0].keys())
-            writer.writeheader()
-            writer.writerows(einsaetze)
-            zip_file.writestr('einsaetze.csv', csv_buffer.getvalue())
-
-    zip_buffer.seek(0)
-    filename = f'maschinengemeinschaft_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip'
-
-    return send_file(
-        zip_buffer,
-        mimetype='application/zip',
-        as_attachment=True,
-        download_name=filename
-    )
+    """Alle Daten als CSV-ZIP exportieren (Hintergrund-Job)"""
+    return _job_starten('export_csv', {'db_path': get_current_db_path()})
 
 
 @admin_system_bp.route('/export/alle-einsaetze-csv')
 @admin_required
 def admin_export_alle_einsaetze_csv():
-    """Exportiert alle Einsätze als CSV für Jahresabschluss"""
-    import csv
-    from io import StringIO
-    from flask import make_response
-
-    db_path = get_current_db_path()
-
-    try:
-        with MaschinenDBContext(db_path) as db:
-            cursor = db.cursor
-            sql = convert_sql("""
-                SELECT
-                    m.datum,
-                    b.name as benutzer,
-                    ma.bezeichnung as maschine,
-                    ez.bezeichnung as einsatzzweck,
-                    ma.abrechnungsart,
-                    ma.preis_pro_einheit,
-                    m.flaeche_menge,
-                    m.treibstoffverbrauch as treibstoff_liter,
-                    m.treibstoffkosten as treibstoff_preis,
-                    m.treibstoffkosten,
-                    m.kosten_berechnet as maschinenkosten,
-                    (COALESCE(m.treibstoffkosten, 0) + COALESCE(m.kosten_berechnet, 0)) as gesamtkosten,
-                    m.anfangstand,
-                    m.endstand,
-                    m.anmerkungen as bemerkung
-                FROM maschineneinsaetze m
-                JOIN benutzer b ON m.benutzer_id = b.id
-                JOIN maschinen ma ON m.maschine_id = ma.id
-                LEFT JOIN einsatzzwecke ez ON m.einsatzzweck_id = ez.id
-                ORDER BY m.datum DESC, m.id DESC
-            """)
-            cursor.execute(sql)
-
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-
-        output = StringIO()
-        writer = csv.writer(output, delimiter=';')
-
-        writer.writerow(columns)
-
-        for row in rows:
-            writer.writerow(row)
-
-        writer.writerow([])
-        writer.writerow(['GESAMT', '', '', '', '', '', '', '', '',
-                        sum(r[9] or 0 for r in rows),
-                        sum(r[10] or 0 for r in rows),
-                        sum(r[11] or 0 for r in rows),
-                        '', '', ''])
-
-        output.seek(0)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-        response = make_response(output.getvalue().encode('utf-8-sig'))
-        response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-        response.headers['Content-Disposition'] = f'attachment; filename=alle_einsaetze_{timestamp}.csv'
-
-        return response
-
-    except Exception as e:
-        flash(f'Fehler beim Exportieren: {str(e)}', 'danger')
-        return redirect(url_for('admin_system.admin_dashboard'))
+    """Exportiert alle Einsätze als CSV für Jahresabschluss (Hintergrund-Job)"""
+    return _job_starten('export_alle_einsaetze_csv', {'db_path': get_current_db_path()})
 
 
 @admin_system_bp.route('/backup/database')
@@ -617,58 +501,8 @@ def admin_backup_database():
 @admin_system_bp.route('/backup')
 @admin_required
 def admin_database_backup():
-    """Erstellt ein Backup der Datenbank als Download"""
-    import os
-    import shutil
-    import tempfile
-    import subprocess
-    from flask import send_file
-    from database import USING_POSTGRESQL
-
-    db_path = get_current_db_path()
-
-    try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-        if USING_POSTGRESQL:
-            from database import PG_HOST, PG_PORT, PG_DATABASE, PG_USER, PG_PASSWORD
-
-            backup_filename = f"maschinengemeinschaft_backup_{timestamp}.sql"
-            temp_dir = tempfile.gettempdir()
-            temp_backup_path = os.path.join(temp_dir, backup_filename)
-
-            env = os.environ.copy()
-            env['PGPASSWORD'] = PG_PASSWORD
-
-            result = subprocess.run([
-                '/usr/bin/pg_dump',
-                '-h', PG_HOST,
-                '-p', str(PG_PORT),
-                '-U', PG_USER,
-                '-d', PG_DATABASE,
-                '-f', temp_backup_path
-            ], env=env, capture_output=True, text=True)
-
-            if result.returncode != 0:
-                raise Exception(f"pg_dump Fehler: {result.stderr}")
-
-            mimetype = 'application/sql'
-        else:
-            backup_filename = f"maschinengemeinschaft_backup_{timestamp}.db"
-            temp_dir = tempfile.gettempdir()
-            temp_backup_path = os.path.join(temp_dir, backup_filename)
-            shutil.copy2(db_path, temp_backup_path)
-            mimetype = 'application/x-sqlite3'
-
-        return send_file(
-            temp_backup_path,
-            as_attachment=True,
-            download_name=backup_filename,
-            mimetype=mimetype
-        )
-    except Exception as e:
-        flash(f'Fehler beim Erstellen des Backups: {str(e)}', 'danger')
-        return redirect(url_for('admin_system.admin_dashboard'))
+    """Erstellt ein Backup der Datenbank (Hintergrund-Job, danach Download)"""
+    return _job_starten('datenbank_backup', {'db_path': get_current_db_path()})
 
 
 @admin_system_bp.route('/restore', methods=['GET', 'POST'])
@@ -678,7 +512,6 @@ def admin_database_restore():
     import os
     import shutil
     import tempfile
-    import subprocess
     from database import USING_POSTGRESQL
 
     db_path = get_current_db_path()
@@ -699,54 +532,9 @@ def admin_database_restore():
                 flash('Ungültiges Dateiformat! Nur .sql Dateien sind erlaubt.', 'danger')
                 return redirect(url_for('admin_system.admin_database_restore'))
 
-            try:
-                from database import PG_HOST, PG_PORT, PG_DATABASE, PG_USER, PG_PASSWORD
-
-                temp_dir = tempfile.gettempdir()
-                temp_upload_path = os.path.join(temp_dir, 'temp_restore.sql')
-                backup_file.save(temp_upload_path)
-
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                backup_current = os.path.join(temp_dir, f"backup_before_restore_{timestamp}.sql")
-
-                env = os.environ.copy()
-                env['PGPASSWORD'] = PG_PASSWORD
-
-                subprocess.run([
-                    '/usr/bin/pg_dump', '-h', PG_HOST, '-p', str(PG_PORT),
-                    '-U', PG_USER, '-d', PG_DATABASE, '-f', backup_current
-                ], env=env, check=True)
-
-                result = subprocess.run([
-                    '/usr/bin/psql', '-h', PG_HOST, '-p', str(PG_PORT),
-                    '-U', PG_USER, '-d', PG_DATABASE, '-f', temp_upload_path
-                ], env=env, capture_output=True, text=True)
-
-                os.remove(temp_upload_path)
-
-                if result.returncode != 0:
-                    raise Exception(f"psql Fehler: {result.stderr}")
-
-                # Schema-Migration nach Restore durchführen
-                from utils.schema_migration import run_migrations_with_report
-                migration_report = run_migrations_with_report()
-
-                flash(f'Datenbank erfolgreich wiederhergestellt! Backup erstellt: {os.path.basename(backup_current)}', 'success')
-
-                if migration_report['tables_added']:
-                    flash(f"Fehlende Tabellen hinzugefügt: {', '.join(migration_report['tables_added'])}", 'info')
-                if migration_report['columns_added']:
-                    flash(f"Fehlende Spalten hinzugefügt: {', '.join(migration_report['columns_added'])}", 'info')
-                if migration_report['errors']:
-                    flash(f"Migration-Fehler: {', '.join(migration_report['errors'])}", 'warning')
-
-                flash('WICHTIG: Bitte starten Sie die Anwendung neu!', 'warning')
-
-                return redirect(url_for('admin_system.admin_dashboard'))
-
-            except Exception as e:
-                flash(f'Fehler bei der Wiederherstellung: {str(e)}', 'danger')
-                return redirect(url_for('admin_system.admin_database_restore'))
+            # pg_dump und psql laufen als Hintergrund-Job, nicht im Request
+            upload_pfad = upload_ablegen(backup_file, '.sql')
+            return _job_starten('datenbank_restore', {'upload_pfad': upload_pfad})
         else:
             if not backup_file.filename.endswith('.db'):
                 flash('Ungültiges Dateiformat! Nur .db Dateien sind erlaubt.', 'danger')
@@ -807,44 +595,40 @@ def admin_database_restore():
 @admin_system_bp.route('/einsaetze/loeschen', methods=['GET', 'POST'])
 @admin_required
 def admin_einsaetze_loeschen():
-    """Einsätze nach Zeitraum löschen"""
+    """Einsätze nach Zeitraum stornieren (ein Storno-Vorgang, widerrufbar)"""
     db_path = get_current_db_path()
 
     if request.method == 'POST':
         von_datum = request.form.get('von_datum')
         bis_datum = request.form.get('bis_datum')
+        maschine_id = request.form.get('maschine_id', type=int)
+        grund = request.form.get('grund') or f'Sammel-Storno {von_datum} bis {bis_datum}'
         bestaetigung = request.form.get('bestaetigung')
 
         if bestaetigung != 'LOESCHEN':
             flash('Bestätigung nicht korrekt. Bitte "LOESCHEN" eingeben.', 'danger')
             return redirect(url_for('admin_system.admin_einsaetze_loeschen'))
 
+        if not von_datum or not bis_datum:
+            flash('Bitte Zeitraum angeben.', 'danger')
+            return redirect(url_for('admin_system.admin_einsaetze_loeschen'))
+
         try:
             with MaschinenDBContext(db_path) as db:
-                cursor = db.cursor
-                sql = convert_sql("""
-                    SELECT COUNT(*) FROM maschineneinsaetze
-                    WHERE datum BETWEEN ? AND ?
-                """)
-                cursor.execute(sql, (von_datum, bis_datum))
-                anzahl = cursor.fetchone()[0]
+                ergebnis = einsaetze_stornieren(db, session['benutzer_id'], grund,
+                                                von=von_datum, bis=bis_datum, maschine_id=maschine_id)
 
-                if anzahl == 0:
-                    flash('Keine Einsätze im angegebenen Zeitraum gefunden.', 'warning')
-                    return redirect(url_for('admin_system.admin_einsaetze_loeschen'))
-
-                sql = convert_sql("""
-                    DELETE FROM maschineneinsaetze
-                    WHERE datum BETWEEN ? AND ?
-                """)
-                cursor.execute(sql, (von_datum, bis_datum))
-                db.connection.commit()
+            if not ergebnis['anzahl']:
+                flash('Keine Einsätze im angegebenen Zeitraum gefunden.', 'warning')
+                return redirect(url_for('admin_system.admin_einsaetze_loeschen'))
 
-                flash(f'{anzahl} Einsätze erfolgreich gelöscht!', 'success')
-                return redirect(url_for('admin_system.admin_dashboard'))
+            flash(f"{ergebnis['anzahl']} Einsätze storniert ({ergebnis['abrechnungen']} offene "
+                  f"Abrechnungen angepasst). Rückgängig machen ist bis "
+                  f"{ergebnis['widerruf_bis'].strftime('%d.%m.%Y %H:%M')} möglich.", 'success')
+            return redirect(url_for('admin_system.admin_stornierte_einsaetze'))
 
         except Exception as e:
-            flash(f'Fehler beim Löschen: {str(e)}', 'danger')
+            flash(f'Fehler beim Stornieren: {str(e)}', 'danger')
             return redirect(url_for('admin_system.admin_einsaetze_loeschen'))
 
     with MaschinenDBContext(db_path) as db:
@@ -855,8 +639,10 @@ def admin_einsaetze_loeschen():
         """)
         cursor.execute(sql)
         zeitraum = cursor.fetchone()
+        maschinen = db.get_all_maschinen()
 
-    return render_template('admin_einsaetze_loeschen.html', zeitraum=zeitraum)
+    return render_template('admin_einsaetze_loeschen.html', zeitraum=zeitraum, maschinen=maschinen,
+                         widerruf_stunden=WIDERRUF_STUNDEN)
 
 
 @admin_system_bp.route('/training-rechte')
@@ -913,6 +699,7 @@ def admin_training_rechte_update():
         cursor.execute(sql, (True if nur_training else False, benutzer_id))
 
         db.connection.commit()
+        invalidate_auth_context(benutzer_id)
 
         sql = convert_sql("SELECT name, vorname FROM benutzer WHERE id = ?")
         cursor.execute(sql, (benutzer_id,))
@@ -970,28 +757,29 @@ def admin_training_datenbanken():
 @admin_system_bp.route('/training-datenbanken/neu-erstellen', methods=['POST'])
 @hauptadmin_required
 def admin_training_db_erstellen():
-    """Erstellt Trainingsdatenbanken neu"""
-    import os
-    import subprocess
+    """Erstellt Trainingsdatenbanken neu (Hintergrund-Job)"""
+    return _job_starten('training_db_erstellen', {},
+                        zurueck=url_for('admin_system.admin_training_datenbanken'))
 
-    script_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'create_training_databases.py')
 
-    if os.path.exists(script_path):
-        try:
-            result = subprocess.run(
-                ['python', script_path],
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
-            if result.returncode == 0:
-                flash('Trainingsdatenbanken wurden neu erstellt!', 'success')
-            else:
-                flash(f'Fehler: {result.stderr}', 'danger')
-        except Exception as e:
-            flash(f'Fehler beim Erstellen: {str(e)}', 'danger')
-    else:
-        flash('Script nicht gefunden!', 'danger')
+@admin_system_bp.route('/training-datenbanken/<db_key>/zuruecksetzen', methods=['POST'])
+@hauptadmin_required
+def admin_training_db_zuruecksetzen(db_key):
+    """Eine Übungsdatenbank aus ihrer Vorlage zurücksetzen (Dateikopie)"""
+    import time
+    from utils.training import TRAINING_DATABASES, training_db_zuruecksetzen
+
+    if db_key not in TRAINING_DATABASES:
+        flash('Unbekannte Übungsdatenbank!', 'danger')
+        return redirect(url_for('admin_system.admin_training_datenbanken'))
+
+    try:
+        start = time.perf_counter()
+        training_db_zuruecksetzen(db_key)
+        dauer_ms = (time.perf_counter() - start) * 1000
+        flash(f"{TRAINING_DATABASES[db_key]['name']} wurde zurückgesetzt ({dauer_ms:.0f} ms).", 'success')
+    except Exception as e:
+        flash(f'Fehler beim Zurücksetzen: {str(e)}', 'danger')
 
     return redirect(url_for('admin_system.admin_training_datenbanken'))
 
@@ -1049,8 +837,10 @@ def admin_training_als_benutzer(user_id):
             session['original_is_admin'] = session['is_admin']
             session['original_admin_level'] = session['admin_level']
             session['original_gemeinschafts_admin_ids'] = session.get('gemeinschafts_admin_ids', [])
+            session['original_auth_datenbank'] = session.get('auth_datenbank', 'produktion')
 
-        # Session mit neuen Benutzer-Daten aktualisieren
+        # Session mit neuen Benutzer-Daten aktualisieren (Rechte aus der Übungsdatenbank)
+        session['auth_datenbank'] = session['current_database']
         session['benutzer_id'] = benutzer['id']
         session['benutzer_name'] = f"{benutzer['name']}, {benutzer['vorname']}"
         session['is_admin'] = bool(benutzer.get('is_admin', False))
@@ -1095,6 +885,7 @@ def admin_training_zurueck():
         session['is_admin'] = session['original_is_admin']
         session['admin_level'] = session['original_admin_level']
         session['gemeinschafts_admin_ids'] = session.get('original_gemeinschafts_admin_ids', [])
+        session['auth_datenbank'] = session.get('original_auth_datenbank', 'produktion')
 
         # Gemeinschaften des Admins laden
         cursor = db.connection.cursor()
@@ -1116,6 +907,7 @@ def admin_training_zurueck():
         del session['original_admin_level']
         if 'original_gemeinschafts_admin_ids' in session:
             del session['original_gemeinschafts_admin_ids']
+        session.pop('original_auth_datenbank', None)
 
         flash('Sie sind wieder als Administrator angemeldet.', 'success')
 
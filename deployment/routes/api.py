@@ -3,10 +3,13 @@
 API-Endpunkte für AJAX-Anfragen
 """
 
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request, session
 from database import MaschinenDBContext
 from utils.decorators import login_required
 from utils.training import get_current_db_path
+from utils.einsatz_sync import einsaetze_synchronisieren, SyncFehler, SyncLaeuft
+from utils.mitgliedschaft import mitgliedschaft
+from utils.stundenzaehler import einsatz_pruefen, zeitachse
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
@@ -27,6 +30,53 @@ def get_stundenzaehler(maschine_id):
         return jsonify({'success': False}), 404
 
 
+@api_bp.route('/maschine/<int:maschine_id>/stundenzaehler/verlauf')
+@login_required
+def stundenzaehler_verlauf(maschine_id):
+    """API: Zählerstände einer Maschine als Zeitachse mit Lücken/Überschneidungen
+
+    Parameter: limit (max. 500), bis_stand zum Zurückblättern
+    (aus 'naechster_bis_stand' der vorherigen Antwort).
+    """
+    db_path = get_current_db_path()
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+    bis_stand = request.args.get('bis_stand', type=float)
+
+    with MaschinenDBContext(db_path, read_only=True) as db:
+        if not session.get('is_admin') and \
+                maschine_id not in mitgliedschaft(db).sichtbare_maschinen(session['benutzer_id']):
+            return jsonify({'success': False}), 404
+        maschine = db.get_maschine_by_id(maschine_id)
+        if not maschine:
+            return jsonify({'success': False}), 404
+        verlauf = zeitachse(db, maschine_id, bis_stand=bis_stand, limit=limit)
+
+    return jsonify({
+        'success': True,
+        'stundenzaehler': maschine.get('stundenzaehler_aktuell', 0),
+        **verlauf
+    })
+
+
+@api_bp.route('/maschine/<int:maschine_id>/stundenzaehler/pruefen')
+@login_required
+def stundenzaehler_pruefen(maschine_id):
+    """API: Geplanten Einsatz (anfangstand, endstand) vor dem Speichern prüfen"""
+    db_path = get_current_db_path()
+    anfangstand = request.args.get('anfangstand', type=float)
+    endstand = request.args.get('endstand', type=float)
+    if anfangstand is None or endstand is None or endstand < anfangstand:
+        return jsonify({'success': False, 'fehler': 'Ungültige Zählerstände'}), 400
+
+    with MaschinenDBContext(db_path, read_only=True) as db:
+        if not session.get('is_admin') and \
+                maschine_id not in mitgliedschaft(db).sichtbare_maschinen(session['benutzer_id']):
+            return jsonify({'success': False}), 404
+        pruefung = einsatz_pruefen(db, maschine_id, anfangstand, endstand)
+
+    return jsonify({'success': True, **pruefung})
+
+
 @api_bp.route('/maschine/<int:maschine_id>')
 @login_required
 def api_maschine_details(maschine_id):
@@ -46,3 +96,28 @@ def api_maschine_details(maschine_id):
             'preis_pro_einheit': maschine.get('preis_pro_einheit', 0)
         })
     return jsonify({'success': False}), 404
+
+
+@api_bp.route('/einsaetze/sync', methods=['POST'])
+@login_required
+def einsaetze_sync():
+    """API: Mehrere Einsätze auf einmal speichern (Offline-Erfassung)
+
+    Erwartet {"einsaetze": [{"schluessel", "datum", "maschine_id",
+    "einsatzzweck_id", "anfangstand"/"endstand" bzw. "direkt_wert", ...}]}.
+    "schluessel" ist Pflicht (Wiederholungen werden daran erkannt).
+    Alles oder nichts: bei einem ungültigen Eintrag wird keiner gespeichert.
+    """
+    daten = request.get_json(silent=True) or {}
+    db_path = get_current_db_path()
+
+    try:
+        with MaschinenDBContext(db_path) as db:
+            ergebnis = einsaetze_synchronisieren(db, session['benutzer_id'], daten.get('einsaetze'))
+    except SyncFehler as e:
+        return jsonify({'success': False, 'fehler': e.fehler}), 400
+    except SyncLaeuft:
+        return jsonify({'success': False,
+                        'fehler': [{'index': None, 'meldung': 'Sendung wird bereits verarbeitet - bitte erneut senden'}]}), 409
+
+    return jsonify(dict(success=True, **ergebnis))
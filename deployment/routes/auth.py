@@ -4,10 +4,14 @@ Authentifizierung - Login, Logout, Passwort ändern
 """
 
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from database import MaschinenDBContext
+from database import MaschinenDBContext, check_password
 from utils.decorators import login_required
-from utils.training import get_current_db_path, TRAINING_DATABASES, get_available_training_dbs, can_access_production
+from utils.training import (
+    get_current_db_path, TRAINING_DATABASES, get_available_training_dbs, can_access_production,
+    sandbox_bereitstellen
+)
 from utils.sql_helpers import convert_sql
+from utils.auth_context import invalidate_auth_context
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -19,11 +23,15 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
 
+        db_key = session.get('current_database', 'produktion')
         db_path = get_current_db_path()
         with MaschinenDBContext(db_path) as db:
             benutzer = db.verify_login(username, password)
 
             if benutzer:
+                # Berechtigungs-Kontext frisch aus der Login-Datenbank aufbauen
+                invalidate_auth_context(benutzer['id'])
+                session['auth_datenbank'] = db_key
                 session['benutzer_id'] = benutzer['id']
                 session['benutzer_name'] = f"{benutzer['name']}, {benutzer['vorname']}"
                 session['is_admin'] = bool(benutzer.get('is_admin', False))
@@ -166,6 +174,34 @@ def datenbank_wechseln():
     return redirect(url_for('dashboard.dashboard'))
 
 
+@auth_bp.route('/datenbank-sandbox', methods=['POST'])
+@login_required
+def datenbank_sandbox():
+    """Eigene Kopie der Übungsdatenbanken ein- oder ausschalten"""
+    session['training_sandbox'] = request.form.get('aktiv') == '1'
+    if session['training_sandbox']:
+        flash('Sie arbeiten in Übungsdatenbanken jetzt mit Ihrer eigenen Kopie.', 'info')
+    else:
+        flash('Sie arbeiten in Übungsdatenbanken jetzt mit der gemeinsamen Datenbank.', 'info')
+    return redirect(url_for('auth.datenbank_auswahl'))
+
+
+@auth_bp.route('/datenbank-sandbox/zuruecksetzen', methods=['POST'])
+@login_required
+def datenbank_sandbox_zuruecksetzen():
+    """Eigene Kopie der aktuellen Übungsdatenbank auf den Ausgangsstand setzen"""
+    db_key = session.get('current_database', 'produktion')
+    if not session.get('training_sandbox') or db_key not in TRAINING_DATABASES:
+        flash('Keine eigene Kopie einer Übungsdatenbank aktiv.', 'warning')
+        return redirect(url_for('auth.datenbank_auswahl'))
+
+    if sandbox_bereitstellen(db_key, session['benutzer_id'], neu=True):
+        flash('Ihre Übungsdatenbank wurde zurückgesetzt.', 'success')
+    else:
+        flash('Ihre Übungsdatenbank konnte nicht zurückgesetzt werden.', 'danger')
+    return redirect(url_for('auth.datenbank_auswahl'))
+
+
 @auth_bp.route('/passwort-aendern', methods=['GET', 'POST'])
 @login_required
 def passwort_aendern():
@@ -192,9 +228,7 @@ def passwort_aendern():
                 return redirect(url_for('auth.passwort_aendern'))
 
             # Hash des alten Passworts prüfen
-            import hashlib
-            altes_hash = hashlib.sha256(altes_passwort.encode('utf-8')).hexdigest()
-            if altes_hash != benutzer.get('password_hash'):
+            if not check_password(benutzer.get('password_hash'), altes_passwort):
                 flash('Das alte Passwort ist falsch!', 'danger')
                 return redirect(url_for('auth.passwort_aendern'))
 
@@ -3,15 +3,19 @@
 Dashboard und Index-Routen
 """
 
+from datetime import datetime
 from flask import Blueprint, render_template, redirect, url_for, session
 from database import MaschinenDBContext
 from utils.decorators import login_required
 from utils.training import get_current_db_path
-from utils.sql_helpers import convert_sql
+from utils.sql_helpers import convert_sql, datum_bereich
+from utils.posteingang import ungelesen_anzahl
+from metrics import timed_job
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
 
+@timed_job('archivierung_reservierungen')
 def archiviere_abgelaufene_reservierungen():
     """Verschiebt abgelaufene Reservierungen in die Archiv-Tabelle"""
     try:
@@ -19,7 +23,7 @@ def archiviere_abgelaufene_reservierungen():
         with MaschinenDBContext(db_path) as db:
             cursor = db.connection.cursor()
 
-            # Finde alle abgelaufenen Reservierungen
+            # Finde alle abgelaufenen Reservierungen (Index status, ende_zeitpunkt)
             sql = convert_sql("""
                 SELECT r.*, m.bezeichnung as maschine_bezeichnung,
                        b.name || ' ' || COALESCE(b.vorname, '') as benutzer_name
@@ -27,9 +31,9 @@ def archiviere_abgelaufene_reservierungen():
                 JOIN maschinen m ON r.maschine_id = m.id
                 JOIN benutzer b ON r.benutzer_id = b.id
                 WHERE r.status = 'aktiv'
-                AND datetime(r.datum || ' ' || r.uhrzeit_bis) < datetime('now', 'localtime')
+                AND r.ende_zeitpunkt < ?
             """)
-            cursor.execute(sql)
+            cursor.execute(sql, (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
 
             abgelaufene = cursor.fetchall()
 
@@ -136,32 +140,24 @@ def dashboard():
             d['gesamtkosten'] = d['maschinenkosten'] or 0
             schulden_nach_gemeinschaft.append(d)
 
-        # Meine aktiven Reservierungen laden
-        sql = convert_sql("""
+        # Meine aktiven Reservierungen laden (Index benutzer_id, status, datum)
+        ab_heute, ab_heute_params = datum_bereich('r.datum', von=datetime.now().date())
+        sql = convert_sql(f"""
             SELECT r.*, m.bezeichnung as maschine_bezeichnung
             FROM maschinen_reservierungen r
             JOIN maschinen m ON r.maschine_id = m.id
             WHERE r.benutzer_id = ?
-              AND r.datum >= date('now')
               AND r.status = 'aktiv'
+              AND {ab_heute}
             ORDER BY r.datum, r.uhrzeit_von
         """)
-        cursor.execute(sql, (benutzer_id,))
+        cursor.execute(sql, [benutzer_id] + ab_heute_params)
 
         columns = [desc[0] for desc in cursor.description]
         reservierungen = [dict(zip(columns, row)) for row in cursor.fetchall()]
 
-        # Ungelesene Nachrichten zählen (über benutzer_betriebe)
-        sql = convert_sql("""
-            SELECT COUNT(DISTINCT n.id) FROM gemeinschafts_nachrichten n
-            JOIN betriebe_gemeinschaften bg ON n.gemeinschaft_id = bg.gemeinschaft_id
-            JOIN benutzer_betriebe bb ON bb.betrieb_id = bg.betrieb_id
-            LEFT JOIN nachricht_gelesen ng ON n.id = ng.nachricht_id AND ng.benutzer_id = ?
-            WHERE bb.benutzer_id = ? AND ng.nachricht_id IS NULL
-        """)
-        cursor.execute(sql, (benutzer_id, benutzer_id))
-
-        ungelesene_nachrichten = cursor.fetchone()[0]
+        # Ungelesene Nachrichten (Zähler pro Benutzer)
+        ungelesene_nachrichten = ungelesen_anzahl(db, benutzer_id)
 
         # Zahlungsreferenzen des Benutzers laden
         sql = convert_sql("""
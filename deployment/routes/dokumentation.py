@@ -9,9 +9,15 @@ Zeigt Dokumentation für verschiedene Benutzergruppen:
 """
 
 import os
+import re
+import time
+import threading
+from html import unescape
+
 import markdown
-from flask import Blueprint, render_template, abort, session, redirect, url_for, current_app
+from flask import Blueprint, render_template, abort, session, redirect, url_for, current_app, request
 from utils.decorators import login_required, admin_required
+from utils.dokument_cache import dokument_antwort
 
 dokumentation_bp = Blueprint('dokumentation', __name__, url_prefix='/dokumentation')
 
@@ -79,6 +85,18 @@ DOCS_STRUCTURE = {
 }
 
 
+# Cache der gerenderten Dokumente: Datei -> {mtime, html, toc, text, woerter}
+# (pro Prozess, wird beim ersten Aufruf gefüllt und bei geänderter mtime erneuert)
+_doc_cache = {}
+_cache_lock = threading.Lock()
+
+# Existenz-Prüfung der Dateien in DOCS_STRUCTURE
+DOCS_SCAN_TTL_SECONDS = int(os.environ.get('DOCS_SCAN_TTL_SECONDS', 60))
+_scan_cache = {'dateien': None, 'zeit': 0.0}
+
+_WORT_RE = re.compile(r'\w+')
+
+
 def get_user_level():
     """Gibt die Berechtigungsstufe des aktuellen Benutzers zurück"""
     if not session.get('benutzer_id'):
@@ -93,29 +111,136 @@ def get_user_level():
     return 0  # Normaler Benutzer
 
 
-def render_markdown(filepath):
-    """Liest und rendert eine Markdown-Datei"""
-    full_path = os.path.join(DOCS_BASE, filepath)
+def _markdown_zu_eintrag(full_path):
+    """Markdown-Datei rendern: HTML, Inhaltsverzeichnis und Suchtext"""
+    with open(full_path, 'r', encoding='utf-8') as f:
+        content = f.read()
 
-    if not os.path.exists(full_path):
-        return None
+    # Markdown zu HTML konvertieren
+    md = markdown.Markdown(extensions=[
+        'tables',
+        'fenced_code',
+        'codehilite',
+        'toc',
+        'nl2br'
+    ])
+    html = md.convert(content)
+
+    # Klartext für die Suche (ohne Tags, Entities aufgelöst)
+    text = unescape(re.sub(r'<[^>]+>', ' ', html))
+    text = re.sub(r'\s+', ' ', text).strip()
+
+    return {
+        'html': html,
+        'toc': md.toc if len(md.toc_tokens) > 1 or any(t['children'] for t in md.toc_tokens) else '',
+        'text': text,
+        'woerter': set(_woerter(text))
+    }
+
+
+def _woerter(text):
+    return [w.lower() for w in _WORT_RE.findall(text)]
+
+
+def get_doc(filepath):
+    """Gerendertes Dokument aus dem Cache (neu gerendert wenn die Datei geändert wurde)
 
+    Gibt None zurück wenn die Datei nicht existiert.
+    """
+    full_path = os.path.join(DOCS_BASE, filepath)
     try:
-        with open(full_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        # Markdown zu HTML konvertieren
-        md = markdown.Markdown(extensions=[
-            'tables',
-            'fenced_code',
-            'codehilite',
-            'toc',
-            'nl2br'
-        ])
-        html = md.convert(content)
-        return html
-    except Exception as e:
-        return f"<p class='text-danger'>Fehler beim Laden: {str(e)}</p>"
+        mtime = os.path.getmtime(full_path)
+    except OSError:
+        _doc_cache.pop(filepath, None)
+        return None
+
+    eintrag = _doc_cache.get(filepath)
+    if eintrag is not None and eintrag['mtime'] == mtime:
+        return eintrag
+
+    with _cache_lock:
+        eintrag = _doc_cache.get(filepath)
+        if eintrag is None or eintrag['mtime'] != mtime:
+            try:
+                eintrag = _markdown_zu_eintrag(full_path)
+            except Exception as e:
+                eintrag = {
+                    'html': f"<p class='text-danger'>Fehler beim Laden: {str(e)}</p>",
+                    'toc': '', 'text': '', 'woerter': set()
+                }
+            eintrag['mtime'] = mtime
+            _doc_cache[filepath] = eintrag
+    return eintrag
+
+
+def render_markdown(filepath):
+    """Liest und rendert eine Markdown-Datei (über den Dokumentations-Cache)"""
+    eintrag = get_doc(filepath)
+    return eintrag['html'] if eintrag else None
+
+
+def vorhandene_docs():
+    """Menge der vorhandenen Dokument-Dateien aus DOCS_STRUCTURE
+
+    Das Ergebnis wird DOCS_SCAN_TTL_SECONDS lang gemerkt, damit die Übersicht
+    nicht bei jedem Aufruf alle Dateien prüft.
+    """
+    jetzt = time.time()
+    if _scan_cache['dateien'] is None or jetzt - _scan_cache['zeit'] > DOCS_SCAN_TTL_SECONDS:
+        _scan_cache['dateien'] = {
+            d['file']
+            for category in DOCS_STRUCTURE.values()
+            for d in category['docs']
+            if os.path.exists(os.path.join(DOCS_BASE, d['file']))
+        }
+        _scan_cache['zeit'] = jetzt
+    return _scan_cache['dateien']
+
+
+def _snippet(text, begriffe, breite=80):
+    """Textausschnitt um den ersten Treffer"""
+    text_lower = text.lower()
+    pos = min((p for p in (text_lower.find(b) for b in begriffe) if p >= 0), default=0)
+    start = max(0, pos - breite)
+    ende = min(len(text), pos + breite)
+    return ('…' if start > 0 else '') + text[start:ende] + ('…' if ende < len(text) else '')
+
+
+def suche_docs(query, user_level):
+    """Volltextsuche über alle für den Benutzer sichtbaren Dokumente
+
+    Alle Suchbegriffe müssen vorkommen (Wortanfang genügt, z.B. "reserv"
+    findet "Reservierungen"). Sortiert nach Anzahl der Fundstellen.
+    """
+    begriffe = _woerter(query)
+    if not begriffe:
+        return []
+
+    vorhanden = vorhandene_docs()
+    treffer = []
+    for key, category in DOCS_STRUCTURE.items():
+        if category['level'] > user_level:
+            continue
+        for d in category['docs']:
+            if d['file'] not in vorhanden:
+                continue
+            eintrag = get_doc(d['file'])
+            if eintrag is None:
+                continue
+            woerter = eintrag['woerter']
+            if not all(b in woerter or any(w.startswith(b) for w in woerter) for b in begriffe):
+                continue
+            text_lower = eintrag['text'].lower()
+            treffer.append({
+                'doc': d,
+                'category': category,
+                'category_key': key,
+                'anzahl': sum(text_lower.count(b) for b in begriffe),
+                'snippet': _snippet(eintrag['text'], begriffe)
+            })
+
+    treffer.sort(key=lambda t: t['anzahl'], reverse=True)
+    return treffer
 
 
 @dokumentation_bp.route('/')
@@ -130,16 +255,12 @@ def index():
     # flash(f'DEBUG: DOCS_BASE={DOCS_BASE}, user_level={user_level}, benutzer_id={session.get("benutzer_id")}', 'info')
 
     # Filtere Kategorien nach Benutzer-Level
+    vorhanden = vorhandene_docs()
     available_categories = {}
     for key, category in DOCS_STRUCTURE.items():
         if category['level'] <= user_level:
             # Filtere auch einzelne Docs
-            available_docs = []
-            for d in category['docs']:
-                full_path = os.path.join(DOCS_BASE, d['file'])
-                exists = os.path.exists(full_path)
-                if exists:
-                    available_docs.append(d)
+            available_docs = [d for d in category['docs'] if d['file'] in vorhanden]
             if available_docs:
                 available_categories[key] = {
                     **category,
@@ -180,14 +301,32 @@ def show_doc(category, doc_path):
     if not doc_info:
         abort(404)
 
-    # Rendere Markdown
-    html_content = render_markdown(doc_file)
-    if html_content is None:
+    # Gerendertes Dokument aus dem Cache
+    eintrag = get_doc(doc_file)
+    if eintrag is None:
         abort(404)
 
-    return render_template('dokumentation_show.html',
-                          content=html_content,
-                          doc=doc_info,
-                          category=cat_info,
-                          category_key=category,
+    # Datenstand: Änderungszeit der Markdown-Datei
+    stand = (doc_file, eintrag['mtime'], user_level)
+    return dokument_antwort(stand, lambda: render_template('dokumentation_show.html',
+                                                           content=eintrag['html'],
+                                                           toc=eintrag['toc'],
+                                                           doc=doc_info,
+                                                           category=cat_info,
+                                                           category_key=category,
+                                                           user_level=user_level),
+                            'text/html; charset=utf-8', seite=True)
+
+
+@dokumentation_bp.route('/suche')
+@login_required
+def suche():
+    """Volltextsuche in der Dokumentation"""
+    user_level = get_user_level()
+    query = request.args.get('q', '').strip()
+    treffer = suche_docs(query, user_level) if query else []
+
+    return render_template('dokumentation_suche.html',
+                          query=query,
+                          treffer=treffer,
                           user_level=user_level)
@@ -4,13 +4,20 @@ Einsätze - Erfassen, Anzeigen, Stornieren
 """
 
 import csv
-from io import StringIO, BytesIO
+from io import StringIO
 from datetime import datetime
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, send_file
-from database import MaschinenDBContext
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash
+from database import MaschinenDBContext, REFERENZDATEN_VERSION
 from utils.decorators import login_required
+from utils.auth_context import get_auth_context
 from utils.training import get_current_db_path
 from utils.sql_helpers import convert_sql
+from utils.mitgliedschaft import mitgliedschaft
+from utils.jahresabschluss import JahrAbgeschlossen, datum_pruefen
+from utils.stundenzaehler import einsatz_pruefen
+from utils.einsatz_storno import StornoFehler, einsaetze_stornieren, storno_widerrufen, widerrufbare_vorgaenge
+from utils.cache_versionen import version_lesen
+from utils.dokument_cache import dokument_antwort, datenstand
 
 einsaetze_bp = Blueprint('einsaetze', __name__)
 
@@ -33,6 +40,13 @@ def neuer_einsatz():
 
             with MaschinenDBContext(db_path) as db:
                 maschine = db.get_maschine_by_id(maschine_id)
+
+                try:
+                    datum_pruefen(db, maschine.get('gemeinschaft_id'), datum)
+                except JahrAbgeschlossen as e:
+                    flash(str(e), 'danger')
+                    return redirect(url_for('einsaetze.neuer_einsatz'))
+
                 erfassungsmodus = maschine.get('erfassungsmodus', 'fortlaufend')
 
                 if erfassungsmodus == 'direkt':
@@ -58,6 +72,13 @@ def neuer_einsatz():
                         flash('Endstand muss größer oder gleich Anfangstand sein!', 'danger')
                         return redirect(url_for('einsaetze.neuer_einsatz'))
 
+                pruefung = einsatz_pruefen(db, maschine_id, anfangstand, endstand)
+                if pruefung['ueberschneidung']:
+                    u = pruefung['ueberschneidung']
+                    flash(f"Zählerstand {anfangstand:g} - {endstand:g} überschneidet sich mit dem "
+                          f"Einsatz vom {u['datum']} ({u['anfangstand']:g} - {u['endstand']:g})!", 'danger')
+                    return redirect(url_for('einsaetze.neuer_einsatz'))
+
                 db.add_einsatz(
                     datum=datum,
                     benutzer_id=session['benutzer_id'],
@@ -82,6 +103,10 @@ def neuer_einsatz():
                     db.connection.commit()
 
             flash('Einsatz wurde erfolgreich gespeichert!', 'success')
+            if pruefung['luecke_vorher']:
+                flash(f"Hinweis: {pruefung['luecke_vorher']:g} Stunden seit dem letzten erfassten "
+                      f"Einsatz dieser Maschine (Stand {pruefung['vorgaenger']['endstand']:g}) "
+                      f"sind nicht erfasst.", 'warning')
             return redirect(url_for('dashboard.dashboard'))
 
         except Exception as e:
@@ -92,20 +117,14 @@ def neuer_einsatz():
     with MaschinenDBContext(db_path) as db:
         cursor = db.connection.cursor()
 
-        sql = convert_sql("""
-            SELECT DISTINCT m.*
-            FROM maschinen m
-            JOIN gemeinschaften g ON m.gemeinschaft_id = g.id
-            JOIN mitglied_gemeinschaft mg ON g.id = mg.gemeinschaft_id
-            WHERE mg.mitglied_id = ?
-              AND m.aktiv = true
-              AND g.aktiv = true
-            ORDER BY m.bezeichnung
-        """)
-        cursor.execute(sql, (session['benutzer_id'],))
-
-        columns = [desc[0] for desc in cursor.description]
-        maschinen = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        maschinen = []
+        maschinen_ids = sorted(mitgliedschaft(db).sichtbare_maschinen(session['benutzer_id']))
+        if maschinen_ids:
+            placeholders = ','.join('?' for _ in maschinen_ids)
+            sql = convert_sql(f"SELECT * FROM maschinen WHERE id IN ({placeholders}) ORDER BY bezeichnung")
+            cursor.execute(sql, maschinen_ids)
+            columns = [desc[0] for desc in cursor.description]
+            maschinen = [dict(zip(columns, row)) for row in cursor.fetchall()]
 
         einsatzzwecke = db.get_all_einsatzzwecke()
 
@@ -219,31 +238,12 @@ def einsatz_stornieren(einsatz_id):
         if request.method == 'POST':
             stornierungsgrund = request.form.get('stornierungsgrund', '')
 
-            sql = convert_sql("""
-                INSERT INTO maschineneinsaetze_storniert
-                (original_einsatz_id, datum, benutzer_id, maschine_id, einsatzzweck_id,
-                 stundenzaehler_anfang, stundenzaehler_ende, betriebsstunden,
-                 hektar, kilometer, stueck, treibstoffverbrauch, treibstoffkosten,
-                 maschinenkosten, gesamtkosten, bemerkung, storniert_am, storniert_von, stornierungsgrund)
-                SELECT id, datum, benutzer_id, maschine_id, einsatzzweck_id,
-                       anfangstand, endstand, betriebsstunden,
-                       flaeche_menge, flaeche_menge, flaeche_menge, treibstoffverbrauch, treibstoffkosten,
-                       kosten_berechnet, (COALESCE(treibstoffkosten, 0) + COALESCE(kosten_berechnet, 0)), anmerkungen, ?, ?, ?
-                FROM maschineneinsaetze
-                WHERE id = ?
-            """)
-            cursor.execute(sql, (
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                session['benutzer_id'],
-                stornierungsgrund,
-                einsatz_id
-            ))
-
-            sql = convert_sql("DELETE FROM maschineneinsaetze WHERE id = ?")
-            cursor.execute(sql, (einsatz_id,))
-            db.connection.commit()
-
-            flash('Einsatz wurde erfolgreich storniert.', 'success')
+            ergebnis = einsaetze_stornieren(db, session['benutzer_id'], stornierungsgrund,
+                                            ids=[einsatz_id])
+
+            flash(f"Einsatz wurde erfolgreich storniert. Rückgängig machen ist bis "
+                  f"{ergebnis['widerruf_bis'].strftime('%d.%m.%Y %H:%M')} unter "
+                  f"\"Stornierte Einsätze\" möglich.", 'success')
 
             if session.get('is_admin'):
                 return redirect(url_for('admin_system.admin_alle_einsaetze'))
@@ -266,7 +266,10 @@ def meine_stornierten_einsaetze():
             SELECT s.*, m.bezeichnung as maschine_name,
                    b.name as benutzer_name, b.vorname as benutzer_vorname,
                    sv.name as storniert_von_name, sv.vorname as storniert_von_vorname,
-                   ez.bezeichnung as einsatzzweck_name
+                   ez.bezeichnung as einsatzzweck_name,
+                   s.endstand - s.anfangstand as stunden,
+                   s.kosten_berechnet as maschinenkosten,
+                   COALESCE(s.treibstoffkosten, 0) + COALESCE(s.kosten_berechnet, 0) as gesamtkosten
             FROM maschineneinsaetze_storniert s
             JOIN maschinen m ON s.maschine_id = m.id
             JOIN benutzer b ON s.benutzer_id = b.id
@@ -280,8 +283,29 @@ def meine_stornierten_einsaetze():
         columns = [desc[0] for desc in cursor.description]
         stornierte_einsaetze = [dict(zip(columns, row)) for row in cursor.fetchall()]
 
+        widerrufbar = widerrufbare_vorgaenge(db, session['benutzer_id'])
+
     return render_template('meine_stornierten_einsaetze.html',
-                         stornierte_einsaetze=stornierte_einsaetze)
+                         stornierte_einsaetze=stornierte_einsaetze,
+                         widerrufbar=widerrufbar)
+
+
+@einsaetze_bp.route('/storno/<vorgang>/widerrufen', methods=['POST'])
+@login_required
+def storno_rueckgaengig(vorgang):
+    """Storno-Vorgang rückgängig machen (innerhalb der Widerrufsfrist)"""
+    db_path = get_current_db_path()
+    # Admin-Recht aus dem serverseitigen Kontext, nicht aus dem Session-Cookie
+    ist_admin = get_auth_context()['is_admin']
+
+    try:
+        with MaschinenDBContext(db_path) as db:
+            ergebnis = storno_widerrufen(db, vorgang, session['benutzer_id'], ist_admin=ist_admin)
+        flash(f"{ergebnis['anzahl']} Einsatz/Einsätze wiederhergestellt.", 'success')
+    except StornoFehler as e:
+        flash(str(e), 'danger')
+
+    return redirect(request.referrer or url_for('einsaetze.meine_stornierten_einsaetze'))
 
 
 @einsaetze_bp.route('/meine-einsaetze/csv')
@@ -289,10 +313,25 @@ def meine_stornierten_einsaetze():
 def meine_einsaetze_csv():
     """Exportiere eigene Einsätze als CSV"""
     db_path = get_current_db_path()
+    benutzer_id = session['benutzer_id']
 
-    with MaschinenDBContext(db_path) as db:
-        einsaetze = db.get_einsaetze_by_benutzer(session['benutzer_id'])
+    with MaschinenDBContext(db_path, read_only=True) as db:
+        # Datenstand: Einsätze werden nie geändert, nur angelegt/storniert
+        stand = (db_path, version_lesen(db, REFERENZDATEN_VERSION), datenstand(db, """
+            SELECT b.name, b.vorname, COUNT(e.id), MAX(e.id), SUM(e.id)
+            FROM benutzer b
+            LEFT JOIN maschineneinsaetze e ON e.benutzer_id = b.id
+            WHERE b.id = ?
+            GROUP BY b.id, b.name, b.vorname
+        """, (benutzer_id,)))
+
+        filename = f'meine_einsaetze_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        return dokument_antwort(stand, lambda: _einsaetze_csv(db.get_einsaetze_by_benutzer(benutzer_id)),
+                                'text/csv; charset=utf-8', filename, anhang=True)
 
+
+def _einsaetze_csv(einsaetze):
+    """Einsatzliste als CSV (Excel-tauglich: Semikolon, deutsches Zahlenformat, BOM)"""
     csv_buffer = StringIO()
     writer = csv.writer(csv_buffer, delimiter=';')
 
@@ -341,13 +380,4 @@ def meine_einsaetze_csv():
             e.get('anmerkungen', '')
         ])
 
-    csv_bytes = BytesIO(csv_buffer.getvalue().encode('utf-8-sig'))
-    csv_bytes.seek(0)
-
-    filename = f'meine_einsaetze_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-    return send_file(
-        csv_bytes,
-        mimetype='text/csv; charset=utf-8',
-        as_attachment=True,
-        download_name=filename
-    )
+    return csv_buffer.getvalue().encode('utf-8-sig')
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Routes für Betriebsmetriken (/metrics, Prometheus-Format)
+
+Zugriff nur mit Token (METRICS_TOKEN, als Bearer-Header - nicht in der URL,
+die in Zugriffslogs und Proxy-Logs landet) oder aus erlaubten Netzen
+(METRICS_ALLOWED_NETWORKS, Standard: localhost).
+"""
+
+import os
+import hmac
+import ipaddress
+from flask import Blueprint, Response, request, abort
+
+import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_NETWORKS = [
+    ipaddress.ip_network(netz.strip(), strict=False)
+    for netz in os.environ.get('METRICS_ALLOWED_NETWORKS', '127.0.0.1/32,::1/128').split(',')
+    if netz.strip()
+]
+
+
+def metrics_zugriff_erlaubt():
+    """Prüft Token bzw. Absender-Netz"""
+    if METRICS_TOKEN:
+        auth = request.headers.get('Authorization', '')
+        token = auth[len('Bearer '):] if auth.startswith('Bearer ') else ''
+        if token and hmac.compare_digest(token, METRICS_TOKEN):
+            return True
+
+    try:
+        adresse = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(adresse in netz for netz in METRICS_ALLOWED_NETWORKS)
+
+
+@metrics_bp.route('/metrics')
+def metrics_export():
+    """Metriken für lokalen Collector (Prometheus, VictoriaMetrics, ...)"""
+    if not metrics_zugriff_erlaubt():
+        abort(403)
+    return Response(metrics.render_prometheus(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -8,7 +8,12 @@ from flask import Blueprint, render_template, request, redirect, url_for, sessio
 from database import MaschinenDBContext
 from utils.decorators import login_required
 from utils.training import get_current_db_path
-from utils.sql_helpers import convert_sql, db_execute
+from utils.sql_helpers import convert_sql
+from utils.posteingang import (
+    NACHRICHTEN_PRO_SEITE, nachricht_verteilen, als_gelesen_markieren,
+    ungelesen_anzahl, posteingang_laden
+)
+from utils.mitgliedschaft import mitgliedschaft
 
 nachrichten_bp = Blueprint('nachrichten', __name__)
 
@@ -19,34 +24,19 @@ def nachrichten():
     """Nachrichten der eigenen Gemeinschaften anzeigen"""
     db_path = get_current_db_path()
 
+    seite = max(1, request.args.get('seite', 1, type=int))
+
     with MaschinenDBContext(db_path) as db:
-        cursor = db.connection.cursor()
+        nachrichten_list, anzahl_gesamt = posteingang_laden(db, session['benutzer_id'], seite)
+        ungelesen = ungelesen_anzahl(db, session['benutzer_id'])
 
-        # Gemeinschaften über Betriebe des Benutzers ermitteln (über benutzer_betriebe)
-        sql = convert_sql("""
-            SELECT DISTINCT n.*,
-                   g.name as gemeinschaft_name,
-                   b.name as absender_name, b.vorname as absender_vorname,
-                   CASE WHEN ng.gelesen_am IS NOT NULL THEN 1 ELSE 0 END as gelesen
-            FROM gemeinschafts_nachrichten n
-            JOIN gemeinschaften g ON n.gemeinschaft_id = g.id
-            JOIN benutzer b ON n.absender_id = b.id
-            JOIN betriebe_gemeinschaften bg ON g.id = bg.gemeinschaft_id
-            JOIN benutzer_betriebe bb ON bg.betrieb_id = bb.betrieb_id
-            LEFT JOIN nachricht_gelesen ng ON n.id = ng.nachricht_id AND ng.benutzer_id = ?
-            WHERE bb.benutzer_id = ?
-            ORDER BY n.erstellt_am DESC
-        """)
-        cursor.execute(sql, (session['benutzer_id'], session['benutzer_id']))
-
-        columns = [desc[0] for desc in cursor.description]
-        nachrichten_list = [dict(zip(columns, row)) for row in cursor.fetchall()]
-
-        ungelesen = sum(1 for n in nachrichten_list if not n['gelesen'])
+    seiten = max(1, -(-anzahl_gesamt // NACHRICHTEN_PRO_SEITE))
 
     return render_template('nachrichten.html',
                          nachrichten=nachrichten_list,
-                         ungelesen=ungelesen)
+                         ungelesen=ungelesen,
+                         seite=seite,
+                         seiten=seiten)
 
 
 @nachrichten_bp.route('/nachricht/<int:nachricht_id>/lesen')
@@ -56,25 +46,11 @@ def nachricht_lesen(nachricht_id):
     db_path = get_current_db_path()
 
     with MaschinenDBContext(db_path) as db:
-        cursor = db.connection.cursor()
-
-        # Prüfen ob Benutzer über seine Betriebe Zugriff auf diese Nachricht hat (über benutzer_betriebe)
-        sql = convert_sql("""
-            SELECT n.* FROM gemeinschafts_nachrichten n
-            JOIN betriebe_gemeinschaften bg ON n.gemeinschaft_id = bg.gemeinschaft_id
-            JOIN benutzer_betriebe bb ON bg.betrieb_id = bb.betrieb_id
-            WHERE bb.benutzer_id = ? AND n.id = ?
-        """)
-        cursor.execute(sql, (session['benutzer_id'], nachricht_id))
-
-        if cursor.fetchone():
-            db_execute(cursor, """
-                INSERT OR IGNORE INTO nachricht_gelesen (nachricht_id, benutzer_id, gelesen_am)
-                VALUES (?, ?, ?)
-            """, (nachricht_id, session['benutzer_id'], datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        # Nur Nachrichten im eigenen Posteingang
+        if als_gelesen_markieren(db, session['benutzer_id'], nachricht_id):
             db.connection.commit()
 
-    return redirect(url_for('nachrichten.nachrichten'))
+    return redirect(url_for('nachrichten.nachrichten', seite=request.args.get('seite', type=int)))
 
 
 @nachrichten_bp.route('/nachricht/neu', methods=['GET', 'POST'])
@@ -91,22 +67,20 @@ def nachricht_neu():
             betreff = request.form.get('betreff')
             nachricht = request.form.get('nachricht')
 
-            # Prüfen ob Benutzer über seine Betriebe Mitglied dieser Gemeinschaft ist (über benutzer_betriebe)
-            sql = convert_sql("""
-                SELECT COUNT(*) FROM betriebe_gemeinschaften bg
-                JOIN benutzer_betriebe bb ON bg.betrieb_id = bb.betrieb_id
-                WHERE bg.gemeinschaft_id = ? AND bb.benutzer_id = ?
-            """)
-            cursor.execute(sql, (gemeinschaft_id, session['benutzer_id']))
-
-            if cursor.fetchone()[0] > 0:
+            # Prüfen ob Benutzer über seine Betriebe Mitglied dieser Gemeinschaft ist
+            if mitgliedschaft(db).ist_mitglied_ueber_betrieb(session['benutzer_id'], gemeinschaft_id):
                 sql = convert_sql("""
                     INSERT INTO gemeinschafts_nachrichten
                     (gemeinschaft_id, absender_id, betreff, inhalt, erstellt_am)
                     VALUES (?, ?, ?, ?, ?)
+                    RETURNING id
                 """)
                 cursor.execute(sql, (gemeinschaft_id, session['benutzer_id'], betreff, nachricht,
                               datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                nachricht_id = cursor.fetchone()[0]
+
+                # An die Posteingänge aller Mitglieder verteilen
+                nachricht_verteilen(db, nachricht_id, gemeinschaft_id, session['benutzer_id'])
                 db.connection.commit()
 
                 flash('Nachricht wurde an alle Mitglieder der Gemeinschaft gesendet!', 'success')
@@ -114,17 +88,10 @@ def nachricht_neu():
             else:
                 flash('Sie sind nicht Mitglied dieser Gemeinschaft.', 'danger')
 
-        # Gemeinschaften über Betriebe des Benutzers laden (über benutzer_betriebe)
-        sql = convert_sql("""
-            SELECT DISTINCT g.* FROM gemeinschaften g
-            JOIN betriebe_gemeinschaften bg ON g.id = bg.gemeinschaft_id
-            JOIN benutzer_betriebe bb ON bg.betrieb_id = bb.betrieb_id
-            WHERE bb.benutzer_id = ? AND g.aktiv = true
-            ORDER BY g.name
-        """)
-        cursor.execute(sql, (session['benutzer_id'],))
-
-        columns = [desc[0] for desc in cursor.description]
-        gemeinschaften = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        # Gemeinschaften über Betriebe des Benutzers
+        graph = mitgliedschaft(db)
+        gemeinschaften = graph.gemeinschaften_liste(
+            graph.gemeinschaften_ueber_betriebe(session['benutzer_id'], nur_aktive=True)
+        )
 
     return render_template('nachricht_neu.html', gemeinschaften=gemeinschaften)
@@ -8,7 +8,8 @@ from flask import Blueprint, render_template, request, redirect, url_for, sessio
 from database import MaschinenDBContext
 from utils.decorators import login_required
 from utils.training import get_current_db_path
-from utils.sql_helpers import convert_sql
+from utils.sql_helpers import convert_sql, datum_bereich
+from utils.mitgliedschaft import mitgliedschaft
 
 reservierungen_bp = Blueprint('reservierungen', __name__)
 
@@ -83,20 +84,14 @@ def neue_reservierung():
 
         # GET - Formular anzeigen
         # Maschinen des Benutzers laden
-        sql = convert_sql("""
-            SELECT DISTINCT m.*
-            FROM maschinen m
-            JOIN gemeinschaften g ON m.gemeinschaft_id = g.id
-            JOIN mitglied_gemeinschaft mg ON g.id = mg.gemeinschaft_id
-            WHERE mg.mitglied_id = ?
-              AND m.aktiv = true
-              AND g.aktiv = true
-            ORDER BY m.bezeichnung
-        """)
-        cursor.execute(sql, (session['benutzer_id'],))
-
-        columns = [desc[0] for desc in cursor.description]
-        maschinen = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        maschinen = []
+        maschinen_ids = sorted(mitgliedschaft(db).sichtbare_maschinen(session['benutzer_id']))
+        if maschinen_ids:
+            placeholders = ','.join('?' for _ in maschinen_ids)
+            sql = convert_sql(f"SELECT * FROM maschinen WHERE id IN ({placeholders}) ORDER BY bezeichnung")
+            cursor.execute(sql, maschinen_ids)
+            columns = [desc[0] for desc in cursor.description]
+            maschinen = [dict(zip(columns, row)) for row in cursor.fetchall()]
 
         einsatzzwecke = db.get_all_einsatzzwecke()
 
@@ -156,29 +151,31 @@ def maschine_reservieren(maschine_id):
 
         einsatzzwecke = db.get_all_einsatzzwecke()
 
-        sql = convert_sql("""
+        # Index (maschine_id, status, datum) bzw. (benutzer_id, status, datum)
+        ab_heute, ab_heute_params = datum_bereich('r.datum', von=datetime.now().date())
+        sql = convert_sql(f"""
             SELECT r.*, b.name || ' ' || COALESCE(b.vorname, '') as benutzer_name
             FROM maschinen_reservierungen r
             JOIN benutzer b ON r.benutzer_id = b.id
             WHERE r.maschine_id = ?
-              AND r.datum >= date('now')
               AND r.status = 'aktiv'
+              AND {ab_heute}
             ORDER BY r.datum, r.uhrzeit_von
         """)
-        cursor.execute(sql, (maschine_id,))
+        cursor.execute(sql, [maschine_id] + ab_heute_params)
 
         columns = [desc[0] for desc in cursor.description]
         reservierungen = [dict(zip(columns, row)) for row in cursor.fetchall()]
 
-        sql = convert_sql("""
-            SELECT * FROM maschinen_reservierungen
-            WHERE maschine_id = ?
-              AND benutzer_id = ?
-              AND datum >= date('now')
-              AND status = 'aktiv'
-            ORDER BY datum, uhrzeit_von
+        sql = convert_sql(f"""
+            SELECT * FROM maschinen_reservierungen r
+            WHERE r.maschine_id = ?
+              AND r.benutzer_id = ?
+              AND r.status = 'aktiv'
+              AND {ab_heute}
+            ORDER BY r.datum, r.uhrzeit_von
         """)
-        cursor.execute(sql, (maschine_id, session['benutzer_id']))
+        cursor.execute(sql, [maschine_id, session['benutzer_id']] + ab_heute_params)
 
         columns = [desc[0] for desc in cursor.description]
         meine_reservierungen = [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -198,40 +195,38 @@ def reservierungen_kalender():
     db_path = get_current_db_path()
     maschine_id = request.args.get('maschine_id', type=int)
 
-    with MaschinenDBContext(db_path) as db:
+    with MaschinenDBContext(db_path, read_only=True) as db:
         cursor = db.connection.cursor()
         maschinen = db.get_all_maschinen()
 
         heute = datetime.now()
-        bis_datum = (heute + timedelta(days=30)).strftime('%Y-%m-%d')
+        zeitraum, zeitraum_params = datum_bereich('r.datum', heute.date(), (heute + timedelta(days=30)).date())
 
         if maschine_id:
-            sql = convert_sql("""
+            sql = convert_sql(f"""
                 SELECT r.*, m.bezeichnung as maschine_bezeichnung,
                        b.name || ' ' || COALESCE(b.vorname, '') as benutzer_name
                 FROM maschinen_reservierungen r
                 JOIN maschinen m ON r.maschine_id = m.id
                 JOIN benutzer b ON r.benutzer_id = b.id
                 WHERE r.maschine_id = ?
-                  AND r.datum >= date('now')
-                  AND r.datum <= ?
                   AND r.status = 'aktiv'
+                  AND {zeitraum}
                 ORDER BY r.datum, r.uhrzeit_von
             """)
-            cursor.execute(sql, (maschine_id, bis_datum))
+            cursor.execute(sql, [maschine_id] + zeitraum_params)
         else:
-            sql = convert_sql("""
+            sql = convert_sql(f"""
                 SELECT r.*, m.bezeichnung as maschine_bezeichnung,
                        b.name || ' ' || COALESCE(b.vorname, '') as benutzer_name
                 FROM maschinen_reservierungen r
                 JOIN maschinen m ON r.maschine_id = m.id
                 JOIN benutzer b ON r.benutzer_id = b.id
-                WHERE r.datum >= date('now')
-                  AND r.datum <= ?
-                  AND r.status = 'aktiv'
+                WHERE r.status = 'aktiv'
+                  AND {zeitraum}
                 ORDER BY r.datum, m.bezeichnung, r.uhrzeit_von
             """)
-            cursor.execute(sql, (bis_datum,))
+            cursor.execute(sql, zeitraum_params)
 
         columns = [desc[0] for desc in cursor.description]
         reservierungen = [dict(zip(columns, row)) for row in cursor.fetchall()]
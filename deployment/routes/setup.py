@@ -13,12 +13,17 @@ Kritische Aktionen (Backup-Restore) erfordern Bestätigung durch zweiten Admin.
 
 import os
 import tempfile
-import subprocess
 import secrets
-from datetime import datetime, timedelta
+from datetime import datetime
 from functools import wraps
 from flask import Blueprint, render_template, request, redirect, url_for, flash, Response
 
+# Ausstehende Bestätigungsanfragen liegen im gemeinsamen Setup-Speicher
+# (von allen Gunicorn-Workern geteilt)
+from utils import setup_store
+from utils.setup_store import REQUEST_TIMEOUT_MINUTES, cleanup_expired_requests
+from utils.prozesse import befehl_ausfuehren, pg_befehl
+
 setup_bp = Blueprint('setup', __name__, url_prefix='/setup')
 
 # Token aus Umgebungsvariablen
@@ -26,28 +31,6 @@ SETUP_TOKEN = os.environ.get('SETUP_TOKEN', '')
 SETUP_TOKEN_ADMIN1 = os.environ.get('SETUP_TOKEN_ADMIN1', '')
 SETUP_TOKEN_ADMIN2 = os.environ.get('SETUP_TOKEN_ADMIN2', '')
 
-# Speicher für ausstehende Bestätigungsanfragen
-# Format: {code: {'file_path': ..., 'filename': ..., 'admin1': ..., 'created': ..., 'action': ...}}
-pending_requests = {}
-
-# Gültigkeitsdauer für Anfragen (30 Minuten)
-REQUEST_TIMEOUT_MINUTES = 30
-
-
-def cleanup_expired_requests():
-    """Entfernt abgelaufene Anfragen"""
-    now = datetime.now()
-    expired = [code for code, req in pending_requests.items()
-               if now - req['created'] > timedelta(minutes=REQUEST_TIMEOUT_MINUTES)]
-    for code in expired:
-        # Temporäre Datei löschen falls vorhanden
-        if 'file_path' in pending_requests[code] and os.path.exists(pending_requests[code]['file_path']):
-            try:
-                os.remove(pending_requests[code]['file_path'])
-            except:
-                pass
-        del pending_requests[code]
-
 
 def get_admin_role(token):
     """Gibt die Admin-Rolle zurück (1, 2 oder None)"""
@@ -156,11 +139,11 @@ def setup_index():
     waiting_for_me = []
 
     if is_two_person_mode() and admin_role:
-        for code, req in pending_requests.items():
+        for req in setup_store.list_requests():
             if req.get('admin1') == admin_role:
-                my_pending.append({'code': code, **req})
-            elif req.get('admin1') != admin_role:
-                waiting_for_me.append({'code': code, **req})
+                my_pending.append(req)
+            else:
+                waiting_for_me.append(req)
 
     return render_template('setup_index.html',
                           db_status=db_status,
@@ -254,20 +237,13 @@ def restore_backup():
 
         # Zwei-Personen-Modus: Anfrage erstellen
         if is_two_person_mode():
-            # Temporäre Datei speichern
-            temp_dir = tempfile.gettempdir()
+            # Backup unter Inhalts-Hash ablegen und Anfrage speichern
             confirmation_code = secrets.token_hex(8).upper()
-            temp_path = os.path.join(temp_dir, f'restore_{confirmation_code}.sql')
-            backup_file.save(temp_path)
-
-            # Anfrage speichern
-            pending_requests[confirmation_code] = {
-                'file_path': temp_path,
-                'filename': backup_file.filename,
-                'admin1': admin_role,
-                'created': datetime.now(),
-                'action': 'restore'
-            }
+            payload_hash = setup_store.save_payload(backup_file)
+            setup_store.create_request(
+                confirmation_code, 'restore', admin_role,
+                filename=backup_file.filename, payload_hash=payload_hash
+            )
 
             flash(f'Restore-Anfrage erstellt! Bestätigungs-Code: {confirmation_code}', 'success')
             flash(f'Der zweite Administrator muss diesen Code bestätigen (gültig für {REQUEST_TIMEOUT_MINUTES} Minuten).', 'info')
@@ -276,21 +252,13 @@ def restore_backup():
         # Einfacher Modus: Direkt ausführen
         try:
             if USING_POSTGRESQL:
-                from database import PG_HOST, PG_PORT, PG_DATABASE, PG_USER, PG_PASSWORD
-
                 # Temporäre Datei speichern
                 temp_dir = tempfile.gettempdir()
                 temp_path = os.path.join(temp_dir, 'restore_backup.sql')
                 backup_file.save(temp_path)
 
                 # Restore ausführen
-                env = os.environ.copy()
-                env['PGPASSWORD'] = PG_PASSWORD
-
-                result = subprocess.run([
-                    'psql', '-h', PG_HOST, '-p', str(PG_PORT),
-                    '-U', PG_USER, '-d', PG_DATABASE, '-f', temp_path
-                ], env=env, capture_output=True, text=True)
+                result = befehl_ausfuehren(*pg_befehl('psql', '-f', temp_path))
 
                 os.remove(temp_path)
 
@@ -340,37 +308,29 @@ def confirm_restore(code):
         flash('Zwei-Personen-Modus nicht aktiv.', 'warning')
         return redirect(url_for('setup.setup_index', token=token))
 
-    if code not in pending_requests:
+    req = setup_store.get_request(code)
+    if req is None:
         flash('Ungültiger oder abgelaufener Bestätigungs-Code!', 'danger')
         return redirect(url_for('setup.setup_index', token=token))
 
-    req = pending_requests[code]
-
     # Prüfen ob anderer Admin bestätigt
     if req['admin1'] == admin_role:
         flash('Sie können Ihre eigene Anfrage nicht bestätigen! Der andere Administrator muss bestätigen.', 'warning')
         return redirect(url_for('setup.setup_index', token=token))
 
     if request.method == 'POST':
+        # Anfrage entnehmen - verhindert doppelte Ausführung durch parallele Requests
+        req = setup_store.claim_request(code)
+        if req is None:
+            flash('Anfrage wurde bereits ausgeführt oder ist abgelaufen.', 'warning')
+            return redirect(url_for('setup.setup_index', token=token))
+
         # Restore durchführen
         try:
-            if USING_POSTGRESQL:
-                from database import PG_HOST, PG_PORT, PG_DATABASE, PG_USER, PG_PASSWORD
-
-                env = os.environ.copy()
-                env['PGPASSWORD'] = PG_PASSWORD
-
-                result = subprocess.run([
-                    'psql', '-h', PG_HOST, '-p', str(PG_PORT),
-                    '-U', PG_USER, '-d', PG_DATABASE, '-f', req['file_path']
-                ], env=env, capture_output=True, text=True)
-
-                # Temporäre Datei löschen
-                if os.path.exists(req['file_path']):
-                    os.remove(req['file_path'])
-
-                # Anfrage entfernen
-                del pending_requests[code]
+            if not req.get('file_path'):
+                flash('Backup-Datei fehlt oder stammt nicht von dieser Anwendung - bitte erneut hochladen.', 'danger')
+            elif USING_POSTGRESQL:
+                result = befehl_ausfuehren(*pg_befehl('psql', '-f', req['file_path']))
 
                 if result.returncode != 0:
                     flash(f'Restore-Fehler: {result.stderr[:500]}', 'danger')
@@ -386,9 +346,14 @@ def confirm_restore(code):
                         pass
 
                     flash('Backup erfolgreich wiederhergestellt! (Bestätigt durch 2 Administratoren)', 'success')
+            else:
+                flash('SQLite-Restore nicht implementiert', 'warning')
 
         except Exception as e:
             flash(f'Fehler bei Wiederherstellung: {str(e)}', 'danger')
+        finally:
+            # Backup-Datei löschen
+            setup_store.release_payload(req.get('payload_hash'))
 
         return redirect(url_for('setup.setup_index', token=token))
 
@@ -408,15 +373,7 @@ def cancel_request(code):
 
     token = request.form.get('token')
 
-    if code in pending_requests:
-        req = pending_requests[code]
-        # Temporäre Datei löschen
-        if 'file_path' in req and os.path.exists(req['file_path']):
-            try:
-                os.remove(req['file_path'])
-            except:
-                pass
-        del pending_requests[code]
+    if setup_store.cancel_request(code):
         flash('Anfrage wurde abgebrochen.', 'info')
     else:
         flash('Anfrage nicht gefunden oder bereits abgelaufen.', 'warning')
@@ -444,9 +401,8 @@ def create_admin():
 
         try:
             if USING_POSTGRESQL:
-                from database import PG_HOST, PG_PORT, PG_DATABASE, PG_USER, PG_PASSWORD
+                from database import PG_HOST, PG_PORT, PG_DATABASE, PG_USER, PG_PASSWORD, hash_password
                 import psycopg2
-                from werkzeug.security import generate_password_hash
 
                 conn = psycopg2.connect(
                     host=PG_HOST,
@@ -465,7 +421,7 @@ def create_admin():
                     return redirect(url_for('setup.setup_index', token=token))
 
                 # Admin erstellen
-                password_hash = generate_password_hash(password)
+                password_hash = hash_password(password)
                 cursor.execute("""
                     INSERT INTO benutzer (username, password_hash, name, vorname, is_admin, admin_level, aktiv)
                     VALUES (%s, %s, %s, %s, TRUE, 3, TRUE)
@@ -496,16 +452,10 @@ def create_backup():
 
     try:
         if USING_POSTGRESQL:
-            from database import PG_HOST, PG_PORT, PG_DATABASE, PG_USER, PG_PASSWORD
+            from database import PG_DATABASE
             from flask import make_response
 
-            env = os.environ.copy()
-            env['PGPASSWORD'] = PG_PASSWORD
-
-            result = subprocess.run([
-                'pg_dump', '-h', PG_HOST, '-p', str(PG_PORT),
-                '-U', PG_USER, PG_DATABASE
-            ], env=env, capture_output=True, text=True)
+            result = befehl_ausfuehren(*pg_befehl('pg_dump'))
 
             if result.returncode != 0:
                 flash(f'Backup-Fehler: {result.stderr[:500]}', 'danger')
@@ -538,7 +488,7 @@ def status():
     status = {
         'timestamp': datetime.now().isoformat(),
         'two_person_mode': is_two_person_mode(),
-        'pending_requests': len(pending_requests),
+        'pending_requests': len(setup_store.list_requests()),
         'database': {
             'type': 'postgresql' if USING_POSTGRESQL else 'sqlite',
             'connected': False
@@ -86,6 +86,7 @@ CREATE TABLE IF NOT EXISTS maschineneinsaetze (
     flaeche_menge REAL,
     kosten_berechnet REAL,
     anmerkungen TEXT,
+    sync_schluessel TEXT,
     erstellt_am DATETIME DEFAULT CURRENT_TIMESTAMP,
     geaendert_am DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (benutzer_id) REFERENCES benutzer(id),
@@ -95,9 +96,13 @@ CREATE TABLE IF NOT EXISTS maschineneinsaetze (
 );
 
 -- Indizes für Performance
-CREATE INDEX IF NOT EXISTS idx_einsaetze_datum ON maschineneinsaetze(datum);
-CREATE INDEX IF NOT EXISTS idx_einsaetze_benutzer ON maschineneinsaetze(benutzer_id);
-CREATE INDEX IF NOT EXISTS idx_einsaetze_maschine ON maschineneinsaetze(maschine_id);
+CREATE INDEX IF NOT EXISTS idx_benutzer_username ON benutzer(username);
+CREATE INDEX IF NOT EXISTS idx_einsaetze_datum_id ON maschineneinsaetze(datum DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_einsaetze_benutzer_datum ON maschineneinsaetze(benutzer_id, datum DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_einsaetze_maschine_datum ON maschineneinsaetze(maschine_id, datum DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_einsaetze_maschine_anfang ON maschineneinsaetze(maschine_id, anfangstand);
+CREATE INDEX IF NOT EXISTS idx_einsaetze_maschine_ende ON maschineneinsaetze(maschine_id, endstand);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_einsaetze_sync_schluessel ON maschineneinsaetze(benutzer_id, sync_schluessel);
 
 -- Beispieldaten für Einsatzzwecke
 INSERT OR IGNORE INTO einsatzzwecke (bezeichnung, beschreibung) VALUES
@@ -186,7 +191,21 @@ CREATE TABLE IF NOT EXISTS maschineneinsaetze_storniert (
     erstellt_am DATETIME,
     storniert_am DATETIME DEFAULT CURRENT_TIMESTAMP,
     storniert_von INTEGER REFERENCES benutzer(id),
-    storno_grund TEXT
+    storno_grund TEXT,
+    storno_vorgang TEXT,
+    sync_schluessel TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_storniert_vorgang ON maschineneinsaetze_storniert(storno_vorgang);
+
+-- Beim Storno geminderte Abrechnungsbeträge, damit der Widerruf genau diese
+-- zurückstellt (siehe utils/einsatz_storno.py)
+CREATE TABLE IF NOT EXISTS storno_abrechnungen (
+    storno_vorgang TEXT NOT NULL,
+    abrechnung_id INTEGER NOT NULL,
+    betrag_maschinen REAL NOT NULL DEFAULT 0,
+    betrag_treibstoff REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (storno_vorgang, abrechnung_id)
 );
 
 -- Tabelle für Gemeinschafts-Nachrichten
@@ -212,6 +231,19 @@ CREATE TABLE IF NOT EXISTS nachricht_gelesen (
     PRIMARY KEY (nachricht_id, benutzer_id)
 );
 
+-- Posteingang: Empfänger jeder Nachricht (beim Senden verteilt)
+CREATE TABLE IF NOT EXISTS nachrichten_posteingang (
+    benutzer_id INTEGER NOT NULL REFERENCES benutzer(id) ON DELETE CASCADE,
+    nachricht_id INTEGER NOT NULL REFERENCES gemeinschafts_nachrichten(id) ON DELETE CASCADE,
+    PRIMARY KEY (benutzer_id, nachricht_id)
+);
+
+-- Zähler ungelesener Nachrichten pro Benutzer
+CREATE TABLE IF NOT EXISTS nachrichten_ungelesen (
+    benutzer_id INTEGER PRIMARY KEY REFERENCES benutzer(id) ON DELETE CASCADE,
+    anzahl INTEGER NOT NULL DEFAULT 0
+);
+
 -- Tabelle für Maschinen-Reservierungen
 CREATE TABLE IF NOT EXISTS maschinen_reservierungen (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -228,28 +260,46 @@ CREATE TABLE IF NOT EXISTS maschinen_reservierungen (
     erstellt_am DATETIME DEFAULT CURRENT_TIMESTAMP,
     storniert BOOLEAN DEFAULT 0,
     storniert_am DATETIME,
+    ende_zeitpunkt TEXT GENERATED ALWAYS AS (datum || ' ' || COALESCE(NULLIF(uhrzeit_bis, ''), '23:59')) VIRTUAL,
     UNIQUE(maschine_id, datum, benutzer_id)
 );
 
 CREATE INDEX IF NOT EXISTS idx_reservierungen_maschine ON maschinen_reservierungen(maschine_id);
 CREATE INDEX IF NOT EXISTS idx_reservierungen_benutzer ON maschinen_reservierungen(benutzer_id);
 CREATE INDEX IF NOT EXISTS idx_reservierungen_datum ON maschinen_reservierungen(datum);
+CREATE INDEX IF NOT EXISTS idx_reservierungen_status_ende ON maschinen_reservierungen(status, ende_zeitpunkt);
+CREATE INDEX IF NOT EXISTS idx_reservierungen_status_datum ON maschinen_reservierungen(status, datum);
+CREATE INDEX IF NOT EXISTS idx_reservierungen_maschine_status_datum ON maschinen_reservierungen(maschine_id, status, datum);
+CREATE INDEX IF NOT EXISTS idx_reservierungen_benutzer_status_datum ON maschinen_reservierungen(benutzer_id, status, datum);
 
 -- Tabelle für Maschinen-Aufwendungen
 CREATE TABLE IF NOT EXISTS maschinen_aufwendungen (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    maschine_id INTEGER NOT NULL REFERENCES maschinen(id),
-    datum DATE NOT NULL,
-    art TEXT NOT NULL,
-    beschreibung TEXT,
-    betrag REAL NOT NULL,
-    beleg_nr TEXT,
+    maschine_id INTEGER NOT NULL REFERENCES maschinen(id) ON DELETE CASCADE,
+    jahr INTEGER NOT NULL,
+    wartungskosten REAL DEFAULT 0.0,
+    reparaturkosten REAL DEFAULT 0.0,
+    versicherung REAL DEFAULT 0.0,
+    steuern REAL DEFAULT 0.0,
+    sonstige_kosten REAL DEFAULT 0.0,
+    bemerkung TEXT,
     erstellt_am DATETIME DEFAULT CURRENT_TIMESTAMP,
-    erstellt_von INTEGER REFERENCES benutzer(id)
+    geaendert_am DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(maschine_id, jahr)
 );
 
-CREATE INDEX IF NOT EXISTS idx_aufwendungen_maschine ON maschinen_aufwendungen(maschine_id);
-CREATE INDEX IF NOT EXISTS idx_aufwendungen_datum ON maschinen_aufwendungen(datum);
+-- Kennzahlen-Cache pro Maschine und Jahr (siehe utils/maschinen_kennzahlen.py)
+CREATE TABLE IF NOT EXISTS maschinen_kennzahlen (
+    maschine_id INTEGER NOT NULL,
+    jahr INTEGER NOT NULL,
+    anzahl_einsaetze INTEGER DEFAULT 0,
+    betriebsstunden REAL DEFAULT 0,
+    einnahmen REAL DEFAULT 0,
+    aufwendungen REAL DEFAULT 0,
+    bankkosten REAL DEFAULT 0,
+    aktualisiert_am DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (maschine_id, jahr)
+);
 
 -- Tabelle für Bank-Transaktionen
 CREATE TABLE IF NOT EXISTS bank_transaktionen (
@@ -263,6 +313,7 @@ CREATE TABLE IF NOT EXISTS bank_transaktionen (
     iban TEXT,
     bic TEXT,
     importiert_am DATETIME DEFAULT CURRENT_TIMESTAMP,
+    import_datum TEXT GENERATED ALWAYS AS (substr(importiert_am, 1, 10)) VIRTUAL,
     importiert_von INTEGER REFERENCES benutzer(id),
     zugeordnet BOOLEAN DEFAULT 0,
     zugeordnet_zu_mitglied INTEGER REFERENCES benutzer(id),
@@ -299,6 +350,7 @@ CREATE TABLE IF NOT EXISTS buchungen (
 
 CREATE INDEX IF NOT EXISTS idx_buchungen_konto ON buchungen(konto_id);
 CREATE INDEX IF NOT EXISTS idx_buchungen_datum ON buchungen(datum);
+CREATE INDEX IF NOT EXISTS idx_buchungen_referenz ON buchungen(referenz_typ, referenz_id, datum);
 
 -- Tabelle für Mitglieder-Abrechnungen
 CREATE TABLE IF NOT EXISTS mitglieder_abrechnungen (
@@ -357,15 +409,18 @@ CREATE TABLE IF NOT EXISTS csv_import_konfiguration (
 CREATE TABLE IF NOT EXISTS gemeinschafts_kosten (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     gemeinschaft_id INTEGER NOT NULL REFERENCES gemeinschaften(id),
-    bezeichnung TEXT NOT NULL,
+    transaktion_id INTEGER REFERENCES bank_transaktionen(id),
+    maschine_id INTEGER REFERENCES maschinen(id),
+    kategorie TEXT NOT NULL,
     betrag REAL NOT NULL,
     datum DATE NOT NULL,
-    kategorie TEXT,
     beschreibung TEXT,
     erstellt_am DATETIME DEFAULT CURRENT_TIMESTAMP,
     erstellt_von INTEGER REFERENCES benutzer(id)
 );
 
+CREATE INDEX IF NOT EXISTS idx_gemeinschafts_kosten_maschine ON gemeinschafts_kosten(maschine_id, datum);
+
 -- Tabelle für Jahresabschlüsse
 CREATE TABLE IF NOT EXISTS jahresabschluesse (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -376,9 +431,49 @@ CREATE TABLE IF NOT EXISTS jahresabschluesse (
     gesamteinnahmen REAL,
     gesamtausgaben REAL,
     bemerkung TEXT,
+    anzahl_einsaetze INTEGER DEFAULT 0,
+    summe_einsaetze REAL DEFAULT 0,
+    anzahl_buchungen INTEGER DEFAULT 0,
+    anzahl_transaktionen INTEGER DEFAULT 0,
+    bank_saldo_archiviert REAL,
     UNIQUE(gemeinschaft_id, jahr)
 );
 
+-- Salden pro Betrieb zum Jahresende (Vortrag ins Folgejahr)
+CREATE TABLE IF NOT EXISTS jahresabschluss_salden (
+    gemeinschaft_id INTEGER NOT NULL REFERENCES gemeinschaften(id),
+    jahr INTEGER NOT NULL,
+    betrieb_id INTEGER NOT NULL REFERENCES betriebe(id),
+    saldo_vortrag REAL NOT NULL DEFAULT 0,
+    bewegungen REAL NOT NULL DEFAULT 0,
+    saldo_ende REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (gemeinschaft_id, jahr, betrieb_id)
+);
+
+-- Tabelle für Cache-Versionen (prozessübergreifende Invalidierung)
+CREATE TABLE IF NOT EXISTS cache_versionen (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Tabelle für Hintergrund-Jobs (Backups, Exporte, Abrechnungsläufe)
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    typ TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'wartend',
+    parameter TEXT,
+    fortschritt INTEGER NOT NULL DEFAULT 0,
+    meldung TEXT,
+    ergebnis TEXT,
+    erstellt_von INTEGER,
+    erstellt_am DATETIME DEFAULT CURRENT_TIMESTAMP,
+    gestartet_am DATETIME,
+    aktualisiert_am DATETIME,
+    beendet_am DATETIME
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+
 -- Standard-Admin-Benutzer
 -- Login: admin / admin123
 INSERT OR IGNORE INTO benutzer (id, name, vorname, username, password_hash, is_admin, admin_level, aktiv)
@@ -389,6 +484,10 @@ CREATE VIEW IF NOT EXISTS einsaetze_uebersicht AS
 SELECT
     e.id,
     e.datum,
+    e.benutzer_id,
+    e.maschine_id,
+    m.gemeinschaft_id,
+    e.einsatzzweck_id,
     b.name || ', ' || COALESCE(b.vorname, '') AS benutzer,
     m.bezeichnung AS maschine,
     m.abrechnungsart AS abrechnungsart,
@@ -405,8 +504,7 @@ SELECT
 FROM maschineneinsaetze e
 JOIN benutzer b ON e.benutzer_id = b.id
 JOIN maschinen m ON e.maschine_id = m.id
-JOIN einsatzzwecke ez ON e.einsatzzweck_id = ez.id
-ORDER BY e.datum DESC;
+JOIN einsatzzwecke ez ON e.einsatzzweck_id = ez.id;
 
 CREATE VIEW IF NOT EXISTS gemeinschaften_uebersicht AS
 SELECT
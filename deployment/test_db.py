@@ -74,14 +74,12 @@ try:
             row = db.cursor.fetchone()
             if row:
                 print(f"  Gespeicherter Hash: {row[0][:40]}...")
-                # Erwarteter Hash für 'admin123'
-                import hashlib
-                expected = hashlib.sha256('admin123'.encode()).hexdigest()
-                print(f"  Erwarteter Hash:    {expected[:40]}...")
-                if row[0] == expected:
-                    print("  Hashes stimmen überein!")
+                # Hash gegen 'admin123' prüfen (scrypt/PBKDF2 oder Alt-SHA-256)
+                from database import check_password
+                if check_password(row[0], 'admin123'):
+                    print("  Hash passt zu 'admin123' - Benutzer inaktiv?")
                 else:
-                    print("  HASHES UNTERSCHIEDLICH!")
+                    print("  HASH PASST NICHT ZU 'admin123'!")
 
 except Exception as e:
     print(f"FEHLER: {e}")
@@ -5,6 +5,7 @@ Utility-Module für Maschinengemeinschaft Web-App
 
 from .decorators import login_required, admin_required, hauptadmin_required
 from .sql_helpers import convert_sql, db_execute
+from .auth_context import get_auth_context, invalidate_auth_context
 from .training import (
     TRAINING_DATABASES,
     get_current_db_path,
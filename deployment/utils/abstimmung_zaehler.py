@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Zähler für Abstimmungen
+
+Jede Abstimmung führt ihre Zwischenstände direkt in der Zeile (stimmen_ja,
+stimmen_nein, stimmen_enthaltung, stimmen_gesamt). Die Zähler werden bei
+jeder Stimmabgabe in derselben Transaktion per Differenz angepasst - Liste,
+Detailseite und Live-Ergebnis lesen nur noch diese Spalten, statt die
+Stimmen jedes Mal neu zu zählen.
+
+Doppelte Stimmen verhindert UNIQUE(abstimmung_id, benutzer_id): die Stimme
+wird per INSERT OR IGNORE angelegt; existiert sie bereits, wird die Zeile
+gesperrt (PostgreSQL: FOR UPDATE) und nur bei geänderter Wahl aktualisiert.
+Die Zähler-Änderung greift nur solange die Abstimmung offen ist.
+"""
+
+from datetime import datetime
+
+from database import USING_POSTGRESQL
+from utils.sql_helpers import convert_sql
+
+STIMMEN = ('ja', 'nein', 'enthaltung')
+
+
+class AbstimmungGeschlossen(Exception):
+    """Stimmabgabe auf eine nicht (mehr) offene Abstimmung"""
+
+
+def _zaehler_anpassen(cursor, abstimmung_id, plus=None, minus=None):
+    """Zähler per Differenz ändern - nur bei offener Abstimmung"""
+    teile = []
+    if plus:
+        teile.append(f"stimmen_{plus} = stimmen_{plus} + 1")
+    if minus:
+        teile.append(f"stimmen_{minus} = stimmen_{minus} - 1")
+    if plus and not minus:
+        teile.append("stimmen_gesamt = stimmen_gesamt + 1")
+
+    sql = convert_sql(f"""
+        UPDATE abstimmungen SET {', '.join(teile)}
+        WHERE id = ? AND status = 'offen'
+    """)
+    cursor.execute(sql, (abstimmung_id,))
+    if cursor.rowcount == 0:
+        raise AbstimmungGeschlossen(abstimmung_id)
+
+
+def stimme_abgeben(cursor, abstimmung_id, benutzer_id, stimme):
+    """Stimme abgeben oder ändern und Zähler nachführen
+
+    Gibt die vorherige Stimme zurück (None bei erster Stimmabgabe).
+    Wirft AbstimmungGeschlossen wenn die Abstimmung nicht mehr offen ist;
+    der Aufrufer muss dann ein Rollback ausführen.
+    """
+    if stimme not in STIMMEN:
+        raise ValueError(f"Ungültige Stimme: {stimme}")
+
+    sql = convert_sql("""
+        INSERT OR IGNORE INTO abstimmung_stimmen (abstimmung_id, benutzer_id, stimme)
+        VALUES (?, ?, ?)
+    """)
+    cursor.execute(sql, (abstimmung_id, benutzer_id, stimme))
+    if cursor.rowcount == 1:
+        _zaehler_anpassen(cursor, abstimmung_id, plus=stimme)
+        return None
+
+    # Bereits abgestimmt: Zeile sperren, damit parallele Änderungen
+    # derselben Stimme die Zähler nicht doppelt verschieben
+    sperre = ' FOR UPDATE' if USING_POSTGRESQL else ''
+    sql = convert_sql(f"""
+        SELECT stimme FROM abstimmung_stimmen
+        WHERE abstimmung_id = ? AND benutzer_id = ?{sperre}
+    """)
+    cursor.execute(sql, (abstimmung_id, benutzer_id))
+    alte_stimme = cursor.fetchone()[0]
+
+    if alte_stimme != stimme:
+        sql = convert_sql("""
+            UPDATE abstimmung_stimmen
+            SET stimme = ?, abgegeben_am = ?
+            WHERE abstimmung_id = ? AND benutzer_id = ?
+        """)
+        cursor.execute(sql, (
+            stimme,
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            abstimmung_id,
+            benutzer_id
+        ))
+        _zaehler_anpassen(cursor, abstimmung_id, plus=stimme, minus=alte_stimme)
+
+    return alte_stimme
+
+
+def statistik_aus_zeile(abstimmung):
+    """Zwischenstand aus einer Abstimmungs-Zeile (dict) lesen"""
+    statistik = {s: abstimmung.get(f'stimmen_{s}') or 0 for s in STIMMEN}
+    statistik['gesamt'] = abstimmung.get('stimmen_gesamt') or 0
+    return statistik
+
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Auslastung der Maschinen einer Gemeinschaft über eine Saison (Kalenderjahr)
+
+Statt einer Abfrage pro Maschine und Woche werden Einsätze und
+Reservierungen der Gemeinschaft mit je einer Abfrage geladen und in
+Spalten-Arrays (Modul array) abgelegt: ein Raster Maschine x Tag für
+Einsatzstunden, Einsatztage, reservierte Tage und reservierte Stunden.
+Alle Kennzahlen sind danach Durchläufe über Array-Ausschnitte:
+
+- Wochenauslastung: Einsatztage pro Woche je Maschine
+- Stillstände: Läufe ohne Einsatz (über bytes.split, ohne Python-Schleife je Tag)
+- Spitzentage: Tage mit den meisten gleichzeitig genutzten/reservierten Maschinen
+- Reservierung vs. Nutzung: reservierte Tage mit tatsächlichem Einsatz
+
+Reservierungen kommen aus maschinen_reservierungen (noch aktiv) und
+reservierungen_abgelaufen (archiviert); Einsätze inkl. archivierter Jahre.
+Ergebnisse werden pro Prozess, Datenbank, Gemeinschaft und Saison für
+AUSLASTUNG_TTL_SECONDS gehalten.
+"""
+
+import os
+import time
+import threading
+from array import array
+from datetime import date, timedelta
+
+from utils.sql_helpers import convert_sql, datum_bereich
+from utils.jahresabschluss import einsaetze_quelle
+
+AUSLASTUNG_TTL_SECONDS = int(os.environ.get('AUSLASTUNG_TTL_SECONDS', 900))
+
+# Stillstände ab dieser Länge (Tage) werden gezählt
+STILLSTAND_TAGE = 14
+
+# Anzahl ausgewiesener Spitzentage
+SPITZENTAGE = 10
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _datum(wert):
+    return wert if isinstance(wert, date) else date.fromisoformat(str(wert)[:10])
+
+
+def _stunden(von, bis):
+    """Dauer zwischen zwei Uhrzeiten 'HH:MM' in Stunden (0 wenn unbekannt)"""
+    try:
+        h1, m1 = str(von).split(':')[:2]
+        h2, m2 = str(bis).split(':')[:2]
+        return max((int(h2) * 60 + int(m2) - int(h1) * 60 - int(m1)) / 60, 0)
+    except (ValueError, AttributeError):
+        return 0
+
+
+class _Raster:
+    """Spalten-Arrays Maschine x Tag einer Saison"""
+
+    def __init__(self, maschinen, start, tage):
+        self.maschinen = maschinen
+        self.index = {m['id']: i for i, m in enumerate(maschinen)}
+        self.start = start.toordinal()
+        self.tage = tage
+        zellen = len(maschinen) * tage
+        self.stunden = array('d', bytes(8 * zellen))
+        self.genutzt = array('B', bytes(zellen))
+        self.reserviert = array('B', bytes(zellen))
+        self.res_stunden = array('d', bytes(8 * zellen))
+
+    def zelle(self, maschine_id, datum):
+        i = self.index.get(maschine_id)
+        tag = _datum(datum).toordinal() - self.start
+        if i is None or not 0 <= tag < self.tage:
+            return None
+        return i * self.tage + tag
+
+    def zeile(self, spalte, i):
+        return spalte[i * self.tage:(i + 1) * self.tage]
+
+
+def _laden(db, gemeinschaft_id, jahr, bis):
+    """Einsätze und Reservierungen der Saison in ein Raster laden (je eine Abfrage)"""
+    cursor = db.connection.cursor()
+    start = date(jahr, 1, 1)
+
+    cursor.execute(convert_sql("""
+        SELECT id, bezeichnung FROM maschinen
+        WHERE gemeinschaft_id = ? AND aktiv = true
+        ORDER BY bezeichnung
+    """), (gemeinschaft_id,))
+    maschinen = [{'id': row[0], 'bezeichnung': row[1]} for row in cursor.fetchall()]
+    raster = _Raster(maschinen, start, (bis - start).days + 1)
+    if not maschinen:
+        return raster
+
+    saison, params = datum_bereich('e.datum', start, bis)
+    cursor.execute(convert_sql(f"""
+        SELECT e.maschine_id, e.datum, e.endstand - e.anfangstand
+        FROM {einsaetze_quelle(db)} e
+        JOIN maschinen m ON e.maschine_id = m.id
+        WHERE m.gemeinschaft_id = ? AND {saison}
+    """), [gemeinschaft_id] + params)
+    for maschine_id, datum, stunden in cursor.fetchall():
+        z = raster.zelle(maschine_id, datum)
+        if z is not None:
+            raster.stunden[z] += stunden or 0
+            raster.genutzt[z] = 1
+
+    # Aktive Reservierungen stehen nur in der Arbeitstabelle, abgelaufene nur im Archiv
+    aktiv, aktiv_params = datum_bereich('r.datum', start, bis)
+    archiv, archiv_params = datum_bereich('a.datum', start, bis)
+    cursor.execute(convert_sql(f"""
+        SELECT r.maschine_id, r.datum, r.uhrzeit_von, r.uhrzeit_bis, r.nutzungsdauer_stunden
+        FROM maschinen_reservierungen r
+        JOIN maschinen m ON r.maschine_id = m.id
+        WHERE m.gemeinschaft_id = ? AND r.status = 'aktiv' AND {aktiv}
+        UNION ALL
+        SELECT a.maschine_id, a.datum, a.uhrzeit_von, a.uhrzeit_bis, a.nutzungsdauer_stunden
+        FROM reservierungen_abgelaufen a
+        JOIN maschinen m ON a.maschine_id = m.id
+        WHERE m.gemeinschaft_id = ? AND {archiv}
+    """), [gemeinschaft_id] + aktiv_params + [gemeinschaft_id] + archiv_params)
+    for maschine_id, datum, uhrzeit_von, uhrzeit_bis, dauer in cursor.fetchall():
+        z = raster.zelle(maschine_id, datum)
+        if z is not None:
+            raster.reserviert[z] = 1
+            raster.res_stunden[z] += dauer if dauer else _stunden(uhrzeit_von, uhrzeit_bis)
+
+    return raster
+
+
+def _stillstaende(genutzt_zeile):
+    """Läufe ohne Einsatz als Liste (erster_tag, laenge)"""
+    laeufe = []
+    tag = 0
+    for lauf in genutzt_zeile.tobytes().split(b'\x01'):
+        if lauf:
+            laeufe.append((tag, len(lauf)))
+        tag += len(lauf) + 1
+    return laeufe
+
+
+def _berechnen(raster):
+    """Alle Kennzahlen aus dem Raster"""
+    tage = raster.tage
+    start = date.fromordinal(raster.start)
+    wochen = (tage + 6) // 7
+
+    maschinen = []
+    for i, m in enumerate(raster.maschinen):
+        genutzt = raster.zeile(raster.genutzt, i)
+        reserviert = raster.zeile(raster.reserviert, i)
+
+        einsatztage = sum(genutzt)
+        reservierte_tage = sum(reserviert)
+        # Reservierte Tage mit Einsatz: UND über beide Zeilen als große Ganzzahl
+        # (jeder Tag ist ein Byte 0/1, die gesetzten Bits zählen die Tage)
+        eingeloest = bin(int.from_bytes(genutzt.tobytes(), 'big')
+                         & int.from_bytes(reserviert.tobytes(), 'big')).count('1')
+
+        pro_woche = [sum(genutzt[w * 7:(w + 1) * 7]) for w in range(wochen)]
+        laeufe = _stillstaende(genutzt)
+        laengster = max(laeufe, key=lambda l: l[1], default=None)
+
+        maschinen.append({
+            'id': m['id'],
+            'bezeichnung': m['bezeichnung'],
+            'einsatztage': einsatztage,
+            'stunden': sum(raster.zeile(raster.stunden, i)),
+            'auslastung_prozent': einsatztage / tage * 100 if tage else 0,
+            'wochen': [
+                tage_genutzt / min(7, tage - w * 7) * 100
+                for w, tage_genutzt in enumerate(pro_woche)
+            ],
+            'stillstaende': sum(1 for _, laenge in laeufe if laenge >= STILLSTAND_TAGE),
+            'laengster_stillstand': laengster[1] if laengster else 0,
+            'laengster_stillstand_ab': start + timedelta(days=laengster[0]) if laengster else None,
+            'reservierte_tage': reservierte_tage,
+            'reservierte_stunden': sum(raster.zeile(raster.res_stunden, i)),
+            'eingeloeste_tage': eingeloest,
+            'einloesequote': eingeloest / reservierte_tage * 100 if reservierte_tage else None,
+            'ohne_reservierung': einsatztage - eingeloest,
+        })
+
+    # Spitzentage: Spalten-Summen über alle Maschinen (Schrittweite = Tage pro Maschine)
+    genutzt_pro_tag = [sum(raster.genutzt[t::tage]) for t in range(tage)]
+    reserviert_pro_tag = [sum(raster.reserviert[t::tage]) for t in range(tage)]
+    spitzen = sorted(range(tage), key=lambda t: (genutzt_pro_tag[t], reserviert_pro_tag[t]), reverse=True)
+    spitzentage = [{
+        'datum': start + timedelta(days=t),
+        'genutzt': genutzt_pro_tag[t],
+        'reserviert': reserviert_pro_tag[t],
+    } for t in spitzen[:SPITZENTAGE] if genutzt_pro_tag[t] or reserviert_pro_tag[t]]
+
+    return {
+        'von': start,
+        'bis': start + timedelta(days=tage - 1),
+        'tage': tage,
+        'wochen': [start + timedelta(days=w * 7) for w in range(wochen)],
+        'maschinen': maschinen,
+        'spitzentage': spitzentage,
+        'einsatztage': sum(m['einsatztage'] for m in maschinen),
+        'reservierte_tage': sum(m['reservierte_tage'] for m in maschinen),
+        'eingeloeste_tage': sum(m['eingeloeste_tage'] for m in maschinen),
+        'berechnet_am': time.time(),
+    }
+
+
+def auslastung_laden(db, gemeinschaft_id, jahr, neu=False):
+    """Auslastung einer Gemeinschaft in einer Saison (aus dem Prozess-Cache)
+
+    Die laufende Saison endet heute; künftige Reservierungen zählen nicht.
+    neu=True berechnet unabhängig vom Cache neu.
+    """
+    heute = date.today()
+    if jahr > heute.year:
+        jahr = heute.year
+    bis = min(date(jahr, 12, 31), heute)
+    schluessel = (db.db_path, gemeinschaft_id, jahr)
+
+    with _lock:
+        eintrag = _cache.get(schluessel)
+    if (not neu and eintrag and eintrag['bis'] == bis
+            and time.time() - eintrag['berechnet_am'] < AUSLASTUNG_TTL_SECONDS):
+        return eintrag
+
+    ergebnis = _berechnen(_laden(db, gemeinschaft_id, jahr, bis))
+    with _lock:
+        _cache[schluessel] = ergebnis
+    return ergebnis
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Serverseitiger Berechtigungs-Kontext
+
+Statt den Feldern im Session-Cookie (is_admin, admin_level, rolle) zu vertrauen,
+wird pro Benutzer und Datenbank ein vorberechneter Kontext serverseitig abgelegt:
+- Admin-Level, Admin-Flag, Vorstandsrolle, Trainings-Einschränkung
+- verwaltete Gemeinschaften (gemeinschafts_admin) und deren Betriebe
+
+Maßgeblich ist die Datenbank, gegen die sich der Benutzer angemeldet hat
+(session['auth_datenbank'], bei Impersonation die Übungsdatenbank) - ein
+Wechsel in eine Übungsdatenbank ändert die eigenen Rechte nicht.
+
+Ablage als JSON-Datei in AUTH_CONTEXT_DIR (von allen Gunicorn-Workern geteilt,
+private Ablage mit 0o700/0o600, siehe utils/privat_ablage.py).
+Rechteprüfungen sind damit Set-Lookups ohne Datenbankzugriff; nach Änderungen
+an Rollen/Rechten wird der Kontext verworfen und beim nächsten Request neu
+aufgebaut - Änderungen wirken sofort, auch für bereits angemeldete Benutzer.
+"""
+
+import os
+import glob
+import json
+import time
+from flask import g, session
+
+from database import MaschinenDBContext
+from utils.training import get_db_path
+from utils.sql_helpers import convert_sql
+from utils.schema_migration import table_exists
+from utils.privat_ablage import privat_pfad, verzeichnis_sichern, datei_oeffnen, atomar_schreiben
+
+AUTH_CONTEXT_DIR = os.environ.get('AUTH_CONTEXT_DIR', privat_pfad('auth_kontext'))
+# Sicherheitsnetz für Änderungen direkt in der Datenbank (ohne App)
+AUTH_CONTEXT_TTL_SECONDS = int(os.environ.get('AUTH_CONTEXT_TTL_SECONDS', 900))
+
+
+def _context_path(benutzer_id, namespace):
+    return os.path.join(AUTH_CONTEXT_DIR, f'{namespace}_{int(benutzer_id)}.json')
+
+
+def build_auth_context(db, benutzer_id):
+    """Berechtigungs-Kontext eines Benutzers aus der Datenbank aufbauen"""
+    cursor = db.connection.cursor()
+
+    # SELECT * - ältere Übungsdatenbanken haben z.B. noch keine Spalte "rolle"
+    sql = convert_sql("SELECT * FROM benutzer WHERE id = ? AND (aktiv = true OR aktiv IS NULL)")
+    cursor.execute(sql, (benutzer_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    benutzer = dict(zip([desc[0] for desc in cursor.description], row))
+
+    kontext = {
+        'benutzer_id': benutzer['id'],
+        'is_admin': bool(benutzer.get('is_admin')),
+        'admin_level': benutzer.get('admin_level') or 0,
+        'rolle': benutzer.get('rolle'),
+        'nur_training': bool(benutzer.get('nur_training')),
+        'gemeinschafts_admin_ids': [],
+        'betrieb_admin_ids': [],
+        'erstellt': time.time()
+    }
+
+    sql = convert_sql("SELECT gemeinschaft_id FROM gemeinschafts_admin WHERE benutzer_id = ?")
+    cursor.execute(sql, (benutzer_id,))
+    kontext['gemeinschafts_admin_ids'] = sorted(r[0] for r in cursor.fetchall())
+
+    if kontext['gemeinschafts_admin_ids'] and table_exists(cursor, 'betriebe_gemeinschaften'):
+        sql = convert_sql("""
+            SELECT DISTINCT bg.betrieb_id
+            FROM betriebe_gemeinschaften bg
+            JOIN gemeinschafts_admin ga ON bg.gemeinschaft_id = ga.gemeinschaft_id
+            WHERE ga.benutzer_id = ?
+        """)
+        cursor.execute(sql, (benutzer_id,))
+        kontext['betrieb_admin_ids'] = sorted(r[0] for r in cursor.fetchall())
+
+    return kontext
+
+
+def _load(pfad):
+    """Kontext lesen - None wenn abgelaufen, fehlend oder nicht von uns angelegt"""
+    try:
+        with datei_oeffnen(pfad, 'r') as f:
+            if time.time() - os.fstat(f.fileno()).st_mtime > AUTH_CONTEXT_TTL_SECONDS:
+                return None
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _store(pfad, kontext):
+    try:
+        verzeichnis_sichern(AUTH_CONTEXT_DIR)
+        atomar_schreiben(pfad, json.dumps(kontext))
+    except OSError as e:
+        print(f"WARNUNG: Berechtigungs-Kontext nicht gespeichert: {e}")
+
+
+def get_auth_context():
+    """Berechtigungs-Kontext des angemeldeten Benutzers (pro Request gemerkt)
+
+    Gibt None zurück wenn niemand angemeldet ist oder der Benutzer nicht
+    mehr existiert bzw. deaktiviert wurde.
+    """
+    if 'auth_context' in g:
+        return g.auth_context
+
+    benutzer_id = session.get('benutzer_id')
+    kontext = None
+    if benutzer_id is not None:
+        db_key = session.get('auth_datenbank', 'produktion')
+        pfad = _context_path(benutzer_id, db_key)
+        kontext = _load(pfad)
+        if kontext is None:
+            with MaschinenDBContext(get_db_path(db_key)) as db:
+                kontext = build_auth_context(db, benutzer_id)
+            if kontext is not None:
+                _store(pfad, kontext)
+        if kontext is not None:
+            kontext['gemeinschafts_admin_set'] = set(kontext['gemeinschafts_admin_ids'])
+            kontext['betrieb_admin_set'] = set(kontext['betrieb_admin_ids'])
+
+    g.auth_context = kontext
+    return kontext
+
+
+def ist_gemeinschafts_admin(gemeinschaft_id):
+    """True für Haupt-Admins und Admins der angegebenen Gemeinschaft"""
+    kontext = get_auth_context()
+    if not kontext:
+        return False
+    if kontext['admin_level'] >= 2:
+        return True
+    try:
+        return int(gemeinschaft_id) in kontext['gemeinschafts_admin_set']
+    except (TypeError, ValueError):
+        return False
+
+
+def ist_betrieb_admin(betrieb_id):
+    """True für Haupt-Admins und Admins einer Gemeinschaft des Betriebs"""
+    kontext = get_auth_context()
+    if not kontext:
+        return False
+    if kontext['admin_level'] >= 2:
+        return True
+    try:
+        return int(betrieb_id) in kontext['betrieb_admin_set']
+    except (TypeError, ValueError):
+        return False
+
+
+def invalidate_auth_context(benutzer_id=None):
+    """Kontext verwerfen - für einen Benutzer (alle Datenbanken) oder für alle"""
+    muster = '*.json' if benutzer_id is None else f'*_{int(benutzer_id)}.json'
+    for pfad in glob.glob(os.path.join(AUTH_CONTEXT_DIR, muster)):
+        try:
+            os.remove(pfad)
+        except OSError:
+            pass
+    g.pop('auth_context', None)
+
+
+def sync_session_with_auth_context():
+    """Berechtigungsfelder in der Session an den Kontext angleichen
+
+    Templates und ältere Routen lesen weiterhin session['admin_level'] usw.;
+    so wirken Rechteänderungen dort ebenfalls ab dem nächsten Request.
+    """
+    kontext = get_auth_context()
+    if not kontext:
+        return
+
+    werte = {
+        'is_admin': kontext['is_admin'],
+        'admin_level': kontext['admin_level'],
+        'rolle': kontext['rolle'],
+        'gemeinschafts_admin_ids': kontext['gemeinschafts_admin_ids'] if kontext['admin_level'] == 1 else []
+    }
+    for key, value in werte.items():
+        if session.get(key) != value:
+            session[key] = value
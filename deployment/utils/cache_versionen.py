@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Versionszähler für prozessinterne Caches
+
+Gunicorn-Worker halten eigene Caches im Speicher. Damit Änderungen in einem
+Worker auch in allen anderen wirken, führt die Tabelle cache_versionen pro
+Cache einen Zähler. Schreibende Routen erhöhen ihn in ihrer Transaktion,
+lesende prüfen ihn per Primärschlüssel-Zugriff und bauen ihren Cache neu auf,
+sobald er sich geändert hat.
+"""
+
+import time
+
+from database import USING_POSTGRESQL
+from utils.sql_helpers import convert_sql
+
+# Alle Zähler - beim Austausch einer Datenbankdatei werden sie vorgerückt
+CACHE_NAMEN = ('mitgliedschaft', 'referenzdaten')
+
+# SQLite-Dateien, in denen die Tabelle in diesem Prozess geprüft wurde
+# (ältere Übungsdatenbanken werden nicht von der Schema-Migration erfasst)
+_geprueft = set()
+
+
+def _sicherstellen(db):
+    """Tabelle in älteren SQLite-Übungsdatenbanken einmalig nachrüsten"""
+    if USING_POSTGRESQL or db.db_path in _geprueft:
+        return
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cache_versionen (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    _geprueft.add(db.db_path)
+
+
+def version_lesen(db, name):
+    """Aktuelle Version eines Caches (0 wenn noch nie geändert)"""
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+    cursor.execute(convert_sql("SELECT version FROM cache_versionen WHERE name = ?"), (name,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def version_erhoehen(db, name):
+    """Cache in allen Prozessen ungültig machen (läuft in der Transaktion des Aufrufers)"""
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+    sql = convert_sql("INSERT OR IGNORE INTO cache_versionen (name, version) VALUES (?, 0)")
+    cursor.execute(sql, (name,))
+    sql = convert_sql("UPDATE cache_versionen SET version = version + 1 WHERE name = ?")
+    cursor.execute(sql, (name,))
+
+
+def versionen_vorruecken(connection):
+    """Alle Zähler einer frisch kopierten SQLite-Datei auf einen neuen Wert setzen
+
+    Eine Kopie (z.B. Übungsdatenbank aus Vorlage) bringt alte Zählerstände mit,
+    die ein Prozess bereits gesehen haben kann. Ein zeitbasierter Wert liegt
+    sicher über allen bisher hochgezählten Ständen.
+    """
+    version = int(time.time() * 1000)
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cache_versionen (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.executemany("INSERT OR REPLACE INTO cache_versionen (name, version) VALUES (?, ?)",
+                       [(name, version) for name in CACHE_NAMEN])
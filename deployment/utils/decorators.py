@@ -1,11 +1,23 @@
 # -*- coding: utf-8 -*-
 """
 Decorators für Zugriffsrechte
+
+Rechte werden aus dem serverseitigen Berechtigungs-Kontext gelesen
+(utils.auth_context), nicht aus den Feldern im Session-Cookie.
 """
 
 from functools import wraps
 from flask import session, flash, redirect, url_for
 
+from utils.auth_context import get_auth_context, ist_gemeinschafts_admin
+
+
+def _abgemeldet_redirect():
+    """Session beenden wenn der Benutzer gelöscht oder deaktiviert wurde"""
+    session.clear()
+    flash('Bitte melden Sie sich an.', 'warning')
+    return redirect(url_for('auth.login'))
+
 
 def login_required(f):
     """Decorator für geschützte Routen"""
@@ -14,6 +26,8 @@ def login_required(f):
         if 'benutzer_id' not in session:
             flash('Bitte melden Sie sich an.', 'warning')
             return redirect(url_for('auth.login'))
+        if get_auth_context() is None:
+            return _abgemeldet_redirect()
         return f(*args, **kwargs)
     return decorated_function
 
@@ -25,7 +39,10 @@ def admin_required(f):
         if 'benutzer_id' not in session:
             flash('Bitte melden Sie sich an.', 'warning')
             return redirect(url_for('auth.login'))
-        if not session.get('is_admin'):
+        kontext = get_auth_context()
+        if kontext is None:
+            return _abgemeldet_redirect()
+        if not kontext['is_admin']:
             flash('Zugriff verweigert. Administrator-Rechte erforderlich.', 'danger')
             return redirect(url_for('dashboard.dashboard'))
         return f(*args, **kwargs)
@@ -39,16 +56,38 @@ def hauptadmin_required(f):
         if 'benutzer_id' not in session:
             flash('Bitte melden Sie sich an.', 'warning')
             return redirect(url_for('auth.login'))
-        if not session.get('is_admin'):
+        kontext = get_auth_context()
+        if kontext is None:
+            return _abgemeldet_redirect()
+        if not kontext['is_admin']:
             flash('Zugriff verweigert. Administrator-Rechte erforderlich.', 'danger')
             return redirect(url_for('dashboard.dashboard'))
-        if session.get('admin_level', 0) < 2:
+        if kontext['admin_level'] < 2:
             flash('Zugriff verweigert. Haupt-Administrator-Rechte erforderlich.', 'danger')
             return redirect(url_for('dashboard.dashboard'))
         return f(*args, **kwargs)
     return decorated_function
 
 
+def gemeinschaft_admin_required(param='gemeinschaft_id',
+                                 redirect_endpoint='admin_finanzen.admin_abrechnungen'):
+    """Decorator für Routen einer bestimmten Gemeinschaft
+
+    Prüft den URL-Parameter ``param`` gegen die verwalteten Gemeinschaften
+    aus dem Berechtigungs-Kontext (ein Set-Lookup statt COUNT(*)-Abfrage).
+    Haupt-Admins (Level 2) haben immer Zugriff. Nach @admin_required verwenden.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not ist_gemeinschafts_admin(kwargs.get(param)):
+                flash('Keine Berechtigung für diese Gemeinschaft!', 'danger')
+                return redirect(url_for(redirect_endpoint))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
 def rolle_required(*required_roles):
     """Decorator für rollenbasierte Zugriffskontrolle (Vorstandsmitglieder)"""
     def decorator(f):
@@ -58,8 +97,11 @@ def rolle_required(*required_roles):
                 flash('Bitte melden Sie sich an.', 'warning')
                 return redirect(url_for('auth.login'))
 
-            user_rolle = session.get('rolle')
-            admin_level = session.get('admin_level', 0)
+            kontext = get_auth_context()
+            if kontext is None:
+                return _abgemeldet_redirect()
+            user_rolle = kontext['rolle']
+            admin_level = kontext['admin_level']
 
             # Haupt-Admin (Level 2) hat immer Zugriff
             if admin_level >= 2:
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Bedingte Auslieferung erzeugter Dokumente (ETag, 304, Datei-Cache)
+
+Abrechnungen, Übersichts-PDFs, CSV-Exporte und Dokumentationsseiten werden
+nicht mehr bei jedem Aufruf neu erzeugt, solange sich ihre Daten nicht
+geändert haben:
+
+- ETag: Hash über einen Datenstand, den die Route mit billigen Abfragen
+  ermittelt (Anzahl/Maximum/Summe der Ids unveränderlicher Zeilen wie
+  Einsätze, Versionszähler aus cache_versionen, Einzelzeilen) plus den
+  Stand des Programmcodes. Ändert sich eines davon, ändert sich der ETag.
+- If-None-Match: passt der ETag, antwortet die Route mit 304 ohne Inhalt.
+  Cache-Control "private, no-cache" - der Browser behält die Datei, fragt
+  aber jedes Mal nach; geteilte Caches (Proxy) speichern nichts.
+- Datei-Cache: erzeugte Dokumente liegen unter DOKUMENT_CACHE_DIR (private
+  Ablage, siehe utils/privat_ablage.py), Dateiname ist der ETag. Andere Benutzer/Worker mit demselben Datenstand erhalten die
+  fertige Datei. Über DOKUMENT_CACHE_MAX_MB hinaus werden die am längsten
+  nicht gelesenen Dateien gelöscht (LRU über die Änderungszeit).
+
+Seiten mit dem gemeinsamen Layout (base.html) hängen zusätzlich von der
+Sitzung ab (Name, Rollen, Gemeinschaften). Sie erhalten nur ETag/304, nie
+den Datei-Cache, und bei ausstehenden Flash-Meldungen wird immer gerendert.
+"""
+
+import os
+import hashlib
+import unicodedata
+from urllib.parse import quote
+
+from flask import request, session, make_response
+
+import metrics
+from utils.sql_helpers import convert_sql
+from utils.privat_ablage import privat_pfad, verzeichnis_sichern, datei_oeffnen, atomar_schreiben
+
+# Private Ablage (0o700/0o600): Dokumente enthalten personenbezogene Daten
+DOKUMENT_CACHE_DIR = os.environ.get('DOKUMENT_CACHE_DIR', privat_pfad('dokumente'))
+# 0 = kein Datei-Cache (ETag/304 bleiben aktiv)
+DOKUMENT_CACHE_MAX_MB = int(os.environ.get('DOKUMENT_CACHE_MAX_MB', 100))
+
+# Nach dem Aufräumen bleibt so viel des Limits belegt
+_AUFRAEUMEN_ZIEL = 0.8
+
+_DEPLOYMENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Sitzungswerte, die im Layout sichtbar sind
+_SEITEN_SITZUNG = ('benutzer_id', 'benutzer_name', 'is_admin', 'admin_level', 'gemeinschaften', 'current_database')
+
+_code_stand = None
+
+
+def _code_stand_lesen():
+    """Stand von Templates und Code (Änderungszeiten) - neue Version = neue ETags"""
+    global _code_stand
+    if _code_stand is None:
+        h = hashlib.sha1()
+        for verzeichnis in ('templates', 'routes', 'utils'):
+            basis = os.path.join(_DEPLOYMENT_DIR, verzeichnis)
+            for wurzel, _, dateien in sorted(os.walk(basis)):
+                for datei in sorted(dateien):
+                    if datei.endswith(('.html', '.py')):
+                        stat = os.stat(os.path.join(wurzel, datei))
+                        h.update(f"{datei}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+        _code_stand = h.hexdigest()[:12]
+    return _code_stand
+
+
+def datenstand(db, sql, params=()):
+    """Stempel-Abfrage ausführen, Ergebnis als Liste von Tupeln (für dokument_antwort)"""
+    cursor = db.connection.cursor()
+    cursor.execute(convert_sql(sql), params)
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def _seiten_stempel():
+    """Für das Layout relevante Sitzungswerte, None bei ausstehenden Flash-Meldungen"""
+    if session.get('_flashes'):
+        return None
+    return tuple((k, repr(session.get(k))) for k in _SEITEN_SITZUNG)
+
+
+def _pfad(etag):
+    return os.path.join(DOKUMENT_CACHE_DIR, etag)
+
+
+def _lesen(etag):
+    pfad = _pfad(etag)
+    try:
+        with datei_oeffnen(pfad, 'rb') as f:
+            inhalt = f.read()
+    except OSError:
+        return None
+    try:
+        # Zugriff vermerken: Aufräumen löscht nach ältester Änderungszeit
+        os.utime(pfad)
+    except OSError:
+        pass
+    return inhalt
+
+
+def _aufraeumen():
+    """Älteste Dateien löschen, bis der Cache unter dem Ziel liegt"""
+    grenze = DOKUMENT_CACHE_MAX_MB * 1024 * 1024
+    dateien = []
+    belegt = 0
+    for eintrag in os.scandir(DOKUMENT_CACHE_DIR):
+        if not eintrag.is_file() or eintrag.name.endswith('.tmp'):
+            continue
+        try:
+            stat = eintrag.stat()
+        except OSError:
+            continue
+        dateien.append((stat.st_mtime, stat.st_size, eintrag.path))
+        belegt += stat.st_size
+    if belegt <= grenze:
+        return
+
+    dateien.sort()
+    for _, groesse, pfad in dateien:
+        if belegt <= grenze * _AUFRAEUMEN_ZIEL:
+            break
+        try:
+            os.remove(pfad)
+        except OSError:
+            pass
+        belegt -= groesse
+
+
+def _speichern(etag, inhalt):
+    """Atomar schreiben (mehrere Worker-Prozesse teilen das Verzeichnis)"""
+    if len(inhalt) > DOKUMENT_CACHE_MAX_MB * 1024 * 1024 * (1 - _AUFRAEUMEN_ZIEL):
+        return
+    try:
+        verzeichnis_sichern(DOKUMENT_CACHE_DIR)
+        atomar_schreiben(_pfad(etag), inhalt)
+        _aufraeumen()
+    except OSError as e:
+        print(f"WARNUNG: Dokument-Cache nicht beschreibbar: {e}")
+
+
+def _disposition(dateiname, anhang):
+    """Content-Disposition; Umlaute im Dateinamen nach RFC 5987 (wie send_file)"""
+    art = 'attachment' if anhang else 'inline'
+    try:
+        dateiname.encode('ascii')
+        return f'{art}; filename="{dateiname}"'
+    except UnicodeEncodeError:
+        einfach = unicodedata.normalize('NFKD', dateiname).encode('ascii', 'ignore').decode('ascii')
+        return f"{art}; filename=\"{einfach}\"; filename*=UTF-8''{quote(dateiname)}"
+
+
+def dokument_antwort(teile, erzeugen, mimetype, dateiname=None, anhang=False, seite=False):
+    """Dokument bedingt ausliefern
+
+    teile: Datenstand (hashbare Werte, z.B. Ergebnisse von datenstand()) -
+        muss alles abdecken, wovon der Inhalt abhängt, inkl. Berechtigung
+        (Benutzer-Id bei persönlichen Dokumenten).
+    erzeugen: Funktion ohne Argumente, liefert den Inhalt (str oder bytes);
+        wird nur bei geändertem Datenstand aufgerufen.
+    seite=True: HTML-Seite mit Layout (nur ETag/304, kein Datei-Cache).
+    """
+    if seite:
+        stempel = _seiten_stempel()
+        if stempel is None:
+            return make_response(erzeugen())
+        teile = (teile, stempel)
+
+    etag = hashlib.sha1(repr((request.endpoint, _code_stand_lesen(), teile)).encode()).hexdigest()
+
+    if request.if_none_match.contains_weak(etag):
+        metrics.inc('mgr_dokument_cache_total', {'ergebnis': 'nicht_geaendert'})
+        response = make_response('', 304)
+    else:
+        inhalt = None if seite or not DOKUMENT_CACHE_MAX_MB else _lesen(etag)
+        if inhalt is not None:
+            metrics.inc('mgr_dokument_cache_total', {'ergebnis': 'datei'})
+        else:
+            metrics.inc('mgr_dokument_cache_total', {'ergebnis': 'erzeugt'})
+            inhalt = erzeugen()
+            if isinstance(inhalt, str):
+                inhalt = inhalt.encode('utf-8')
+            if not seite and DOKUMENT_CACHE_MAX_MB:
+                _speichern(etag, inhalt)
+        response = make_response(inhalt)
+        response.headers['Content-Type'] = mimetype
+        if dateiname:
+            response.headers['Content-Disposition'] = _disposition(dateiname, anhang)
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Storno von Einsätzen als Mengenoperation
+
+Beliebig viele Einsätze werden in einer Transaktion storniert:
+
+- ein INSERT ... SELECT kopiert die Auswahl nach maschineneinsaetze_storniert,
+  alle Zeilen tragen denselben Storno-Vorgang (UUID),
+- ein DELETE ... RETURNING entfernt die Originale und liefert die betroffenen
+  Zählerstände, aus denen der Stundenzähler je Maschine neu bestimmt wird,
+- offene Abrechnungen, deren Zeitraum stornierte Einsätze enthält, werden
+  samt Abrechnungs-Buchung und Kontosaldo um deren Kosten vermindert; die
+  Minderung je Abrechnung wird in storno_abrechnungen vermerkt.
+
+Innerhalb von WIDERRUF_STUNDEN kann ein Vorgang vollständig rückgängig
+gemacht werden (gleiche IDs, Abrechnungen und Zähler werden zurückgestellt).
+Ist eine geminderte Abrechnung inzwischen nicht mehr offen, wird der
+Widerruf abgelehnt.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+from database import USING_POSTGRESQL
+from utils.sql_helpers import convert_sql
+from utils.jahresabschluss import JahrAbgeschlossen, datum_pruefen
+from utils.stundenzaehler import ueberschneidung, zaehler_nach_einsatz, zaehler_nach_storno
+from utils.maschinen_kennzahlen import kennzahlen_nach_einsaetzen
+
+# Frist, in der ein Storno-Vorgang widerrufen werden kann
+WIDERRUF_STUNDEN = 24
+
+# Gemeinsame Spalten von maschineneinsaetze und maschineneinsaetze_storniert
+# (betriebsstunden ist unter PostgreSQL eine berechnete Spalte)
+_SPALTEN = ['datum', 'benutzer_id', 'maschine_id', 'einsatzzweck_id', 'anfangstand', 'endstand',
+            'treibstoffverbrauch', 'treibstoffkosten', 'flaeche_menge', 'kosten_berechnet',
+            'anmerkungen', 'erstellt_am']
+
+# SQLite-Dateien, in denen die Spalten in diesem Prozess geprüft wurden
+# (ältere Übungsdatenbanken werden nicht von der Schema-Migration erfasst)
+_geprueft = set()
+
+
+class StornoFehler(Exception):
+    """Storno bzw. Widerruf nicht möglich"""
+
+
+def _sicherstellen(db):
+    """Spalten/Tabelle in älteren SQLite-Übungsdatenbanken einmalig nachrüsten"""
+    if USING_POSTGRESQL or db.db_path in _geprueft:
+        return
+    cursor = db.connection.cursor()
+    cursor.execute("PRAGMA table_info(maschineneinsaetze_storniert)")
+    vorhanden = {row[1] for row in cursor.fetchall()}
+    for spalte in ('storno_vorgang', 'sync_schluessel'):
+        if spalte not in vorhanden:
+            cursor.execute(f"ALTER TABLE maschineneinsaetze_storniert ADD COLUMN {spalte} TEXT")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_storniert_vorgang
+        ON maschineneinsaetze_storniert(storno_vorgang)
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS storno_abrechnungen (
+            storno_vorgang TEXT NOT NULL,
+            abrechnung_id INTEGER NOT NULL,
+            betrag_maschinen REAL NOT NULL DEFAULT 0,
+            betrag_treibstoff REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (storno_vorgang, abrechnung_id)
+        )
+    """)
+    _geprueft.add(db.db_path)
+
+
+def _widerruf_grenze():
+    return (datetime.now() - timedelta(hours=WIDERRUF_STUNDEN)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _betraege_buchen(cursor, aenderungen, vorzeichen):
+    """Abrechnung, Abrechnungs-Buchung und Kontosaldo ändern
+
+    aenderungen: (abrechnung_id, betrieb_id, gemeinschaft_id, maschinen,
+    treibstoff) mit positiven Beträgen; vorzeichen -1 mindert, +1 erhöht.
+    """
+    werte = [(abr_id, betrieb_id, gemeinschaft_id, vorzeichen * m, vorzeichen * t)
+             for abr_id, betrieb_id, gemeinschaft_id, m, t in aenderungen]
+    cursor.executemany(convert_sql("""
+        UPDATE mitglieder_abrechnungen
+        SET betrag_maschinen = betrag_maschinen + ?,
+            betrag_treibstoff = betrag_treibstoff + ?,
+            betrag_gesamt = betrag_gesamt + ?
+        WHERE id = ?
+    """), [(m, t, m + t, abr_id) for abr_id, _, _, m, t in werte])
+
+    # Abrechnungs-Buchung und Saldo sind Belastungen (negativ)
+    cursor.executemany(convert_sql("""
+        UPDATE buchungen SET betrag = betrag - ?
+        WHERE referenz_typ = 'abrechnung' AND referenz_id = ?
+    """), [(m + t, abr_id) for abr_id, _, _, m, t in werte])
+    cursor.executemany(convert_sql("""
+        UPDATE mitglieder_konten
+        SET saldo = saldo - ?, letzte_aktualisierung = CURRENT_TIMESTAMP
+        WHERE betrieb_id = ? AND gemeinschaft_id = ?
+    """), [(m + t, betrieb_id, gemeinschaft_id) for _, betrieb_id, gemeinschaft_id, m, t in werte])
+
+
+def _abrechnungen_mindern(cursor, vorgang):
+    """Offene Abrechnungen um die Kosten der stornierten Einsätze mindern
+
+    Zugeordnet wird wie beim Erstellen der Abrechnungen: Betrieb über
+    benutzer_betriebe, Gemeinschaft über die Maschine, Datum im Zeitraum.
+    Die geminderten Beträge werden je Abrechnung in storno_abrechnungen
+    vermerkt - der Widerruf stellt genau diese zurück.
+    """
+    cursor.execute(convert_sql("""
+        SELECT ma.id, ma.betrieb_id, ma.gemeinschaft_id,
+               SUM(COALESCE(s.kosten_berechnet, 0)),
+               SUM(CASE WHEN m.treibstoff_berechnen = true
+                        THEN COALESCE(s.treibstoffkosten, 0) ELSE 0 END)
+        FROM maschineneinsaetze_storniert s
+        JOIN maschinen m ON s.maschine_id = m.id
+        JOIN benutzer_betriebe bb ON s.benutzer_id = bb.benutzer_id
+        JOIN mitglieder_abrechnungen ma
+          ON ma.betrieb_id = bb.betrieb_id AND ma.gemeinschaft_id = m.gemeinschaft_id
+         AND s.datum BETWEEN ma.zeitraum_von AND ma.zeitraum_bis
+        WHERE s.storno_vorgang = ? AND ma.status = 'offen'
+        GROUP BY ma.id, ma.betrieb_id, ma.gemeinschaft_id
+    """), (vorgang,))
+    aenderungen = [zeile for zeile in cursor.fetchall() if zeile[3] or zeile[4]]
+    if not aenderungen:
+        return 0
+
+    cursor.executemany(convert_sql("""
+        INSERT INTO storno_abrechnungen
+        (storno_vorgang, abrechnung_id, betrag_maschinen, betrag_treibstoff)
+        VALUES (?, ?, ?, ?)
+    """), [(vorgang, abr_id, m, t) for abr_id, _, _, m, t in aenderungen])
+    _betraege_buchen(cursor, aenderungen, -1)
+    return len(aenderungen)
+
+
+def _abrechnungen_zurueckstellen(cursor, vorgang):
+    """Beim Storno geminderte Abrechnungen wieder um dieselben Beträge erhöhen
+
+    Löst StornoFehler aus, wenn eine davon nicht mehr offen ist (bezahlt,
+    storniert oder gelöscht) - deren Beträge dürfen sich nicht mehr ändern.
+    """
+    cursor.execute(convert_sql("""
+        SELECT sa.abrechnung_id, ma.betrieb_id, ma.gemeinschaft_id,
+               sa.betrag_maschinen, sa.betrag_treibstoff, ma.status
+        FROM storno_abrechnungen sa
+        LEFT JOIN mitglieder_abrechnungen ma ON ma.id = sa.abrechnung_id
+        WHERE sa.storno_vorgang = ?
+    """), (vorgang,))
+    zeilen = cursor.fetchall()
+    geschlossen = sorted(z[0] for z in zeilen if z[5] != 'offen')
+    if geschlossen:
+        raise StornoFehler('Abrechnung(en) ' + ', '.join(str(i) for i in geschlossen) +
+                           ' sind nicht mehr offen - Widerruf nicht möglich')
+    if not zeilen:
+        return 0
+
+    _betraege_buchen(cursor, [z[:5] for z in zeilen], +1)
+    cursor.execute(convert_sql("DELETE FROM storno_abrechnungen WHERE storno_vorgang = ?"),
+                   (vorgang,))
+    return len(zeilen)
+
+
+def einsaetze_stornieren(db, benutzer_id, grund=None, ids=None, **auswahl):
+    """Einsätze stornieren - per ID-Liste und/oder Filter von db._einsatz_filter
+
+    Läuft in der Transaktion des Aufrufers. Liefert {'vorgang', 'anzahl',
+    'abrechnungen', 'widerruf_bis'}; bei leerer Auswahl ist vorgang None.
+    """
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+
+    bedingungen, params = db._einsatz_filter(**auswahl)
+    if ids is not None:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {'vorgang': None, 'anzahl': 0, 'abrechnungen': 0, 'widerruf_bis': None}
+        bedingungen.append(f"e.id IN ({','.join('?' for _ in ids)})")
+        params.extend(ids)
+    if not bedingungen:
+        raise StornoFehler('Keine Auswahl angegeben')
+
+    jetzt = datetime.now()
+    vorgang = uuid.uuid4().hex
+    spalten = ', '.join(_SPALTEN)
+    quelle = ', '.join(f'e.{s}' for s in _SPALTEN)
+
+    cursor.execute(convert_sql(f"""
+        INSERT INTO maschineneinsaetze_storniert
+        (original_id, {spalten}, betriebsstunden, sync_schluessel,
+         storniert_am, storniert_von, storno_grund, storno_vorgang)
+        SELECT e.id, {quelle}, e.endstand - e.anfangstand, e.sync_schluessel, ?, ?, ?, ?
+        FROM maschineneinsaetze e
+        JOIN maschinen m ON e.maschine_id = m.id
+        WHERE {' AND '.join(bedingungen)}
+    """), [jetzt.strftime('%Y-%m-%d %H:%M:%S'), benutzer_id, grund or None, vorgang] + params)
+    anzahl = cursor.rowcount
+    if not anzahl:
+        return {'vorgang': None, 'anzahl': 0, 'abrechnungen': 0, 'widerruf_bis': None}
+
+    cursor.execute(convert_sql("""
+        DELETE FROM maschineneinsaetze
+        WHERE id IN (SELECT original_id FROM maschineneinsaetze_storniert WHERE storno_vorgang = ?)
+        RETURNING maschine_id, anfangstand, endstand, datum
+    """), (vorgang,))
+    bereiche = {}
+    betroffen = set()
+    for maschine_id, anfang, ende, datum in cursor.fetchall():
+        von, bis = bereiche.get(maschine_id, (anfang, ende))
+        bereiche[maschine_id] = (min(von, anfang), max(bis, ende))
+        betroffen.add((maschine_id, datum))
+
+    abrechnungen = _abrechnungen_mindern(cursor, vorgang)
+
+    for maschine_id, (anfang, ende) in bereiche.items():
+        zaehler_nach_storno(db, maschine_id, anfang, ende)
+    kennzahlen_nach_einsaetzen(db, betroffen)
+
+    return {
+        'vorgang': vorgang,
+        'anzahl': anzahl,
+        'abrechnungen': abrechnungen,
+        'widerruf_bis': jetzt + timedelta(hours=WIDERRUF_STUNDEN),
+    }
+
+
+def storno_widerrufen(db, vorgang, benutzer_id, ist_admin=False):
+    """Storno-Vorgang innerhalb der Frist vollständig rückgängig machen
+
+    Läuft in der Transaktion des Aufrufers. Löst StornoFehler aus, wenn der
+    Vorgang nicht (mehr) widerrufbar ist oder die Zählerstände inzwischen
+    durch neue Einsätze belegt sind.
+    """
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+
+    cursor.execute(convert_sql("""
+        SELECT s.id, s.datum, s.maschine_id, s.anfangstand, s.endstand,
+               s.storniert_am, s.storniert_von, m.gemeinschaft_id
+        FROM maschineneinsaetze_storniert s
+        JOIN maschinen m ON s.maschine_id = m.id
+        WHERE s.storno_vorgang = ?
+    """), (vorgang,))
+    zeilen = cursor.fetchall()
+    if not zeilen:
+        raise StornoFehler('Storno-Vorgang nicht gefunden oder bereits widerrufen')
+    if not ist_admin and any(z[6] != benutzer_id for z in zeilen):
+        raise StornoFehler('Keine Berechtigung für diesen Storno-Vorgang')
+    if min(str(z[5]) for z in zeilen) < _widerruf_grenze():
+        raise StornoFehler(f'Widerrufsfrist ({WIDERRUF_STUNDEN} Stunden) ist abgelaufen')
+
+    aelteste = {}
+    for z in zeilen:
+        aelteste[z[7]] = min(aelteste.get(z[7], str(z[1])), str(z[1]))
+    try:
+        for gemeinschaft_id, datum in aelteste.items():
+            datum_pruefen(db, gemeinschaft_id, datum)
+    except JahrAbgeschlossen as e:
+        raise StornoFehler(str(e))
+
+    for _, _, maschine_id, anfang, ende, _, _, _ in zeilen:
+        treffer = ueberschneidung(cursor, maschine_id, anfang, ende)
+        if treffer:
+            raise StornoFehler(f'Zählerstand {anfang:g} - {ende:g} ist inzwischen durch den '
+                               f'Einsatz vom {treffer["datum"]} belegt')
+
+    abrechnungen = _abrechnungen_zurueckstellen(cursor, vorgang)
+
+    # Unter SQLite ist betriebsstunden eine gewöhnliche Spalte
+    spalten = _SPALTEN if USING_POSTGRESQL else _SPALTEN + ['betriebsstunden']
+    cursor.execute(convert_sql(f"""
+        INSERT INTO maschineneinsaetze (id, {', '.join(spalten)}, sync_schluessel)
+        SELECT s.original_id, {', '.join(f's.{sp}' for sp in spalten)},
+               CASE WHEN EXISTS (SELECT 1 FROM maschineneinsaetze x
+                                 WHERE x.benutzer_id = s.benutzer_id
+                                   AND x.sync_schluessel = s.sync_schluessel)
+                    THEN NULL ELSE s.sync_schluessel END
+        FROM maschineneinsaetze_storniert s
+        WHERE s.storno_vorgang = ?
+    """), (vorgang,))
+    cursor.execute(convert_sql("DELETE FROM maschineneinsaetze_storniert WHERE storno_vorgang = ?"),
+                   (vorgang,))
+
+    hoechste = {}
+    for z in zeilen:
+        hoechste[z[2]] = max(hoechste.get(z[2], z[4]), z[4])
+    for maschine_id, ende in hoechste.items():
+        zaehler_nach_einsatz(db, maschine_id, ende)
+    kennzahlen_nach_einsaetzen(db, {(z[2], z[1]) for z in zeilen})
+
+    return {'anzahl': len(zeilen), 'abrechnungen': abrechnungen}
+
+
+def widerrufbare_vorgaenge(db, benutzer_id=None):
+    """Storno-Vorgänge innerhalb der Widerrufsfrist (optional nur eines Benutzers)"""
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+    sql = """
+        SELECT storno_vorgang FROM maschineneinsaetze_storniert
+        WHERE storno_vorgang IS NOT NULL AND storniert_am >= ?
+    """
+    params = [_widerruf_grenze()]
+    if benutzer_id is not None:
+        sql += " AND storniert_von = ?"
+        params.append(benutzer_id)
+    cursor.execute(convert_sql(sql + " GROUP BY storno_vorgang"), params)
+    return {row[0] for row in cursor.fetchall()}
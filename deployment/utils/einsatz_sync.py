@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Sammelerfassung von Einsätzen (Offline-Synchronisation)
+
+Ein Handy in der Traktorkabine sammelt die Einsätze eines Tages offline und
+schickt sie gesammelt an POST /api/einsaetze/sync. Alle Einträge werden
+gemeinsam geprüft (Zählerstände pro Maschine, Sichtbarkeit, abgeschlossene
+Jahre), die Kosten in einem Durchgang berechnet und alle Einsätze mit
+executemany in einer Transaktion gespeichert - entweder alle oder keiner.
+
+Jeder Eintrag muss einen vom Gerät erzeugten Schlüssel (z.B. UUID) in
+'schluessel' mitbringen. Einträge mit bereits bekanntem Schlüssel werden
+nicht erneut angelegt, sondern mit ihrer vorhandenen ID bestätigt - eine
+Wiederholung nach Verbindungsabbruch ist damit gefahrlos. Über den
+Schlüssel werden auch die IDs neu angelegter Einsätze zurückgemeldet.
+"""
+
+from datetime import datetime
+
+from database import USING_POSTGRESQL, einsatz_kosten
+from utils.sql_helpers import convert_sql
+from utils.mitgliedschaft import mitgliedschaft
+from utils.jahresabschluss import JahrAbgeschlossen, abgeschlossen_bis, jahr_pruefen
+from utils.stundenzaehler import TOLERANZ, ueberschneidung, zaehler_nach_einsatz
+from utils.maschinen_kennzahlen import kennzahlen_nach_einsaetzen
+
+if USING_POSTGRESQL:
+    from psycopg2.errors import UniqueViolation as _Eindeutigkeit
+else:
+    from sqlite3 import IntegrityError as _Eindeutigkeit
+
+# Höchstzahl Einträge pro Anfrage
+MAX_EINTRAEGE = 500
+
+# SQLite-Dateien, in denen die Spalte in diesem Prozess geprüft wurde
+# (ältere Übungsdatenbanken werden nicht von der Schema-Migration erfasst)
+_geprueft = set()
+
+
+class SyncFehler(Exception):
+    """Ungültige Einträge - nichts wurde gespeichert"""
+
+    def __init__(self, fehler):
+        super().__init__(f'{len(fehler)} ungültige Einträge')
+        self.fehler = fehler
+
+
+class SyncLaeuft(Exception):
+    """Dieselbe Sendung wird gleichzeitig gespeichert (Schlüssel schon vergeben)"""
+
+
+def _schluessel_vergeben(fehler):
+    """True, wenn die Verletzung vom Index auf (benutzer_id, sync_schluessel) stammt"""
+    if USING_POSTGRESQL:
+        return fehler.diag.constraint_name == 'idx_einsaetze_sync_schluessel'
+    # SQLite nennt nur die Spalten: "UNIQUE constraint failed: ...sync_schluessel"
+    return str(fehler).startswith('UNIQUE constraint failed') and 'sync_schluessel' in str(fehler)
+
+
+def _sicherstellen(db):
+    """Spalte und Index in älteren SQLite-Übungsdatenbanken einmalig nachrüsten"""
+    if USING_POSTGRESQL or db.db_path in _geprueft:
+        return
+    cursor = db.connection.cursor()
+    cursor.execute("PRAGMA table_info(maschineneinsaetze)")
+    if 'sync_schluessel' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE maschineneinsaetze ADD COLUMN sync_schluessel TEXT")
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_einsaetze_sync_schluessel
+        ON maschineneinsaetze(benutzer_id, sync_schluessel)
+    """)
+    _geprueft.add(db.db_path)
+
+
+def _zahl(eintrag, feld, pflicht=False):
+    wert = eintrag.get(feld)
+    if wert in (None, ''):
+        if pflicht:
+            raise ValueError(f"'{feld}' fehlt")
+        return None
+    try:
+        return float(wert)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{feld}' ist keine Zahl")
+
+
+def _eintrag_lesen(eintrag, maschinen, einsatzzwecke):
+    """Eintrag prüfen und normalisieren (ohne Zählerstände des direkten Modus)"""
+    if not isinstance(eintrag, dict):
+        raise ValueError('Eintrag ist kein Objekt')
+
+    datum = str(eintrag.get('datum') or '')
+    try:
+        datetime.strptime(datum, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError("'datum' fehlt oder ist nicht im Format JJJJ-MM-TT")
+
+    try:
+        maschine_id = int(eintrag.get('maschine_id'))
+        einsatzzweck_id = int(eintrag.get('einsatzzweck_id'))
+    except (TypeError, ValueError):
+        raise ValueError("'maschine_id' und 'einsatzzweck_id' sind Pflichtfelder")
+
+    maschine = maschinen.get(maschine_id)
+    if not maschine:
+        raise ValueError(f'Maschine {maschine_id} nicht verfügbar')
+    if einsatzzweck_id not in einsatzzwecke:
+        raise ValueError(f'Einsatzzweck {einsatzzweck_id} unbekannt')
+
+    schluessel = str(eintrag.get('schluessel') or '').strip()[:100]
+    if not schluessel:
+        raise ValueError("'schluessel' fehlt (vom Gerät erzeugter, eindeutiger Schlüssel)")
+
+    daten = {
+        'schluessel': schluessel,
+        'datum': datum,
+        'maschine_id': maschine_id,
+        'einsatzzweck_id': einsatzzweck_id,
+        'treibstoffverbrauch': _zahl(eintrag, 'treibstoffverbrauch'),
+        'treibstoffkosten': _zahl(eintrag, 'treibstoffkosten'),
+        'flaeche_menge': _zahl(eintrag, 'flaeche_menge'),
+        'anmerkungen': (eintrag.get('anmerkungen') or None),
+    }
+
+    if maschine.get('erfassungsmodus', 'fortlaufend') == 'direkt':
+        direkt_wert = _zahl(eintrag, 'direkt_wert', pflicht=True)
+        if direkt_wert <= 0:
+            raise ValueError("'direkt_wert' muss größer als 0 sein")
+        daten['direkt_wert'] = direkt_wert
+        if maschine.get('abrechnungsart') != 'stunden' and not daten['flaeche_menge']:
+            daten['flaeche_menge'] = direkt_wert
+    else:
+        daten['anfangstand'] = _zahl(eintrag, 'anfangstand', pflicht=True)
+        daten['endstand'] = _zahl(eintrag, 'endstand', pflicht=True)
+        if daten['endstand'] < daten['anfangstand']:
+            raise ValueError('Endstand muss größer oder gleich Anfangstand sein')
+
+    return daten
+
+
+def _ueberschneidungen(cursor, maschine_id, eintraege):
+    """Prüft die Zählerstände einer Maschine auf Lücken-/Überlappungsfreiheit
+
+    Innerhalb der Sendung dürfen sich die Intervalle [anfangstand, endstand]
+    nicht überschneiden, ebenso nicht mit bereits gespeicherten Einsätzen.
+    Liefert (index, meldung) pro fehlerhaftem Eintrag.
+    """
+    fehler = []
+    sortiert = sorted(eintraege, key=lambda e: (e[1]['anfangstand'], e[1]['endstand']))
+
+    for (_, vorher), (index, eintrag) in zip(sortiert, sortiert[1:]):
+        if eintrag['anfangstand'] < vorher['endstand'] - TOLERANZ:
+            fehler.append((index, f"Zählerstand {eintrag['anfangstand']:g} überschneidet sich mit "
+                                  f"einem anderen Eintrag ({vorher['anfangstand']:g} - {vorher['endstand']:g})"))
+
+    # Gegen gespeicherte Einsätze: je ein Index-Zugriff im Stundenzähler-Buch
+    for index, eintrag in sortiert:
+        treffer = ueberschneidung(cursor, maschine_id, eintrag['anfangstand'], eintrag['endstand'])
+        if treffer:
+            fehler.append((index, f'Zählerstand {eintrag["anfangstand"]:g} - {eintrag["endstand"]:g} '
+                                  f'überschneidet sich mit dem Einsatz vom {treffer["datum"]} '
+                                  f'({treffer["anfangstand"]:g} - {treffer["endstand"]:g})'))
+
+    return fehler
+
+
+def einsaetze_synchronisieren(db, benutzer_id, eintraege):
+    """Einsätze gesammelt speichern
+
+    Läuft in der Transaktion des Aufrufers. Löst SyncFehler mit allen
+    Fehlern aus, wenn auch nur ein Eintrag ungültig ist.
+    """
+    if not isinstance(eintraege, list) or not eintraege:
+        raise SyncFehler([{'index': None, 'meldung': 'Keine Einträge übergeben'}])
+    if len(eintraege) > MAX_EINTRAEGE:
+        raise SyncFehler([{'index': None,
+                           'meldung': f'Höchstens {MAX_EINTRAEGE} Einträge pro Anfrage'}])
+
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+
+    # Referenzdaten einmal laden (Cache) statt pro Eintrag
+    sichtbar = mitgliedschaft(db).sichtbare_maschinen(benutzer_id)
+    maschinen = {m['id']: m for m in db.get_all_maschinen() if m['id'] in sichtbar}
+    einsatzzwecke = {z['id'] for z in db.get_all_einsatzzwecke()}
+
+    # Bereits übertragene Einträge (Wiederholung) erkennen
+    schluessel = [str(e.get('schluessel')).strip()[:100]
+                  for e in eintraege if isinstance(e, dict) and e.get('schluessel')]
+    bekannt = {}
+    for start in range(0, len(schluessel), 200):
+        teil = schluessel[start:start + 200]
+        placeholders = ','.join('?' for _ in teil)
+        cursor.execute(convert_sql(f"""
+            SELECT sync_schluessel, id FROM maschineneinsaetze
+            WHERE benutzer_id = ? AND sync_schluessel IN ({placeholders})
+        """), [benutzer_id] + teil)
+        bekannt.update({row[0]: row[1] for row in cursor.fetchall()})
+
+    fehler = []
+    neue = []
+    ergebnisse = [None] * len(eintraege)
+    gesehen = set()
+    # Letztes abgeschlossenes Jahr pro Gemeinschaft - eine Abfrage je Gemeinschaft
+    abgeschlossen = {}
+
+    for index, eintrag in enumerate(eintraege):
+        try:
+            daten = _eintrag_lesen(eintrag, maschinen, einsatzzwecke)
+        except ValueError as e:
+            fehler.append({'index': index, 'meldung': str(e)})
+            continue
+
+        if daten['schluessel'] in bekannt:
+            ergebnisse[index] = {'schluessel': daten['schluessel'], 'status': 'vorhanden',
+                                 'id': bekannt[daten['schluessel']]}
+            continue
+        if daten['schluessel'] in gesehen:
+            fehler.append({'index': index, 'meldung': 'Schlüssel doppelt in dieser Sendung'})
+            continue
+        gesehen.add(daten['schluessel'])
+
+        gemeinschaft_id = maschinen[daten['maschine_id']].get('gemeinschaft_id')
+        if gemeinschaft_id not in abgeschlossen:
+            abgeschlossen[gemeinschaft_id] = abgeschlossen_bis(db, gemeinschaft_id)
+        try:
+            jahr_pruefen(abgeschlossen[gemeinschaft_id], daten['datum'])
+        except JahrAbgeschlossen as e:
+            fehler.append({'index': index, 'meldung': str(e)})
+            continue
+
+        neue.append((index, daten))
+
+    # Direkter Modus: Zählerstände fortlaufend ab aktuellem Stand vergeben.
+    # Maschinenzeile sperren (PostgreSQL: FOR UPDATE, in Id-Reihenfolge), damit
+    # parallele Sendungen nicht denselben Stand als Anfang verwenden
+    stand = {}
+    direkt = sorted({daten['maschine_id'] for _, daten in neue if 'direkt_wert' in daten})
+    sperre = ' FOR UPDATE' if USING_POSTGRESQL else ''
+    for maschine_id in direkt:
+        cursor.execute(convert_sql(f"""
+            SELECT stundenzaehler_aktuell FROM maschinen WHERE id = ?{sperre}
+        """), (maschine_id,))
+        stand[maschine_id] = cursor.fetchone()[0] or 0
+    for index, daten in sorted(neue, key=lambda e: (e[1]['datum'], e[0])):
+        if 'direkt_wert' in daten:
+            anfang = stand[daten['maschine_id']]
+            daten['anfangstand'] = anfang
+            daten['endstand'] = anfang + daten.pop('direkt_wert')
+            stand[daten['maschine_id']] = daten['endstand']
+
+    # Zählerstände pro Maschine prüfen
+    pro_maschine = {}
+    for index, daten in neue:
+        pro_maschine.setdefault(daten['maschine_id'], []).append((index, daten))
+    for maschine_id, liste in pro_maschine.items():
+        for index, meldung in _ueberschneidungen(cursor, maschine_id, liste):
+            fehler.append({'index': index, 'meldung': meldung})
+
+    if fehler:
+        for f in fehler:
+            if f['index'] is not None and isinstance(eintraege[f['index']], dict):
+                f['schluessel'] = eintraege[f['index']].get('schluessel')
+        raise SyncFehler(sorted(fehler, key=lambda f: f['index']))
+
+    if neue:
+        zeilen = []
+        for index, daten in neue:
+            maschine = maschinen[daten['maschine_id']]
+            zeilen.append((
+                daten['datum'], benutzer_id, daten['maschine_id'], daten['einsatzzweck_id'],
+                daten['anfangstand'], daten['endstand'],
+                daten['treibstoffverbrauch'], daten['treibstoffkosten'],
+                daten['anmerkungen'], daten['flaeche_menge'],
+                einsatz_kosten(maschine, daten['anfangstand'], daten['endstand'], daten['flaeche_menge']),
+                daten['schluessel']
+            ))
+        try:
+            cursor.executemany(convert_sql("""
+                INSERT INTO maschineneinsaetze
+                (datum, benutzer_id, maschine_id, einsatzzweck_id, anfangstand, endstand,
+                 treibstoffverbrauch, treibstoffkosten, anmerkungen, flaeche_menge,
+                 kosten_berechnet, sync_schluessel)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """), zeilen)
+        except _Eindeutigkeit as e:
+            # Gleichzeitige Wiederholung derselben Sendung - andere Verletzungen weiterreichen
+            if not _schluessel_vergeben(e):
+                raise
+            raise SyncLaeuft(str(e))
+
+        # Stundenzähler nur vorwärts stellen - nachgetragene ältere Einsätze ändern ihn nicht
+        for maschine_id, liste in pro_maschine.items():
+            zaehler_nach_einsatz(db, maschine_id, max(daten['endstand'] for _, daten in liste))
+        kennzahlen_nach_einsaetzen(db, {(daten['maschine_id'], daten['datum']) for _, daten in neue})
+
+        # Letzten Treibstoffpreis merken (wie bei der Einzelerfassung)
+        mit_preis = [daten for _, daten in neue if daten['treibstoffkosten']]
+        if mit_preis:
+            letzter = max(mit_preis, key=lambda d: d['datum'])
+            cursor.execute(convert_sql("UPDATE benutzer SET letzter_treibstoffpreis = ? WHERE id = ?"),
+                           (letzter['treibstoffkosten'], benutzer_id))
+
+        # IDs der neuen Einsätze über ihre Schlüssel zurückmelden
+        neue_schluessel = [daten['schluessel'] for _, daten in neue]
+        ids = {}
+        for start in range(0, len(neue_schluessel), 200):
+            teil = neue_schluessel[start:start + 200]
+            placeholders = ','.join('?' for _ in teil)
+            cursor.execute(convert_sql(f"""
+                SELECT sync_schluessel, id FROM maschineneinsaetze
+                WHERE benutzer_id = ? AND sync_schluessel IN ({placeholders})
+            """), [benutzer_id] + teil)
+            ids.update({row[0]: row[1] for row in cursor.fetchall()})
+
+        for index, daten in neue:
+            ergebnisse[index] = {'schluessel': daten['schluessel'], 'status': 'angelegt',
+                                 'id': ids[daten['schluessel']]}
+
+    return {
+        'angelegt': len(neue),
+        'vorhanden': sum(1 for e in ergebnisse if e and e['status'] == 'vorhanden'),
+        'ergebnisse': ergebnisse,
+    }
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+Jahresabschluss pro Gemeinschaft
+
+Ein Jahresabschluss friert ein Geschäftsjahr ein:
+
+- Gesamteinnahmen/-ausgaben und Kennzahlen landen in jahresabschluesse,
+- der Saldo jedes Betriebs zum Jahresende in jahresabschluss_salden
+  (Vortrag ins Folgejahr),
+- Einsätze, Betriebs-Buchungen und Bank-Transaktionen des Jahres werden in
+  Archivtabellen (<tabelle>_archiv) verschoben.
+
+Unter PostgreSQL sind die Archivtabellen nach archiv_jahr partitioniert
+(eine Partition <tabelle>_archiv_<jahr> pro Jahr). Unter SQLite liegen sie
+in derselben Datei, damit Backups, Übungsdatenbank-Kopien und die
+Verbindungen der Worker ohne ATTACH auskommen.
+
+Die Arbeitstabellen enthalten danach nur noch offene Jahre; Abfragen für das
+laufende Jahr werden nicht mehr durch die Historie gebremst. Wer die ganze
+Historie braucht, liest über einsaetze_quelle().
+"""
+
+from datetime import date
+
+from database import USING_POSTGRESQL
+from utils.sql_helpers import convert_sql
+
+
+class JahrAbgeschlossen(Exception):
+    """Schreibzugriff auf ein abgeschlossenes Jahr"""
+
+
+# Archivierte Tabellen mit ihrer Datumsspalte
+ARCHIV_TABELLEN = {
+    'maschineneinsaetze': 'datum',
+    'buchungen': 'datum',
+    'bank_transaktionen': 'buchungsdatum',
+}
+
+# SQLite-Dateien, in denen die Tabellen in diesem Prozess geprüft wurden
+# (ältere Übungsdatenbanken werden nicht von der Schema-Migration erfasst)
+_geprueft = set()
+
+
+def _sicherstellen(db):
+    """Tabellen in älteren SQLite-Übungsdatenbanken einmalig nachrüsten"""
+    if USING_POSTGRESQL or db.db_path in _geprueft:
+        return
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jahresabschluesse (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            gemeinschaft_id INTEGER NOT NULL,
+            jahr INTEGER NOT NULL,
+            abgeschlossen_am DATETIME DEFAULT CURRENT_TIMESTAMP,
+            abgeschlossen_von INTEGER,
+            gesamteinnahmen REAL,
+            gesamtausgaben REAL,
+            bemerkung TEXT,
+            anzahl_einsaetze INTEGER DEFAULT 0,
+            summe_einsaetze REAL DEFAULT 0,
+            anzahl_buchungen INTEGER DEFAULT 0,
+            anzahl_transaktionen INTEGER DEFAULT 0,
+            bank_saldo_archiviert REAL,
+            UNIQUE(gemeinschaft_id, jahr)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jahresabschluss_salden (
+            gemeinschaft_id INTEGER NOT NULL,
+            jahr INTEGER NOT NULL,
+            betrieb_id INTEGER NOT NULL,
+            saldo_vortrag REAL NOT NULL DEFAULT 0,
+            bewegungen REAL NOT NULL DEFAULT 0,
+            saldo_ende REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (gemeinschaft_id, jahr, betrieb_id)
+        )
+    """)
+    vorhanden = {row[1] for row in cursor.execute("PRAGMA table_info(jahresabschluesse)")}
+    for spalte, typ in (('anzahl_einsaetze', 'INTEGER'), ('summe_einsaetze', 'REAL'),
+                        ('anzahl_buchungen', 'INTEGER'), ('anzahl_transaktionen', 'INTEGER')):
+        if spalte not in vorhanden:
+            cursor.execute(f"ALTER TABLE jahresabschluesse ADD COLUMN {spalte} {typ} DEFAULT 0")
+    if 'bank_saldo_archiviert' not in vorhanden:
+        cursor.execute("ALTER TABLE jahresabschluesse ADD COLUMN bank_saldo_archiviert REAL")
+    _geprueft.add(db.db_path)
+
+
+# ============================================================================
+# ABFRAGEN
+# ============================================================================
+
+def abgeschlossen_bis(db, gemeinschaft_id):
+    """Letztes abgeschlossene Jahr der Gemeinschaft (None wenn keines)"""
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+    cursor.execute(convert_sql("""
+        SELECT MAX(jahr) FROM jahresabschluesse WHERE gemeinschaft_id = ?
+    """), (gemeinschaft_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def datum_pruefen(db, gemeinschaft_id, datum):
+    """JahrAbgeschlossen auslösen, wenn das Datum in einem abgeschlossenen Jahr liegt"""
+    jahr_pruefen(abgeschlossen_bis(db, gemeinschaft_id), datum)
+
+
+def jahr_pruefen(bis, datum):
+    """Wie datum_pruefen, mit bereits gelesenem abgeschlossen_bis (Sammelprüfungen)"""
+    if bis is not None and datum and int(str(datum)[:4]) <= bis:
+        raise JahrAbgeschlossen(
+            f'Das Jahr {str(datum)[:4]} ist abgeschlossen - Buchungen bis '
+            f'31.12.{bis} sind nicht mehr möglich.')
+
+
+def jahresabschluesse_laden(db, gemeinschaft_id):
+    """Alle Jahresabschlüsse einer Gemeinschaft, neuestes zuerst"""
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+    cursor.execute(convert_sql("""
+        SELECT j.*, b.vorname || ' ' || b.name as abgeschlossen_von_name
+        FROM jahresabschluesse j
+        LEFT JOIN benutzer b ON j.abgeschlossen_von = b.id
+        WHERE j.gemeinschaft_id = ?
+        ORDER BY j.jahr DESC
+    """), (gemeinschaft_id,))
+    columns = [desc[0] for desc in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def aeltestes_offenes_jahr(db, gemeinschaft_id):
+    """Ältestes Jahr mit Daten in den Arbeitstabellen (None wenn leer)"""
+    cursor = db.connection.cursor()
+    aeltestes = None
+    for tabelle, (bedingung, params) in _bedingungen(cursor, gemeinschaft_id).items():
+        datumsspalte = ARCHIV_TABELLEN[tabelle]
+        cursor.execute(convert_sql(f"""
+            SELECT MIN({datumsspalte}) FROM {tabelle} WHERE {bedingung}
+        """), params)
+        row = cursor.fetchone()
+        if row and row[0]:
+            erstes = int(str(row[0])[:4])
+            aeltestes = erstes if aeltestes is None else min(aeltestes, erstes)
+    return aeltestes
+
+
+def saldo_vortrag(db, gemeinschaft_id, betrieb_ids):
+    """Summe der Salden der Betriebe zum Ende des letzten abgeschlossenen Jahres"""
+    if not betrieb_ids:
+        return 0
+    bis = abgeschlossen_bis(db, gemeinschaft_id)
+    if bis is None:
+        return 0
+    cursor = db.connection.cursor()
+    placeholders = ','.join('?' for _ in betrieb_ids)
+    cursor.execute(convert_sql(f"""
+        SELECT COALESCE(SUM(saldo_ende), 0) FROM jahresabschluss_salden
+        WHERE gemeinschaft_id = ? AND jahr = ? AND betrieb_id IN ({placeholders})
+    """), [gemeinschaft_id, bis] + list(betrieb_ids))
+    return cursor.fetchone()[0] or 0
+
+
+def bank_saldo_archiv(db, gemeinschaft_id):
+    """Netto-Summe der archivierten Bank-Transaktionen aller abgeschlossenen Jahre
+
+    Nur tatsächlich verschobene Transaktionen - zugeordnete bleiben in der
+    Arbeitstabelle und sind dort schon im Saldo enthalten. Abschlüsse ohne
+    bank_saldo_archiviert stammen aus der Zeit, als die Jahressummen nur die
+    verschobenen Transaktionen umfassten.
+    """
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+    cursor.execute(convert_sql("""
+        SELECT COALESCE(SUM(COALESCE(bank_saldo_archiviert,
+                                     COALESCE(gesamteinnahmen, 0) - COALESCE(gesamtausgaben, 0))), 0)
+        FROM jahresabschluesse WHERE gemeinschaft_id = ?
+    """), (gemeinschaft_id,))
+    return cursor.fetchone()[0] or 0
+
+
+def einsaetze_quelle(db):
+    """Tabellenausdruck für Einsätze aller Jahre (Arbeitstabelle + Archiv)
+
+    Ohne Archiv ist das schlicht 'maschineneinsaetze'. Gedacht für
+    Auswertungen über die ganze Lebensdauer einer Maschine und für
+    Abrechnungen abgeschlossener Zeiträume.
+    """
+    cursor = db.connection.cursor()
+    if not _tabelle_existiert(cursor, 'maschineneinsaetze_archiv'):
+        return 'maschineneinsaetze'
+    archiv = {name for name, _ in _spalten(cursor, 'maschineneinsaetze_archiv')}
+    spalten = [name for name, _ in _spalten(cursor, 'maschineneinsaetze')]
+    archiv_spalten = ', '.join(name if name in archiv else f'NULL AS {name}' for name in spalten)
+    return (f"(SELECT {', '.join(spalten)} FROM maschineneinsaetze "
+            f"UNION ALL SELECT {archiv_spalten} FROM maschineneinsaetze_archiv)")
+
+
+# ============================================================================
+# ARCHIVTABELLEN
+# ============================================================================
+
+def _tabelle_existiert(cursor, tabelle):
+    if USING_POSTGRESQL:
+        cursor.execute(convert_sql("""
+            SELECT 1 FROM information_schema.tables WHERE table_name = ?
+        """), (tabelle,))
+    else:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabelle,))
+    return cursor.fetchone() is not None
+
+
+def _spalten(cursor, tabelle):
+    """Spalten einer Tabelle als Liste von (name, typ)"""
+    if USING_POSTGRESQL:
+        cursor.execute(convert_sql("""
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_name = ?
+            ORDER BY ordinal_position
+        """), (tabelle,))
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+    cursor.execute(f"PRAGMA table_info({tabelle})")
+    return [(row[1], row[2] or '') for row in cursor.fetchall()]
+
+
+def _archiv_vorbereiten(cursor, tabelle, jahr):
+    """Archivtabelle (bzw. Partition für das Jahr) anlegen und Spalten angleichen"""
+    archiv = f'{tabelle}_archiv'
+
+    if not _tabelle_existiert(cursor, archiv):
+        if USING_POSTGRESQL:
+            cursor.execute(f"""
+                CREATE TABLE {archiv} (LIKE {tabelle}, archiv_jahr INTEGER NOT NULL)
+                PARTITION BY LIST (archiv_jahr)
+            """)
+        else:
+            definition = ', '.join(f'{name} {typ}' for name, typ in _spalten(cursor, tabelle))
+            cursor.execute(f"CREATE TABLE {archiv} ({definition}, archiv_jahr INTEGER NOT NULL)")
+            cursor.execute(f"CREATE INDEX idx_{archiv}_jahr ON {archiv} (archiv_jahr)")
+    else:
+        # Spalten, die die Schema-Migration seit dem letzten Abschluss ergänzt hat
+        vorhanden = {name for name, _ in _spalten(cursor, archiv)}
+        for name, typ in _spalten(cursor, tabelle):
+            if name not in vorhanden:
+                cursor.execute(f"ALTER TABLE {archiv} ADD COLUMN {name} {typ}")
+
+    if USING_POSTGRESQL:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {archiv}_{int(jahr)}
+            PARTITION OF {archiv} FOR VALUES IN ({int(jahr)})
+        """)
+
+
+def _verschieben(cursor, tabelle, jahr, bedingung, params):
+    """Zeilen einer Arbeitstabelle ins Archiv verschieben, liefert die Anzahl"""
+    _archiv_vorbereiten(cursor, tabelle, jahr)
+    spalten = ', '.join(name for name, _ in _spalten(cursor, tabelle))
+
+    cursor.execute(convert_sql(f"""
+        INSERT INTO {tabelle}_archiv ({spalten}, archiv_jahr)
+        SELECT {spalten}, ? FROM {tabelle} WHERE {bedingung}
+    """), [jahr] + list(params))
+    cursor.execute(convert_sql(f"DELETE FROM {tabelle} WHERE {bedingung}"), list(params))
+    return cursor.rowcount
+
+
+def _bedingungen(cursor, gemeinschaft_id):
+    """WHERE-Bedingung (ohne Datum) und Parameter pro archivierter Tabelle"""
+    bank = 'gemeinschaft_id = ?'
+    # Über zahlungs_zuordnungen referenzierte Transaktionen bleiben stehen (Fremdschlüssel)
+    if _tabelle_existiert(cursor, 'zahlungs_zuordnungen'):
+        bank += ' AND id NOT IN (SELECT transaktion_id FROM zahlungs_zuordnungen)'
+
+    return {
+        'maschineneinsaetze': (
+            'maschine_id IN (SELECT id FROM maschinen WHERE gemeinschaft_id = ?)', [gemeinschaft_id]),
+        # Buchungen ohne Betrieb (Maschinen-/Gemeinschaftskosten) gehören zu keinem Konto
+        'buchungen': ('gemeinschaft_id = ? AND betrieb_id IS NOT NULL', [gemeinschaft_id]),
+        'bank_transaktionen': (bank, [gemeinschaft_id]),
+    }
+
+
+# ============================================================================
+# ABSCHLUSS
+# ============================================================================
+
+def jahr_abschliessen(db, gemeinschaft_id, jahr, benutzer_id, bemerkung=None, fortschritt=None):
+    """Geschäftsjahr einer Gemeinschaft abschließen
+
+    Läuft komplett in der Transaktion des Aufrufers; bei einem Fehler bleibt
+    nichts halb verschoben zurück. Liefert die gespeicherten Kennzahlen.
+    """
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+    jahr = int(jahr)
+    melden = fortschritt or (lambda prozent, meldung=None: None)
+
+    if jahr >= date.today().year:
+        raise ValueError('Nur vergangene Jahre können abgeschlossen werden.')
+
+    cursor.execute(convert_sql("""
+        SELECT 1 FROM jahresabschluesse WHERE gemeinschaft_id = ? AND jahr = ?
+    """), (gemeinschaft_id, jahr))
+    if cursor.fetchone():
+        raise JahrAbgeschlossen(f'Das Jahr {jahr} ist bereits abgeschlossen.')
+
+    von = f'{jahr}-01-01'
+    bis = f'{jahr + 1}-01-01'
+    bedingungen = _bedingungen(cursor, gemeinschaft_id)
+
+    # Ältere offene Jahre müssen zuerst abgeschlossen werden, sonst stimmt der Vortrag nicht
+    aeltestes = aeltestes_offenes_jahr(db, gemeinschaft_id)
+    if aeltestes is not None and aeltestes < jahr:
+        raise ValueError(f'Es gibt noch Daten aus {aeltestes} - bitte ältere Jahre zuerst abschließen.')
+
+    melden(10, 'Kennzahlen werden berechnet...')
+
+    # Kennzahlen über alle Transaktionen des Jahres - auch die zugeordneten,
+    # die nur wegen des Fremdschlüssels in der Arbeitstabelle bleiben
+    cursor.execute(convert_sql("""
+        SELECT COUNT(*),
+               COALESCE(SUM(CASE WHEN betrag > 0 THEN betrag ELSE 0 END), 0),
+               COALESCE(SUM(CASE WHEN betrag < 0 THEN -betrag ELSE 0 END), 0)
+        FROM bank_transaktionen
+        WHERE gemeinschaft_id = ? AND buchungsdatum >= ? AND buchungsdatum < ?
+    """), (gemeinschaft_id, von, bis))
+    anzahl_transaktionen, einnahmen, ausgaben = cursor.fetchone()
+
+    # Netto der Transaktionen, die ins Archiv wandern (Saldo in bank_saldo_archiv)
+    bedingung, params = bedingungen['bank_transaktionen']
+    cursor.execute(convert_sql(f"""
+        SELECT COALESCE(SUM(betrag), 0) FROM bank_transaktionen
+        WHERE {bedingung} AND buchungsdatum >= ? AND buchungsdatum < ?
+    """), params + [von, bis])
+    bank_saldo_archiviert = cursor.fetchone()[0] or 0
+
+    bedingung, params = bedingungen['maschineneinsaetze']
+    cursor.execute(convert_sql(f"""
+        SELECT COUNT(*), COALESCE(SUM(COALESCE(kosten_berechnet, 0) + COALESCE(treibstoffkosten, 0)), 0)
+        FROM maschineneinsaetze
+        WHERE {bedingung} AND datum >= ? AND datum < ?
+    """), params + [von, bis])
+    anzahl_einsaetze, summe_einsaetze = cursor.fetchone()
+
+    # Salden pro Betrieb: Vortrag des letzten Abschlusses + Buchungen des Jahres
+    cursor.execute(convert_sql("""
+        SELECT betrieb_id, saldo_ende FROM jahresabschluss_salden
+        WHERE gemeinschaft_id = ? AND jahr = (
+            SELECT MAX(jahr) FROM jahresabschluss_salden WHERE gemeinschaft_id = ? AND jahr < ?
+        )
+    """), (gemeinschaft_id, gemeinschaft_id, jahr))
+    salden = {betrieb_id: [saldo or 0, 0] for betrieb_id, saldo in cursor.fetchall()}
+
+    bedingung, params = bedingungen['buchungen']
+    cursor.execute(convert_sql(f"""
+        SELECT betrieb_id, COUNT(*), COALESCE(SUM(betrag), 0)
+        FROM buchungen
+        WHERE {bedingung} AND datum >= ? AND datum < ?
+        GROUP BY betrieb_id
+    """), params + [von, bis])
+    anzahl_buchungen = 0
+    for betrieb_id, anzahl, summe in cursor.fetchall():
+        salden.setdefault(betrieb_id, [0, 0])[1] = summe or 0
+        anzahl_buchungen += anzahl
+
+    cursor.execute(convert_sql("""
+        INSERT INTO jahresabschluesse
+        (gemeinschaft_id, jahr, abgeschlossen_von, gesamteinnahmen, gesamtausgaben, bemerkung,
+         anzahl_einsaetze, summe_einsaetze, anzahl_buchungen, anzahl_transaktionen,
+         bank_saldo_archiviert)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """), (gemeinschaft_id, jahr, benutzer_id, einnahmen, ausgaben, bemerkung,
+           anzahl_einsaetze, summe_einsaetze, anzahl_buchungen, anzahl_transaktionen,
+           bank_saldo_archiviert))
+
+    sql = convert_sql("""
+        INSERT INTO jahresabschluss_salden
+        (gemeinschaft_id, jahr, betrieb_id, saldo_vortrag, bewegungen, saldo_ende)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """)
+    for betrieb_id, (vortrag, bewegungen) in sorted(salden.items()):
+        cursor.execute(sql, (gemeinschaft_id, jahr, betrieb_id, vortrag, bewegungen,
+                             round(vortrag + bewegungen, 2)))
+
+    verschoben = {}
+    for nummer, (tabelle, datumsspalte) in enumerate(ARCHIV_TABELLEN.items()):
+        melden(30 + 20 * nummer, f'{tabelle} wird archiviert...')
+        bedingung, params = bedingungen[tabelle]
+        verschoben[tabelle] = _verschieben(
+            cursor, tabelle, jahr,
+            f'{bedingung} AND {datumsspalte} >= ? AND {datumsspalte} < ?', params + [von, bis])
+
+    return {
+        'jahr': jahr,
+        'gesamteinnahmen': einnahmen,
+        'gesamtausgaben': ausgaben,
+        'anzahl_einsaetze': anzahl_einsaetze,
+        'summe_einsaetze': summe_einsaetze,
+        'anzahl_buchungen': anzahl_buchungen,
+        'anzahl_transaktionen': anzahl_transaktionen,
+        'betriebe': len(salden),
+        'verschoben': verschoben,
+    }
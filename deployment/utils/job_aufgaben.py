@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+Aufgaben für Hintergrund-Jobs (siehe utils/jobs.py)
+
+Jede Aufgabe erhält den JobKontext und die beim Einreihen übergebenen
+Parameter. Sie liefert ein dict zurück; 'meldung' erscheint als Ergebnistext,
+'datei'/'download_name'/'mimetype' machen eine Ergebnisdatei herunterladbar.
+"""
+
+import os
+import csv
+import json
+import sqlite3
+import zipfile
+from io import StringIO
+from datetime import datetime
+
+from database import MaschinenDBContext, USING_POSTGRESQL
+from utils.jobs import aufgabe, warteschlange_erhalten
+from utils.jahresabschluss import einsaetze_quelle, jahr_abschliessen
+from utils.sql_helpers import convert_sql
+from utils.prozesse import befehl_ausfuehren, pg_befehl
+from utils.maschinen_kennzahlen import kennzahlen_nach_einsaetzen, kennzahlen_neu_aufbauen
+
+# Backups ohne Inhalt der Job-Warteschlange (nur die Tabellendefinition)
+PG_DUMP_OPTIONEN = ('--exclude-table-data=jobs',)
+
+
+def _zeitstempel():
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
+
+
+def _datei_ergebnis(pfad, download_name, mimetype, meldung):
+    return {
+        'datei': os.path.basename(pfad),
+        'download_name': download_name,
+        'mimetype': mimetype,
+        'meldung': meldung
+    }
+
+
+# ============================================================================
+# BACKUP UND EXPORT
+# ============================================================================
+
+@aufgabe('datenbank_backup', 'Datenbank-Backup')
+def datenbank_backup(kontext, db_path):
+    """pg_dump bzw. konsistente Kopie der SQLite-Datenbank"""
+    timestamp = _zeitstempel()
+    kontext.fortschritt(5, 'Backup wird erstellt...')
+
+    if USING_POSTGRESQL:
+        backup_filename = f"maschinengemeinschaft_backup_{timestamp}.sql"
+        backup_path = kontext.datei(backup_filename)
+
+        result = befehl_ausfuehren(*pg_befehl('/usr/bin/pg_dump', *PG_DUMP_OPTIONEN, '-f', backup_path))
+
+        if result.returncode != 0:
+            raise Exception(f"pg_dump Fehler: {result.stderr}")
+
+        mimetype = 'application/sql'
+    else:
+        backup_filename = f"maschinengemeinschaft_backup_{timestamp}.db"
+        backup_path = kontext.datei(backup_filename)
+
+        # Backup-API statt Dateikopie: konsistent auch bei gleichzeitigen Schreibzugriffen.
+        # In einem Schritt und ohne Fortschritt dazwischen - jeder Schreibzugriff
+        # auf die Quelle (auch der Fortschritt im jobs-Eintrag) startet ein
+        # schrittweises Backup von vorn.
+        quelle = sqlite3.connect(db_path)
+        ziel = sqlite3.connect(backup_path)
+        try:
+            quelle.backup(ziel)
+        finally:
+            ziel.close()
+            quelle.close()
+
+        mimetype = 'application/x-sqlite3'
+
+    kontext.fortschritt(95, 'Backup gespeichert')
+    return _datei_ergebnis(backup_path, backup_filename, mimetype, 'Backup erstellt')
+
+
+@aufgabe('datenbank_restore', 'Datenbank-Wiederherstellung')
+def datenbank_restore(kontext, upload_pfad):
+    """PostgreSQL: aktuellen Stand sichern (pg_dump), dann Backup per psql einspielen
+
+    Die Sicherung des alten Stands ist als Ergebnisdatei herunterladbar. Die
+    Job-Warteschlange (auch der Eintrag dieses Jobs) bleibt unverändert.
+    """
+    from utils.schema_migration import run_migrations_with_report
+
+    try:
+        kontext.fortschritt(5, 'Aktueller Stand wird gesichert...')
+        backup_filename = f"backup_before_restore_{_zeitstempel()}.sql"
+        backup_path = kontext.datei(backup_filename)
+        result = befehl_ausfuehren(*pg_befehl('/usr/bin/pg_dump', *PG_DUMP_OPTIONEN, '-f', backup_path))
+        if result.returncode != 0:
+            raise Exception(f"pg_dump Fehler: {result.stderr}")
+
+        kontext.fortschritt(40, 'Backup wird eingespielt...')
+        with warteschlange_erhalten():
+            result = befehl_ausfuehren(*pg_befehl('/usr/bin/psql', '-f', upload_pfad))
+            if result.returncode != 0:
+                raise Exception(f"psql Fehler: {result.stderr}")
+
+            # Schema-Migration nach Restore durchführen (legt auch jobs wieder an)
+            kontext.fortschritt(90, 'Schema-Migration...')
+            migration_report = run_migrations_with_report()
+    finally:
+        if os.path.exists(upload_pfad):
+            os.remove(upload_pfad)
+
+    meldung = 'Datenbank erfolgreich wiederhergestellt!'
+    if migration_report['tables_added']:
+        meldung += f" Fehlende Tabellen hinzugefügt: {', '.join(migration_report['tables_added'])}."
+    if migration_report['columns_added']:
+        meldung += f" Fehlende Spalten hinzugefügt: {', '.join(migration_report['columns_added'])}."
+    if migration_report['errors']:
+        meldung += f" Migration-Fehler: {', '.join(migration_report['errors'])}."
+    meldung += ' WICHTIG: Bitte starten Sie die Anwendung neu!'
+
+    return _datei_ergebnis(backup_path, backup_filename, 'application/sql', meldung)
+
+
+def _export_daten(db_path):
+    with MaschinenDBContext(db_path, read_only=True) as db:
+        return {
+            'benutzer': db.get_all_benutzer(nur_aktive=False),
+            'maschinen': db.get_all_maschinen(nur_aktive=False, mit_zaehler=True),
+            'einsatzzwecke': db.get_all_einsatzzwecke(nur_aktive=False),
+            'einsaetze': db.get_all_einsaetze()
+        }
+
+
+@aufgabe('export_json', 'Export (JSON)')
+def export_json(kontext, db_path):
+    """Alle Daten als JSON exportieren"""
+    kontext.fortschritt(10, 'Daten werden gelesen...')
+    data = {'export_datum': datetime.now().isoformat()}
+    data.update(_export_daten(db_path))
+
+    kontext.fortschritt(60, 'Datei wird geschrieben...')
+    filename = f'maschinengemeinschaft_backup_{_zeitstempel()}.json'
+    pfad = kontext.datei(filename)
+    with open(pfad, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+
+    return _datei_ergebnis(pfad, filename, 'application/json', 'Export erstellt')
+
+
+@aufgabe('export_csv', 'Export (CSV-ZIP)')
+def export_csv(kontext, db_path):
+    """Alle Daten als CSV-ZIP exportieren"""
+    kontext.fortschritt(10, 'Daten werden gelesen...')
+    daten = _export_daten(db_path)
+
+    filename = f'maschinengemeinschaft_backup_{_zeitstempel()}.zip'
+    pfad = kontext.datei(filename)
+
+    with zipfile.ZipFile(pfad, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for nummer, (name, zeilen) in enumerate(daten.items()):
+            kontext.fortschritt(20 + 20 * nummer, f'{name}.csv wird geschrieben...')
+            if not zeilen:
+                continue
+            csv_buffer = StringIO()
+            writer = csv.DictWriter(csv_buffer, fieldnames=zeilen[0].keys())
+            writer.writeheader()
+            writer.writerows(zeilen)
+            zip_file.writestr(f'{name}.csv', csv_buffer.getvalue())
+
+    return _datei_ergebnis(pfad, filename, 'application/zip', 'Export erstellt')
+
+
+@aufgabe('export_alle_einsaetze_csv', 'Export aller Einsätze (CSV)')
+def export_alle_einsaetze_csv(kontext, db_path):
+    """Alle Einsätze als CSV für den Jahresabschluss"""
+    kontext.fortschritt(10, 'Einsätze werden gelesen...')
+
+    with MaschinenDBContext(db_path, read_only=True) as db:
+        cursor = db.cursor
+        # Abgeschlossene Jahre liegen im Archiv und gehören mit in den Export
+        sql = convert_sql(f"""
+            SELECT
+                m.datum,
+                b.name as benutzer,
+                ma.bezeichnung as maschine,
+                ez.bezeichnung as einsatzzweck,
+                ma.abrechnungsart,
+                ma.preis_pro_einheit,
+                m.flaeche_menge,
+                m.treibstoffverbrauch as treibstoff_liter,
+                m.treibstoffkosten as treibstoff_preis,
+                m.treibstoffkosten,
+                m.kosten_berechnet as maschinenkosten,
+                (COALESCE(m.treibstoffkosten, 0) + COALESCE(m.kosten_berechnet, 0)) as gesamtkosten,
+                m.anfangstand,
+                m.endstand,
+                m.anmerkungen as bemerkung
+            FROM {einsaetze_quelle(db)} m
+            JOIN benutzer b ON m.benutzer_id = b.id
+            JOIN maschinen ma ON m.maschine_id = ma.id
+            LEFT JOIN einsatzzwecke ez ON m.einsatzzweck_id = ez.id
+            ORDER BY m.datum DESC, m.id DESC
+        """)
+        cursor.execute(sql)
+        columns = [desc[0] for desc in cursor.description]
+
+        filename = f'alle_einsaetze_{_zeitstempel()}.csv'
+        pfad = kontext.datei(filename)
+        summen = [0, 0, 0]
+        anzahl = 0
+
+        with open(pfad, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(columns)
+
+            while True:
+                rows = cursor.fetchmany(5000)
+                if not rows:
+                    break
+                for row in rows:
+                    writer.writerow(row)
+                    summen[0] += row[9] or 0
+                    summen[1] += row[10] or 0
+                    summen[2] += row[11] or 0
+                anzahl += len(rows)
+                kontext.fortschritt(50, f'{anzahl} Einsätze geschrieben...')
+
+            writer.writerow([])
+            writer.writerow(['GESAMT', '', '', '', '', '', '', '', ''] + summen + ['', '', ''])
+
+    return _datei_ergebnis(pfad, filename, 'text/csv; charset=utf-8', f'{anzahl} Einsätze exportiert')
+
+
+# ============================================================================
+# ÜBUNGSDATENBANKEN
+# ============================================================================
+
+@aufgabe('training_db_erstellen', 'Übungsdatenbanken neu erstellen')
+def training_db_erstellen(kontext):
+    """Vorlagen neu bauen und alle Übungsdatenbanken daraus zurücksetzen"""
+    from utils.training import (
+        TRAINING_DATABASES, vorlage_erstellen, training_db_zuruecksetzen, sandboxes_aufraeumen
+    )
+
+    for nummer, db_key in enumerate(TRAINING_DATABASES):
+        kontext.fortschritt(100 * nummer // len(TRAINING_DATABASES),
+                            f"{TRAINING_DATABASES[db_key]['name']} wird erstellt...")
+        vorlage_erstellen(db_key, neu=True)
+        training_db_zuruecksetzen(db_key)
+
+    geloescht = sandboxes_aufraeumen()
+    meldung = 'Trainingsdatenbanken wurden neu erstellt!'
+    if geloescht:
+        meldung += f' {geloescht} alte Sandbox(es) gelöscht.'
+    return {'meldung': meldung}
+
+
+# ============================================================================
+# FINANZEN
+# ============================================================================
+
+@aufgabe('import_loeschen', 'Bank-Import löschen')
+def import_loeschen(kontext, db_path, gemeinschaft_id, import_datum, importiert_von):
+    """Alle Transaktionen eines bestimmten Imports löschen"""
+    with MaschinenDBContext(db_path) as db, kontext.transaktion(db):
+        cursor = db.connection.cursor()
+
+        sql = convert_sql("""
+            SELECT id FROM bank_transaktionen
+            WHERE gemeinschaft_id = ? AND import_datum = ? AND importiert_von = ?
+        """)
+        cursor.execute(sql, (gemeinschaft_id, import_datum, importiert_von))
+        trans_ids = [row[0] for row in cursor.fetchall()]
+
+        if not trans_ids:
+            return {'meldung': 'Keine Transaktionen zum Löschen gefunden!'}
+
+        kontext.fortschritt(30, f'{len(trans_ids)} Transaktionen werden gelöscht...')
+
+        placeholders = ','.join(['?' for _ in trans_ids])
+        sql = convert_sql(f"""
+            DELETE FROM gemeinschafts_kosten WHERE transaktion_id IN ({placeholders})
+            RETURNING maschine_id, datum
+        """)
+        cursor.execute(sql, trans_ids)
+        kennzahlen_nach_einsaetzen(db, [row for row in cursor.fetchall() if row[0]])
+
+        sql = convert_sql("""
+            DELETE FROM bank_transaktionen
+            WHERE gemeinschaft_id = ? AND import_datum = ? AND importiert_von = ?
+        """)
+        cursor.execute(sql, (gemeinschaft_id, import_datum, importiert_von))
+
+        db.connection.commit()
+
+    return {'meldung': f'{len(trans_ids)} Transaktionen des Imports vom {import_datum} gelöscht'}
+
+
+@aufgabe('kennzahlen_neu', 'Maschinen-Kennzahlen neu berechnen')
+def kennzahlen_neu(kontext, db_path):
+    """Kennzahlen-Cache aller Maschinen aus Einsätzen, Archiv und Kosten neu aufbauen"""
+    with MaschinenDBContext(db_path) as db:
+        anzahl = kennzahlen_neu_aufbauen(db)
+    return {'meldung': f'{anzahl} Kennzahlen-Zeilen neu berechnet'}
+
+
+@aufgabe('abrechnungen_erstellen', 'Abrechnungslauf')
+def abrechnungen_erstellen(kontext, db_path, gemeinschaft_id, zeitraum_von, zeitraum_bis, benutzer_id):
+    """Abrechnungen für alle Betriebe einer Gemeinschaft erstellen"""
+    von_obj = datetime.strptime(zeitraum_von, '%Y-%m-%d')
+    bis_obj = datetime.strptime(zeitraum_bis, '%Y-%m-%d')
+    abrechnungszeitraum = f"{von_obj.strftime('%m/%Y')} - {bis_obj.strftime('%m/%Y')}"
+
+    with MaschinenDBContext(db_path) as db, kontext.transaktion(db):
+        cursor = db.connection.cursor()
+
+        # Abrechnungen pro Betrieb erstellen (über betriebe_gemeinschaften)
+        sql = convert_sql("""
+            SELECT bt.id, bt.name FROM betriebe bt
+            JOIN betriebe_gemeinschaften bgem ON bt.id = bgem.betrieb_id
+            WHERE bgem.gemeinschaft_id = ? AND (bt.aktiv = true OR bt.aktiv IS NULL)
+            ORDER BY bt.name
+        """)
+        cursor.execute(sql, (gemeinschaft_id,))
+        betriebe = cursor.fetchall()
+
+        erstellt = 0
+        uebersprungen = 0
+
+        for nummer, betrieb_row in enumerate(betriebe):
+            betrieb_id = betrieb_row[0]
+            betrieb_name = betrieb_row[1]
+            kontext.fortschritt(100 * nummer // max(len(betriebe), 1),
+                                f'{nummer + 1}/{len(betriebe)}: {betrieb_name}')
+
+            # Prüfen ob bereits Abrechnung existiert
+            sql = convert_sql("""
+                SELECT COUNT(*) FROM mitglieder_abrechnungen
+                WHERE gemeinschaft_id = ? AND betrieb_id = ?
+                AND zeitraum_von = ? AND zeitraum_bis = ?
+            """)
+            cursor.execute(sql, (gemeinschaft_id, betrieb_id, zeitraum_von, zeitraum_bis))
+
+            if cursor.fetchone()[0] > 0:
+                uebersprungen += 1
+                continue
+
+            # Maschinenkosten für alle Benutzer des Betriebs summieren (über benutzer_betriebe)
+            sql = convert_sql("""
+                SELECT COALESCE(SUM(me.kosten_berechnet), 0)
+                FROM maschineneinsaetze me
+                JOIN maschinen m ON me.maschine_id = m.id
+                JOIN benutzer_betriebe bb ON me.benutzer_id = bb.benutzer_id
+                WHERE bb.betrieb_id = ?
+                AND me.datum BETWEEN ? AND ?
+                AND m.gemeinschaft_id = ?
+            """)
+            cursor.execute(sql, (betrieb_id, zeitraum_von, zeitraum_bis, gemeinschaft_id))
+            betrag_maschinen = cursor.fetchone()[0] or 0
+
+            # Treibstoffkosten für alle Benutzer des Betriebs summieren (über benutzer_betriebe)
+            sql = convert_sql("""
+                SELECT COALESCE(SUM(me.treibstoffkosten), 0)
+                FROM maschineneinsaetze me
+                JOIN maschinen m ON me.maschine_id = m.id
+                JOIN benutzer_betriebe bb ON me.benutzer_id = bb.benutzer_id
+                WHERE bb.betrieb_id = ?
+                AND me.datum BETWEEN ? AND ?
+                AND m.treibstoff_berechnen = true
+                AND m.gemeinschaft_id = ?
+            """)
+            cursor.execute(sql, (betrieb_id, zeitraum_von, zeitraum_bis, gemeinschaft_id))
+            betrag_treibstoff = cursor.fetchone()[0] or 0
+
+            betrag_gesamt = betrag_maschinen + betrag_treibstoff
+
+            if betrag_gesamt > 0:
+                sql = convert_sql("""
+                    INSERT INTO mitglieder_abrechnungen
+                    (gemeinschaft_id, betrieb_id,
+                     abrechnungszeitraum, zeitraum_von, zeitraum_bis, betrag_gesamt,
+                     betrag_treibstoff, betrag_maschinen, betrag_sonstiges,
+                     status, erstellt_von)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, 'offen', ?)
+                    RETURNING id
+                """)
+                cursor.execute(sql, (gemeinschaft_id, betrieb_id,
+                                    abrechnungszeitraum, zeitraum_von, zeitraum_bis, betrag_gesamt,
+                                    betrag_treibstoff, betrag_maschinen, benutzer_id))
+
+                abrechnung_id = cursor.fetchone()[0]
+
+                # Konto erstellen oder aktualisieren (pro Betrieb)
+                sql = convert_sql("""
+                    INSERT INTO mitglieder_konten (betrieb_id, gemeinschaft_id, saldo)
+                    VALUES (?, ?, 0)
+                    ON CONFLICT(betrieb_id, gemeinschaft_id) DO NOTHING
+                """)
+                cursor.execute(sql, (betrieb_id, gemeinschaft_id))
+
+                # Buchung erstellen (pro Betrieb)
+                sql = convert_sql("""
+                    INSERT INTO buchungen (
+                        betrieb_id, gemeinschaft_id, datum, betrag, typ,
+                        beschreibung, referenz_typ, referenz_id, erstellt_von
+                    ) VALUES (?, ?, ?, ?, 'abrechnung', ?, 'abrechnung', ?, ?)
+                """)
+                cursor.execute(sql, (
+                    betrieb_id, gemeinschaft_id, zeitraum_bis, -betrag_gesamt,
+                    f'Abrechnung #{abrechnung_id} für {abrechnungszeitraum}',
+                    abrechnung_id, benutzer_id
+                ))
+
+                # Saldo aktualisieren
+                sql = convert_sql("""
+                    UPDATE mitglieder_konten
+                    SET saldo = saldo - ?, letzte_aktualisierung = CURRENT_TIMESTAMP
+                    WHERE betrieb_id = ? AND gemeinschaft_id = ?
+                """)
+                cursor.execute(sql, (betrag_gesamt, betrieb_id, gemeinschaft_id))
+
+                erstellt += 1
+
+        db.connection.commit()
+
+    meldungen = []
+    if erstellt > 0:
+        meldungen.append(f'{erstellt} Abrechnung(en) erfolgreich erstellt')
+    if uebersprungen > 0:
+        meldungen.append(f'{uebersprungen} Abrechnung(en) bereits vorhanden (übersprungen)')
+    if erstellt == 0 and uebersprungen == 0:
+        meldungen.append(f'Keine Maschineneinsätze im Zeitraum {zeitraum_von} bis {zeitraum_bis} gefunden.')
+
+    return {'meldung': '. '.join(meldungen), 'erstellt': erstellt, 'uebersprungen': uebersprungen}
+
+
+@aufgabe('jahresabschluss', 'Jahresabschluss')
+def jahresabschluss(kontext, db_path, gemeinschaft_id, jahr, benutzer_id, bemerkung=None):
+    """Geschäftsjahr abschließen und die Daten des Jahres archivieren"""
+    with MaschinenDBContext(db_path) as db, kontext.transaktion(db):
+        ergebnis = jahr_abschliessen(db, gemeinschaft_id, jahr, benutzer_id, bemerkung,
+                                     fortschritt=kontext.fortschritt)
+        kontext.fortschritt(95, 'Änderungen werden gespeichert...')
+
+    verschoben = ergebnis['verschoben']
+    ergebnis['meldung'] = (
+        f"Jahr {ergebnis['jahr']} abgeschlossen: {verschoben['maschineneinsaetze']} Einsätze, "
+        f"{verschoben['buchungen']} Buchungen und {verschoben['bank_transaktionen']} "
+        f"Transaktionen archiviert, Salden für {ergebnis['betriebe']} Betriebe vorgetragen"
+    )
+    return ergebnis
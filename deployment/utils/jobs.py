@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Hintergrund-Jobs (Warteschlange in der Datenbank)
+
+Lange Vorgänge - Backups, Komplett-Exporte, Abrechnungsläufe, das Neuerstellen
+der Übungsdatenbanken, das Löschen von Bank-Importen - laufen nicht mehr im
+HTTP-Request. Die Route legt einen Eintrag in der Tabelle jobs an und leitet
+auf die Statusseite weiter; Worker-Threads arbeiten die Warteschlange ab.
+
+- Die Warteschlange liegt immer in der Produktionsdatenbank, die Ziel-Datenbank
+  eines Jobs (Produktion oder Übungsdatenbank) steht in seinen Parametern.
+- Jeder Gunicorn-Worker startet JOB_WORKER_THREADS Threads (0 = keine, z.B.
+  wenn job_worker.py als eigener Prozess läuft). Ein Job wird per UPDATE ...
+  RETURNING genau einmal vergeben (PostgreSQL: FOR UPDATE SKIP LOCKED).
+- Ergebnisdateien liegen in JOB_DIR/<job_id>/ und werden nach
+  JOB_AUFBEWAHRUNG_TAGE zusammen mit dem Job gelöscht.
+- Jobs ohne Lebenszeichen seit JOB_STALE_MINUTES (Worker beendet/abgestürzt)
+  werden als Fehler markiert.
+
+Aufgaben werden mit @aufgabe('typ', 'Titel') registriert (utils/job_aufgaben.py)
+und erhalten einen JobKontext für Fortschritt und Ergebnisdateien.
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from database import MaschinenDBContext, USING_POSTGRESQL
+from metrics import job_timer
+from utils.training import DB_PATH_PRODUCTION
+from utils.sql_helpers import convert_sql
+
+JOB_DIR = os.environ.get('JOB_DIR', os.path.join(tempfile.gettempdir(), 'mgr_jobs'))
+JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS', 1))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 2))
+JOB_STALE_MINUTES = int(os.environ.get('JOB_STALE_MINUTES', 60))
+JOB_AUFBEWAHRUNG_TAGE = int(os.environ.get('JOB_AUFBEWAHRUNG_TAGE', 7))
+
+# Mindestabstand zwischen zwei Fortschritts-Schreibzugriffen
+_FORTSCHRITT_INTERVALL_SECONDS = 1.0
+# Abstand für Aufräumen (abgelaufene/hängende Jobs)
+_AUFRAEUMEN_INTERVALL_SECONDS = 300
+
+STATUS_TEXT = {
+    'wartend': 'Wartet',
+    'laeuft': 'Läuft',
+    'fertig': 'Fertig',
+    'fehler': 'Fehler'
+}
+
+# typ -> (funktion, titel)
+_AUFGABEN = {}
+
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def _jetzt():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def aufgabe(typ, titel):
+    """Funktion als Job-Typ registrieren: f(kontext, **parameter) -> ergebnis (dict)"""
+    def decorator(f):
+        _AUFGABEN[typ] = (f, titel)
+        return f
+    return decorator
+
+
+def job_titel(typ):
+    _aufgaben_laden()
+    return _AUFGABEN[typ][1] if typ in _AUFGABEN else typ
+
+
+def _aufgaben_laden():
+    """Registrierung der Aufgaben sicherstellen (Import mit Seiteneffekt)"""
+    import utils.job_aufgaben  # noqa: F401
+
+
+def job_verzeichnis(job_id):
+    return os.path.join(JOB_DIR, str(int(job_id)))
+
+
+def upload_ablegen(datei, endung):
+    """Hochgeladene Datei für einen Job unter JOB_DIR/uploads ablegen, gibt den Pfad zurück
+
+    JOB_DIR muss für Web- und Worker-Prozesse dasselbe Verzeichnis sein
+    (bei job_worker.py in eigenem Container: gemeinsames Volume).
+    """
+    verzeichnis = os.path.join(JOB_DIR, 'uploads')
+    os.makedirs(verzeichnis, exist_ok=True)
+    pfad = os.path.join(verzeichnis, f"{uuid.uuid4().hex}{endung}")
+    datei.save(pfad)
+    return pfad
+
+
+class JobKontext:
+    """Schnittstelle eines laufenden Jobs zur Warteschlange"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._zuletzt = 0.0
+        self._transaktion = None
+
+    @contextmanager
+    def transaktion(self, db):
+        """Offene Schreibtransaktion der Aufgabe anmelden
+
+        SQLite kennt nur einen Schreiber pro Datei: solange die Aufgabe in die
+        Produktionsdatenbank schreibt, würde eine zweite Verbindung für den
+        Fortschritt auf die Sperre warten und mit "database is locked"
+        scheitern. Innerhalb des Blocks schreibt fortschritt() daher über die
+        Verbindung der Aufgabe (sichtbar mit deren Commit).
+        """
+        vorher = self._transaktion
+        self._transaktion = db
+        try:
+            yield db
+        finally:
+            self._transaktion = vorher
+
+    def _eigene_verbindung(self):
+        """Verbindung der Aufgabe, falls sie die Warteschlange sperrt (SQLite, gleiche Datei)"""
+        db = self._transaktion
+        if db is None or USING_POSTGRESQL:
+            return None
+        try:
+            gleich = os.path.samefile(db.db_path, DB_PATH_PRODUCTION)
+        except OSError:
+            gleich = False
+        return db if gleich else None
+
+    def fortschritt(self, prozent, meldung=None):
+        """Fortschritt (0-100) melden - dient zugleich als Lebenszeichen"""
+        jetzt = time.time()
+        if prozent < 100 and jetzt - self._zuletzt < _FORTSCHRITT_INTERVALL_SECONDS:
+            return
+        self._zuletzt = jetzt
+        sql = convert_sql("""
+            UPDATE jobs SET fortschritt = ?, meldung = COALESCE(?, meldung), aktualisiert_am = ?
+            WHERE id = ?
+        """)
+        parameter = (max(0, min(100, int(prozent))), meldung, _jetzt(), self.job_id)
+
+        db = self._eigene_verbindung()
+        if db is not None:
+            db.connection.cursor().execute(sql, parameter)
+            return
+        with MaschinenDBContext(DB_PATH_PRODUCTION) as db:
+            db.connection.cursor().execute(sql, parameter)
+
+    def datei(self, dateiname):
+        """Pfad für eine Ergebnisdatei dieses Jobs"""
+        verzeichnis = job_verzeichnis(self.job_id)
+        os.makedirs(verzeichnis, exist_ok=True)
+        return os.path.join(verzeichnis, os.path.basename(dateiname))
+
+
+def _zeile_zu_job(columns, row):
+    job = dict(zip(columns, row))
+    parameter = json.loads(job['parameter']) if job.get('parameter') else {}
+    job['zurueck'] = parameter.pop('_zurueck', None)
+    job['parameter'] = parameter
+    job['ergebnis'] = json.loads(job['ergebnis']) if job.get('ergebnis') else {}
+    job['titel'] = job_titel(job['typ'])
+    job['status_text'] = STATUS_TEXT.get(job['status'], job['status'])
+    return job
+
+
+def job_einreihen(typ, parameter=None, benutzer_id=None, zurueck=None):
+    """Job anlegen, gibt die Job-ID zurück
+
+    zurueck: URL für den Rücksprung von der Statusseite (z.B. Abrechnungsliste).
+    """
+    _aufgaben_laden()
+    if typ not in _AUFGABEN:
+        raise ValueError(f"Unbekannter Job-Typ: {typ}")
+    daten = dict(parameter or {})
+    if zurueck:
+        daten['_zurueck'] = zurueck
+
+    with MaschinenDBContext(DB_PATH_PRODUCTION) as db:
+        cursor = db.connection.cursor()
+        sql = convert_sql("""
+            INSERT INTO jobs (typ, status, parameter, erstellt_von, erstellt_am, aktualisiert_am)
+            VALUES (?, 'wartend', ?, ?, ?, ?)
+            RETURNING id
+        """)
+        jetzt = _jetzt()
+        cursor.execute(sql, (typ, json.dumps(daten, default=str), benutzer_id, jetzt, jetzt))
+        return cursor.fetchone()[0]
+
+
+def job_laden(job_id):
+    """Job als dict (None wenn unbekannt)"""
+    with MaschinenDBContext(DB_PATH_PRODUCTION) as db:
+        cursor = db.connection.cursor()
+        cursor.execute(convert_sql("SELECT * FROM jobs WHERE id = ?"), (job_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return _zeile_zu_job([desc[0] for desc in cursor.description], row)
+
+
+def jobs_liste(benutzer_id=None, limit=50):
+    """Letzte Jobs (optional nur eines Benutzers), neueste zuerst"""
+    with MaschinenDBContext(DB_PATH_PRODUCTION) as db:
+        cursor = db.connection.cursor()
+        if benutzer_id is None:
+            cursor.execute(convert_sql("SELECT * FROM jobs ORDER BY id DESC LIMIT ?"), (limit,))
+        else:
+            sql = convert_sql("SELECT * FROM jobs WHERE erstellt_von = ? ORDER BY id DESC LIMIT ?")
+            cursor.execute(sql, (benutzer_id, limit))
+        columns = [desc[0] for desc in cursor.description]
+        return [_zeile_zu_job(columns, row) for row in cursor.fetchall()]
+
+
+def _job_holen():
+    """Ältesten wartenden Job atomar übernehmen"""
+    sperre = ' FOR UPDATE SKIP LOCKED' if USING_POSTGRESQL else ''
+    with MaschinenDBContext(DB_PATH_PRODUCTION) as db:
+        cursor = db.connection.cursor()
+        sql = convert_sql(f"""
+            UPDATE jobs SET status = 'laeuft', gestartet_am = ?, aktualisiert_am = ?
+            WHERE status = 'wartend' AND id = (
+                SELECT id FROM jobs WHERE status = 'wartend' ORDER BY id LIMIT 1{sperre}
+            )
+            RETURNING id, typ, parameter
+        """)
+        jetzt = _jetzt()
+        cursor.execute(sql, (jetzt, jetzt))
+        row = cursor.fetchone()
+    if not row:
+        return None
+    parameter = json.loads(row[2]) if row[2] else {}
+    return {
+        'id': row[0],
+        'typ': row[1],
+        'parameter': {k: v for k, v in parameter.items() if not k.startswith('_')}
+    }
+
+
+def _abschliessen(job_id, status, meldung, ergebnis):
+    with MaschinenDBContext(DB_PATH_PRODUCTION) as db:
+        cursor = db.connection.cursor()
+        # Bei Fehlern bleibt der letzte gemeldete Fortschritt stehen
+        sql = convert_sql("""
+            UPDATE jobs
+            SET status = ?, fortschritt = CASE WHEN ? = 'fertig' THEN 100 ELSE fortschritt END,
+                meldung = ?, ergebnis = ?, aktualisiert_am = ?, beendet_am = ?
+            WHERE id = ?
+        """)
+        jetzt = _jetzt()
+        cursor.execute(sql, (
+            status, status, meldung, json.dumps(ergebnis or {}, default=str), jetzt, jetzt, job_id
+        ))
+
+
+@contextmanager
+def warteschlange_erhalten():
+    """Inhalt der Tabelle jobs über eine Datenbank-Wiederherstellung erhalten
+
+    Die Warteschlange ist Betriebszustand, kein Datenbestand: ein eingespieltes
+    Backup kann die Tabelle ersetzen (auch mit alten Jobs derselben IDs), und
+    der Abschluss des laufenden Restore-Jobs ginge verloren. Nach dem Block
+    wird der Stand von vorher zurückgeschrieben und die ID-Folge dahinter
+    gestellt. Die Tabelle muss dann existieren (Schema-Migration im Block).
+    """
+    with MaschinenDBContext(DB_PATH_PRODUCTION) as db:
+        cursor = db.connection.cursor()
+        cursor.execute("SELECT * FROM jobs ORDER BY id")
+        columns = [desc[0] for desc in cursor.description]
+        zeilen = cursor.fetchall()
+
+    try:
+        yield
+    finally:
+        try:
+            with MaschinenDBContext(DB_PATH_PRODUCTION) as db:
+                cursor = db.connection.cursor()
+                cursor.execute("DELETE FROM jobs")
+                if zeilen:
+                    cursor.executemany(convert_sql(f"""
+                        INSERT INTO jobs ({', '.join(columns)})
+                        VALUES ({', '.join('?' for _ in columns)})
+                    """), zeilen)
+                if USING_POSTGRESQL:
+                    cursor.execute("""
+                        SELECT setval(pg_get_serial_sequence('jobs', 'id'),
+                                      (SELECT COALESCE(MAX(id), 0) + 1 FROM jobs), false)
+                    """)
+        except Exception as e:
+            print(f"WARNUNG: Job-Warteschlange nach Wiederherstellung nicht zurückgeschrieben: {e}")
+
+
+def job_ausfuehren(job):
+    """Einen übernommenen Job ausführen und Ergebnis/Fehler speichern"""
+    _aufgaben_laden()
+    funktion, _ = _AUFGABEN.get(job['typ'], (None, None))
+    if funktion is None:
+        _abschliessen(job['id'], 'fehler', f"Unbekannter Job-Typ: {job['typ']}", None)
+        return
+
+    try:
+        with job_timer(job['typ']):
+            ergebnis = funktion(JobKontext(job['id']), **job['parameter']) or {}
+    except Exception as e:
+        traceback.print_exc()
+        _abschliessen(job['id'], 'fehler', str(e), None)
+        return
+
+    _abschliessen(job['id'], 'fertig', ergebnis.pop('meldung', None), ergebnis)
+
+
+def _aufraeumen():
+    """Hängende Jobs als Fehler markieren, alte Jobs samt Dateien löschen"""
+    grenze_stale = (datetime.now() - timedelta(minutes=JOB_STALE_MINUTES)).strftime('%Y-%m-%d %H:%M:%S')
+    grenze_alt = (datetime.now() - timedelta(days=JOB_AUFBEWAHRUNG_TAGE)).strftime('%Y-%m-%d %H:%M:%S')
+
+    with MaschinenDBContext(DB_PATH_PRODUCTION) as db:
+        cursor = db.connection.cursor()
+        sql = convert_sql("""
+            UPDATE jobs
+            SET status = 'fehler', meldung = 'Abgebrochen (kein Lebenszeichen des Workers)', beendet_am = ?
+            WHERE status = 'laeuft' AND aktualisiert_am < ?
+        """)
+        cursor.execute(sql, (_jetzt(), grenze_stale))
+
+        sql = convert_sql("DELETE FROM jobs WHERE beendet_am < ? RETURNING id")
+        cursor.execute(sql, (grenze_alt,))
+        geloescht = [row[0] for row in cursor.fetchall()]
+
+    for job_id in geloescht:
+        shutil.rmtree(job_verzeichnis(job_id), ignore_errors=True)
+
+
+def job_schritt():
+    """Ältesten wartenden Job übernehmen und ausführen; False wenn keiner wartet
+
+    Für job_worker.py-Schleifen und Benchmarks, die Jobs synchron abarbeiten
+    (JOB_WORKER_THREADS=0).
+    """
+    job = _job_holen()
+    if job is None:
+        return False
+    job_ausfuehren(job)
+    return True
+
+
+def worker_schleife(stop=None):
+    """Warteschlange abarbeiten bis stop gesetzt ist (Thread oder job_worker.py)"""
+    _aufgaben_laden()
+    stop = stop or threading.Event()
+    zuletzt_aufgeraeumt = 0.0
+
+    while not stop.is_set():
+        try:
+            if time.time() - zuletzt_aufgeraeumt >= _AUFRAEUMEN_INTERVALL_SECONDS:
+                zuletzt_aufgeraeumt = time.time()
+                _aufraeumen()
+
+            if job_schritt():
+                continue
+        except Exception as e:
+            print(f"WARNUNG: Job-Worker: {e}")
+        stop.wait(JOB_POLL_SECONDS)
+
+
+def worker_starten():
+    """Worker-Threads im aktuellen Prozess starten (einmal pro Prozess)
+
+    Wird beim Import von web_app aufgerufen; Gunicorn importiert die App ohne
+    --preload in jedem Worker-Prozess, so dass jeder eigene Threads erhält.
+    """
+    global _worker_pid
+    if JOB_WORKER_THREADS <= 0:
+        return
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+        for nummer in range(JOB_WORKER_THREADS):
+            thread = threading.Thread(target=worker_schleife, name=f'job-worker-{nummer}', daemon=True)
+            thread.start()
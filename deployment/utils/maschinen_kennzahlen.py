@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Kennzahlen-Cache für die Maschinen-Rentabilität
+
+maschinen_kennzahlen hält pro (maschine_id, jahr) Einsatzanzahl,
+Betriebsstunden, Einnahmen, Aufwendungen und Bankkosten. Wer Einsätze,
+Aufwendungen oder einer Maschine zugeordnete Kosten ändert, ruft
+kennzahlen_aktualisieren() für die betroffenen Jahre auf; nur diese
+Zeilen werden in derselben Transaktion neu berechnet. Ein einzelner neuer
+Einsatz zählt nur seine Werte hinzu (kennzahlen_einsatz_hinzu).
+
+Rentabilitätsseite, Maschinenübersicht-PDF und Flottenvergleich lesen nur
+noch den Cache - der Vergleich aller Maschinen ist eine einzige Abfrage.
+
+Einnahmen werden wie bisher mit dem aktuellen Preis der Maschine
+bewertet; nach einer Preisänderung werden daher alle Jahre der Maschine
+neu berechnet. Bankkosten stammen aus Buchungen mit referenz_typ
+'maschine' und aus gemeinschafts_kosten mit maschine_id.
+"""
+
+from database import USING_POSTGRESQL
+from utils.sql_helpers import convert_sql, jahr_bereich
+from utils.jahresabschluss import abgeschlossen_bis, einsaetze_quelle
+
+# Einnahmen eines Einsatzes (Alias e = Einsatz, m = Maschine)
+_EINNAHMEN = """CASE
+        WHEN m.abrechnungsart = 'stunden' THEN (e.endstand - e.anfangstand) * COALESCE(m.preis_pro_einheit, 0)
+        ELSE COALESCE(e.flaeche_menge, 0) * COALESCE(m.preis_pro_einheit, 0)
+    END"""
+
+_AUFWENDUNGEN = """COALESCE(wartungskosten, 0) + COALESCE(reparaturkosten, 0) + COALESCE(versicherung, 0)
+        + COALESCE(steuern, 0) + COALESCE(sonstige_kosten, 0)"""
+
+# SQLite-Dateien, in denen der Cache in diesem Prozess geprüft wurde
+# (ältere Übungsdatenbanken werden nicht von der Schema-Migration erfasst).
+# Zurückgesetzte Übungsdatenbanken ersetzen die Datei unter demselben Pfad -
+# ihre Vorlagen enthalten den Cache daher bereits (create_training_databases.py).
+_geprueft = set()
+
+
+def _sicherstellen(db):
+    """Cache-Tabelle nachrüsten und beim ersten Zugriff einmalig füllen
+
+    Gibt True zurück, wenn der Cache dabei gerade vollständig aufgebaut wurde.
+    """
+    if db.db_path in _geprueft or getattr(db, 'using_replica', False):
+        return False
+    cursor = db.connection.cursor()
+    if not USING_POSTGRESQL:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS maschinen_kennzahlen (
+                maschine_id INTEGER NOT NULL,
+                jahr INTEGER NOT NULL,
+                anzahl_einsaetze INTEGER DEFAULT 0,
+                betriebsstunden REAL DEFAULT 0,
+                einnahmen REAL DEFAULT 0,
+                aufwendungen REAL DEFAULT 0,
+                bankkosten REAL DEFAULT 0,
+                aktualisiert_am DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (maschine_id, jahr)
+            )
+        """)
+    cursor.execute("SELECT 1 FROM maschinen_kennzahlen LIMIT 1")
+    if not cursor.fetchone():
+        _geprueft.add(db.db_path)
+        kennzahlen_neu_aufbauen(db)
+        return True
+    _geprueft.add(db.db_path)
+    return False
+
+
+def _jahr(spalte):
+    return f"CAST(strftime('%Y', {spalte}) AS INTEGER)"
+
+
+def kennzahlen_neu_aufbauen(db):
+    """Cache vollständig aus allen Quellen neu berechnen (inkl. Archiv)"""
+    cursor = db.connection.cursor()
+    if _sicherstellen(db):
+        # Beim ersten Zugriff gerade aufgebaut
+        cursor.execute("SELECT COUNT(*) FROM maschinen_kennzahlen")
+        return cursor.fetchone()[0]
+    quelle = einsaetze_quelle(db)
+
+    cursor.execute("DELETE FROM maschinen_kennzahlen")
+    cursor.execute(convert_sql(f"""
+        INSERT INTO maschinen_kennzahlen
+        (maschine_id, jahr, anzahl_einsaetze, betriebsstunden, einnahmen, aufwendungen, bankkosten)
+        SELECT maschine_id, jahr, SUM(anzahl), SUM(stunden), SUM(einnahmen),
+               SUM(aufwendungen), SUM(bankkosten)
+        FROM (
+            SELECT e.maschine_id, {_jahr('e.datum')} AS jahr, COUNT(*) AS anzahl,
+                   SUM(e.endstand - e.anfangstand) AS stunden, SUM({_EINNAHMEN}) AS einnahmen,
+                   0 AS aufwendungen, 0 AS bankkosten
+            FROM {quelle} e
+            JOIN maschinen m ON e.maschine_id = m.id
+            GROUP BY e.maschine_id, {_jahr('e.datum')}
+            UNION ALL
+            SELECT maschine_id, jahr, 0, 0, 0, {_AUFWENDUNGEN}, 0
+            FROM maschinen_aufwendungen
+            UNION ALL
+            SELECT referenz_id, {_jahr('datum')}, 0, 0, 0, 0, betrag
+            FROM buchungen
+            WHERE referenz_typ = 'maschine' AND referenz_id IS NOT NULL
+            UNION ALL
+            SELECT maschine_id, {_jahr('datum')}, 0, 0, 0, 0, betrag
+            FROM gemeinschafts_kosten
+            WHERE maschine_id IS NOT NULL
+        ) t
+        GROUP BY maschine_id, jahr
+    """))
+    return cursor.rowcount
+
+
+def _jahre_der_maschine(cursor, quelle, maschine_id):
+    cursor.execute(convert_sql(f"""
+        SELECT jahr FROM maschinen_kennzahlen WHERE maschine_id = ?
+        UNION
+        SELECT DISTINCT {_jahr('e.datum')} FROM {quelle} e WHERE e.maschine_id = ?
+        UNION
+        SELECT jahr FROM maschinen_aufwendungen WHERE maschine_id = ?
+    """), (maschine_id, maschine_id, maschine_id))
+    return [row[0] for row in cursor.fetchall() if row[0] is not None]
+
+
+def kennzahlen_aktualisieren(db, maschine_id, *jahre):
+    """Cache-Zeilen einer Maschine für die angegebenen Jahre neu berechnen
+
+    Ohne Jahre werden alle Jahre der Maschine berechnet (z.B. nach einer
+    Preisänderung). Läuft in der Transaktion des Aufrufers.
+    """
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+
+    cursor.execute(convert_sql("SELECT gemeinschaft_id FROM maschinen WHERE id = ?"), (maschine_id,))
+    row = cursor.fetchone()
+    if not row:
+        cursor.execute(convert_sql("DELETE FROM maschinen_kennzahlen WHERE maschine_id = ?"), (maschine_id,))
+        return
+    bis = abgeschlossen_bis(db, row[0])
+
+    if not jahre:
+        jahre = _jahre_der_maschine(cursor, einsaetze_quelle(db), maschine_id)
+
+    for jahr in {int(j) for j in jahre}:
+        # Offene Jahre liegen nur in der Arbeitstabelle (Index maschine_id, datum)
+        quelle = einsaetze_quelle(db) if bis is not None and jahr <= bis else 'maschineneinsaetze'
+        im_jahr, params = jahr_bereich('e.datum', jahr)
+        cursor.execute(convert_sql(f"""
+            SELECT COUNT(*), COALESCE(SUM(e.endstand - e.anfangstand), 0),
+                   COALESCE(SUM({_EINNAHMEN}), 0)
+            FROM {quelle} e
+            JOIN maschinen m ON e.maschine_id = m.id
+            WHERE e.maschine_id = ? AND {im_jahr}
+        """), [maschine_id] + params)
+        anzahl, stunden, einnahmen = cursor.fetchone()
+
+        cursor.execute(convert_sql(f"""
+            SELECT COALESCE(SUM({_AUFWENDUNGEN}), 0)
+            FROM maschinen_aufwendungen WHERE maschine_id = ? AND jahr = ?
+        """), (maschine_id, jahr))
+        aufwendungen = cursor.fetchone()[0]
+
+        im_jahr, params = jahr_bereich('datum', jahr)
+        cursor.execute(convert_sql(f"""
+            SELECT COALESCE(SUM(betrag), 0) FROM buchungen
+            WHERE referenz_typ = 'maschine' AND referenz_id = ? AND {im_jahr}
+        """), [maschine_id] + params)
+        bankkosten = cursor.fetchone()[0]
+        cursor.execute(convert_sql(f"""
+            SELECT COALESCE(SUM(betrag), 0) FROM gemeinschafts_kosten
+            WHERE maschine_id = ? AND {im_jahr}
+        """), [maschine_id] + params)
+        bankkosten += cursor.fetchone()[0]
+
+        if not (anzahl or aufwendungen or bankkosten):
+            cursor.execute(convert_sql("""
+                DELETE FROM maschinen_kennzahlen WHERE maschine_id = ? AND jahr = ?
+            """), (maschine_id, jahr))
+            continue
+
+        cursor.execute(convert_sql("""
+            INSERT INTO maschinen_kennzahlen
+            (maschine_id, jahr, anzahl_einsaetze, betriebsstunden, einnahmen,
+             aufwendungen, bankkosten, aktualisiert_am)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(maschine_id, jahr) DO UPDATE SET
+                anzahl_einsaetze = excluded.anzahl_einsaetze,
+                betriebsstunden = excluded.betriebsstunden,
+                einnahmen = excluded.einnahmen,
+                aufwendungen = excluded.aufwendungen,
+                bankkosten = excluded.bankkosten,
+                aktualisiert_am = CURRENT_TIMESTAMP
+        """), (maschine_id, jahr, anzahl, stunden, einnahmen, aufwendungen, bankkosten))
+
+
+def kennzahlen_einsatz_hinzu(db, maschine, datum, anfangstand, endstand, flaeche_menge=None):
+    """Neu gespeicherten Einsatz in den Cache übernehmen (ein Upsert)
+
+    Ein neuer Einsatz ändert sein Jahr nur additiv - statt das Jahr neu zu
+    berechnen, werden Anzahl, Stunden und Einnahmen hochgezählt. Storno,
+    Sync-Stapel und der Neuaufbau rechnen weiterhin vollständig.
+    Läuft in der Transaktion des Aufrufers, nach dem INSERT des Einsatzes.
+    """
+    if not maschine or _sicherstellen(db):
+        # Frisch aufgebauter Cache enthält den Einsatz bereits
+        return
+
+    stunden = endstand - anfangstand
+    preis = maschine.get('preis_pro_einheit') or 0
+    # Wie _EINNAHMEN
+    if maschine.get('abrechnungsart') == 'stunden':
+        einnahmen = stunden * preis
+    else:
+        einnahmen = (flaeche_menge or 0) * preis
+
+    cursor = db.connection.cursor()
+    cursor.execute(convert_sql("""
+        INSERT INTO maschinen_kennzahlen
+        (maschine_id, jahr, anzahl_einsaetze, betriebsstunden, einnahmen,
+         aufwendungen, bankkosten, aktualisiert_am)
+        VALUES (?, ?, 1, ?, ?, 0, 0, CURRENT_TIMESTAMP)
+        ON CONFLICT(maschine_id, jahr) DO UPDATE SET
+            anzahl_einsaetze = maschinen_kennzahlen.anzahl_einsaetze + 1,
+            betriebsstunden = maschinen_kennzahlen.betriebsstunden + excluded.betriebsstunden,
+            einnahmen = maschinen_kennzahlen.einnahmen + excluded.einnahmen,
+            aktualisiert_am = CURRENT_TIMESTAMP
+    """), (maschine['id'], int(str(datum)[:4]), stunden, einnahmen))
+
+
+def kennzahlen_nach_einsaetzen(db, einsaetze):
+    """Cache für (maschine_id, datum)-Paare geänderter Einsätze nachführen"""
+    jahre = {}
+    for maschine_id, datum in einsaetze:
+        jahre.setdefault(maschine_id, set()).add(int(str(datum)[:4]))
+    for maschine_id, maschine_jahre in jahre.items():
+        kennzahlen_aktualisieren(db, maschine_id, *maschine_jahre)
+
+
+def kennzahlen_laden(db, maschine_id):
+    """Kennzahlen einer Maschine pro Jahr, neuestes Jahr zuerst"""
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+    cursor.execute(convert_sql("""
+        SELECT jahr, anzahl_einsaetze, betriebsstunden, einnahmen, aufwendungen, bankkosten
+        FROM maschinen_kennzahlen
+        WHERE maschine_id = ?
+        ORDER BY jahr DESC
+    """), (maschine_id,))
+    columns = [desc[0] for desc in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def flotte_laden(db, gemeinschaft_id=None, jahr=None):
+    """Kennzahlen aller Maschinen (Lebensdauer oder ein Jahr) in einer Abfrage
+
+    Liefert pro Maschine die Summen sowie abschreibung_pro_jahr,
+    gesamtkosten, deckungsbeitrag und rentabilitaet_prozent - berechnet
+    wie auf der Rentabilitätsseite. Sortiert nach Deckungsbeitrag.
+    """
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+
+    sql = """
+        SELECT m.id, m.bezeichnung, m.hersteller, m.modell, m.baujahr,
+               m.gemeinschaft_id, g.name AS gemeinschaft_name, m.aktiv, m.anschaffungspreis, m.abschreibungsdauer_jahre,
+               COALESCE(SUM(k.anzahl_einsaetze), 0) AS anzahl_einsaetze,
+               COALESCE(SUM(k.betriebsstunden), 0) AS betriebsstunden,
+               COALESCE(SUM(k.einnahmen), 0) AS einnahmen,
+               COALESCE(SUM(k.aufwendungen), 0) AS aufwendungen,
+               COALESCE(SUM(k.bankkosten), 0) AS bankkosten
+        FROM maschinen m
+        LEFT JOIN gemeinschaften g ON m.gemeinschaft_id = g.id
+        LEFT JOIN maschinen_kennzahlen k ON k.maschine_id = m.id
+    """
+    params = []
+    if jahr:
+        sql += " AND k.jahr = ?"
+        params.append(int(jahr))
+    if gemeinschaft_id:
+        sql += " WHERE m.gemeinschaft_id = ?"
+        params.append(int(gemeinschaft_id))
+    sql += """
+        GROUP BY m.id, m.bezeichnung, m.hersteller, m.modell, m.baujahr,
+                 m.gemeinschaft_id, g.name, m.aktiv,
+                 m.anschaffungspreis, m.abschreibungsdauer_jahre
+    """
+    cursor.execute(convert_sql(sql), params)
+    columns = [desc[0] for desc in cursor.description]
+    maschinen = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    for m in maschinen:
+        anschaffungspreis = m['anschaffungspreis'] or 0
+        dauer = m['abschreibungsdauer_jahre'] or 10
+        m['abschreibung_pro_jahr'] = anschaffungspreis / dauer if dauer > 0 else 0
+        m['gesamtkosten'] = m['aufwendungen'] + m['bankkosten']
+        m['deckungsbeitrag'] = m['einnahmen'] - m['abschreibung_pro_jahr'] - m['gesamtkosten']
+        m['rentabilitaet_prozent'] = (m['deckungsbeitrag'] / anschaffungspreis * 100
+                                      if anschaffungspreis > 0 else 0)
+
+    maschinen.sort(key=lambda m: m['deckungsbeitrag'], reverse=True)
+    return maschinen
+
+
+def kennzahlen_jahre(db):
+    """Alle Jahre mit Kennzahlen (für die Jahresauswahl)"""
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+    cursor.execute("SELECT DISTINCT jahr FROM maschinen_kennzahlen ORDER BY jahr DESC")
+    return [row[0] for row in cursor.fetchall()]
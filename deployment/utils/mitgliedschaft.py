@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Mitgliedschafts-Graph (Benutzer, Betriebe, Gemeinschaften, Maschinen)
+
+Fast jede Mitglieder-Seite fragt "in welchen Gemeinschaften ist der Benutzer?"
+über mitglied_gemeinschaft bzw. benutzer_betriebe/betriebe_gemeinschaften ab.
+Der komplette Graph wird deshalb pro Prozess und Datenbank einmal geladen und
+als Sets/Dicts gehalten; Routen fragen ihn ohne Join ab.
+
+Zwei Arten der Zugehörigkeit bleiben wie bisher getrennt:
+- direkt: mitglied_gemeinschaft (Abstimmungen, Anträge, Maschinen, Konten)
+- über Betriebe: benutzer_betriebe + betriebe_gemeinschaften (Nachrichten)
+
+Gültigkeit über den Zähler 'mitgliedschaft' in cache_versionen: Admin-Routen,
+die Zuordnungen, Gemeinschaften oder Maschinen ändern, rufen
+mitgliedschaft_geaendert() in ihrer Transaktion auf. Als Sicherheitsnetz für
+Änderungen ohne App (Restore, direkte SQL-Änderungen) wird der Graph
+zusätzlich nach MITGLIEDSCHAFT_TTL_SECONDS neu geladen.
+"""
+
+import os
+import time
+import threading
+
+from utils.cache_versionen import version_lesen, version_erhoehen
+
+VERSION_NAME = 'mitgliedschaft'
+MITGLIEDSCHAFT_TTL_SECONDS = int(os.environ.get('MITGLIEDSCHAFT_TTL_SECONDS', 300))
+
+_LEER = frozenset()
+
+_graphen = {}
+_lock = threading.Lock()
+
+
+class MitgliedschaftsGraph:
+    """Unveränderliche Momentaufnahme der Zugehörigkeiten einer Datenbank"""
+
+    def __init__(self, version, gemeinschaften, direkt, ueber_betriebe, maschinen):
+        self.version = version
+        self.geladen = time.time()
+        # gemeinschaft_id -> (name, aktiv)
+        self._gemeinschaften = gemeinschaften
+        self._aktiv = frozenset(gid for gid, (_, aktiv) in gemeinschaften.items() if aktiv)
+        # benutzer_id -> frozenset(gemeinschaft_id)
+        self._direkt = direkt
+        self._ueber_betriebe = ueber_betriebe
+        # gemeinschaft_id -> Tupel aktiver Maschinen-IDs
+        self._maschinen = maschinen
+        self._sichtbare_maschinen = {}
+
+    def gemeinschaften_von(self, benutzer_id, nur_aktive=False):
+        """Gemeinschaften mit direkter Mitgliedschaft (mitglied_gemeinschaft)"""
+        ids = self._direkt.get(benutzer_id, _LEER)
+        return ids & self._aktiv if nur_aktive else ids
+
+    def gemeinschaften_ueber_betriebe(self, benutzer_id, nur_aktive=False):
+        """Gemeinschaften, denen ein Betrieb des Benutzers angehört"""
+        ids = self._ueber_betriebe.get(benutzer_id, _LEER)
+        return ids & self._aktiv if nur_aktive else ids
+
+    def ist_mitglied(self, benutzer_id, gemeinschaft_id):
+        return gemeinschaft_id in self._direkt.get(benutzer_id, _LEER)
+
+    def ist_mitglied_ueber_betrieb(self, benutzer_id, gemeinschaft_id):
+        return gemeinschaft_id in self._ueber_betriebe.get(benutzer_id, _LEER)
+
+    def sichtbare_maschinen(self, benutzer_id):
+        """Aktive Maschinen aktiver Gemeinschaften des Benutzers (IDs)"""
+        ids = self._sichtbare_maschinen.get(benutzer_id)
+        if ids is None:
+            ids = frozenset(
+                maschine_id
+                for gemeinschaft_id in self.gemeinschaften_von(benutzer_id, nur_aktive=True)
+                for maschine_id in self._maschinen.get(gemeinschaft_id, ())
+            )
+            self._sichtbare_maschinen[benutzer_id] = ids
+        return ids
+
+    def gemeinschaften_liste(self, ids):
+        """[{'id', 'name'}] nach Name sortiert - für Auswahlfelder"""
+        liste = [{'id': gid, 'name': self._gemeinschaften[gid][0]}
+                 for gid in ids if gid in self._gemeinschaften]
+        return sorted(liste, key=lambda g: (g['name'] or '').lower())
+
+
+def _laden(db, version):
+    """Kompletten Graph mit vier einfachen Abfragen laden"""
+    cursor = db.connection.cursor()
+
+    cursor.execute("SELECT id, name, aktiv FROM gemeinschaften")
+    gemeinschaften = {row[0]: (row[1], bool(row[2])) for row in cursor.fetchall()}
+
+    direkt = {}
+    cursor.execute("SELECT mitglied_id, gemeinschaft_id FROM mitglied_gemeinschaft")
+    for benutzer_id, gemeinschaft_id in cursor.fetchall():
+        direkt.setdefault(benutzer_id, set()).add(gemeinschaft_id)
+
+    ueber_betriebe = {}
+    cursor.execute("""
+        SELECT DISTINCT bb.benutzer_id, bg.gemeinschaft_id
+        FROM benutzer_betriebe bb
+        JOIN betriebe_gemeinschaften bg ON bb.betrieb_id = bg.betrieb_id
+    """)
+    for benutzer_id, gemeinschaft_id in cursor.fetchall():
+        ueber_betriebe.setdefault(benutzer_id, set()).add(gemeinschaft_id)
+
+    maschinen = {}
+    cursor.execute("""
+        SELECT id, gemeinschaft_id FROM maschinen
+        WHERE aktiv = true AND gemeinschaft_id IS NOT NULL
+    """)
+    for maschine_id, gemeinschaft_id in cursor.fetchall():
+        maschinen.setdefault(gemeinschaft_id, []).append(maschine_id)
+
+    return MitgliedschaftsGraph(
+        version,
+        gemeinschaften,
+        {b: frozenset(ids) for b, ids in direkt.items()},
+        {b: frozenset(ids) for b, ids in ueber_betriebe.items()},
+        {gid: tuple(ids) for gid, ids in maschinen.items()}
+    )
+
+
+def mitgliedschaft(db):
+    """Aktuellen Graph der Datenbank liefern (bei geänderter Version neu laden)"""
+    version = version_lesen(db, VERSION_NAME)
+    graph = _graphen.get(db.db_path)
+    if graph is not None and graph.version == version \
+            and time.time() - graph.geladen < MITGLIEDSCHAFT_TTL_SECONDS:
+        return graph
+
+    with _lock:
+        graph = _graphen.get(db.db_path)
+        if graph is None or graph.version != version \
+                or time.time() - graph.geladen >= MITGLIEDSCHAFT_TTL_SECONDS:
+            graph = _laden(db, version)
+            _graphen[db.db_path] = graph
+    return graph
+
+
+def mitgliedschaft_geaendert(db):
+    """Graph in allen Prozessen ungültig machen (läuft in der Transaktion des Aufrufers)"""
+    version_erhoehen(db, VERSION_NAME)
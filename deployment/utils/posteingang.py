@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Posteingang für Gemeinschafts-Nachrichten
+
+Statt bei jedem Seitenaufruf Nachrichten über betriebe_gemeinschaften und
+benutzer_betriebe den Mitgliedern zuzuordnen, wird beim Senden verteilt:
+- nachrichten_posteingang: eine Zeile pro Empfänger und Nachricht
+- nachrichten_ungelesen: Zähler ungelesener Nachrichten pro Benutzer
+- nachricht_gelesen: Lesebestätigungen (wie bisher)
+
+Das Dashboard-Badge ist damit ein Primärschlüssel-Zugriff, die Nachrichtenliste
+eine seitenweise Abfrage über den Posteingang.
+
+Ändert sich die Zugehörigkeit (Benutzer <-> Betrieb, Betrieb <-> Gemeinschaft),
+gleicht posteingang_abgleichen() Posteingang und Zähler der betroffenen
+Benutzer an - neue Mitglieder sehen die bisherigen Nachrichten wie zuvor.
+"""
+
+from datetime import datetime
+
+from database import USING_POSTGRESQL
+from utils.sql_helpers import convert_sql
+
+NACHRICHTEN_PRO_SEITE = 20
+
+# SQLite-Dateien, deren Posteingang-Tabellen in diesem Prozess geprüft wurden
+# (ältere Übungsdatenbanken werden nicht von der Schema-Migration erfasst)
+_geprueft = set()
+
+_TABELLEN_SQLITE = [
+    """CREATE TABLE IF NOT EXISTS nachrichten_posteingang (
+        benutzer_id INTEGER NOT NULL REFERENCES benutzer(id) ON DELETE CASCADE,
+        nachricht_id INTEGER NOT NULL REFERENCES gemeinschafts_nachrichten(id) ON DELETE CASCADE,
+        PRIMARY KEY (benutzer_id, nachricht_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS nachrichten_ungelesen (
+        benutzer_id INTEGER PRIMARY KEY REFERENCES benutzer(id) ON DELETE CASCADE,
+        anzahl INTEGER NOT NULL DEFAULT 0
+    )""",
+]
+
+
+def _sicherstellen(db):
+    """Tabellen in älteren SQLite-Übungsdatenbanken einmalig nachrüsten"""
+    if USING_POSTGRESQL or db.db_path in _geprueft:
+        return
+    cursor = db.connection.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'nachrichten_posteingang'")
+    if not cursor.fetchone():
+        for sql in _TABELLEN_SQLITE:
+            cursor.execute(sql)
+        posteingang_abgleichen(cursor)
+        db.connection.commit()
+    _geprueft.add(db.db_path)
+
+
+def _benutzer_filter(spalte, benutzer_ids):
+    if benutzer_ids is None:
+        return '1 = 1', []
+    benutzer_ids = list(benutzer_ids)
+    if not benutzer_ids:
+        return '1 = 0', []
+    return f"{spalte} IN ({','.join('?' for _ in benutzer_ids)})", benutzer_ids
+
+
+def posteingang_abgleichen(cursor, benutzer_ids=None):
+    """Posteingang und Zähler aus den Zugehörigkeiten neu aufbauen
+
+    Ohne benutzer_ids für alle Benutzer (Migration), sonst nur für die
+    angegebenen. Fehlende Nachrichten werden ergänzt, nicht mehr sichtbare
+    entfernt und die Zähler neu gezählt.
+    """
+    filter_bb, params = _benutzer_filter('bb.benutzer_id', benutzer_ids)
+    sql = convert_sql(f"""
+        INSERT INTO nachrichten_posteingang (benutzer_id, nachricht_id)
+        SELECT DISTINCT bb.benutzer_id, n.id
+        FROM gemeinschafts_nachrichten n
+        JOIN betriebe_gemeinschaften bg ON n.gemeinschaft_id = bg.gemeinschaft_id
+        JOIN benutzer_betriebe bb ON bg.betrieb_id = bb.betrieb_id
+        WHERE {filter_bb}
+        AND NOT EXISTS (
+            SELECT 1 FROM nachrichten_posteingang p
+            WHERE p.benutzer_id = bb.benutzer_id AND p.nachricht_id = n.id
+        )
+    """)
+    cursor.execute(sql, params)
+
+    filter_p, params = _benutzer_filter('nachrichten_posteingang.benutzer_id', benutzer_ids)
+    sql = convert_sql(f"""
+        DELETE FROM nachrichten_posteingang
+        WHERE {filter_p}
+        AND NOT EXISTS (
+            SELECT 1 FROM gemeinschafts_nachrichten n
+            JOIN betriebe_gemeinschaften bg ON n.gemeinschaft_id = bg.gemeinschaft_id
+            JOIN benutzer_betriebe bb ON bg.betrieb_id = bb.betrieb_id
+            WHERE n.id = nachrichten_posteingang.nachricht_id
+            AND bb.benutzer_id = nachrichten_posteingang.benutzer_id
+        )
+    """)
+    cursor.execute(sql, params)
+
+    filter_u, params = _benutzer_filter('benutzer_id', benutzer_ids)
+    cursor.execute(convert_sql(f"DELETE FROM nachrichten_ungelesen WHERE {filter_u}"), params)
+
+    filter_p, params = _benutzer_filter('p.benutzer_id', benutzer_ids)
+    sql = convert_sql(f"""
+        INSERT INTO nachrichten_ungelesen (benutzer_id, anzahl)
+        SELECT p.benutzer_id, COUNT(*)
+        FROM nachrichten_posteingang p
+        LEFT JOIN nachricht_gelesen ng ON ng.nachricht_id = p.nachricht_id AND ng.benutzer_id = p.benutzer_id
+        WHERE {filter_p} AND ng.nachricht_id IS NULL
+        GROUP BY p.benutzer_id
+    """)
+    cursor.execute(sql, params)
+
+
+def zugehoerigkeit_geaendert(db, benutzer_ids=None, betrieb_ids=None):
+    """Posteingang nach Änderungen an Betrieb-/Gemeinschafts-Zuordnungen abgleichen
+
+    Betroffen sind die angegebenen Benutzer und alle Benutzer der
+    angegebenen Betriebe. Läuft in der Transaktion des Aufrufers.
+    """
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+    betroffen = set(benutzer_ids or [])
+    if betrieb_ids:
+        placeholders = ','.join('?' for _ in betrieb_ids)
+        sql = convert_sql(f"SELECT benutzer_id FROM benutzer_betriebe WHERE betrieb_id IN ({placeholders})")
+        cursor.execute(sql, [int(b) for b in betrieb_ids])
+        betroffen.update(row[0] for row in cursor.fetchall())
+    if betroffen:
+        posteingang_abgleichen(cursor, sorted(betroffen))
+
+
+def nachricht_verteilen(db, nachricht_id, gemeinschaft_id, absender_id):
+    """Neue Nachricht allen Mitgliedern der Gemeinschaft zustellen
+
+    Die eigene Nachricht gilt für den Absender als gelesen.
+    """
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+
+    sql = convert_sql("""
+        INSERT INTO nachrichten_posteingang (benutzer_id, nachricht_id)
+        SELECT DISTINCT bb.benutzer_id, ?
+        FROM betriebe_gemeinschaften bg
+        JOIN benutzer_betriebe bb ON bg.betrieb_id = bb.betrieb_id
+        WHERE bg.gemeinschaft_id = ?
+    """)
+    cursor.execute(sql, (nachricht_id, gemeinschaft_id))
+
+    sql = convert_sql("""
+        INSERT OR IGNORE INTO nachricht_gelesen (nachricht_id, benutzer_id, gelesen_am)
+        VALUES (?, ?, ?)
+    """)
+    cursor.execute(sql, (nachricht_id, absender_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+    sql = convert_sql("""
+        INSERT INTO nachrichten_ungelesen (benutzer_id, anzahl)
+        SELECT benutzer_id, 0 FROM nachrichten_posteingang
+        WHERE nachricht_id = ? AND benutzer_id <> ?
+        ON CONFLICT (benutzer_id) DO NOTHING
+    """)
+    cursor.execute(sql, (nachricht_id, absender_id))
+
+    sql = convert_sql("""
+        UPDATE nachrichten_ungelesen SET anzahl = anzahl + 1
+        WHERE benutzer_id IN (
+            SELECT benutzer_id FROM nachrichten_posteingang
+            WHERE nachricht_id = ? AND benutzer_id <> ?
+        )
+    """)
+    cursor.execute(sql, (nachricht_id, absender_id))
+
+
+def als_gelesen_markieren(db, benutzer_id, nachricht_id):
+    """Nachricht als gelesen markieren, gibt False zurück wenn sie nicht im Posteingang liegt"""
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+
+    sql = convert_sql("""
+        SELECT 1 FROM nachrichten_posteingang
+        WHERE benutzer_id = ? AND nachricht_id = ?
+    """)
+    cursor.execute(sql, (benutzer_id, nachricht_id))
+    if not cursor.fetchone():
+        return False
+
+    sql = convert_sql("""
+        INSERT OR IGNORE INTO nachricht_gelesen (nachricht_id, benutzer_id, gelesen_am)
+        VALUES (?, ?, ?)
+    """)
+    cursor.execute(sql, (nachricht_id, benutzer_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+    # Nur zählen wenn die Nachricht bisher ungelesen war
+    if cursor.rowcount == 1:
+        sql = convert_sql("""
+            UPDATE nachrichten_ungelesen SET anzahl = anzahl - 1
+            WHERE benutzer_id = ? AND anzahl > 0
+        """)
+        cursor.execute(sql, (benutzer_id,))
+    return True
+
+
+def ungelesen_anzahl(db, benutzer_id):
+    """Anzahl ungelesener Nachrichten (Primärschlüssel-Zugriff)"""
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+    sql = convert_sql("SELECT anzahl FROM nachrichten_ungelesen WHERE benutzer_id = ?")
+    cursor.execute(sql, (benutzer_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def posteingang_laden(db, benutzer_id, seite=1):
+    """Eine Seite des Posteingangs (neueste zuerst)
+
+    Gibt (nachrichten, anzahl_gesamt) zurück.
+    """
+    _sicherstellen(db)
+    cursor = db.connection.cursor()
+
+    sql = convert_sql("SELECT COUNT(*) FROM nachrichten_posteingang WHERE benutzer_id = ?")
+    cursor.execute(sql, (benutzer_id,))
+    anzahl_gesamt = cursor.fetchone()[0]
+
+    sql = convert_sql("""
+        SELECT n.*,
+               g.name as gemeinschaft_name,
+               b.name as absender_name, b.vorname as absender_vorname,
+               CASE WHEN ng.gelesen_am IS NOT NULL THEN 1 ELSE 0 END as gelesen
+        FROM nachrichten_posteingang p
+        JOIN gemeinschafts_nachrichten n ON p.nachricht_id = n.id
+        JOIN gemeinschaften g ON n.gemeinschaft_id = g.id
+        JOIN benutzer b ON n.absender_id = b.id
+        LEFT JOIN nachricht_gelesen ng ON n.id = ng.nachricht_id AND ng.benutzer_id = p.benutzer_id
+        WHERE p.benutzer_id = ?
+        ORDER BY p.nachricht_id DESC
+        LIMIT ? OFFSET ?
+    """)
+    cursor.execute(sql, (benutzer_id, NACHRICHTEN_PRO_SEITE, (seite - 1) * NACHRICHTEN_PRO_SEITE))
+    columns = [desc[0] for desc in cursor.description]
+    nachrichten = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    return nachrichten, anzahl_gesamt
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Private Ablage für Zustandsdateien der Anwendung
+
+Berechtigungs-Kontexte, Restore-Anfragen samt hochgeladenen Backups und der
+Dokument-Cache liegen als Dateien auf der Platte. Im gemeinsamen Temp-
+Verzeichnis könnte jeder lokale Benutzer sie lesen oder vorab eigene Dateien
+unter den erwarteten Namen anlegen (z.B. einen Kontext mit admin_level 2).
+
+Deshalb:
+- Standardort ist data/privat/<name> neben der Datenbank (PRIVAT_DIR),
+  Verzeichnisse werden mit 0o700 angelegt bzw. auf 0o700 gesetzt
+- Dateien werden mit 0o600 angelegt
+- gelesen wird nur, was dem eigenen Prozess-Benutzer gehört, kein
+  symbolischer Link ist und für Gruppe/andere nicht beschreibbar ist
+
+Unter Windows (kein os.getuid) entfallen die Besitzerprüfungen.
+"""
+
+import os
+import stat
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PRIVAT_DIR = os.environ.get('PRIVAT_DIR', os.path.join(_BASE_DIR, 'data', 'privat'))
+
+_MODI = {
+    'r': os.O_RDONLY,
+    'rb': os.O_RDONLY,
+    'a': os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+    'w': os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+    'wb': os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+}
+
+
+def privat_pfad(name):
+    """Standardpfad eines Unterverzeichnisses der privaten Ablage"""
+    return os.path.join(PRIVAT_DIR, name)
+
+
+def _eigentuemer_pruefen(st, pfad):
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        raise PermissionError(f'{pfad} gehört nicht dem Prozess-Benutzer (uid {st.st_uid})')
+
+
+def verzeichnis_sichern(pfad):
+    """Verzeichnis mit 0o700 anlegen bzw. prüfen
+
+    Wirft PermissionError, wenn es ein symbolischer Link ist oder einem
+    anderen Benutzer gehört. Zu weite Rechte eines eigenen Verzeichnisses
+    werden auf 0o700 zurückgesetzt.
+    """
+    os.makedirs(pfad, mode=0o700, exist_ok=True)
+    st = os.lstat(pfad)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError(f'{pfad} ist kein Verzeichnis')
+    _eigentuemer_pruefen(st, pfad)
+    if hasattr(os, 'getuid') and stat.S_IMODE(st.st_mode) & 0o077:
+        os.chmod(pfad, 0o700)
+
+
+def datei_oeffnen(pfad, modus='r'):
+    """Datei in der privaten Ablage öffnen
+
+    Lesen nur bei eigenen, regulären Dateien ohne Schreibrecht für andere;
+    neu angelegte Dateien erhalten 0o600. 'w'/'wb' legen exklusiv an (für
+    temporäre Dateien vor os.replace). Wirft OSError (PermissionError bei
+    fremden Dateien).
+    """
+    flags = _MODI[modus] | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_BINARY', 0)
+    fd = os.open(pfad, flags, 0o600)
+    try:
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            raise PermissionError(f'{pfad} ist keine reguläre Datei')
+        _eigentuemer_pruefen(st, pfad)
+        if hasattr(os, 'getuid') and stat.S_IMODE(st.st_mode) & 0o022:
+            raise PermissionError(f'{pfad} ist für andere Benutzer beschreibbar')
+    except BaseException:
+        os.close(fd)
+        raise
+    if 'b' in modus:
+        return os.fdopen(fd, modus)
+    return os.fdopen(fd, modus, encoding='utf-8')
+
+
+def datei_pruefen(pfad):
+    """True, wenn die Datei gelesen werden darf (für Dateien, die ein anderes
+    Programm öffnet, z.B. psql -f)"""
+    try:
+        with datei_oeffnen(pfad, 'rb'):
+            return True
+    except OSError:
+        return False
+
+
+def atomar_schreiben(pfad, inhalt):
+    """Datei mit 0o600 über eine temporäre Datei und os.replace schreiben
+
+    inhalt: str oder bytes. Das Verzeichnis muss mit verzeichnis_sichern()
+    vorbereitet sein.
+    """
+    tmp = f'{pfad}.{os.getpid()}.{os.urandom(4).hex()}.tmp'
+    try:
+        with datei_oeffnen(tmp, 'wb' if isinstance(inhalt, bytes) else 'w') as f:
+            f.write(inhalt)
+        os.replace(tmp, pfad)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
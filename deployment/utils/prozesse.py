@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Externe Programme ausführen (pg_dump, psql, Übungsdatenbank-Generator)
+
+Alle Aufrufe laufen über befehl_ausfuehren():
+- Im gevent-Modus (GUNICORN_WORKER_CLASS=gevent, siehe gunicorn.conf.py) ist
+  subprocess durch das Monkey-Patching des Gunicorn-Workers kooperativ: solange
+  pg_dump läuft, bedient derselbe Worker-Prozess weitere Requests.
+- Im sync-Modus blockiert das Warten den Thread - lange Vorgänge laufen daher
+  als Hintergrund-Job (utils/jobs.py), nicht im Request.
+- Jeder Aufruf hat eine Zeitgrenze (PROZESS_TIMEOUT_SECONDS); ein hängender
+  Prozess wird beendet statt einen Worker dauerhaft zu belegen.
+"""
+
+import os
+import sys
+import subprocess
+
+PROZESS_TIMEOUT_SECONDS = int(os.environ.get('PROZESS_TIMEOUT_SECONDS', 3600))
+
+_DEPLOYMENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def befehl_ausfuehren(befehl, env=None, timeout=None, cwd=None):
+    """Programm ausführen, Ausgabe als Text einsammeln
+
+    Gibt subprocess.CompletedProcess zurück; bei Überschreitung der Zeitgrenze
+    wird der Prozess beendet und subprocess.TimeoutExpired ausgelöst.
+    """
+    return subprocess.run(befehl, env=env, cwd=cwd, capture_output=True, text=True,
+                          timeout=timeout or PROZESS_TIMEOUT_SECONDS)
+
+
+def pg_befehl(programm, *argumente, datenbank=True):
+    """Aufruf eines PostgreSQL-Werkzeugs gegen den Primary: (befehl, env)
+
+    Das Passwort wird über PGPASSWORD übergeben, nicht auf der Kommandozeile.
+    """
+    from database import PG_HOST, PG_PORT, PG_DATABASE, PG_USER, PG_PASSWORD
+
+    env = os.environ.copy()
+    env['PGPASSWORD'] = PG_PASSWORD
+    befehl = [programm, '-h', PG_HOST, '-p', str(PG_PORT), '-U', PG_USER]
+    if datenbank:
+        befehl += ['-d', PG_DATABASE]
+    return befehl + list(argumente), env
+
+
+def python_skript(skript, *argumente, timeout=None):
+    """Python-Skript aus dem deployment-Verzeichnis in eigenem Prozess ausführen
+
+    Rechenintensive Arbeit (z.B. Übungsdatenbanken generieren) belegt so weder
+    den gevent-Hub noch das GIL des Worker-Prozesses.
+    """
+    befehl = [sys.executable, os.path.join(_DEPLOYMENT_DIR, skript)] + [str(a) for a in argumente]
+    return befehl_ausfuehren(befehl, cwd=_DEPLOYMENT_DIR, timeout=timeout)
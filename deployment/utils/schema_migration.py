@@ -19,6 +19,22 @@ if USING_POSTGRESQL:
     PG_PASSWORD = os.environ.get('PG_PASSWORD', '')
 
 
+# Berechnete Spalten für indexfähige Datumsbedingungen (siehe datum_bereich in
+# utils/sql_helpers.py). SQLite: VIRTUAL (per ALTER TABLE nachrüstbar, indexierbar),
+# PostgreSQL: STORED mit ausschließlich IMMUTABLE-Funktionen. uhrzeit_bis ist je nach
+# Alter der Datenbank TIME oder TEXT, daher der Umweg über TEXT und make_time().
+_RESERVIERUNG_BIS_PG = "COALESCE(NULLIF(CAST(uhrzeit_bis AS TEXT), ''), '23:59')"
+RESERVIERUNG_ENDE_PG = (
+    "TIMESTAMP GENERATED ALWAYS AS (datum + make_time("
+    f"split_part({_RESERVIERUNG_BIS_PG}, ':', 1)::int, "
+    f"split_part({_RESERVIERUNG_BIS_PG}, ':', 2)::int, 0)) STORED"
+)
+RESERVIERUNG_ENDE_SQLITE = (
+    "TEXT GENERATED ALWAYS AS (datum || ' ' || COALESCE(NULLIF(uhrzeit_bis, ''), '23:59')) VIRTUAL"
+)
+IMPORT_DATUM_PG = "DATE GENERATED ALWAYS AS (CAST(importiert_am AS DATE)) STORED"
+IMPORT_DATUM_SQLITE = "TEXT GENERATED ALWAYS AS (substr(importiert_am, 1, 10)) VIRTUAL"
+
 # Liste aller erforderlichen Spalten
 # Format: (tabelle, spalte, datentyp_postgresql, datentyp_sqlite, default_wert)
 REQUIRED_COLUMNS = [
@@ -106,8 +122,67 @@ REQUIRED_COLUMNS = [
 
     # benutzer - Rolle für Vorstandsmitglieder
     ("benutzer", "rolle", "VARCHAR(50)", "TEXT", None),
+
+    # abstimmungen - laufende Zähler (siehe utils/abstimmung_zaehler.py)
+    ("abstimmungen", "stimmen_ja", "INTEGER", "INTEGER", "0"),
+    ("abstimmungen", "stimmen_nein", "INTEGER", "INTEGER", "0"),
+    ("abstimmungen", "stimmen_enthaltung", "INTEGER", "INTEGER", "0"),
+    ("abstimmungen", "stimmen_gesamt", "INTEGER", "INTEGER", "0"),
+
+    # maschineneinsaetze - Idempotenz-Schlüssel der Sammelerfassung
+    ("maschineneinsaetze", "sync_schluessel", "TEXT", "TEXT", None),
+
+    # jahresabschluesse - Kennzahlen des abgeschlossenen Jahres (siehe utils/jahresabschluss.py)
+    ("jahresabschluesse", "anzahl_einsaetze", "INTEGER", "INTEGER", "0"),
+    ("jahresabschluesse", "summe_einsaetze", "REAL", "REAL", "0"),
+    ("jahresabschluesse", "anzahl_buchungen", "INTEGER", "INTEGER", "0"),
+    ("jahresabschluesse", "anzahl_transaktionen", "INTEGER", "INTEGER", "0"),
+    ("jahresabschluesse", "bank_saldo_archiviert", "REAL", "REAL", None),
+
+    # maschineneinsaetze_storniert - Storno-Vorgang für Widerruf (siehe utils/einsatz_storno.py)
+    ("maschineneinsaetze_storniert", "storno_vorgang", "TEXT", "TEXT", None),
+    ("maschineneinsaetze_storniert", "sync_schluessel", "TEXT", "TEXT", None),
+
+    # gemeinschafts_kosten - Zuordnung von Bank-Ausgängen zu Maschinen
+    ("gemeinschafts_kosten", "transaktion_id", "INTEGER", "INTEGER", None),
+    ("gemeinschafts_kosten", "maschine_id", "INTEGER", "INTEGER", None),
+
+    # Berechnete Datumsspalten (Abfragen ohne datetime()/date() um die Spalte)
+    ("maschinen_reservierungen", "ende_zeitpunkt", RESERVIERUNG_ENDE_PG, RESERVIERUNG_ENDE_SQLITE, None),
+    ("bank_transaktionen", "import_datum", IMPORT_DATUM_PG, IMPORT_DATUM_SQLITE, None),
 ]
 
+# Jährliche Aufwendungen pro Maschine (auch von migrate_maschinen_aufwendungen genutzt)
+MASCHINEN_AUFWENDUNGEN_PG = """CREATE TABLE IF NOT EXISTS maschinen_aufwendungen (
+            id SERIAL PRIMARY KEY,
+            maschine_id INTEGER NOT NULL REFERENCES maschinen(id) ON DELETE CASCADE,
+            jahr INTEGER NOT NULL,
+            wartungskosten REAL DEFAULT 0.0,
+            reparaturkosten REAL DEFAULT 0.0,
+            versicherung REAL DEFAULT 0.0,
+            steuern REAL DEFAULT 0.0,
+            sonstige_kosten REAL DEFAULT 0.0,
+            bemerkung TEXT,
+            erstellt_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            geaendert_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(maschine_id, jahr)
+        )"""
+
+MASCHINEN_AUFWENDUNGEN_SQLITE = """CREATE TABLE IF NOT EXISTS maschinen_aufwendungen (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            maschine_id INTEGER NOT NULL REFERENCES maschinen(id) ON DELETE CASCADE,
+            jahr INTEGER NOT NULL,
+            wartungskosten REAL DEFAULT 0.0,
+            reparaturkosten REAL DEFAULT 0.0,
+            versicherung REAL DEFAULT 0.0,
+            steuern REAL DEFAULT 0.0,
+            sonstige_kosten REAL DEFAULT 0.0,
+            bemerkung TEXT,
+            erstellt_am DATETIME DEFAULT CURRENT_TIMESTAMP,
+            geaendert_am DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(maschine_id, jahr)
+        )"""
+
 # Liste aller erforderlichen Tabellen
 # Format: (tabelle, create_statement_postgresql, create_statement_sqlite)
 REQUIRED_TABLES = [
@@ -430,7 +505,11 @@ REQUIRED_TABLES = [
             geheim BOOLEAN DEFAULT FALSE,
             ergebnis_ja INTEGER DEFAULT 0,
             ergebnis_nein INTEGER DEFAULT 0,
-            ergebnis_enthaltung INTEGER DEFAULT 0
+            ergebnis_enthaltung INTEGER DEFAULT 0,
+            stimmen_ja INTEGER DEFAULT 0,
+            stimmen_nein INTEGER DEFAULT 0,
+            stimmen_enthaltung INTEGER DEFAULT 0,
+            stimmen_gesamt INTEGER DEFAULT 0
         )""",
         """CREATE TABLE IF NOT EXISTS abstimmungen (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -444,7 +523,11 @@ REQUIRED_TABLES = [
             geheim INTEGER DEFAULT 0,
             ergebnis_ja INTEGER DEFAULT 0,
             ergebnis_nein INTEGER DEFAULT 0,
-            ergebnis_enthaltung INTEGER DEFAULT 0
+            ergebnis_enthaltung INTEGER DEFAULT 0,
+            stimmen_ja INTEGER DEFAULT 0,
+            stimmen_nein INTEGER DEFAULT 0,
+            stimmen_enthaltung INTEGER DEFAULT 0,
+            stimmen_gesamt INTEGER DEFAULT 0
         )"""
     ),
     (
@@ -466,6 +549,30 @@ REQUIRED_TABLES = [
             UNIQUE(abstimmung_id, benutzer_id)
         )"""
     ),
+    (
+        "nachrichten_posteingang",
+        """CREATE TABLE IF NOT EXISTS nachrichten_posteingang (
+            benutzer_id INTEGER NOT NULL REFERENCES benutzer(id) ON DELETE CASCADE,
+            nachricht_id INTEGER NOT NULL REFERENCES gemeinschafts_nachrichten(id) ON DELETE CASCADE,
+            PRIMARY KEY (benutzer_id, nachricht_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS nachrichten_posteingang (
+            benutzer_id INTEGER NOT NULL REFERENCES benutzer(id) ON DELETE CASCADE,
+            nachricht_id INTEGER NOT NULL REFERENCES gemeinschafts_nachrichten(id) ON DELETE CASCADE,
+            PRIMARY KEY (benutzer_id, nachricht_id)
+        )"""
+    ),
+    (
+        "nachrichten_ungelesen",
+        """CREATE TABLE IF NOT EXISTS nachrichten_ungelesen (
+            benutzer_id INTEGER PRIMARY KEY REFERENCES benutzer(id) ON DELETE CASCADE,
+            anzahl INTEGER NOT NULL DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS nachrichten_ungelesen (
+            benutzer_id INTEGER PRIMARY KEY REFERENCES benutzer(id) ON DELETE CASCADE,
+            anzahl INTEGER NOT NULL DEFAULT 0
+        )"""
+    ),
     (
         "antraege",
         """CREATE TABLE IF NOT EXISTS antraege (
@@ -493,6 +600,173 @@ REQUIRED_TABLES = [
             bemerkung TEXT
         )"""
     ),
+    (
+        "cache_versionen",
+        """CREATE TABLE IF NOT EXISTS cache_versionen (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS cache_versionen (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )"""
+    ),
+    (
+        "jobs",
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id SERIAL PRIMARY KEY,
+            typ TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'wartend',
+            parameter TEXT,
+            fortschritt INTEGER NOT NULL DEFAULT 0,
+            meldung TEXT,
+            ergebnis TEXT,
+            erstellt_von INTEGER,
+            erstellt_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            gestartet_am TIMESTAMP,
+            aktualisiert_am TIMESTAMP,
+            beendet_am TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            typ TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'wartend',
+            parameter TEXT,
+            fortschritt INTEGER NOT NULL DEFAULT 0,
+            meldung TEXT,
+            ergebnis TEXT,
+            erstellt_von INTEGER,
+            erstellt_am DATETIME DEFAULT CURRENT_TIMESTAMP,
+            gestartet_am DATETIME,
+            aktualisiert_am DATETIME,
+            beendet_am DATETIME
+        )"""
+    ),
+    (
+        "jahresabschluesse",
+        """CREATE TABLE IF NOT EXISTS jahresabschluesse (
+            id SERIAL PRIMARY KEY,
+            gemeinschaft_id INTEGER NOT NULL,
+            jahr INTEGER NOT NULL,
+            abgeschlossen_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            abgeschlossen_von INTEGER,
+            gesamteinnahmen REAL,
+            gesamtausgaben REAL,
+            bemerkung TEXT,
+            UNIQUE(gemeinschaft_id, jahr)
+        )""",
+        """CREATE TABLE IF NOT EXISTS jahresabschluesse (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            gemeinschaft_id INTEGER NOT NULL,
+            jahr INTEGER NOT NULL,
+            abgeschlossen_am DATETIME DEFAULT CURRENT_TIMESTAMP,
+            abgeschlossen_von INTEGER,
+            gesamteinnahmen REAL,
+            gesamtausgaben REAL,
+            bemerkung TEXT,
+            UNIQUE(gemeinschaft_id, jahr)
+        )"""
+    ),
+    (
+        "jahresabschluss_salden",
+        """CREATE TABLE IF NOT EXISTS jahresabschluss_salden (
+            gemeinschaft_id INTEGER NOT NULL,
+            jahr INTEGER NOT NULL,
+            betrieb_id INTEGER NOT NULL,
+            saldo_vortrag REAL NOT NULL DEFAULT 0,
+            bewegungen REAL NOT NULL DEFAULT 0,
+            saldo_ende REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (gemeinschaft_id, jahr, betrieb_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS jahresabschluss_salden (
+            gemeinschaft_id INTEGER NOT NULL,
+            jahr INTEGER NOT NULL,
+            betrieb_id INTEGER NOT NULL,
+            saldo_vortrag REAL NOT NULL DEFAULT 0,
+            bewegungen REAL NOT NULL DEFAULT 0,
+            saldo_ende REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (gemeinschaft_id, jahr, betrieb_id)
+        )"""
+    ),
+    (
+        "storno_abrechnungen",
+        """CREATE TABLE IF NOT EXISTS storno_abrechnungen (
+            storno_vorgang TEXT NOT NULL,
+            abrechnung_id INTEGER NOT NULL,
+            betrag_maschinen REAL NOT NULL DEFAULT 0,
+            betrag_treibstoff REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (storno_vorgang, abrechnung_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS storno_abrechnungen (
+            storno_vorgang TEXT NOT NULL,
+            abrechnung_id INTEGER NOT NULL,
+            betrag_maschinen REAL NOT NULL DEFAULT 0,
+            betrag_treibstoff REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (storno_vorgang, abrechnung_id)
+        )"""
+    ),
+    (
+        "maschinen_aufwendungen",
+        MASCHINEN_AUFWENDUNGEN_PG,
+        MASCHINEN_AUFWENDUNGEN_SQLITE
+    ),
+    (
+        "maschinen_kennzahlen",
+        """CREATE TABLE IF NOT EXISTS maschinen_kennzahlen (
+            maschine_id INTEGER NOT NULL,
+            jahr INTEGER NOT NULL,
+            anzahl_einsaetze INTEGER DEFAULT 0,
+            betriebsstunden REAL DEFAULT 0,
+            einnahmen REAL DEFAULT 0,
+            aufwendungen REAL DEFAULT 0,
+            bankkosten REAL DEFAULT 0,
+            aktualisiert_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (maschine_id, jahr)
+        )""",
+        """CREATE TABLE IF NOT EXISTS maschinen_kennzahlen (
+            maschine_id INTEGER NOT NULL,
+            jahr INTEGER NOT NULL,
+            anzahl_einsaetze INTEGER DEFAULT 0,
+            betriebsstunden REAL DEFAULT 0,
+            einnahmen REAL DEFAULT 0,
+            aufwendungen REAL DEFAULT 0,
+            bankkosten REAL DEFAULT 0,
+            aktualisiert_am DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (maschine_id, jahr)
+        )"""
+    ),
+]
+
+
+# Liste aller erforderlichen Indizes
+# Format: (index_name, tabelle, spalten)
+REQUIRED_INDEXES = [
+    ("idx_benutzer_username", "benutzer", "username"),
+    ("idx_abstimmungen_gemeinschaft_status", "abstimmungen", "gemeinschaft_id, status"),
+    ("idx_jobs_status", "jobs", "status, id"),
+    # Einsatz-Übersicht: "neueste zuerst" als Index-Bereich (siehe get_einsaetze_uebersicht)
+    ("idx_einsaetze_datum_id", "maschineneinsaetze", "datum DESC, id DESC"),
+    ("idx_einsaetze_benutzer_datum", "maschineneinsaetze", "benutzer_id, datum DESC, id DESC"),
+    ("idx_einsaetze_maschine_datum", "maschineneinsaetze", "maschine_id, datum DESC, id DESC"),
+    # Stundenzähler-Buch: Vorgänger/Nachfolger/höchster Stand (siehe utils/stundenzaehler.py)
+    ("idx_einsaetze_maschine_anfang", "maschineneinsaetze", "maschine_id, anfangstand"),
+    ("idx_einsaetze_maschine_ende", "maschineneinsaetze", "maschine_id, endstand"),
+    ("idx_storniert_vorgang", "maschineneinsaetze_storniert", "storno_vorgang"),
+    # Kennzahlen-Cache: Bankkosten einer Maschine pro Jahr (siehe utils/maschinen_kennzahlen.py)
+    ("idx_buchungen_referenz", "buchungen", "referenz_typ, referenz_id, datum"),
+    ("idx_gemeinschafts_kosten_maschine", "gemeinschafts_kosten", "maschine_id, datum"),
+    # Datumsbereiche statt Funktionen um die Spalte (siehe datum_bereich)
+    ("idx_reservierungen_status_ende", "maschinen_reservierungen", "status, ende_zeitpunkt"),
+    ("idx_reservierungen_status_datum", "maschinen_reservierungen", "status, datum"),
+    ("idx_reservierungen_maschine_status_datum", "maschinen_reservierungen", "maschine_id, status, datum"),
+    ("idx_reservierungen_benutzer_status_datum", "maschinen_reservierungen", "benutzer_id, status, datum"),
+    ("idx_bank_trans_import", "bank_transaktionen", "gemeinschaft_id, import_datum, importiert_von"),
+]
+
+# Eindeutige Indizes (gleiches Format)
+REQUIRED_UNIQUE_INDEXES = [
+    # Idempotenz-Schlüssel der Sammelerfassung (siehe utils/einsatz_sync.py)
+    ("idx_einsaetze_sync_schluessel", "maschineneinsaetze", "benutzer_id, sync_schluessel"),
 ]
 
 
@@ -520,7 +794,8 @@ def column_exists(cursor, table: str, column: str) -> bool:
             WHERE table_name = %s AND column_name = %s
         """, (table, column))
     else:
-        cursor.execute(f"PRAGMA table_info({table})")
+        # table_xinfo zeigt auch berechnete Spalten (table_info blendet sie aus)
+        cursor.execute(f"PRAGMA table_xinfo({table})")
         columns = [row[1] for row in cursor.fetchall()]
         return column in columns
 
@@ -572,6 +847,23 @@ def create_table(cursor, table: str, create_sql: str):
     print(f"  + Tabelle erstellt: {table}")
 
 
+def index_exists(cursor, index: str) -> bool:
+    """Prüft ob ein Index existiert"""
+    if USING_POSTGRESQL:
+        cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", (index,))
+    else:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name=?", (index,))
+
+    return cursor.fetchone() is not None
+
+
+def create_index(cursor, index: str, table: str, columns: str, unique: bool = False):
+    """Erstellt einen Index"""
+    art = "UNIQUE INDEX" if unique else "INDEX"
+    cursor.execute(f"CREATE {art} IF NOT EXISTS {index} ON {table}({columns})")
+    print(f"  + Index erstellt: {index}")
+
+
 # Automatische Betrieb-Erstellung wurde entfernt.
 # Betriebe werden nur manuell über die Admin-Oberfläche angelegt.
 
@@ -694,6 +986,136 @@ def migrate_benutzer_gemeinschaften(cursor):
     return inserted
 
 
+def migrate_abstimmung_zaehler(cursor):
+    """Zähler der Abstimmungen aus abstimmung_stimmen nachführen
+
+    Nötig nach dem Hinzufügen der Zähler-Spalten sowie für Stimmen, die
+    direkt in der Datenbank (ohne App) geändert wurden.
+    """
+    print("  Prüfe Abstimmungs-Zähler...")
+
+    anzahl = "(SELECT COUNT(*) FROM abstimmung_stimmen s WHERE s.abstimmung_id = abstimmungen.id{})"
+    cursor.execute(f"""
+        UPDATE abstimmungen
+        SET stimmen_ja = {anzahl.format(" AND s.stimme = 'ja'")},
+            stimmen_nein = {anzahl.format(" AND s.stimme = 'nein'")},
+            stimmen_enthaltung = {anzahl.format(" AND s.stimme = 'enthaltung'")},
+            stimmen_gesamt = {anzahl.format('')}
+        WHERE COALESCE(stimmen_gesamt, -1) <> {anzahl.format('')}
+           OR COALESCE(stimmen_ja, -1) <> {anzahl.format(" AND s.stimme = 'ja'")}
+           OR COALESCE(stimmen_nein, -1) <> {anzahl.format(" AND s.stimme = 'nein'")}
+    """)
+
+    updated = cursor.rowcount
+    if updated > 0:
+        print(f"    + {updated} Abstimmungen neu gezählt")
+    return updated
+
+
+# Einsatz-Übersicht mit ID-Spalten und ohne eingebaute Sortierung
+# (Abfragen sortieren selbst über idx_einsaetze_datum_id)
+EINSAETZE_UEBERSICHT_VIEW = """
+    CREATE VIEW einsaetze_uebersicht AS
+    SELECT
+        e.id,
+        e.datum,
+        e.benutzer_id,
+        e.maschine_id,
+        m.gemeinschaft_id,
+        e.einsatzzweck_id,
+        b.name || ', ' || COALESCE(b.vorname, '') AS benutzer,
+        m.bezeichnung AS maschine,
+        m.abrechnungsart AS abrechnungsart,
+        m.preis_pro_einheit AS preis_pro_einheit,
+        ez.bezeichnung AS einsatzzweck,
+        e.anfangstand,
+        e.endstand,
+        e.betriebsstunden,
+        e.treibstoffverbrauch,
+        e.treibstoffkosten,
+        e.flaeche_menge,
+        e.kosten_berechnet,
+        e.anmerkungen
+    FROM maschineneinsaetze e
+    JOIN benutzer b ON e.benutzer_id = b.id
+    JOIN maschinen m ON e.maschine_id = m.id
+    JOIN einsatzzwecke ez ON e.einsatzzweck_id = ez.id
+"""
+
+
+def migrate_einsaetze_uebersicht(cursor):
+    """Alte View einsaetze_uebersicht (ohne IDs, mit ORDER BY) ersetzen"""
+    print("  Prüfe View einsaetze_uebersicht...")
+
+    if USING_POSTGRESQL:
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'einsaetze_uebersicht' AND column_name = 'gemeinschaft_id'
+        """)
+    else:
+        cursor.execute("""
+            SELECT 1 FROM pragma_table_info('einsaetze_uebersicht') WHERE name = 'gemeinschaft_id'
+        """)
+    if cursor.fetchone():
+        return 0
+
+    cursor.execute("DROP VIEW IF EXISTS einsaetze_uebersicht")
+    cursor.execute(EINSAETZE_UEBERSICHT_VIEW)
+    print("    + View einsaetze_uebersicht neu erstellt")
+    return 1
+
+
+def migrate_nachrichten_posteingang(cursor):
+    """Posteingang einmalig aus den bestehenden Nachrichten aufbauen"""
+    print("  Prüfe Nachrichten-Posteingang...")
+
+    cursor.execute("SELECT 1 FROM nachrichten_posteingang LIMIT 1")
+    if cursor.fetchone():
+        return 0
+    cursor.execute("SELECT 1 FROM gemeinschafts_nachrichten LIMIT 1")
+    if not cursor.fetchone():
+        return 0
+
+    from utils.posteingang import posteingang_abgleichen
+    posteingang_abgleichen(cursor)
+    print("    + Posteingang und Zähler ungelesener Nachrichten aufgebaut")
+    return 1
+
+
+def migrate_maschinen_aufwendungen(cursor):
+    """Aufwendungen als Einzelbuchungen (datum, art, betrag) in Jahreswerte umstellen
+
+    Die Rentabilität arbeitet mit einer Zeile pro Maschine und Jahr. Alte
+    Buchungen werden nach art den Kostenarten zugeordnet und summiert.
+    """
+    print("  Prüfe Maschinen-Aufwendungen...")
+
+    if not column_exists(cursor, 'maschinen_aufwendungen', 'art'):
+        return 0
+
+    cursor.execute("ALTER TABLE maschinen_aufwendungen RENAME TO maschinen_aufwendungen_buchungen")
+    cursor.execute(MASCHINEN_AUFWENDUNGEN_PG if USING_POSTGRESQL else MASCHINEN_AUFWENDUNGEN_SQLITE)
+
+    jahr = "CAST(TO_CHAR(datum, 'YYYY') AS INTEGER)" if USING_POSTGRESQL else "CAST(strftime('%Y', datum) AS INTEGER)"
+    cursor.execute(f"""
+        INSERT INTO maschinen_aufwendungen
+        (maschine_id, jahr, wartungskosten, reparaturkosten, versicherung, steuern, sonstige_kosten)
+        SELECT maschine_id, {jahr},
+               SUM(CASE WHEN LOWER(art) LIKE 'wartung%' THEN betrag ELSE 0 END),
+               SUM(CASE WHEN LOWER(art) LIKE 'reparatur%' THEN betrag ELSE 0 END),
+               SUM(CASE WHEN LOWER(art) LIKE 'versicherung%' THEN betrag ELSE 0 END),
+               SUM(CASE WHEN LOWER(art) LIKE 'steuer%' THEN betrag ELSE 0 END),
+               SUM(CASE WHEN LOWER(art) LIKE 'wartung%' OR LOWER(art) LIKE 'reparatur%'
+                          OR LOWER(art) LIKE 'versicherung%' OR LOWER(art) LIKE 'steuer%'
+                        THEN 0 ELSE betrag END)
+        FROM maschinen_aufwendungen_buchungen
+        GROUP BY maschine_id, {jahr}
+    """)
+    cursor.execute("DROP TABLE maschinen_aufwendungen_buchungen")
+    print("    + Maschinen-Aufwendungen auf Jahreswerte umgestellt")
+    return 1
+
+
 def run_migrations():
     """Führt alle notwendigen Migrationen durch"""
     print("Schema-Migration: Prüfe Datenbankstruktur...")
@@ -718,6 +1140,17 @@ def run_migrations():
                     add_column(cursor, table, column, datatype, default)
                     changes_made += 1
 
+        # Indizes prüfen und erstellen
+        for index, table, columns in REQUIRED_INDEXES:
+            if table_exists(cursor, table) and not index_exists(cursor, index):
+                create_index(cursor, index, table, columns)
+                changes_made += 1
+
+        for index, table, columns in REQUIRED_UNIQUE_INDEXES:
+            if table_exists(cursor, table) and not index_exists(cursor, index):
+                create_index(cursor, index, table, columns, unique=True)
+                changes_made += 1
+
         conn.commit()
 
         if changes_made > 0:
@@ -747,6 +1180,22 @@ def run_migrations():
         if table_exists(cursor, 'benutzer_gemeinschaften') and table_exists(cursor, 'betriebe'):
             data_changes += migrate_benutzer_gemeinschaften(cursor)
 
+        # Posteingang für Nachrichten aufbauen
+        if table_exists(cursor, 'nachrichten_posteingang') and table_exists(cursor, 'gemeinschafts_nachrichten'):
+            data_changes += migrate_nachrichten_posteingang(cursor)
+
+        # Abstimmungs-Zähler nachführen
+        if table_exists(cursor, 'abstimmung_stimmen') and column_exists(cursor, 'abstimmungen', 'stimmen_gesamt'):
+            data_changes += migrate_abstimmung_zaehler(cursor)
+
+        # Aufwendungen pro Maschine und Jahr
+        if table_exists(cursor, 'maschinen_aufwendungen'):
+            data_changes += migrate_maschinen_aufwendungen(cursor)
+
+        # Einsatz-Übersicht mit ID-Spalten
+        if table_exists(cursor, 'maschineneinsaetze') and table_exists(cursor, 'einsatzzwecke'):
+            data_changes += migrate_einsaetze_uebersicht(cursor)
+
         conn.commit()
 
         if data_changes > 0:
@@ -829,6 +1278,21 @@ def run_migrations_with_report():
                         if "already exists" not in str(e).lower():
                             report['errors'].append(f"Spalte {table}.{column}: {e}")
 
+        # Indizes prüfen und erstellen
+        for index, table, columns in REQUIRED_INDEXES:
+            if table_exists(cursor, table) and not index_exists(cursor, index):
+                try:
+                    cursor.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table}({columns})")
+                except Exception as e:
+                    report['errors'].append(f"Index {index}: {e}")
+
+        for index, table, columns in REQUIRED_UNIQUE_INDEXES:
+            if table_exists(cursor, table) and not index_exists(cursor, index):
+                try:
+                    cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table}({columns})")
+                except Exception as e:
+                    report['errors'].append(f"Index {index}: {e}")
+
         conn.commit()
         cursor.close()
         conn.close()
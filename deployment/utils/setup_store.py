@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Gemeinsamer Speicher für Bestätigungsanfragen des Notfall-Setups
+
+Die Zwei-Personen-Bestätigung (Restore-Anfrage von Admin 1, Bestätigung durch
+Admin 2) muss über mehrere Gunicorn-Worker hinweg funktionieren. Anfragen
+liegen deshalb nicht im Prozessspeicher, sondern als JSON-Datei in
+SETUP_STATE_DIR; Zugriffe werden per Dateisperre serialisiert.
+
+Bewusst keine Datenbank-Tabelle: das Setup muss auch bei leerer oder
+defekter Datenbank funktionieren, und ein Restore überschreibt die Datenbank.
+
+Hochgeladene Backups werden unter ihrem SHA-256-Hash in SETUP_STATE_DIR/payloads
+abgelegt und gelöscht, sobald keine Anfrage mehr darauf verweist.
+
+SETUP_STATE_DIR liegt in der privaten Ablage (0o700, Dateien 0o600, nur
+eigene Dateien werden gelesen, siehe utils/privat_ablage.py) - sonst könnte
+ein lokaler Benutzer Anfragen oder Backups unterschieben.
+"""
+
+import os
+import json
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows (lokaler Betrieb, nur ein Prozess)
+    fcntl = None
+
+from utils.privat_ablage import privat_pfad, verzeichnis_sichern, datei_oeffnen, datei_pruefen, atomar_schreiben
+
+SETUP_STATE_DIR = os.environ.get('SETUP_STATE_DIR', privat_pfad('setup'))
+PAYLOAD_DIR = os.path.join(SETUP_STATE_DIR, 'payloads')
+_REQUESTS_FILE = os.path.join(SETUP_STATE_DIR, 'anfragen.json')
+_LOCK_FILE = os.path.join(SETUP_STATE_DIR, '.lock')
+
+# Gültigkeitsdauer für Anfragen
+REQUEST_TIMEOUT_MINUTES = int(os.environ.get('SETUP_REQUEST_TIMEOUT_MINUTES', 30))
+
+
+@contextmanager
+def _locked():
+    """Exklusive Sperre über alle Prozesse"""
+    verzeichnis_sichern(SETUP_STATE_DIR)
+    with datei_oeffnen(_LOCK_FILE, 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read():
+    try:
+        with datei_oeffnen(_REQUESTS_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write(anfragen):
+    atomar_schreiben(_REQUESTS_FILE, json.dumps(anfragen))
+
+
+def _is_expired(anfrage, now):
+    created = datetime.fromisoformat(anfrage['created'])
+    return now - created > timedelta(minutes=REQUEST_TIMEOUT_MINUTES)
+
+
+def _remove_unreferenced_payloads(anfragen, hashes):
+    """Payloads löschen, auf die keine Anfrage mehr verweist"""
+    benutzt = {a.get('payload_hash') for a in anfragen.values()}
+    for payload_hash in hashes:
+        if payload_hash and payload_hash not in benutzt:
+            try:
+                os.remove(payload_path(payload_hash))
+            except OSError:
+                pass
+
+
+def _expire(anfragen):
+    """Abgelaufene Anfragen entfernen (Aufrufer hält die Sperre)"""
+    now = datetime.now()
+    expired = [code for code, a in anfragen.items() if _is_expired(a, now)]
+    entfernt = [anfragen.pop(code).get('payload_hash') for code in expired]
+    _remove_unreferenced_payloads(anfragen, entfernt)
+    return bool(expired)
+
+
+def _public(code, anfrage):
+    """Anfrage für Routen/Templates aufbereiten (created als datetime, file_path)
+
+    file_path fehlt, wenn die Payload-Datei nicht (mehr) vorhanden ist oder
+    nicht von dieser Anwendung stammt.
+    """
+    daten = dict(anfrage, code=code, created=datetime.fromisoformat(anfrage['created']))
+    if anfrage.get('payload_hash') and datei_pruefen(payload_path(anfrage['payload_hash'])):
+        daten['file_path'] = payload_path(anfrage['payload_hash'])
+    return daten
+
+
+def payload_path(payload_hash):
+    return os.path.join(PAYLOAD_DIR, f'{payload_hash}.sql')
+
+
+def save_payload(file_storage):
+    """Hochgeladene Datei unter ihrem Inhalts-Hash ablegen, gibt den Hash zurück"""
+    verzeichnis_sichern(SETUP_STATE_DIR)
+    verzeichnis_sichern(PAYLOAD_DIR)
+    tmp = os.path.join(PAYLOAD_DIR, f'upload.{os.getpid()}.{os.urandom(4).hex()}.tmp')
+    sha = hashlib.sha256()
+    with datei_oeffnen(tmp, 'wb') as f:
+        for chunk in iter(lambda: file_storage.stream.read(1024 * 1024), b''):
+            sha.update(chunk)
+            f.write(chunk)
+    payload_hash = sha.hexdigest()
+    os.replace(tmp, payload_path(payload_hash))
+    return payload_hash
+
+
+def create_request(code, action, admin1, filename=None, payload_hash=None):
+    """Neue Bestätigungsanfrage speichern"""
+    with _locked():
+        anfragen = _read()
+        _expire(anfragen)
+        anfragen[code] = {
+            'action': action,
+            'admin1': admin1,
+            'filename': filename,
+            'payload_hash': payload_hash,
+            'created': datetime.now().isoformat()
+        }
+        _write(anfragen)
+
+
+def get_request(code):
+    """Anfrage lesen (None wenn unbekannt oder abgelaufen)"""
+    with _locked():
+        anfrage = _read().get(code)
+    if anfrage is None or _is_expired(anfrage, datetime.now()):
+        return None
+    return _public(code, anfrage)
+
+
+def list_requests():
+    """Alle gültigen Anfragen, älteste zuerst"""
+    with _locked():
+        anfragen = _read()
+        if _expire(anfragen):
+            _write(anfragen)
+    liste = [_public(code, a) for code, a in anfragen.items()]
+    return sorted(liste, key=lambda a: a['created'])
+
+
+def claim_request(code):
+    """Anfrage atomar entnehmen - nur ein Worker kann sie ausführen
+
+    Gibt die Anfrage zurück oder None wenn sie nicht (mehr) existiert.
+    Die Payload-Datei bleibt bestehen, bis release_payload() aufgerufen wird.
+    """
+    with _locked():
+        anfragen = _read()
+        _expire(anfragen)
+        anfrage = anfragen.pop(code, None)
+        _write(anfragen)
+    return _public(code, anfrage) if anfrage else None
+
+
+def release_payload(payload_hash):
+    """Payload nach Ausführung löschen, falls keine andere Anfrage sie braucht"""
+    with _locked():
+        _remove_unreferenced_payloads(_read(), [payload_hash])
+
+
+def cancel_request(code):
+    """Anfrage abbrechen, gibt True zurück wenn sie existierte"""
+    anfrage = claim_request(code)
+    if anfrage is None:
+        return False
+    release_payload(anfrage.get('payload_hash'))
+    return True
+
+
+def cleanup_expired_requests():
+    """Abgelaufene Anfragen und deren Payloads entfernen"""
+    with _locked():
+        anfragen = _read()
+        if _expire(anfragen):
+            _write(anfragen)
@@ -4,6 +4,7 @@ SQL-Hilfsfunktionen für PostgreSQL/SQLite-Kompatibilität
 """
 
 import re
+from datetime import date, timedelta
 from database import USING_POSTGRESQL
 
 
@@ -97,6 +98,33 @@ def convert_sql(sql: str) -> str:
     return sql
 
 
+def datum_bereich(spalte: str, von=None, bis=None):
+    """Indexfähige Bedingung für ein Datumsintervall (von/bis jeweils einschließlich)
+
+    Die Spalte wird nicht in date()/strftime()/TO_CHAR() verpackt, sondern
+    direkt mit den Grenzen verglichen - so liest ein Index nur den Bereich.
+    bis wird als "kleiner als Folgetag" geschrieben und erfasst damit auch
+    Zeitstempel des letzten Tages vollständig.
+
+    von/bis: date oder 'YYYY-MM-DD'. Liefert (sql, params).
+    """
+    bedingungen = []
+    params = []
+    if von:
+        bedingungen.append(f"{spalte} >= ?")
+        params.append(str(von)[:10])
+    if bis:
+        folgetag = date.fromisoformat(str(bis)[:10]) + timedelta(days=1)
+        bedingungen.append(f"{spalte} < ?")
+        params.append(folgetag.isoformat())
+    return (' AND '.join(bedingungen) or '1 = 1'), params
+
+
+def jahr_bereich(spalte: str, jahr: int):
+    """Indexfähige Bedingung für ein Kalenderjahr statt strftime('%Y', spalte) = ?"""
+    return datum_bereich(spalte, f'{int(jahr):04d}-01-01', f'{int(jahr):04d}-12-31')
+
+
 def db_execute(cursor, sql: str, params: tuple = None):
     """Führt SQL aus mit automatischer Konvertierung"""
     sql = convert_sql(sql)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Stundenzähler-Buch pro Maschine
+
+Die Einsätze einer Maschine bilden über ihre Zählerstände eine lückenlose
+Kette von Intervallen [anfangstand, endstand]. Die Indizes
+idx_einsaetze_maschine_anfang (maschine_id, anfangstand) und
+idx_einsaetze_maschine_ende (maschine_id, endstand) machen daraus ein
+geordnetes Buch: Vorgänger, Nachfolger und der höchste Stand sind jeweils
+ein einzelner Index-Zugriff, unabhängig von der Länge der Historie.
+
+- einsatz_pruefen(): Lücke/Überschneidung zu den Nachbarn vor dem Speichern
+- zaehler_nach_einsatz(): Stand nur vorwärts stellen (nachgetragene Einsätze)
+- zaehler_nach_storno(): Stand nach Storno aus dem Buch neu bestimmen
+- zeitachse(): Verlauf mit markierten Lücken und Überschneidungen
+
+Der Stand ist nicht Teil des Referenzdaten-Caches (get_all_maschinen), eine
+Änderung macht ihn daher auch nicht ungültig.
+"""
+
+from utils.sql_helpers import convert_sql
+
+# Rundungstoleranz beim Vergleich von Zählerständen
+TOLERANZ = 0.001
+
+
+def _einsatz(cursor, sql, params):
+    cursor.execute(convert_sql(sql), params)
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {'id': row[0], 'datum': row[1], 'anfangstand': row[2], 'endstand': row[3]}
+
+
+def vorgaenger(cursor, maschine_id, anfangstand, ausser_id=None):
+    """Einsatz mit dem höchsten Endstand bis einschließlich anfangstand"""
+    return _einsatz(cursor, """
+        SELECT id, datum, anfangstand, endstand FROM maschineneinsaetze
+        WHERE maschine_id = ? AND endstand <= ? AND id <> ?
+        ORDER BY endstand DESC LIMIT 1
+    """, (maschine_id, anfangstand + TOLERANZ, ausser_id or 0))
+
+
+def nachfolger(cursor, maschine_id, endstand, ausser_id=None):
+    """Einsatz mit dem niedrigsten Anfangsstand ab endstand"""
+    return _einsatz(cursor, """
+        SELECT id, datum, anfangstand, endstand FROM maschineneinsaetze
+        WHERE maschine_id = ? AND anfangstand >= ? AND id <> ?
+        ORDER BY anfangstand LIMIT 1
+    """, (maschine_id, endstand - TOLERANZ, ausser_id or 0))
+
+
+def ueberschneidung(cursor, maschine_id, anfangstand, endstand, ausser_id=None):
+    """Einsatz, dessen Intervall sich mit [anfangstand, endstand] überschneidet
+
+    Weil die gespeicherten Intervalle selbst überschneidungsfrei sind, kommt
+    nur der Einsatz mit dem höchsten Anfangsstand unterhalb von endstand
+    in Frage - ein Index-Zugriff statt eines Bereichs-Scans. Einsätze ohne
+    Zählerfortschritt (reine Flächen-/Stückerfassung) überschneiden nichts.
+    """
+    if endstand - anfangstand <= TOLERANZ:
+        return None
+    kandidat = _einsatz(cursor, """
+        SELECT id, datum, anfangstand, endstand FROM maschineneinsaetze
+        WHERE maschine_id = ? AND anfangstand < ? AND endstand - anfangstand > ? AND id <> ?
+        ORDER BY anfangstand DESC LIMIT 1
+    """, (maschine_id, endstand - TOLERANZ, TOLERANZ, ausser_id or 0))
+    if kandidat and kandidat['endstand'] > anfangstand + TOLERANZ:
+        return kandidat
+    return None
+
+
+def einsatz_pruefen(db, maschine_id, anfangstand, endstand):
+    """Neuen Einsatz gegen seine Nachbarn im Buch prüfen
+
+    Liefert {'ueberschneidung': Einsatz oder None,
+             'luecke_vorher': Stunden seit dem Vorgänger (0 = lückenlos),
+             'luecke_nachher': Stunden bis zum Nachfolger}.
+    """
+    cursor = db.connection.cursor()
+    vorher = vorgaenger(cursor, maschine_id, anfangstand)
+    nachher = nachfolger(cursor, maschine_id, endstand)
+
+    luecke_vorher = anfangstand - vorher['endstand'] if vorher else 0
+    luecke_nachher = nachher['anfangstand'] - endstand if nachher else 0
+
+    return {
+        'ueberschneidung': ueberschneidung(cursor, maschine_id, anfangstand, endstand),
+        'vorgaenger': vorher,
+        'nachfolger': nachher,
+        'luecke_vorher': round(luecke_vorher, 2) if luecke_vorher > TOLERANZ else 0,
+        'luecke_nachher': round(luecke_nachher, 2) if luecke_nachher > TOLERANZ else 0,
+    }
+
+
+def zaehler_nach_einsatz(db, maschine_id, endstand):
+    """Aktuellen Stand nur erhöhen - ein nachgetragener älterer Einsatz ändert ihn nicht"""
+    cursor = db.connection.cursor()
+    cursor.execute(convert_sql("""
+        UPDATE maschinen SET stundenzaehler_aktuell = ?
+        WHERE id = ? AND (stundenzaehler_aktuell IS NULL OR stundenzaehler_aktuell < ?)
+    """), (endstand, maschine_id, endstand))
+
+
+def zaehler_nach_storno(db, maschine_id, anfangstand, endstand):
+    """Stand nach dem Storno eines Einsatzes (bereits gelöscht) neu bestimmen
+
+    Nur wenn der stornierte Einsatz den aktuellen Stand gesetzt hat: dann ist
+    der neue Stand der höchste verbliebene Endstand (Index-Zugriff), ohne
+    verbliebene Einsätze der Anfangsstand des stornierten.
+    """
+    cursor = db.connection.cursor()
+    cursor.execute(convert_sql("SELECT stundenzaehler_aktuell FROM maschinen WHERE id = ?"), (maschine_id,))
+    row = cursor.fetchone()
+    if not row or (row[0] or 0) > endstand + TOLERANZ:
+        return
+
+    cursor.execute(convert_sql("""
+        SELECT MAX(endstand) FROM maschineneinsaetze WHERE maschine_id = ?
+    """), (maschine_id,))
+    hoechster = cursor.fetchone()[0]
+    neu = hoechster if hoechster is not None else anfangstand
+
+    cursor.execute(convert_sql("UPDATE maschinen SET stundenzaehler_aktuell = ? WHERE id = ?"),
+                   (neu, maschine_id))
+
+
+def zeitachse(db, maschine_id, bis_stand=None, limit=100):
+    """Einsätze einer Maschine nach Zählerstand absteigend, mit Lücken und Überschneidungen
+
+    bis_stand blättert zurück (nur Einsätze mit kleinerem Anfangsstand).
+    Jeder Eintrag erhält 'luecke' (Stunden bis zum nächsthöheren Einsatz)
+    bzw. 'ueberschneidung' (Stunden Überlappung mit ihm).
+    """
+    cursor = db.connection.cursor()
+    sql = """
+        SELECT e.id, e.datum, e.anfangstand, e.endstand, e.benutzer_id,
+               b.name || ', ' || COALESCE(b.vorname, '') AS benutzer
+        FROM maschineneinsaetze e
+        JOIN benutzer b ON e.benutzer_id = b.id
+        WHERE e.maschine_id = ?
+    """
+    params = [maschine_id]
+    if bis_stand is not None:
+        sql += " AND e.anfangstand < ?"
+        params.append(bis_stand)
+    sql += " ORDER BY e.anfangstand DESC, e.endstand DESC LIMIT ?"
+    params.append(int(limit) + 1)
+
+    cursor.execute(convert_sql(sql), params)
+    columns = [desc[0] for desc in cursor.description]
+    eintraege = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    weitere = len(eintraege) > limit
+    eintraege = eintraege[:limit]
+
+    # Vergleich jeweils mit dem nächsthöheren Einsatz (dem vorherigen in der Liste)
+    hoeher = None
+    for eintrag in eintraege:
+        eintrag['luecke'] = 0
+        eintrag['ueberschneidung'] = 0
+        if hoeher is not None:
+            abstand = hoeher['anfangstand'] - eintrag['endstand']
+            if abstand > TOLERANZ:
+                eintrag['luecke'] = round(abstand, 2)
+            elif abstand < -TOLERANZ:
+                eintrag['ueberschneidung'] = round(-abstand, 2)
+        hoeher = eintrag
+
+    return {
+        'eintraege': eintraege,
+        'weitere': weitere,
+        'naechster_bis_stand': eintraege[-1]['anfangstand'] if weitere and eintraege else None,
+    }
@@ -1,16 +1,40 @@
 # -*- coding: utf-8 -*-
 """
 Training-Datenbank Funktionen
+
+Übungsdatenbanken werden nicht mehr bei jedem Zurücksetzen neu generiert:
+- Vorlage: pro Übungsdatenbank einmal aus schema.sql und
+  create_training_databases.py gebaut, abgelegt unter
+  data/training/vorlagen/<name>_<version>.db. Die Version ist ein Hash über
+  Schema, Generator und Seed - ändert sich eines davon, wird neu gebaut.
+- Zurücksetzen: Dateikopie der (nie beschriebenen) Vorlage, atomar per
+  os.replace über die gemeinsame Übungsdatenbank - Millisekunden.
+- Sandbox: auf Wunsch erhält ein Benutzer eine eigene Kopie
+  (data/training/sandbox/<name>_<benutzer_id>.db), angelegt beim ersten
+  Zugriff. Mehrere Teilnehmer eines Kurses arbeiten so nicht in derselben Datei.
 """
 
 import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
 from flask import session
 
 # Datenbank-Pfade
 # Basis-Pfad ermitteln (relativ zum deployment-Verzeichnis oder Hauptverzeichnis)
 _BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 DB_PATH_PRODUCTION = os.environ.get('DB_PATH', os.path.join(_BASE_DIR, 'data', 'maschinengemeinschaft.db'))
-TRAINING_DB_DIR = os.path.join(_BASE_DIR, 'data', 'training')
+TRAINING_DB_DIR = os.environ.get('TRAINING_DB_DIR', os.path.join(_BASE_DIR, 'data', 'training'))
+TRAINING_VORLAGEN_DIR = os.path.join(TRAINING_DB_DIR, 'vorlagen')
+TRAINING_SANDBOX_DIR = os.path.join(TRAINING_DB_DIR, 'sandbox')
+TRAINING_SEED = int(os.environ.get('TRAINING_SEED', 42))
+# Sandboxes ohne Zugriff seit so vielen Tagen werden gelöscht
+TRAINING_SANDBOX_TAGE = int(os.environ.get('TRAINING_SANDBOX_TAGE', 14))
+
+_vorlagen_lock = threading.Lock()
 
 # Trainings-Datenbanken Konfiguration
 TRAINING_DATABASES = {
@@ -41,15 +65,147 @@ TRAINING_DATABASES = {
 }
 
 
+def get_db_path(db_key):
+    """Gibt den Datenbankpfad zu einem Schlüssel ('produktion' oder Übungs-DB) zurück"""
+    if db_key and db_key != 'produktion' and db_key in TRAINING_DATABASES:
+        training_path = os.path.join(TRAINING_DB_DIR, TRAINING_DATABASES[db_key]['file'])
+        # Fehlende Übungsdatenbank aus vorhandener Vorlage bereitstellen
+        if not os.path.exists(training_path) and os.path.exists(vorlage_pfad(db_key)):
+            training_db_zuruecksetzen(db_key)
+        if os.path.exists(training_path):
+            return training_path
+    return DB_PATH_PRODUCTION
+
+
 def get_current_db_path():
     """Gibt den aktuellen Datenbankpfad basierend auf Session zurück"""
-    if 'current_database' in session and session['current_database'] != 'produktion':
-        db_key = session['current_database']
-        if db_key in TRAINING_DATABASES:
-            training_path = os.path.join(TRAINING_DB_DIR, TRAINING_DATABASES[db_key]['file'])
-            if os.path.exists(training_path):
-                return training_path
-    return DB_PATH_PRODUCTION
+    db_key = session.get('current_database', 'produktion')
+    if session.get('training_sandbox') and db_key in TRAINING_DATABASES and 'benutzer_id' in session:
+        pfad = sandbox_bereitstellen(db_key, session['benutzer_id'])
+        if pfad:
+            return pfad
+    return get_db_path(db_key)
+
+
+# ============================================================================
+# VORLAGEN UND SANDBOXES
+# ============================================================================
+
+@lru_cache(maxsize=None)
+def vorlagen_version():
+    """Hash über Schema, Generator und Seed (12 Zeichen)"""
+    deployment_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    h = hashlib.sha1(str(TRAINING_SEED).encode())
+    for name in ('schema.sql', 'create_training_databases.py'):
+        pfad = os.path.join(deployment_dir, name)
+        if os.path.exists(pfad):
+            with open(pfad, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()[:12]
+
+
+def vorlage_pfad(db_key):
+    """Pfad der Vorlage in der aktuellen Version"""
+    stamm = os.path.splitext(TRAINING_DATABASES[db_key]['file'])[0]
+    return os.path.join(TRAINING_VORLAGEN_DIR, f"{stamm}_{vorlagen_version()}.db")
+
+
+def vorlage_erstellen(db_key, neu=False):
+    """Vorlage bauen, falls sie in der aktuellen Version fehlt (oder neu=True)"""
+    ziel = vorlage_pfad(db_key)
+    with _vorlagen_lock:
+        if os.path.exists(ziel) and not neu:
+            return ziel
+
+        from utils.prozesse import python_skript
+
+        os.makedirs(TRAINING_VORLAGEN_DIR, exist_ok=True)
+        temp = f"{ziel}.{os.getpid()}.tmp"
+        # Generator in eigenem Prozess: belegt weder GIL noch gevent-Hub des Workers
+        result = python_skript('create_training_databases.py', '--vorlage', db_key, temp)
+        if result.returncode != 0:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise RuntimeError(f"Vorlage {db_key} nicht erstellt: {result.stderr[-500:]}")
+        os.replace(temp, ziel)
+
+        # Vorlagen älterer Versionen entfernen
+        stamm = os.path.splitext(TRAINING_DATABASES[db_key]['file'])[0]
+        for datei in os.listdir(TRAINING_VORLAGEN_DIR):
+            pfad = os.path.join(TRAINING_VORLAGEN_DIR, datei)
+            if datei.startswith(f"{stamm}_") and datei.endswith('.db') and pfad != ziel:
+                os.remove(pfad)
+    return ziel
+
+
+def _aus_vorlage_kopieren(db_key, ziel):
+    """Vorlage atomar nach ziel kopieren
+
+    Die Vorlage wird nie beschrieben, eine Dateikopie ist daher konsistent.
+    Offene Verbindungen auf die alte Datei arbeiten auf dem alten Inode weiter;
+    neue Verbindungen sehen die frische Kopie. Die Versionszähler der
+    prozessinternen Caches werden vorgerückt, damit kein Worker Daten der
+    alten Datei weiterverwendet.
+    """
+    quelle = vorlage_erstellen(db_key)
+    os.makedirs(os.path.dirname(ziel), exist_ok=True)
+    temp = f"{ziel}.{os.getpid()}.tmp"
+    shutil.copyfile(quelle, temp)
+
+    from utils.cache_versionen import versionen_vorruecken
+    conn = sqlite3.connect(temp)
+    try:
+        versionen_vorruecken(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+    for rest in (f"{ziel}-journal", f"{ziel}-wal", f"{ziel}-shm"):
+        if os.path.exists(rest):
+            os.remove(rest)
+    os.replace(temp, ziel)
+    return ziel
+
+
+def training_db_zuruecksetzen(db_key):
+    """Gemeinsame Übungsdatenbank auf den Stand der Vorlage zurücksetzen"""
+    ziel = os.path.join(TRAINING_DB_DIR, TRAINING_DATABASES[db_key]['file'])
+    return _aus_vorlage_kopieren(db_key, ziel)
+
+
+def sandbox_pfad(db_key, benutzer_id):
+    stamm = os.path.splitext(TRAINING_DATABASES[db_key]['file'])[0]
+    return os.path.join(TRAINING_SANDBOX_DIR, f"{stamm}_{int(benutzer_id)}.db")
+
+
+def sandbox_bereitstellen(db_key, benutzer_id, neu=False):
+    """Eigene Kopie der Übungsdatenbank (beim ersten Zugriff aus der Vorlage)
+
+    Gibt None zurück, wenn die Kopie nicht angelegt werden konnte (dann wird
+    wie bisher die gemeinsame Datei verwendet).
+    """
+    pfad = sandbox_pfad(db_key, benutzer_id)
+    if os.path.exists(pfad) and not neu:
+        return pfad
+    try:
+        return _aus_vorlage_kopieren(db_key, pfad)
+    except Exception as e:
+        print(f"WARNUNG: Sandbox {pfad} nicht angelegt: {e}")
+        return None
+
+
+def sandboxes_aufraeumen():
+    """Sandboxes ohne Änderung seit TRAINING_SANDBOX_TAGE löschen"""
+    if not os.path.isdir(TRAINING_SANDBOX_DIR):
+        return 0
+    grenze = time.time() - TRAINING_SANDBOX_TAGE * 86400
+    geloescht = 0
+    for datei in os.listdir(TRAINING_SANDBOX_DIR):
+        pfad = os.path.join(TRAINING_SANDBOX_DIR, datei)
+        if datei.endswith('.db') and os.path.getmtime(pfad) < grenze:
+            os.remove(pfad)
+            geloescht += 1
+    return geloescht
 
 
 def get_available_training_dbs():
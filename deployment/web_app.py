@@ -14,7 +14,10 @@ Erstellt: Januar 2026
 """
 
 import os
-from flask import Flask, session
+import time
+from flask import Flask, session, request, g
+
+import metrics
 
 # Schema-Migration beim Start ausführen
 from utils.schema_migration import run_migrations
@@ -34,6 +37,7 @@ from utils.training import (
     get_current_db_path,
     is_training_mode
 )
+from utils.auth_context import sync_session_with_auth_context
 
 # Blueprints importieren
 from routes.auth import auth_bp
@@ -56,6 +60,8 @@ from routes.admin_antraege import admin_antraege_bp
 from routes.abstimmungen import abstimmungen_bp
 from routes.setup import setup_bp
 from routes.dokumentation import dokumentation_bp
+from routes.metrics import metrics_bp
+from routes.admin_jobs import admin_jobs_bp
 
 # Blueprints registrieren
 app.register_blueprint(auth_bp)
@@ -78,6 +84,12 @@ app.register_blueprint(admin_antraege_bp)
 app.register_blueprint(abstimmungen_bp)
 app.register_blueprint(setup_bp)
 app.register_blueprint(dokumentation_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(admin_jobs_bp)
+
+# Hintergrund-Jobs (Backups, Exporte, Abrechnungsläufe) in diesem Prozess abarbeiten
+from utils.jobs import worker_starten
+worker_starten()
 
 
 @app.context_processor
@@ -105,6 +117,41 @@ def set_database_path():
     DB_PATH = get_current_db_path()
 
 
+@app.before_request
+def refresh_authorization():
+    """Rechte aus dem serverseitigen Kontext in die Session übernehmen"""
+    if 'benutzer_id' in session and request.endpoint != 'static':
+        sync_session_with_auth_context()
+
+
+@app.before_request
+def start_request_timer():
+    """Startzeit für Latenz-Metrik merken"""
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Latenz pro Endpoint und Größe von Downloads/Exporten erfassen"""
+    start = g.pop('request_start', None)
+    endpoint = request.endpoint or 'unbekannt'
+    if start is not None and endpoint != 'metrics.metrics_export':
+        metrics.observe('mgr_http_request_duration_seconds', time.perf_counter() - start, {
+            'endpoint': endpoint,
+            'method': request.method,
+            'status': str(response.status_code)
+        })
+
+    # Exporte erkennen wir am Download-Header (CSV, JSON, ZIP, PDF, Backups)
+    if 'filename=' in response.headers.get('Content-Disposition', ''):
+        groesse = response.calculate_content_length()
+        if groesse is not None:
+            metrics.observe('mgr_export_size_bytes', groesse, {'endpoint': endpoint})
+
+    metrics.write_snapshot()
+    return response
+
+
 # Für Gunicorn/WSGI
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -5,14 +5,18 @@ Füllt die Template-Datenbank mit Testdaten
 import sqlite3
 import random
 from datetime import datetime, timedelta
-import hashlib
+from functools import lru_cache
 import os
 
+from database import hash_password as _hash_password
+
 # Pfad zur Template-Datenbank
 DB_PATH = os.path.join(os.path.dirname(__file__), 'data', 'DB_Templates', 'maschinengemeinschaft.db')
 
+@lru_cache(maxsize=None)
 def hash_password(password):
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    # Einmal pro Klartext berechnen - alle Testbenutzer mit 'test123' teilen sich den Hash
+    return _hash_password(password)
 
 def generate_data():
     print(f"Verbinde mit Datenbank: {DB_PATH}")
@@ -5,16 +5,23 @@ Generiert Beispieldaten für die Maschinengemeinschaft-Datenbank
 import sqlite3
 import random
 from datetime import datetime, timedelta
-import hashlib
+from functools import lru_cache
 import os
 
+from database import hash_password as _hash_password
+
 # Pfad zur Datenbank
 DB_PATH = os.path.join(os.path.dirname(__file__), 'data', 'maschinengemeinschaft.db')
 
+@lru_cache(maxsize=None)
 def hash_password(password):
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    # scrypt ist absichtlich teuer - Hash je Klartext nur einmal berechnen
+    return _hash_password(password)
+
+def generate_data(seed=42):
+    # Fester Seed: gleiche Beispieldaten bei jedem Lauf
+    random.seed(seed)
 
-def generate_data():
     conn = sqlite3.connect(DB_PATH, timeout=30)
     cursor = conn.cursor()
 
@@ -136,7 +143,8 @@ def generate_data():
     start_date = datetime.now() - timedelta(days=730)
     end_date = datetime.now()
 
-    einsatz_count = 0
+    einsatz_rows = []
+    stand_updates = []
 
     for maschine in maschinen_data:
         maschine_id, aktueller_stand, abrechnungsart, preis, gemeinschaft_id = maschine
@@ -162,11 +170,10 @@ def generate_data():
 
         current_stand = max(0, total_stunden - (avg_stunden * num_einsaetze))
 
-        for i in range(num_einsaetze):
-            # Zufälliges Datum
-            random_days = random.randint(0, 730)
-            einsatz_datum = start_date + timedelta(days=random_days)
+        # Chronologisch, damit die Zählerstände fortlaufend sind
+        einsatz_daten = sorted(start_date + timedelta(days=random.randint(0, 730)) for _ in range(num_einsaetze))
 
+        for einsatz_datum in einsatz_daten:
             # Zufälliger Benutzer aus der Gemeinschaft
             benutzer_id = random.choice(gemeinschaft_benutzer)
 
@@ -220,26 +227,27 @@ def generate_data():
                 ]
                 anmerkungen = random.choice(anmerkungen_liste)
 
-            cursor.execute("""
-                INSERT INTO maschineneinsaetze
-                (datum, benutzer_id, maschine_id, einsatzzweck_id, anfangstand, endstand,
-                 treibstoffverbrauch, treibstoffkosten, flaeche_menge, kosten_berechnet, anmerkungen)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (einsatz_datum.strftime('%Y-%m-%d'), benutzer_id, maschine_id,
-                  einsatzzweck_id, round(anfangstand, 1), round(endstand, 1),
-                  round(treibstoffverbrauch, 1) if treibstoffverbrauch else None,
-                  round(treibstoffkosten, 2) if treibstoffkosten else None,
-                  round(flaeche_menge, 2) if flaeche_menge else None,
-                  round(kosten, 2), anmerkungen))
-            einsatz_count += 1
-
-        # Aktualisiere Stundenzähler der Maschine
-        cursor.execute("""
-            UPDATE maschinen SET stundenzaehler_aktuell = ? WHERE id = ?
-        """, (round(current_stand, 1), maschine_id))
+            einsatz_rows.append((einsatz_datum.strftime('%Y-%m-%d'), benutzer_id, maschine_id,
+                                 einsatzzweck_id, round(anfangstand, 1), round(endstand, 1),
+                                 round(treibstoffverbrauch, 1) if treibstoffverbrauch else None,
+                                 round(treibstoffkosten, 2) if treibstoffkosten else None,
+                                 round(flaeche_menge, 2) if flaeche_menge else None,
+                                 round(kosten, 2), anmerkungen))
+
+        # Stundenzähler der Maschine
+        stand_updates.append((round(current_stand, 1), maschine_id))
+
+    # Gesammelt einfügen statt Zeile für Zeile
+    cursor.executemany("""
+        INSERT INTO maschineneinsaetze
+        (datum, benutzer_id, maschine_id, einsatzzweck_id, anfangstand, endstand,
+         treibstoffverbrauch, treibstoffkosten, flaeche_menge, kosten_berechnet, anmerkungen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, einsatz_rows)
+    cursor.executemany("UPDATE maschinen SET stundenzaehler_aktuell = ? WHERE id = ?", stand_updates)
 
     conn.commit()
-    print(f"  -> {einsatz_count} Einsätze generiert")
+    print(f"  -> {len(einsatz_rows)} Einsätze generiert")
 
     # ==================== ZUSAMMENFASSUNG ====================
     print("\n" + "="*50)